@@ -1,6 +1,7 @@
 """Class to implement the latest capabilities of the alpidecontrol/ctrl block relative to
 trigger commands with busy management"""
 
+from collections import OrderedDict
 from enum import IntEnum, unique
 
 from wishbone_module import WishboneModule
@@ -126,26 +127,9 @@ class AlpideControl(WishboneModule):
         if readback is None:
             readback = False
 
-        self._set_up_dctrl(extended_chipid)
-
-        #YCM disable OB configuration for MVTX project
-        assert (extended_chipid == 0xF) or \
-            ((self.mask & 0x4) == 0x4 and (extended_chipid < 15)) #or \
-           #((self.mask & 0x1) == 0x1 and (extended_chipid & 0x88) == 0x08) or \
-           #((self.mask & 0x2) == 0x2 and (extended_chipid & 0x88) == 0x00) or \
-           #((self.mask & 0x4) == 0x4 and (extended_chipid & 0x88) == 0x88) or \
-           #((self.mask & 0x8) == 0x8 and (extended_chipid & 0x88) == 0x80)
-
-        chipid = extended_chipid & 0x7F
-
-        assert chipid|0x7F == 0x7F
-        assert address|0xFFFF == 0xFFFF
-        assert data|0xFFFF == 0xFFFF
-        self.write(WsAlpideControlAddress.WRITE_ADDRESS, address, commitTransaction=False)
-        self.write(WsAlpideControlAddress.WRITE_DATA, data, commitTransaction=False)
-        self.write(WsAlpideControlAddress.WRITE_CTRL, 0x9C<<8|chipid, commitTransaction=False)
+        self.write_chip_regs([(extended_chipid, address, data)], commitTransaction=False)
         self.logger.debug("Write chip register: ChipId: %#2X Addr: %#4X, Data: %04X, commit: %s",
-                          chipid, address, data, commitTransaction)
+                          extended_chipid & 0x7F, address, data, commitTransaction)
         if readback:
             self.flush()
             self.board.wait(1000, False)
@@ -165,6 +149,21 @@ class AlpideControl(WishboneModule):
         if commitTransaction:
             self.flush()
 
+    def write_chip_regs(self, reg_list, commitTransaction=True):
+        """Writes a list of chip registers [(extended_chipid, address, data), ...] in a single wishbone sequence,
+        the DCTRL set up does not flush the previous writes."""
+        for extended_chipid, address, data in reg_list:
+            self._set_up_dctrl(extended_chipid, commitTransaction=False)
+            #YCM disable OB configuration for MVTX project
+            assert (extended_chipid == 0xF) or ((self.mask & 0x4) == 0x4 and (extended_chipid < 15))
+            assert address|0xFFFF == 0xFFFF
+            assert data|0xFFFF == 0xFFFF
+            self.write(WsAlpideControlAddress.WRITE_ADDRESS, address, commitTransaction=False)
+            self.write(WsAlpideControlAddress.WRITE_DATA, data, commitTransaction=False)
+            self.write(WsAlpideControlAddress.WRITE_CTRL, 0x9C<<8|(extended_chipid & 0x7F), commitTransaction=False)
+        if commitTransaction:
+            self.flush()
+
     def read_chip_reg(self, address, extended_chipid, disable_read=False, commitTransaction=True):
         """Read from a specific chip Register.  commitTransaction flushes all
         pending write operations and sends it to the board.
@@ -245,6 +244,86 @@ class AlpideControl(WishboneModule):
 
             return data
 
+    def _check_chip_reg_read_args(self, extended_chipid, address):
+        """Asserts the validity of a chip register read, as in read_chip_reg"""
+        #YCM disable OB configuration for MVTX project
+        assert extended_chipid < 0xF, f"Invalid chipid {extended_chipid:#X}"
+        assert address|0xFFFF == 0xFFFF
+        if ((address & 0x300) >> 8) == 0x1:
+            self.logger.info(f"POTENTIAL SPURIOUS TRIGGER: reading address {hex(address)}, chip ID {hex(extended_chipid & 0x7F)}")
+
+    def read_chip_regs(self, reg_list):
+        """Reads a list of chip registers [(extended_chipid, address), ...] in a single wishbone sequence.
+
+        Returns a list with an OrderedDict per register, in the same order as reg_list, with
+        extended_chipid, address, data, chipid_read, state, phase and valid (state 0x3F and matching chipid).
+        Unlike read_chip_reg, failed reads are reported in the result and logged, but do not raise.
+        """
+        reg_list = list(reg_list)
+        if not reg_list:
+            return []
+        ret = self._read_chip_regs(reg_list)
+        failed = [r for r in ret if not r['valid']]
+        if failed:
+            gbt_ch = self.board.get_gbt_channel()
+            for r in failed:
+                self.logger.error("RU %d: read of chip %#02X register %#04X failed. chipid read %#02X, status %#02X, data %#04X, "
+                                  "Connector %r, Phase %d",
+                                  gbt_ch, r['extended_chipid'], r['address'], r['chipid_read'], r['state'], r['data'],
+                                  self.connector_used, r['phase'])
+            self.logger.info("Dumping the debug fifo:")
+            for data in self.dump_db_fifo(verbose=False):
+                self.logger.error(f"Data 8'b{data:08b}")
+        return ret
+
+    def _read_chip_regs(self, reg_list):
+        """Queues the chip register reads and decodes the results.
+        All the chips are on the same DCTRL connector (IB)"""
+        self._request_chip_regs(reg_list)
+        results = self.board.flush_and_read_results(expected_length=2*len(reg_list))
+        return self._format_chip_regs(reg_list, results)
+
+    def _request_chip_regs(self, reg_list):
+        """Queues the chip register reads without flushing, 2 results per register.
+        The DCTRL is set up for each chip, all the chips are on the same DCTRL connector (IB)"""
+        for extended_chipid, address in reg_list:
+            self._check_chip_reg_read_args(extended_chipid, address)
+        previous = None
+        for extended_chipid, address in reg_list:
+            if extended_chipid != previous:
+                self._set_up_dctrl(extended_chipid, commitTransaction=False)
+                assert self.connector_used is not None, "Input connector is not set"
+                assert self.mask & (0x1 << self.connector_used) == (0x1 << self.connector_used)
+                previous = extended_chipid
+            self.write(WsAlpideControlAddress.WRITE_ADDRESS, address, commitTransaction=False)
+            self.write(WsAlpideControlAddress.WRITE_CTRL, 0x4E<<8|(extended_chipid & 0x7F), commitTransaction=False)
+            self.read(WsAlpideControlAddress.READ_STATUS, commitTransaction=False)
+            self.read(WsAlpideControlAddress.READ_DATA, commitTransaction=False)
+        self._reset_dctrl_mask(commitTransaction=False)
+
+    def _format_chip_regs(self, reg_list, results):
+        """Decodes the results of _request_chip_regs, see read_chip_regs"""
+        assert len(results) == 2*len(reg_list), f"Expected {2*len(reg_list)} results, got {len(results)}"
+        ret = []
+        for i, (extended_chipid, address) in enumerate(reg_list):
+            for j, expected_address in enumerate([WsAlpideControlAddress.READ_STATUS, WsAlpideControlAddress.READ_DATA]):
+                result = results[2*i+j]
+                assert ((result[0] >> 8) & 0x7f) == self.moduleid, \
+                    "Requested to read module {0}, but got result for module {1}, iteration {2}".format(self.moduleid, ((result[0] >> 8) & 0x7f), i)
+                assert (result[0] & 0xff) == expected_address, \
+                    "Requested to read address {0}, but got result for address {1}, iteration {2}".format(expected_address, (result[0] & 0xff), i)
+            status = results[2*i][1]
+            reg = OrderedDict()
+            reg['extended_chipid'] = extended_chipid
+            reg['address'] = address
+            reg['data'] = results[2*i+1][1]
+            reg['chipid_read'] = status & 0x7F
+            reg['state'] = status>>7 & 0x3F
+            reg['phase'] = status>>13
+            reg['valid'] = reg['state'] == 0x3F and reg['chipid_read'] == extended_chipid & 0x7F
+            ret.append(reg)
+        return ret
+
     def write_chip_opcode(self, opcode, extended_chipid=0xF, commitTransaction=True):
         """Write a specific opcode to the chip. commitTransaction
         flushes all pending write operations and sends it to the
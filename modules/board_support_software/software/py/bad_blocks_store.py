@@ -0,0 +1,174 @@
+"""
+Local store of the flash bad blocks of the RUs, and concurrent bad block scan of several RUs.
+
+The store is a sqlite database indexed by RU DNA and serial number, so that the flashing code
+can look up the result of a previous scan instead of rescanning the flash (~10^6 PA3 transactions per RU).
+
+usage:
+store = BadBlockStore('bad_blocks.db')  # or BadBlockStore() for an in-memory store
+bad_blocks = scan_bad_blocks(rdo_list, store)  # {gbt_channel: {0: [...], 1: [...]}}, scans only unknown boards
+store.lookup(serial=7)
+
+bad_blocks_d: Dict[int, List[int]]
+e.g {0: [1,2,3,4], 1:[1334,1335]}, the key is the flash device and values are the bad blocks,
+as returned by ProAsic3Flash.find_bad_blocks
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from card_lock import CardLock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS boards (
+    board TEXT PRIMARY KEY,
+    dna TEXT,
+    serial TEXT,
+    date REAL
+);
+CREATE INDEX IF NOT EXISTS boards_dna ON boards (dna);
+CREATE INDEX IF NOT EXISTS boards_serial ON boards (serial);
+CREATE TABLE IF NOT EXISTS bad_blocks (
+    board TEXT,
+    flash_device INTEGER,
+    block_addr INTEGER,
+    PRIMARY KEY (board, flash_device, block_addr)
+) WITHOUT ROWID;
+"""
+
+
+def _dna_key(dna):
+    """DNA are stored as 24 digit hex strings"""
+    if dna is None:
+        return None
+    if isinstance(dna, str):
+        dna = int(dna, 16) if dna.lower().startswith('0x') else int(dna)
+    return f"{dna:024X}"
+
+
+def _serial_key(serial):
+    """Serial numbers are stored without leading zeroes, as in bad_blocks_io"""
+    if serial is None:
+        return None
+    return str(serial).lstrip('0')
+
+
+class BadBlockStore:
+    """Bad blocks of the RU flash chips, keyed by DNA (or serial number when the DNA is not known).
+    Thread safe, the scans of several RUs can store their results concurrently."""
+
+    def __init__(self, filename=':memory:'):
+        self.filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _find_board(self, dna=None, serial=None) -> Optional[str]:
+        assert dna is not None or serial is not None, "Either dna or serial is required"
+        if dna is not None:
+            row = self._conn.execute('SELECT board FROM boards WHERE dna = ?', (_dna_key(dna),)).fetchone()
+            if row is not None:
+                return row[0]
+        if serial is not None:
+            row = self._conn.execute('SELECT board FROM boards WHERE serial = ?', (_serial_key(serial),)).fetchone()
+            if row is not None:
+                return row[0]
+        return None
+
+    def store(self, bad_blocks_d: Dict[int, List[int]], dna=None, serial=None, date=None):
+        """Stores the bad blocks of a board, replacing the ones of a previous scan"""
+        for flash_device, bad_blocks_l in bad_blocks_d.items():
+            if type(flash_device) != int or type(bad_blocks_l) != list:
+                raise TypeError("malformed bad block dictionary")
+        with self._lock, self._conn:
+            board = self._find_board(dna, serial)
+            if board is None:
+                board = _dna_key(dna) if dna is not None else _serial_key(serial)
+            self._conn.execute('DELETE FROM bad_blocks WHERE board = ?', (board,))
+            self._conn.execute('INSERT OR REPLACE INTO boards VALUES (?, ?, ?, ?)',
+                               (board, _dna_key(dna), _serial_key(serial), time.time() if date is None else date))
+            self._conn.executemany('INSERT OR IGNORE INTO bad_blocks VALUES (?, ?, ?)',
+                                   [(board, flash_device, block)
+                                    for flash_device, bad_blocks_l in bad_blocks_d.items()
+                                    for block in bad_blocks_l])
+
+    def lookup(self, dna=None, serial=None) -> Optional[Dict[int, List[int]]]:
+        """Returns the bad blocks of a board, None if the board was never scanned"""
+        with self._lock:
+            board = self._find_board(dna, serial)
+            if board is None:
+                return None
+            rows = self._conn.execute('SELECT flash_device, block_addr FROM bad_blocks WHERE board = ? '
+                                      'ORDER BY flash_device, block_addr', (board,)).fetchall()
+        bad_blocks_d = {0: [], 1: []}
+        for flash_device, block in rows:
+            bad_blocks_d.setdefault(flash_device, []).append(block)
+        return bad_blocks_d
+
+    def boards(self):
+        """Returns the (board, dna, serial, date) of all scanned boards"""
+        with self._lock:
+            return self._conn.execute('SELECT board, dna, serial, date FROM boards ORDER BY board').fetchall()
+
+    def import_legacy_db(self, conn):
+        """Imports the bad_blocks and board_id tables of a bad_blocks_io database, reading each table once.
+        Entries named by serial number or by DNA of the same board are merged,
+        boards which are not mapped to a DNA are stored with their name as serial number."""
+        dna_of, serial_of = {}, {}
+        for dna, serial in conn.execute('SELECT board_id, board_serial_no FROM board_id'):
+            dna_of[_serial_key(serial)] = _serial_key(dna)
+            serial_of[_serial_key(dna)] = _serial_key(serial)
+        boards = {}
+        for name, block, flash_device, date in conn.execute('SELECT board_id, block_addr, flash_device, date FROM bad_blocks'):
+            name = _serial_key(name)
+            if name in dna_of:
+                dna, serial = dna_of[name], name
+            elif name in serial_of:
+                dna, serial = name, serial_of[name]
+            else:
+                dna, serial = None, name
+            entry = boards.setdefault(dna or serial, [dna, serial, {}, date])
+            entry[2].setdefault(int(flash_device), set()).add(int(block))
+            entry[3] = max(entry[3], date)
+        for dna, serial, bad_blocks_d, date in boards.values():
+            self.store({k: sorted(v) for k, v in bad_blocks_d.items()},
+                       dna=int(dna) if dna else None, serial=serial, date=date)
+        return len(boards)
+
+def scan_bad_blocks(rdo_list, store, rescan=False, max_workers=None, logger=None) -> Dict[int, Dict[int, List[int]]]:
+    """Scans the bad blocks of the RUs concurrently (one thread per RU, at most max_workers),
+    skipping the RUs already in the store unless rescan.
+    The transactions of the RUs sharing a FELIX/CRU card (rdo.cru) are serialized by a CardLock during the scan.
+    Returns {gbt_channel: bad_blocks_d}, failed scans are logged and left out."""
+    if logger is None:
+        logger = logging.getLogger("bad_blocks_store")
+    cards = []
+    for rdo in rdo_list:
+        card = getattr(rdo, 'cru', None)
+        if card is not None and all(card is not other for other in cards):
+            cards.append(card)
+    card_locks = [CardLock(card) for card in cards]
+    results = {}
+    try:
+        for card_lock in card_locks:
+            card_lock.install()
+        with ThreadPoolExecutor(max_workers=max_workers or len(rdo_list) or 1) as executor:
+            futures = {rdo.get_gbt_channel(): executor.submit(rdo.scan_bad_blocks, store, rescan) for rdo in rdo_list}
+            for gbt_channel, future in futures.items():
+                try:
+                    results[gbt_channel] = future.result()
+                except Exception as e:
+                    logger.error(f"RU {gbt_channel}: bad block scan failed: {e}")
+    finally:
+        for card_lock in reversed(card_locks):
+            card_lock.uninstall()
+    return results
@@ -0,0 +1,79 @@
+"""Serialization of the transactions of several threads on a FELIX/CRU card.
+
+The _lock_comm/_unlock_comm of the card only count the nested transactions of the LLA session,
+which serializes the processes sharing the card (e.g. DCS) but not the threads of a process:
+the transactions of two threads on the same card can interleave.
+A CardLock adds a reentrant lock held by a thread from its _lock_comm to the matching _unlock_comm.
+
+usage:
+card_lock = CardLock(tb.cru)
+card_lock.install()
+try:
+    ...  # threads accessing the RUs of tb.cru
+finally:
+    card_lock.uninstall()
+"""
+
+import threading
+
+
+class CardLock(object):
+    """Serializes the transactions of the threads on a FELIX/CRU card.
+
+    install() wraps the _lock_comm and _unlock_comm of the card, which the transactions of the
+    SWT and SCA communications of all the RUs go through, with a reentrant lock: the lock is held
+    from the _lock_comm to the matching _unlock_comm, as the LLA lock for the other processes.
+    """
+
+    def __init__(self, card):
+        self.card = card
+        self._lock = threading.RLock()
+        self._held = threading.local()
+        self._installed = False
+        self._wrapped = None
+
+    def install(self):
+        if self._installed:
+            return
+        # the card methods, or the wrappers of a CardLock installed before, restored by uninstall
+        self._wrapped = {name: self.card.__dict__.get(name) for name in ('_lock_comm', '_unlock_comm')}
+        lock_comm = self.card._lock_comm
+        unlock_comm = self.card._unlock_comm
+
+        def _lock_comm(*args, **kwargs):
+            self._acquire()
+            try:
+                return lock_comm(*args, **kwargs)
+            except BaseException:
+                self._release()
+                raise
+
+        def _unlock_comm(*args, **kwargs):
+            try:
+                return unlock_comm(*args, **kwargs)
+            finally:
+                self._release()
+
+        self.card._lock_comm = _lock_comm
+        self.card._unlock_comm = _unlock_comm
+        self._installed = True
+
+    def uninstall(self):
+        if self._installed:
+            for name, wrapped in self._wrapped.items():
+                if wrapped is None:
+                    delattr(self.card, name)
+                else:
+                    setattr(self.card, name, wrapped)
+            self._installed = False
+
+    def _acquire(self):
+        self._lock.acquire()
+        self._held.count = getattr(self._held, 'count', 0) + 1
+
+    def _release(self):
+        # _unlock_comm(force=True) can be called without a matching _lock_comm
+        count = getattr(self._held, 'count', 0)
+        if count > 0:
+            self._held.count = count - 1
+            self._lock.release()
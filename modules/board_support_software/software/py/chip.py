@@ -3,6 +3,8 @@ from enum import IntEnum, unique
 
 import logging
 
+from userdefinedexceptions import ChipidMismatchError
+
 
 @unique
 class ModeControlChipModeSelector(IntEnum):
@@ -123,6 +125,41 @@ class Chip(object):
                 self.logger.debug(logmessage)
         return ret
 
+    def read_regs(self, addresses):
+        """Reads a list of registers in a single sequence invoking the corresponding board function.
+        Returns the list of values, raises ChipidMismatchError if any of the reads failed"""
+        addresses = list(addresses)
+        for address in addresses:
+            assert address | 0xFFFF == 0xFFFF
+        return self._check_regs(self.board.read_chip_regs([(self.extended_chipid, address) for address in addresses]))
+
+    def _request_regs(self, addresses):
+        """Queues the reads of a list of registers without flushing, so that the reads of several chips
+        can share a sequence. Returns the request to be passed to _format_regs with the results"""
+        reg_list = [(self.extended_chipid, address) for address in addresses]
+        self.board.alpide_control._request_chip_regs(reg_list)
+        return reg_list
+
+    def _format_regs(self, reg_list, results):
+        """Returns the values of the registers requested by _request_regs,
+        raises ChipidMismatchError if any of the reads failed"""
+        return self._check_regs(self.board.alpide_control._format_chip_regs(reg_list, results))
+
+    def _check_regs(self, regs):
+        for reg in regs:
+            if not reg['valid']:
+                message = f"Read of register {reg['address']:#06X} failed with status {reg['state']:#X}: " + \
+                          "chipid read is 0b{0:07b} while 0b{1:07b} was expected"
+                raise ChipidMismatchError(message, self.extended_chipid & 0x7F, reg['chipid_read'])
+        return [reg['data'] for reg in regs]
+
+    def write_regs(self, reg_list, commitTransaction=None):
+        """Writes a list of registers [(address, data), ...] in a single sequence invoking the corresponding board function"""
+        if commitTransaction == None:
+            commitTransaction = self.commitTransaction
+        self.board.write_chip_regs([(self.extended_chipid, address, data) for address, data in reg_list],
+                                   commitTransaction=commitTransaction)
+
     def read_region_reg(self, rgn_add, base_add, sub_add, log=None, commitTransaction=None, verbose=False):
         """Basic function to write to a chip register using the extended address"""
         assert rgn_add | 0x1F == 0x1F
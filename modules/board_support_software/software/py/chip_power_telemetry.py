@@ -0,0 +1,181 @@
+"""Continuous telemetry of the chip power ADCs (AVDD, DVDD voltages and currents) of a list of RUs.
+
+Each sample of a RU is a single wishbone sequence: the conversion of the four ADC channels, each
+followed by a firmware wait and the reads of the ADC status and data (see ChipPower._request_values_raw).
+The sequences of all the RUs are sent before reading any result.
+The raw ADC values are kept in per RU ring buffers and converted to V and mA when they are read.
+After each sample, the values are checked against the threshold and slope (rise per second) limits:
+an alarm is raised when a limit is crossed, and raised again only after the value went back within it.
+
+usage:
+telemetry = ChipPowerTelemetry(chip_power_list, rate=100.,
+                               thresholds={'DVDD_CURRENT': (None, 1500.)}, slopes={'DVDD_CURRENT': 20000.})
+telemetry.add_alarm_callback(lambda alarm: print(alarm))
+telemetry.start()
+...
+timestamps, values = telemetry.get_samples(ru=0, last=100)  # values[sample, channel], see CHANNELS
+telemetry.stop()
+"""
+
+import time
+from collections import deque, namedtuple, OrderedDict
+
+import numpy as np
+
+from periodic_sampler import PeriodicSampler
+from ru_chip_power import ADC_CONVERSION_WAIT, ADC_MAPPING
+
+CHANNELS = [ADC_MAPPING[i] for i in range(len(ADC_MAPPING))] # ADC channel order
+INVALID = 0xFFFF
+
+Alarm = namedtuple('Alarm', ['timestamp', 'ru', 'channel', 'kind', 'value', 'limit'])
+Alarm.__doc__ = """Alarm raised by ChipPowerTelemetry: kind is 'high', 'low' or 'slope', value in V, mA or per s"""
+
+
+class ChipPowerTelemetry(PeriodicSampler):
+    """Periodically samples the chip power ADCs of the ChipPower modules in chip_power_list.
+
+    thresholds: {channel: (low, high)} limits on the values in V or mA, None for no limit
+    slopes: {channel: limit} limit on the rise per second between two consecutive samples
+    max_alarms: number of alarms kept (see get_alarms)
+
+    The buffers are preallocated: timestamps [buffer_size, len(chip_power_list)] and raw ADC values
+    [buffer_size, len(chip_power_list), len(CHANNELS)] (uint16, INVALID where the channel could not be read).
+    The communication is not thread safe: while sampling in the background (start/stop),
+    the RUs must not be accessed by other threads of the same process.
+    The alarm callbacks are called from the sampling thread and should return quickly.
+    """
+
+    def __init__(self, chip_power_list, rate=10., buffer_size=36000, thresholds=None, slopes=None,
+                 wait_value=ADC_CONVERSION_WAIT, max_alarms=1000):
+        self.chip_power_list = list(chip_power_list)
+        self.wait_value = wait_value
+        nrus = len(self.chip_power_list)
+        super(ChipPowerTelemetry, self).__init__(OrderedDict([('timestamps', ((nrus,), np.float64, np.nan)),
+                                                              ('raw', ((nrus, len(CHANNELS)), np.uint16, INVALID))]),
+                                                 rate=rate, buffer_size=buffer_size)
+        parameters = self.chip_power_list[0].parameters
+        self._k = np.array([parameters["ADC_" + channel].k for channel in CHANNELS])
+        self._d = np.array([parameters["ADC_" + channel].d for channel in CHANNELS])
+        self._low = np.full(len(CHANNELS), -np.inf)
+        self._high = np.full(len(CHANNELS), np.inf)
+        self._slope = np.full(len(CHANNELS), np.inf)
+        for channel, (low, high) in (thresholds or {}).items():
+            if low is not None:
+                self._low[CHANNELS.index(channel)] = low
+            if high is not None:
+                self._high[CHANNELS.index(channel)] = high
+        for channel, limit in (slopes or {}).items():
+            self._slope[CHANNELS.index(channel)] = limit
+        self._active = np.zeros((nrus, 3, len(CHANNELS)), dtype=bool) # alarms active per RU, kind and channel
+        self._last = [None] * nrus # (timestamp, values) of the previous valid sample per RU
+        self.alarms = deque(maxlen=max_alarms)
+        self._callbacks = []
+
+    def add_alarm_callback(self, callback):
+        """callback(alarm) is called for each alarm raised, see Alarm"""
+        self._callbacks.append(callback)
+
+    def to_values(self, raw):
+        """Converts raw ADC values [..., len(CHANNELS)] to V and mA, NaN where INVALID"""
+        values = raw * self._k + self._d
+        values[raw == INVALID] = np.nan
+        return values
+
+    def _read(self):
+        """Reads the ADC values of all the RUs, returns (timestamps, raw [len(chip_power_list), len(CHANNELS)])"""
+        nrus = len(self.chip_power_list)
+        raw = np.full((nrus, len(CHANNELS)), INVALID, dtype=np.uint16)
+        timestamps = np.full(nrus, np.nan)
+        requested = [False] * nrus
+        for i, chip_power in enumerate(self.chip_power_list):
+            try:
+                chip_power._request_values_raw(len(CHANNELS), self.wait_value)
+                chip_power.flush()
+                requested[i] = True
+            except Exception as e:
+                self.logger.error(f"Failed to request the chip power ADC values of RU {i}: {e}")
+        for i, chip_power in enumerate(self.chip_power_list):
+            if not requested[i]:
+                continue
+            try:
+                values_raw = chip_power._format_values_raw(chip_power.board.read_results())
+                timestamps[i] = time.time()
+            except Exception as e:
+                self.logger.error(f"Failed to read the chip power ADC values of RU {i}: {e}")
+                continue
+            raw[i] = [INVALID if values_raw[j] is None else values_raw[j] for j in range(len(CHANNELS))]
+        return timestamps, raw
+
+    def _check(self, timestamps, raw):
+        """Returns the alarms raised by a sample"""
+        values = self.to_values(raw)
+        slopes = np.full(values.shape, np.nan)
+        for i in range(len(self.chip_power_list)):
+            if np.isnan(timestamps[i]):
+                continue
+            if self._last[i] is not None:
+                last_time, last_values = self._last[i]
+                slopes[i] = (values[i] - last_values) / (timestamps[i] - last_time)
+            self._last[i] = (timestamps[i], values[i])
+        alarms = []
+        with np.errstate(invalid='ignore'):
+            for kind, exceeded, measured, limits in [('high', values > self._high, values, self._high),
+                                                     ('low', values < self._low, values, self._low),
+                                                     ('slope', slopes > self._slope, slopes, self._slope)]:
+                k = ['high', 'low', 'slope'].index(kind)
+                checked = ~np.isnan(measured)
+                for i, j in zip(*np.nonzero(exceeded & ~self._active[:, k])):
+                    alarms.append(Alarm(float(timestamps[i]), int(i), CHANNELS[j], kind,
+                                        float(measured[i, j]), float(limits[j])))
+                self._active[:, k] = np.where(checked, exceeded, self._active[:, k])
+        return alarms
+
+    def sample(self):
+        """Samples the ADCs of all the RUs, stores the raw values in the buffers and checks the limits.
+        Returns the alarms raised"""
+        timestamps, raw = super(ChipPowerTelemetry, self).sample()
+        with self._lock:
+            alarms = self._check(timestamps, raw)
+            self.alarms.extend(alarms)
+        for alarm in alarms:
+            self.logger.warning(f"RU {alarm.ru} {alarm.channel}: {alarm.kind} {alarm.value:.2f} (limit {alarm.limit:.2f})")
+            for callback in self._callbacks:
+                try:
+                    callback(alarm)
+                except Exception as e:
+                    self.logger.error(f"Alarm callback failed: {e}")
+        return alarms
+
+    def clear(self):
+        """Clears the buffers, the alarms and the state of the limits"""
+        with self._lock:
+            self.count = 0
+            self._last = [None] * len(self.chip_power_list)
+            self._active[:] = False
+            self.alarms.clear()
+
+    def get_samples(self, ru, since=None, last=None):
+        """Returns copies of the buffered (timestamps, values [sample, len(CHANNELS)]) of a RU in chronological order,
+        optionally only those taken after since (timestamp) and/or the last ones.
+        The values are in V and mA, NaN where the channel could not be read"""
+        timestamps, raw = super(ChipPowerTelemetry, self).get_samples(since=since, last=last, index=(ru,))
+        return timestamps, self.to_values(raw)
+
+    def get_latest(self):
+        """Returns the values of the last sample as {ru index: {channel: value}}, None if there is none"""
+        if self.count == 0:
+            return None
+        ret = OrderedDict()
+        for i in range(len(self.chip_power_list)):
+            _, values = self.get_samples(i, last=1)
+            ret[i] = OrderedDict((channel, float(values[0, j])) for j, channel in enumerate(CHANNELS))
+        return ret
+
+    def get_alarms(self, since=None):
+        """Returns the alarms raised, optionally only those after since (timestamp)"""
+        with self._lock:
+            alarms = list(self.alarms)
+        if since is not None:
+            alarms = [alarm for alarm in alarms if alarm.timestamp > since]
+        return alarms
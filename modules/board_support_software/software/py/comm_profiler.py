@@ -0,0 +1,271 @@
+"""Transaction profiler for the Communication classes.
+
+Records, per wishbone module ID and per caller, the transactions queued (register_write/register_read/
+register_write_stream),
+the flushes (round trips), the bytes moved and a latency histogram of the transport operations.
+The caller is the first frame outside the communication plumbing (Communication, WishboneModule and
+the read/write/flush methods of the board), e.g. "Sca_RU._sca_write (sca_ru.py:47)".
+
+The profiler wraps the methods of a single Communication instance while attached:
+nothing is changed, and there is no overhead, when it is not attached.
+It works with any Communication subclass (USB, CRU, FELIX, simulation or a mock), since it only relies on
+register_write/register_write_stream/register_read/register_read_custom_data/flush/_read_all_bytes of the base class.
+
+usage:
+profiler = CommProfiler()
+with profiler.attached(rdo.comm):
+    rdo.initialize()
+print(profiler.report())
+profiler.write_folded("comm.folded")  # flamegraph.pl comm.folded > comm.svg
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from wishbone_module import WishboneModule
+
+HISTOGRAM_BINS = 32
+BOARD_PLUMBING = ('read', 'write', 'flush', 'flush_and_read_results', 'read_all', 'read_results', 'read_loopback')
+PLUMBING_FILES = ('communication.py', 'wishbone_module.py', os.path.basename(__file__))
+
+
+class _Stats:
+    __slots__ = ('writes', 'reads', 'flushes', 'bytes_out', 'bytes_in', 'time', 'histogram')
+
+    def __init__(self):
+        self.writes = 0
+        self.reads = 0
+        self.flushes = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.time = 0.
+        self.histogram = [0] * HISTOGRAM_BINS  # bin i: latency in [2^(i-1), 2^i) us
+
+    def add_latency(self, duration):
+        self.time += duration
+        self.histogram[min(int(duration * 1e6).bit_length(), HISTOGRAM_BINS - 1)] += 1
+
+    def merge(self, other):
+        for name in ('writes', 'reads', 'flushes', 'bytes_out', 'bytes_in', 'time'):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, q):
+        """Upper edge [s] of the histogram bin containing the q-th percentile"""
+        total = sum(self.histogram)
+        if total == 0:
+            return 0.
+        count = 0
+        for i, n in enumerate(self.histogram):
+            count += n
+            if count >= total * q / 100:
+                return (1 << i) * 1e-6
+        return (1 << (HISTOGRAM_BINS - 1)) * 1e-6
+
+
+class CommProfiler:
+    """Profiles the wishbone transactions of a Communication instance, see module docstring.
+
+    stack_depth: number of caller frames kept for the folded stacks (flame graph), 0 disables them
+    """
+
+    def __init__(self, stack_depth=16):
+        self.stack_depth = stack_depth
+        self._stats = defaultdict(_Stats)  # (module ids, caller): _Stats
+        self._stacks = defaultdict(float)  # folded stack: time
+        self._lock = threading.Lock()
+        self._comm = None
+        self._flush_modules = ''
+        self._labels = {}
+        self._plumbing_codes = {}
+        self._comm_codes = set()
+
+    # Attach/detach
+
+    def attach(self, comm):
+        """Starts profiling comm"""
+        assert self._comm is None, "Profiler already attached"
+        self._comm = comm
+        self._plumbing_codes = {}
+        self._comm_codes = {f.__code__ for cls in type(comm).__mro__ for f in vars(cls).values() if hasattr(f, '__code__')}
+        orig_register_write = comm.register_write
+        orig_register_write_stream = comm.register_write_stream
+        orig_register_read = comm.register_read
+        orig_register_read_custom_data = comm.register_read_custom_data
+        orig_flush = comm.flush
+        orig_read_all_bytes = comm._read_all_bytes
+
+        def register_write(module, address, data):
+            self._record_queued(module, 'writes')
+            return orig_register_write(module, address, data)
+
+        def register_write_stream(module, address, payload):
+            self._record_queued(module, 'writes', len(payload) // 2)
+            return orig_register_write_stream(module, address, payload)
+
+        def register_read(module, address):
+            self._record_queued(module, 'reads')
+            return orig_register_read(module, address)
+
+        def register_read_custom_data(module, address, data):
+            self._record_queued(module, 'reads')
+            return orig_register_read_custom_data(module, address, data)
+
+        def flush(*args, **kwargs):
+            self._flush_modules = self._modules(comm._buffer)
+            nbytes = len(comm._buffer)
+            start = time.perf_counter()
+            try:
+                return orig_flush(*args, **kwargs)
+            finally:
+                self._record_transfer(self._flush_modules, time.perf_counter() - start, flush=True, nbytes=nbytes)
+
+        def _read_all_bytes(*args, **kwargs):
+            start = time.perf_counter()
+            ret = orig_read_all_bytes(*args, **kwargs)
+            self._record_transfer(self._flush_modules, time.perf_counter() - start, flush=False, nbytes=len(ret))
+            return ret
+
+        comm.register_write = register_write
+        comm.register_write_stream = register_write_stream
+        comm.register_read = register_read
+        comm.register_read_custom_data = register_read_custom_data
+        comm.flush = flush
+        comm._read_all_bytes = _read_all_bytes
+
+    def detach(self):
+        """Stops profiling, the methods of the Communication instance are restored"""
+        if self._comm is None:
+            return
+        for name in ('register_write', 'register_write_stream', 'register_read', 'register_read_custom_data', 'flush',
+                     '_read_all_bytes'):
+            del self._comm.__dict__[name]
+        self._comm = None
+
+    @contextmanager
+    def attached(self, comm):
+        self.attach(comm)
+        try:
+            yield self
+        finally:
+            self.detach()
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+            self._stacks.clear()
+
+    # Recording
+
+    @staticmethod
+    def _modules(buffer):
+        return ",".join(f"0x{module:02X}" for module in sorted({b & 0x7F for b in buffer[3::4]}))
+
+    def _is_plumbing(self, frame):
+        code = frame.f_code
+        plumbing = self._plumbing_codes.get(code)
+        if plumbing is None:
+            plumbing = os.path.basename(code.co_filename) in PLUMBING_FILES or code in self._comm_codes
+            if not plumbing and code.co_name in BOARD_PLUMBING:
+                obj = frame.f_locals.get('self')
+                return getattr(obj, 'comm', None) is self._comm and not isinstance(obj, WishboneModule)
+            self._plumbing_codes[code] = plumbing
+        return plumbing
+
+    def _label(self, frame):
+        obj = frame.f_locals.get('self')
+        key = (frame.f_code, type(obj))
+        label = self._labels.get(key)
+        if label is None:
+            name = f"{type(obj).__name__}.{frame.f_code.co_name}" if obj is not None else frame.f_code.co_name
+            label = f"{name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_firstlineno})"
+            self._labels[key] = label
+        return label
+
+    def _caller(self):
+        """Returns the caller frame outside the communication plumbing"""
+        frame = sys._getframe(1)
+        while frame is not None and self._is_plumbing(frame):
+            frame = frame.f_back
+        return frame
+
+    def _folded_stack(self, frame):
+        names = []
+        while frame is not None and len(names) < self.stack_depth:
+            obj = frame.f_locals.get('self')
+            names.append(f"{type(obj).__name__}.{frame.f_code.co_name}" if obj is not None else frame.f_code.co_name)
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _record_queued(self, module, kind, count=1):
+        frame = self._caller()
+        key = (f"0x{module:02X}", self._label(frame) if frame is not None else "?")
+        with self._lock:
+            stats = self._stats[key]
+            setattr(stats, kind, getattr(stats, kind) + count)
+
+    def _record_transfer(self, modules, duration, flush, nbytes):
+        frame = self._caller()
+        key = (modules, self._label(frame) if frame is not None else "?")
+        stack = self._folded_stack(frame) if self.stack_depth and frame is not None else None
+        with self._lock:
+            stats = self._stats[key]
+            if flush:
+                stats.flushes += 1
+                stats.bytes_out += nbytes
+            else:
+                stats.bytes_in += nbytes
+            stats.add_latency(duration)
+            if stack is not None:
+                self._stacks[stack] += duration
+
+    # Results
+
+    def get_stats(self, by='caller'):
+        """Returns the statistics as an OrderedDict sorted by decreasing time,
+        keyed by (module ids, caller), by module ids (by='module') or by caller (by='caller')"""
+        with self._lock:
+            items = list(self._stats.items())
+        merged = defaultdict(_Stats)
+        for (modules, caller), stats in items:
+            key = {'module': modules, 'caller': caller}.get(by, (modules, caller))
+            merged[key].merge(stats)
+        ret = OrderedDict()
+        for key, stats in sorted(merged.items(), key=lambda item: (-item[1].time, -item[1].flushes)):
+            ret[key] = OrderedDict([('writes', stats.writes),
+                                    ('reads', stats.reads),
+                                    ('flushes', stats.flushes),
+                                    ('bytes_out', stats.bytes_out),
+                                    ('bytes_in', stats.bytes_in),
+                                    ('time', stats.time),
+                                    ('p50', stats.percentile(50)),
+                                    ('p99', stats.percentile(99)),
+                                    ('histogram', stats.histogram[:])])
+        return ret
+
+    def report(self, by='caller', limit=30):
+        """Returns a text report of the statistics (see get_stats), the time includes flushes and result reads"""
+        stats = self.get_stats(by=by)
+        lines = [f"{'writes':>8} {'reads':>8} {'flushes':>8} {'bytes out':>10} {'bytes in':>10} "
+                 f"{'time [ms]':>10} {'p50 [us]':>9} {'p99 [us]':>9}  {by}"]
+        for key, s in list(stats.items())[:limit]:
+            name = " ".join(key) if isinstance(key, tuple) else key
+            lines.append(f"{s['writes']:8d} {s['reads']:8d} {s['flushes']:8d} {s['bytes_out']:10d} {s['bytes_in']:10d} "
+                         f"{s['time']*1e3:10.2f} {s['p50']*1e6:9.0f} {s['p99']*1e6:9.0f}  {name}")
+        if len(stats) > limit:
+            lines.append(f"... {len(stats) - limit} more")
+        return "\n".join(lines)
+
+    def folded_stacks(self):
+        """Returns the time spent in the transport per call stack, in the folded format of flamegraph.pl (us)"""
+        with self._lock:
+            stacks = sorted(self._stacks.items())
+        return "\n".join(f"{stack} {int(duration * 1e6)}" for stack, duration in stacks)
+
+    def write_folded(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.folded_stacks() + "\n")
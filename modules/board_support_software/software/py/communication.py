@@ -275,6 +275,21 @@ class Communication(object):
         self._buffer += bytearray([data_low, data_high,
                                    address, module | 0x80])
 
+    def register_write_stream(self, module, address, payload):
+        """ Register a write register command in the buffer for each 16 bit little endian word of payload,
+        all to the same address (e.g. a FIFO) """
+        assert module | 0x7F == 0x7F
+        assert address | 0xFF == 0xFF
+        assert len(payload) % 2 == 0, "payload must contain an integer number of 16 bit words"
+        payload = bytes(payload)
+        nwords = len(payload) // 2
+        commands = bytearray(4*nwords)
+        commands[0::4] = payload[0::2]
+        commands[1::4] = payload[1::2]
+        commands[2::4] = bytes([address]) * nwords
+        commands[3::4] = bytes([module | 0x80]) * nwords
+        self._buffer += commands
+
     def register_read(self, module, address):
         """ Register a read register command in the buffer """
         assert module | 0x7F == 0x7F
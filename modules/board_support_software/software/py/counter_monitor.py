@@ -148,14 +148,20 @@ class WsCounterMonitor(WishboneModule):
         ret = collections.OrderedDict()
         if commitTransaction:
             results = self.board.flush_and_read_results(expected_length=len(addresses))
-            for i, address in enumerate(addresses):
-                res_moduleid = ((results[i][0] >> 8) & 0x7f)
-                res_address = (results[i][0] & 0xff)
-                assert res_moduleid == self.moduleid, \
-                    f"Requested to read module {self.moduleid}, but got result for module {res_moduleid}, iteration {i}"
-                assert res_address == address, \
-                    f"Requested to read address {address}, but got result for address {res_address}, iteration {i}"
-                ret[self.registers(address).name] = results[i][1]
+            ret = self._check_results(addresses, results)
+        return ret
+
+    def _check_results(self, addresses, results):
+        """Checks the wishbone results of the reads of addresses, returns {register name: value}"""
+        ret = collections.OrderedDict()
+        for i, address in enumerate(addresses):
+            res_moduleid = ((results[i][0] >> 8) & 0x7f)
+            res_address = (results[i][0] & 0xff)
+            assert res_moduleid == self.moduleid, \
+                f"Requested to read module {self.moduleid}, but got result for module {res_moduleid}, iteration {i}"
+            assert res_address == address, \
+                f"Requested to read address {address}, but got result for address {res_address}, iteration {i}"
+            ret[self.registers(address).name] = results[i][1]
         return ret
 
     def read_counters(self, counters=None, latch_first=True, reset_after=False, commitTransaction=True):
@@ -169,6 +175,30 @@ class WsCounterMonitor(WishboneModule):
             ret = self._process_counters(counters, results)
         return ret
 
+    def _request_counters(self, counters=None, latch_first=True):
+        """Queues the reads of the counters without committing them.
+        Returns the register addresses read, to be passed to _format_counters with the results"""
+        if counters is None:
+            counters = self.counters
+        addresses = self._to_register_mapping(counters)
+        self._get_counters(addresses=addresses, latch_first=latch_first, commitTransaction=False)
+        return addresses
+
+    def _format_counters(self, counters, addresses, results):
+        """Returns the counter values from the results of the reads queued by _request_counters"""
+        if counters is None:
+            counters = self.counters
+        return self._process_counters(counters, self._check_results(addresses, results))
+
+    def get_counter_width(self, counter):
+        """Returns the number of bits of a counter, i.e. it wraps around at 2**width"""
+        assert counter in self.counters, f"Counter {counter} not in counter mapping"
+        if counter in self.counters_32b:
+            return 32
+        elif counter in self.counters_8b_low or counter in self.counters_8b_high:
+            return 8
+        return 16
+
     def read_counter(self, counter, latch_first=True, reset_after=False, commitTransaction=True):
         """Reads a single counter, returns only the value"""
         assert isinstance(counter, str), "Read counter is only for a single counter"
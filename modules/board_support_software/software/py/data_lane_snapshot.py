@@ -0,0 +1,191 @@
+"""Coherent snapshots of the data lane counters of a list of RUs, with a history of the deltas for the rates.
+
+A snapshot latches the data lane monitors of all the RUs first, one latch command per RU flushed
+back to back, then queues the reads of the latched counters of all the RUs and flushes them before
+reading any result (see DataLaneMonitor._request_counters), i.e. one blocking read per RU.
+The values are returned as an array [RU, lane, counter].
+The deltas between consecutive snapshots take into account the wraparound of the counters
+(32, 16 or 8 bits): the sampling period must be shorter than the time it takes a counter to wrap around.
+
+usage:
+sampler = DataLaneSnapshotSampler(rdo_list, datapath='ob', rate=1.)
+timestamp, values = sampler.snapshot()  # values[rdo index, lane index, counter index]
+sampler.start()
+...
+timestamps, rates = sampler.get_rates(last=10)
+sampler.stop()
+"""
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from periodic_sampler import PeriodicSampler
+
+DATAPATHS = ('ib', 'ob')
+
+
+def get_data_lane_monitors(rdo, datapath):
+    """Returns the data lane monitors of the datapath of a RU, the first one latching all of them"""
+    assert datapath in DATAPATHS, f"datapath must be in {DATAPATHS}"
+    if datapath == 'ib':
+        return [rdo._datalane_monitor_ib]
+    return [rdo._datalane_monitor_ob_1, rdo._datalane_monitor_ob_2]
+
+
+class DataLaneSnapshotSampler(PeriodicSampler):
+    """Snapshots the data lane counters of the RUs in rdo_list and stores the deltas into a fixed size ring buffer.
+
+    lanes: lanes of the datapath read on each RU, by default all of them
+    counters: data lane monitor counters read, by default all of them
+
+    The buffer is preallocated: timestamps [buffer_size], intervals [buffer_size, len(rdo_list)] (s between the
+    latches of two consecutive snapshots) and deltas [buffer_size, len(rdo_list), len(lanes), len(counters)].
+    A RU which could not be read has NaN deltas.
+    The communication is not thread safe: while sampling in the background (start/stop),
+    the RUs must not be accessed by other threads of the same process.
+    """
+
+    def __init__(self, rdo_list, datapath='ib', lanes=None, counters=None, rate=1., buffer_size=3600):
+        self.rdo_list = list(rdo_list)
+        self.datapath = datapath
+        self._monitors = [get_data_lane_monitors(rdo, datapath) for rdo in self.rdo_list]
+        first = self._monitors[0]
+        if lanes is None:
+            lanes = [lane for monitor in first for lane in monitor.get_default_lanes()]
+        self.lanes = list(lanes)
+        if counters is None:
+            counters = first[0].counter_mapping
+        self.counters = list(counters)
+        # lanes of each monitor, by position in self.lanes
+        self._lane_split = []
+        for monitor in first:
+            indices = [i for i, lane in enumerate(self.lanes) if lane in monitor.get_default_lanes()]
+            if indices:
+                self._lane_split.append((first.index(monitor), indices))
+        assert sum(len(indices) for _, indices in self._lane_split) == len(self.lanes), \
+            f"Lanes {self.lanes} not all in the {datapath} datapath"
+        self._modulo = np.array([1 << first[0].get_counter_width(counter) for counter in self.counters], dtype=np.int64)
+        super(DataLaneSnapshotSampler, self).__init__(
+            OrderedDict([('timestamps', ((), np.float64, 0.)),
+                         ('intervals', ((len(self.rdo_list),), np.float64, np.nan)),
+                         ('deltas', ((len(self.rdo_list), len(self.lanes), len(self.counters)), np.float64, np.nan))]),
+            rate=rate, buffer_size=buffer_size)
+        self.latch_spread = None  # s between the first and the last latch of the last snapshot
+        self._last = [None] * len(self.rdo_list)  # (latch time, values) of the previous snapshot per RU
+
+    def _discard_pending(self, i):
+        """Drops the transactions still queued for RU i and the results it has sent back, after a failed
+        flush or read: they would otherwise be taken for those of the next snapshot"""
+        comm = self.rdo_list[i].comm
+        try:
+            comm._buffer = bytearray()
+            comm._read_bytes = 0
+            comm.discardall_dp1()
+        except Exception as e:
+            self.logger.error(f"Failed to discard the pending results of RU {i}: {e}")
+
+    def _latch_and_read(self):
+        """Latches and reads the counters of all the RUs.
+        Returns (latch times [len(rdo_list)], values [len(rdo_list), len(lanes), len(counters)], -1 if not read)"""
+        values = np.full((len(self.rdo_list), len(self.lanes), len(self.counters)), -1, dtype=np.int64)
+        latch_times = np.full(len(self.rdo_list), np.nan, dtype=np.float64)
+        ok = [True] * len(self.rdo_list)
+        # the latches are queued first, so that only the flushes separate the latches of the RUs
+        for i in range(len(self.rdo_list)):
+            self._monitors[i][0].latch_all_counters(commitTransaction=False)
+        for i, rdo in enumerate(self.rdo_list):
+            try:
+                rdo.flush()
+                latch_times[i] = time.time()
+            except Exception as e:
+                self.logger.error(f"Failed to latch the data lane counters of RU {i}: {e}")
+                self._discard_pending(i)
+                ok[i] = False
+        requests = [None] * len(self.rdo_list)
+        for i, rdo in enumerate(self.rdo_list):
+            if not ok[i]:
+                continue
+            try:
+                requests[i] = [self._monitors[i][m]._request_counters([self.lanes[j] for j in indices], self.counters,
+                                                                        latch_first=False)
+                               for m, indices in self._lane_split]
+                rdo.flush()
+            except Exception as e:
+                self.logger.error(f"Failed to request the data lane counters of RU {i}: {e}")
+                self._discard_pending(i)
+                ok[i] = False
+        for i, rdo in enumerate(self.rdo_list):
+            if not ok[i]:
+                continue
+            try:
+                results = rdo.read_results()
+                offset = 0
+                for (m, indices), request in zip(self._lane_split, requests[i]):
+                    length = len(request[0])*len(request[2])
+                    lanes = self._monitors[i][m]._format_counters(request, results[offset:offset+length])
+                    offset += length
+                    for j, lane_values in zip(indices, lanes):
+                        values[i, j] = [lane_values[counter] for counter in self.counters]
+                assert offset == len(results), f"Expected {offset} results, got {len(results)}"
+            except Exception as e:
+                self.logger.error(f"Failed to read the data lane counters of RU {i}: {e}")
+                self._discard_pending(i)
+                latch_times[i] = np.nan
+                values[i] = -1
+        self.latch_spread = float(np.nanmax(latch_times) - np.nanmin(latch_times)) if np.any(~np.isnan(latch_times)) else None
+        return latch_times, values
+
+    def snapshot(self):
+        """Returns (timestamp, values [len(rdo_list), len(lanes), len(counters)]) without storing it,
+        -1 for the RUs which could not be read"""
+        timestamp = time.time()
+        _, values = self._latch_and_read()
+        return timestamp, values
+
+    def _read(self):
+        """Snapshots the counters of all the RUs and returns (timestamp, intervals, deltas).
+        The first snapshot of a RU only sets the reference, its deltas are NaN"""
+        timestamp = time.time()
+        latch_times, values = self._latch_and_read()
+        deltas = np.full(values.shape, np.nan, dtype=np.float64)
+        intervals = np.full(len(self.rdo_list), np.nan, dtype=np.float64)
+        for i in range(len(self.rdo_list)):
+            if np.isnan(latch_times[i]):
+                self._last[i] = None
+                continue
+            if self._last[i] is not None:
+                last_time, last_values = self._last[i]
+                deltas[i] = (values[i] - last_values) % self._modulo
+                intervals[i] = latch_times[i] - last_time
+            self._last[i] = (latch_times[i], values[i])
+        return timestamp, intervals, deltas
+
+    def clear(self):
+        """Clears the buffer, the next snapshot of each RU only sets the reference"""
+        with self._lock:
+            self.count = 0
+            self._last = [None] * len(self.rdo_list)
+
+    def get_rates(self, since=None, last=None):
+        """Returns the buffered (timestamps, rates [Hz]) in chronological order, see get_samples"""
+        timestamps, intervals, deltas = self.get_samples(since=since, last=last)
+        return timestamps, deltas / intervals[:, :, np.newaxis, np.newaxis]
+
+    def get_totals(self, since=None):
+        """Returns the sums of the buffered deltas [len(rdo_list), len(lanes), len(counters)], NaN samples are ignored"""
+        _, _, deltas = self.get_samples(since=since)
+        return np.nansum(deltas, axis=0)
+
+    def get_latest(self):
+        """Returns the rates of the last sample as {rdo index: {lane: {counter: rate}}}, None if there is none"""
+        _, rates = self.get_rates(last=1)
+        if len(rates) == 0:
+            return None
+        ret = OrderedDict()
+        for i in range(len(self.rdo_list)):
+            ret[i] = OrderedDict((lane, OrderedDict((counter, float(rates[0, i, j, k]))
+                                                    for k, counter in enumerate(self.counters)))
+                                 for j, lane in enumerate(self.lanes))
+        return ret
@@ -7,6 +7,11 @@ from enum import IntFlag
 from aenum import Enum, NoAlias
 
 import logging
+import time
+
+import numpy as np
+
+from periodic_sampler import PeriodicSampler
 
 
 @unique
@@ -388,6 +393,7 @@ class Sca(object):
 
         assert not(is_on_ruv1 and is_on_ruv2_0), "RU cannot be RUv1 and RUv2.0! (is_on_ruv1: {0}, is_on_ruv2_0: {1})".format(is_on_ruv1, is_on_ruv2_0)
 
+        self._adc_coefficients = {}
         self.adc_channels = None
         self._set_adc_channels(is_on_ruv1)
 
@@ -437,6 +443,7 @@ class Sca(object):
             self.adc_channels = ScaAdcChannelsRUv1
         else:
             self.adc_channels = ScaAdcChannelsRUv2
+        self._adc_coefficients.clear()
 
     def _set_adc_correction_factor(self,is_on_ruv2_0):
         """Sets the adc correction factor which is specific to RUv2.0
@@ -446,6 +453,7 @@ class Sca(object):
             self.adc_correction_factor = 0.8
         else:
             self.adc_correction_factor = 1.0
+        self._adc_coefficients.clear()
 
     def _sca_write(self, channel, length, command, scadata, trid=0x12, commitTransaction=True, wait=400):
         """Implementation of writing to SCA"""
@@ -901,19 +909,61 @@ class Sca(object):
         return self.adc_code_to_float(adc,
                                       self.read_adc_channel(adc.value))
 
+    def read_adc_channels(self, channels):
+        """Reads a list of ADC channels, holding the communication for the whole list.
+        Returns the list of ADC codes"""
+        self._lock_comm()
+        try:
+            codes = []
+            for channel in channels:
+                self.set_adc_channel(channel, commitTransaction=True)
+                self._sca_write(channel=ScaChannel.ADC, length=4, command=ScaAdcCmd.ADC_GO, scadata=1, commitTransaction=True, wait=20000) # ADC go command
+                codes.append(self._sca_read())
+        finally:
+            self._unlock_comm()
+        return codes
+
+    def _get_adc_list(self, adcs=None):
+        if adcs is None:
+            return list(self.adc_channels)
+        return [self.adc_channels[adc] if isinstance(adc, str) else self.adc_channels(adc) for adc in adcs]
+
+    def get_adc_conversion_coefficients(self, adcs=None):
+        """Returns the gain and offset arrays converting the ADC codes of adcs (default all) to floats,
+        value = gain*code + offset, all the conversions of adc_code_to_float being linear"""
+        adcs = tuple(self._get_adc_list(adcs))
+        if adcs not in self._adc_coefficients:
+            offset = np.array([self.adc_code_to_float(adc, 0) for adc in adcs], dtype=np.float64)
+            gain = (np.array([self.adc_code_to_float(adc, 4095) for adc in adcs], dtype=np.float64) - offset) / 4095
+            self._adc_coefficients[adcs] = (gain, offset)
+        return self._adc_coefficients[adcs]
+
+    def adc_codes_to_float(self, codes, adcs=None):
+        """Vectorized adc_code_to_float of the codes of adcs (default all), returns a numpy array"""
+        gain, offset = self.get_adc_conversion_coefficients(adcs)
+        return gain * np.asarray(codes, dtype=np.float64) + offset
+
+    def get_adc_units(self, adcs=None):
+        """Returns the units of measurement of adcs (default all)"""
+        return [self.get_adc_unit_of_measurement(adc) for adc in self._get_adc_list(adcs)]
+
+    def read_adcs_array(self, adcs=None):
+        """Reads adcs (default all) in a single access to the SCA and returns the converted values as a numpy array,
+        in the order of adcs (see get_adc_names and get_adc_units)"""
+        adcs = self._get_adc_list(adcs)
+        return self.adc_codes_to_float(self.read_adc_channels([adc.value for adc in adcs]), adcs)
+
     def read_adcs(self):
         """Reads all the ADCs in the ADC list"""
-        results = OrderedDict()
-        for adc in self.adc_channels:
-            results[adc.name] = self.read_adc_channel(adc.value)
-        return results
+        codes = self.read_adc_channels([adc.value for adc in self.adc_channels])
+        return OrderedDict(zip(self.get_adc_names(), codes))
 
     def read_adcs_conv(self):
         """Reads the ADC values and converts them into the correct read value"""
+        codes = self.read_adc_channels([adc.value for adc in self.adc_channels])
         results = OrderedDict()
-        for adc in self.adc_channels:
-            results[adc.name] = self.adc_code_to_float(adc,
-                                                       self.read_adc_channel(adc.value))
+        for adc, code in zip(self.adc_channels, codes):
+            results[adc.name] = self.adc_code_to_float(adc, code)
         return results
 
     def get_adc_unit_of_measurement(self, adc):
@@ -1111,3 +1161,38 @@ class Sca(object):
         if num_errors > 0:
             return False
         return True
+
+
+class ScaAdcSampler(PeriodicSampler):
+    """Periodically samples the ADCs of a SCA into a fixed size ring buffer,
+    each sample being a single bulk acquisition (see Sca.read_adcs_array).
+
+    The buffer is preallocated: timestamps [buffer_size] and values [buffer_size, len(adcs)],
+    the oldest samples are overwritten when it is full.
+    The communication is not thread safe: while sampling in the background (start/stop),
+    the SCA must not be accessed by other threads of the same process.
+    """
+
+    def __init__(self, sca, adcs=None, rate=10., buffer_size=10000):
+        self.sca = sca
+        self.adcs = sca._get_adc_list(adcs)
+        self.names = [adc.name for adc in self.adcs]
+        self.units = sca.get_adc_units(self.adcs)
+        super(ScaAdcSampler, self).__init__(OrderedDict([('timestamps', ((), np.float64, 0.)),
+                                                         ('values', ((len(self.adcs),), np.float64, 0.))]),
+                                            rate=rate, buffer_size=buffer_size)
+        self.logger = sca.logger
+
+    def _read(self):
+        return time.time(), self.sca.read_adcs_array(self.adcs)
+
+    def aggregate(self, since=None):
+        """Returns min/max/mean of the buffered values as {adc name: {"min": ., "max": ., "mean": ., "unit": .}}"""
+        _, values = self.get_samples(since)
+        ret = OrderedDict()
+        if len(values) == 0:
+            return ret
+        minimum, maximum, mean = values.min(axis=0), values.max(axis=0), values.mean(axis=0)
+        for i, (name, unit) in enumerate(zip(self.names, self.units)):
+            ret[name] = OrderedDict([("min", minimum[i]), ("max", maximum[i]), ("mean", mean[i]), ("unit", unit)])
+        return ret
@@ -1,15 +1,29 @@
 #!/usr/bin/env python
 
-"""Control of HAMEG power supply"""
+"""Control of HAMEG power supply
+
+The serial link is read by a background thread. The SCPI responses come in the order of the
+queries, so each query gets a future which is resolved by the next response line.
+Commands are not followed by sleeps, and the queries of several channels are sent in a single
+write (e.g. get_power_values), so that they are processed back to back by the supply.
+HamegMonitor samples the voltages and currents in the background into a timestamped ring buffer.
+"""
 
 import logging
 import os
 import re
+import threading
 import time
 import errno
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
 import serial
 import fire
 
+from periodic_sampler import PeriodicSampler
+
 DEFAULT_PORT = '/dev/ttyHAMEG'
 #DEFAULT_PORT = '/dev/ttyHAMEG1PRAGUE' # RUv1, ALPIDE_AV, ALPIDE_DV
 #DEFAULT_PORT = '/dev/ttyHAMEG2PRAGUE' # CRU, Fan, JCM
@@ -17,15 +31,31 @@ DEFAULT_PORT = '/dev/ttyHAMEG'
 STANDALONE_RUN = False
 
 
+class HamegResponseLostError(Exception):
+    """The response to a query can not be told apart from the late response to a timed out query"""
+    pass
+
+
 class Hameg:
-    """Control of HAMEG power supply"""
+    """Control of HAMEG power supply
 
-    def __init__(self, port=DEFAULT_PORT):
-        self.logger = None
+    timeout: time to wait for the response to a query, in s
+    """
 
-        self.link = serial.Serial(port=port, baudrate=9600, timeout=0.5)
-        self.link.reset_input_buffer()
+    def __init__(self, port=DEFAULT_PORT, timeout=1.):
         self.logger = logging.getLogger("HAMEG power supply")
+        self.timeout = timeout
+
+        self.link = serial.Serial(port=port, baudrate=9600, timeout=0.1)
+        self.link.reset_input_buffer()
+
+        self._cond = threading.Condition()
+        self._pending = []           # futures of the queries waiting for their response, oldest first
+        self._orphans = 0            # responses of timed out queries which may still arrive
+        self._orphans_deadline = 0.
+        self._closed = threading.Event()
+        self._reader = threading.Thread(target=self._read_responses, name="HamegReader", daemon=True)
+        self._reader.start()
 
         self.number_channels = 0
         self._check_max_channels()
@@ -72,14 +102,78 @@ class Hameg:
 
         self.logger = logger
 
+    def close(self):
+        """Stops the reader thread and closes the serial link"""
+        self._closed.set()
+        self._reader.join()
+        self.link.close()
+        with self._cond:
+            self._fail_pending(ConnectionError("Serial link closed"))
+
+    def _read_responses(self):
+        """Reader thread: resolves the oldest pending query with each response line"""
+        line = b''
+        while not self._closed.is_set():
+            try:
+                line += self.link.readline()
+            except (serial.SerialException, OSError, TypeError) as e:
+                if self._closed.is_set():
+                    break
+                self.logger.error("Failed to read from serial link: %s", e)
+                with self._cond:
+                    self._fail_pending(e)
+                self._closed.wait(self.timeout)
+                continue
+            if not line.endswith(b'\n'):
+                continue # read timeout, possibly within a line
+            response, line = line.decode('utf-8', errors='replace').rstrip('\r\n'), b''
+            with self._cond:
+                if self._orphans > 0:
+                    self._orphans -= 1
+                    self.logger.warning("Discarding late response %r", response)
+                    self._cond.notify_all()
+                elif self._pending:
+                    self._pending.pop(0).set_result(response)
+                else:
+                    self.logger.warning("Unexpected response %r", response)
+
+    def _fail_pending(self, exception):
+        """Fails the pending queries, the lock must be held"""
+        for future in self._pending:
+            future.set_exception(exception)
+        self._pending = []
+
     def _write(self, cmd):
         """Write to serial link"""
-        self.link.write(cmd.encode('utf-8'))
-        time.sleep(0.05)
-
-    def _read(self):
-        """Read from serial link"""
-        return self.link.readline().decode('utf-8')[:-1]
+        with self._cond:
+            self.link.write(cmd.encode('utf-8'))
+
+    def _request(self, cmd):
+        """Writes cmd (one or more newline terminated commands) and returns a future per query (command ending with ?)"""
+        nqueries = sum(1 for command in cmd.splitlines() if command.strip().endswith('?'))
+        futures = [Future() for _ in range(nqueries)]
+        with self._cond:
+            # The responses of timed out queries must not be taken for the responses of new ones
+            while self._orphans > 0 and time.time() < self._orphans_deadline:
+                self._cond.wait(self._orphans_deadline - time.time())
+            self._orphans = 0
+            self._pending += futures
+            self.link.write(cmd.encode('utf-8'))
+        return futures
+
+    def _query(self, cmd):
+        """Writes cmd and returns the list of the responses to its queries"""
+        futures = self._request(cmd)
+        try:
+            return [future.result(timeout=self.timeout) for future in futures]
+        except FutureTimeoutError:
+            with self._cond:
+                # The queries of other threads sent after cmd are answered after it: fail them too
+                self._orphans = len(self._pending)
+                self._orphans_deadline = time.time() + self.timeout
+                self._fail_pending(HamegResponseLostError("Response lost after the timeout of {0!r}".format(cmd)))
+            self.logger.error("No response to %r within %.1f s", cmd, self.timeout)
+            raise TimeoutError("No response from HAMEG to {0!r}".format(cmd))
 
     def _check_max_channels(self):
         """Attempt to detect number of channels based on model name"""
@@ -111,8 +205,7 @@ class Hameg:
 
     def get_model(self):
         """Return model and type"""
-        self._write('*IDN?\n')
-        return self._read()
+        return self._query('*IDN?\n')[0]
 
     def set_local_control(self):
         """Turns off remote control"""
@@ -134,24 +227,17 @@ class Hameg:
         """Configure channel N with given voltage, current. Fuses are on and
         linked to the same channel. Channel gets activated"""
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST OUT{0}\n'.format(channel))
-        self._write('VOLT {0}\n'.format(voltage))
-        self._write('CURR {0}\n'.format(current))
-        self._write('FUSE ON\n')
-        self._write('FUSE:DELAY 100\n')
-        self._write('FUSE:LINK {0}\n'.format(channel))
+        self._write('INST OUT{0}\n'.format(channel) +
+                    'VOLT {0}\n'.format(voltage) +
+                    'CURR {0}\n'.format(current) +
+                    'FUSE ON\n' +
+                    'FUSE:DELAY 100\n' +
+                    'FUSE:LINK {0}\n'.format(channel))
 
     def get_channel_config(self, channel):
         """Get the channel configuration"""
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST OUT{0}\n'.format(channel))
-        time.sleep(0.05)
-        self._write('CURR?\n')
-        curr = self._read()
-        self._write('VOLT?\n')
-        volt = self._read()
-        self._write('INST OUT{0}\nOUTP:SEL?\n'.format(channel))
-        active = self._read()
+        curr, volt, active = self._query('INST OUT{0}\nCURR?\nVOLT?\nOUTP:SEL?\n'.format(channel))
         return float(volt), float(curr), int(active)
 
     def get_channel_config_all(self):
@@ -166,13 +252,11 @@ class Hameg:
 
     def fuse_off(self, channel):
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST OUT{0}\n'.format(channel))
-        self._write('FUSE OFF\n')
+        self._write('INST OUT{0}\nFUSE OFF\n'.format(channel))
 
     def fuse_on(self, channel):
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST OUT{0}\n'.format(channel))
-        self._write('FUSE ON\n')
+        self._write('INST OUT{0}\nFUSE ON\n'.format(channel))
 
     def activate_channel(self, channel):
         """Activate given channel"""
@@ -222,34 +306,39 @@ class Hameg:
     def get_fuse_triggered(self, channel):
         """Returns whether or not a fuse was triggered"""
         assert channel > 0 & channel <= self.number_channels
-        self._write('STAT:QUES:INST:ISUM{0}:COND?\n'.format(channel))
-        status = int(self._read())
+        status = int(self._query('STAT:QUES:INST:ISUM{0}:COND?\n'.format(channel))[0])
         return (status & 1024) != 0
 
     def get_current(self, channel):
         """Get the current of a given channel in mA"""
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST:SEL OUT{0}\n'.format(channel))
-        time.sleep(0.05)
-        self._write('MEAS:CURR?\n')
-        current = float(self._read())*1000
+        current = float(self._query('INST:SEL OUT{0}\nMEAS:CURR?\n'.format(channel))[0])*1000
         self.logger.debug("Current on channel {0} is {1} mA".format(channel, current))
         return current
 
     def get_voltage(self, channel):
         """Get the voltage of a given channel in V"""
         assert channel > 0 & channel <= self.number_channels
-        self._write('INST:SEL OUT{0}\n'.format(channel))
-        time.sleep(0.05)
-        self._write('MEAS:SCAL:VOLT?\n')
-        voltage = float(self._read())
+        voltage = float(self._query('INST:SEL OUT{0}\nMEAS:SCAL:VOLT?\n'.format(channel))[0])
         self.logger.debug("Voltage on channel {0} is {1} V".format(channel, voltage))
         return voltage
 
+    def get_power_values(self, channels=None):
+        """Returns {channel: (voltage in V, current in mA)}, all the channels are queried in a single write"""
+        if channels is None:
+            channels = range(1, self.number_channels+1)
+        channels = list(channels)
+        assert min(channels) > 0 and max(channels) <= self.number_channels
+        responses = self._query(''.join('INST:SEL OUT{0}\nMEAS:SCAL:VOLT?\nMEAS:CURR?\n'.format(channel)
+                                        for channel in channels))
+        return {channel: (float(responses[2*i]), float(responses[2*i+1])*1000)
+                for i, channel in enumerate(channels)}
+
     def get_power(self, channel):
         """Return Voltage, Current, Power of channel"""
-        voltage = self.get_voltage(channel)
-        current = self.get_current(channel)
+        return self._format_power(channel, *self.get_power_values([channel])[channel])
+
+    def _format_power(self, channel, voltage, current):
         power = voltage*current*0.001
         msg = "Channel {0}: {1:.2f} V, {2:.0f} mA, {3:.2f} W".format(
             channel, voltage, current, power)
@@ -259,8 +348,43 @@ class Hameg:
 
     def get_power_all(self):
         """Gets the voltage, current and power of all channels"""
-        for channel in range(1, self.number_channels+1):
-            self.get_power(channel)
+        for channel, (voltage, current) in self.get_power_values().items():
+            self._format_power(channel, voltage, current)
+
+    def get_monitor(self, rate=1., buffer_size=3600, channels=None):
+        """Returns a HamegMonitor of the channels"""
+        return HamegMonitor(self, rate=rate, buffer_size=buffer_size, channels=channels)
+
+
+class HamegMonitor(PeriodicSampler):
+    """Periodically measures the voltages and currents of the channels of a Hameg and stores them
+    into a fixed size ring buffer: timestamps [buffer_size] and values [buffer_size, len(channels), 2]
+    with the voltage in V and the current in mA, NaN if the measurement failed.
+    The supply can be used by other threads while monitoring."""
+
+    def __init__(self, hameg, rate=1., buffer_size=3600, channels=None):
+        self.hameg = hameg
+        self.channels = list(channels) if channels is not None else list(range(1, hameg.number_channels+1))
+        super(HamegMonitor, self).__init__(OrderedDict([('timestamps', ((), np.float64, 0.)),
+                                                        ('values', ((len(self.channels), 2), np.float64, np.nan))]),
+                                           rate=rate, buffer_size=buffer_size)
+
+    def _read(self):
+        timestamp = time.time()
+        values = np.full((len(self.channels), 2), np.nan, dtype=np.float64)
+        try:
+            measured = self.hameg.get_power_values(self.channels)
+            values[:] = [measured[channel] for channel in self.channels]
+        except Exception as e:
+            self.logger.error(f"Failed to measure the channels: {e}")
+        return timestamp, values
+
+    def get_latest(self):
+        """Returns (timestamp, {channel: (voltage, current)}) of the last sample, None if there is none"""
+        timestamps, values = self.get_samples(last=1)
+        if len(timestamps) == 0:
+            return None
+        return timestamps[0], {channel: tuple(values[0, i].tolist()) for i, channel in enumerate(self.channels)}
 
 
 if __name__ == "__main__":
@@ -13,6 +13,10 @@ from userdefinedexceptions import DataReadbackMismatchError
 
 from enum import IntEnum, unique
 
+ALPIDE_COLS = 1024
+ALPIDE_ROWS = 512
+
+
 class Opcode(object):
     """Opcodes supported by ALPIDE"""
     GRST = 0x00D2
@@ -176,6 +180,16 @@ class Alpide(Chip):
         ret = {"ret": dataread, ...:...}
     """
 
+    # Status registers read by _request_status_regs
+    STATUS_REGS = (Addr.DTU_PLL_LOCK_1,
+                   Addr.FROMU_STATUS_1, Addr.FROMU_STATUS_2, Addr.FROMU_STATUS_3, Addr.FROMU_STATUS_4, Addr.FROMU_STATUS_5,
+                   Addr.SEU_ERROR_COUNTER,
+                   Addr.CMU_AND_DMU_STATUS)
+
+    # Pixel configuration register of all the regions, bit [2:0] address: writing it 0xFFFF sets the
+    # flip-flops of the addressed pixels to the value of the Pixel Configuration Register, 0 clears the addressing
+    PIXEL_CFG_ALL_ADDRESS = 0<<11 | 0b100<<8 | 1<<7 | 0x7
+
     def __init__(self, board, chipid,
                  is_on_lower_hs=False,
                  is_on_upper_hs=False,
@@ -527,9 +541,8 @@ class Alpide(Chip):
         assert pulse_notmask | 1 == 1
         self.setreg_pixel_cfg(PIXCNFG_REGSEL=pulse_notmask, PIXCNFG_DATA=value,
                               commitTransaction=commitTransaction,log=log,readback=readback)
-        sub_add = (1<<7) | 0x7
-        self.write_region_reg(0x0, 0b100, sub_add, 0xFFFF, readback, log, commitTransaction)
-        self.write_region_reg(0x0, 0b100, sub_add, 0, readback, log, commitTransaction)
+        self.write_reg(self.PIXEL_CFG_ALL_ADDRESS, 0xFFFF, readback=readback, log=log, commitTransaction=commitTransaction)
+        self.write_reg(self.PIXEL_CFG_ALL_ADDRESS, 0, readback=readback, log=log, commitTransaction=commitTransaction)
 
     def unmask_reg(self, reg, readback=None, log=None, commitTransaction=None):
         """unmasks the region in the given reg"""
@@ -706,22 +719,37 @@ class Alpide(Chip):
 
         self._clear_pixel_cfg_register(readback = readback, log=log,commitTransaction=commitTransaction)
 
-    def _address_row(self, row, readback=None, log=None, commitTransaction=None):
-        """addressing a signle row of pixels"""
+    @staticmethod
+    def _get_address_row_regs(row):
+        """Returns the register writes [(address, data), ...] addressing a single row of pixels,
+        see _address_row"""
         assert row | 0x1FF == 0x1FF
 
         region_row = row>>4 & 0x1F # bit [15:11] address
         row_lsb = row & 0xF # bit index data
         data_row = 1<<row_lsb
         sub_addr_row = 1<<2 # bit [2] address
-        self.write_region_reg(region_row, 0b100, sub_addr_row, data_row, readback, log, commitTransaction)
 
         region_col = 0 # bit [15:11] address
         sub_addr_col = (1<<7)| 3  # bit [1:0] address
         data_col = 0xFFFF
-        self.write_region_reg(region_col, 0b100, sub_addr_col, data_col, readback, log, commitTransaction)
 
-        self._clear_pixel_cfg_register(readback = readback, log=log,commitTransaction=commitTransaction)
+        return [(region_row<<11 | 0b100<<8 | sub_addr_row, data_row),
+                (region_col<<11 | 0b100<<8 | sub_addr_col, data_col),
+                (Alpide.PIXEL_CFG_ALL_ADDRESS, 0)]
+
+    def _address_row(self, row, readback=None, log=None, commitTransaction=None):
+        """addressing a signle row of pixels"""
+        for address, data in self._get_address_row_regs(row):
+            self.write_reg(address, data, readback=readback, log=log, commitTransaction=commitTransaction)
+
+    @staticmethod
+    def get_row_config_regs(row, pulse_notmask, value):
+        """Returns the register writes [(address, data), ...] setting the mask (pulse_notmask=0) or
+        pulse (pulse_notmask=1) flip-flops of a row to value, as mask_row, unmask_row, pulse_row_enable
+        and pulse_row_disable do. To be written with write_regs, e.g. precompiled for a scan"""
+        return [(Addr.PIXEL_CFG, Alpide.encode_pixel_cfg(PIXCNFG_REGSEL=pulse_notmask, PIXCNFG_DATA=value))] + \
+            Alpide._get_address_row_regs(row)
 
     def _address_dcol(self, dcol, readback=None, log=None, commitTransaction=None):
         """addressing a single double column of pixels"""
@@ -764,10 +792,7 @@ class Alpide(Chip):
 
     def _clear_pixel_cfg_register(self, readback=None,log=None,commitTransaction=None):
         """clears the pixel config register"""
-        region_all = 0
-        sub_addr_all = 1<<7|0x7 # bit [2:0] address
-        address=region_all<<11|0b100<<8|sub_addr_all
-        self.write_reg(address, 0, readback = readback, log=log,commitTransaction=commitTransaction)
+        self.write_reg(self.PIXEL_CFG_ALL_ADDRESS, 0, readback = readback, log=log,commitTransaction=commitTransaction)
 
     def _read_pixel_config(self, col, row, readback=None,log=None,commitTransaction=None):
         """reads back the configuration of the row/col select"""
@@ -896,9 +921,8 @@ class Alpide(Chip):
             for name, value in result[1].items():
                 config_str += "  - {0} : {1:#X}\n".format(name, value)
         config_str += "--- Register double columns disable\n"
-        for i in range(32):
-            address = i <<11 |0x300
-            value = self.read_reg(address)
+        addresses = [i <<11 |0x300 for i in range(32)]
+        for address, value in zip(addresses, self.read_regs(addresses)):
             config_str += "  - {0:#X} : {1:#X}\n".format(address, value)
         return config_str
 
@@ -949,6 +973,24 @@ class Alpide(Chip):
 
         return (dataread, ret)
 
+    # STATUS REGISTERS
+    def _request_status_regs(self):
+        """Queues the reads of the STATUS_REGS without flushing, so that the status of all the chips
+        of a stave is read in a single sequence. Returns the request to be passed to _format_status_regs"""
+        return self._request_regs(self.STATUS_REGS)
+
+    def _format_status_regs(self, request, results):
+        """Returns the STATUS_REGS requested by _request_status_regs as {address: (dataread, fields)},
+        the fields being decoded as by the getreg_<register> functions (empty for the counters).
+        Raises ChipidMismatchError if any of the reads failed"""
+        decoders = {Addr.DTU_PLL_LOCK_1: self._decode_dtu_pll_lock_1,
+                    Addr.FROMU_STATUS_5: self._decode_fromu_status_5,
+                    Addr.CMU_AND_DMU_STATUS: self._decode_cmu_and_dmu_status}
+        ret = OrderedDict()
+        for address, dataread in zip(self.STATUS_REGS, self._format_regs(request, results)):
+            ret[address] = (dataread, decoders[address](dataread) if address in decoders else OrderedDict())
+        return ret
+
     #######
     # ADC #
     #######
@@ -2116,12 +2158,16 @@ class Alpide(Chip):
                                  log=log,
                                  commitTransaction=commitTransaction,
                                  verbose=verbose)
+        return (dataread, self._decode_fromu_status_5(dataread))
+
+    @staticmethod
+    def _decode_fromu_status_5(dataread):
+        """Fields of FROMU Status Register 5, see getreg_fromu_status_5"""
         ret = OrderedDict()
         ret["BunchCounter"] = (dataread >> 0) & 0XFFF
         ret["EventCounter"] = (dataread >> 12) & 0X7
         ret["EnStrobeGeneration"] = (dataread >> 15) & 0X1
-
-        return (dataread, ret)
+        return ret
 
     def setreg_dac_settings_dclk_and_mclk_io_buffers(self,
                                                      DCLKReceiver=None,
@@ -2385,12 +2431,16 @@ class Alpide(Chip):
                                  log=log,
                                  commitTransaction=commitTransaction,
                                  verbose=verbose)
+        return (dataread, self._decode_cmu_and_dmu_status(dataread))
+
+    @staticmethod
+    def _decode_cmu_and_dmu_status(dataread):
+        """Fields of CMU and DMU Status Register, see getreg_cmu_and_dmu_status"""
         ret = OrderedDict()
         ret["CMUErrorsCounter"] = (dataread >> 0) & 0XF
         ret["CMUTimeOutCounter"] = (dataread >> 4) & 0XF
         ret["CMUOpCounter"] = (dataread >> 8) & 0XF
-
-        return (dataread, ret)
+        return ret
 
     # Autogenerated function
     def getreg_dmu_data_fifo_lsbs(self, commitTransaction=None, log=None, verbose=False):
@@ -2659,12 +2709,16 @@ class Alpide(Chip):
                                  log=log,
                                  commitTransaction=commitTransaction,
                                  verbose=verbose)
+        return (dataread, self._decode_dtu_pll_lock_1(dataread))
+
+    @staticmethod
+    def _decode_dtu_pll_lock_1(dataread):
+        """Fields of DTU PLL Lock Register 1, see getreg_dtu_pll_lock_1"""
         ret = OrderedDict()
         ret["LockCounter"] = (dataread >> 0) & 0XFF
         ret["LockFlag"] = (dataread >> 8) & 0X1
         ret["LockStatus"] = (dataread >> 9) & 0X1
-
-        return (dataread, ret)
+        return ret
 
     def setreg_dtu_pll_lock_2(self,
                               LockWaitCycles=None,
@@ -3145,8 +3199,7 @@ class Alpide(Chip):
             PIXCNFG_DATA = dataout['PIXCNFG_DATA']
 
         # Writedata generation
-        datawrite = (((PIXCNFG_REGSEL & 0X1) << 0) |
-                     ((PIXCNFG_DATA & 0X1) << 1))
+        datawrite = self.encode_pixel_cfg(PIXCNFG_REGSEL=PIXCNFG_REGSEL, PIXCNFG_DATA=PIXCNFG_DATA)
 
         self.write_reg(address=Addr.PIXEL_CFG,
                        data=datawrite,
@@ -3155,6 +3208,13 @@ class Alpide(Chip):
                        commitTransaction=commitTransaction,
                        verbose=verbose)
 
+    @staticmethod
+    def encode_pixel_cfg(PIXCNFG_REGSEL, PIXCNFG_DATA):
+        """Value of the Pixel Configuration Register, see setreg_pixel_cfg.
+        To be written with write_regs/write_chip_regs, e.g. precompiled for a scan"""
+        return (((PIXCNFG_REGSEL & 0X1) << 0) |
+                ((PIXCNFG_DATA & 0X1) << 1))
+
     # Autogenerated function
     def getreg_pixel_cfg(self, commitTransaction=None, log=None, verbose=False):
         """ Autogenerated function for Pixel Configuration Register
@@ -3261,11 +3321,11 @@ class Alpide(Chip):
             IRefBufferCurrent = dataout['IRefBufferCurrent']
 
         # Writedata generation
-        datawrite = (((VoltageDACSel & 0XF) << 0) |
-                     ((CurrentDACSel & 0X7) << 4) |
-                     ((SWCNTL_DACMONI & 0X1) << 7) |
-                     ((SWCNTL_DACMONV & 0X1) << 8) |
-                     ((IRefBufferCurrent & 0X3) << 9))
+        datawrite = self.encode_analog_monitor_and_override(VoltageDACSel=VoltageDACSel,
+                                                            CurrentDACSel=CurrentDACSel,
+                                                            SWCNTL_DACMONI=SWCNTL_DACMONI,
+                                                            SWCNTL_DACMONV=SWCNTL_DACMONV,
+                                                            IRefBufferCurrent=IRefBufferCurrent)
 
         self.write_reg(address=Addr.ANALOG_MONITOR_AND_OVERRIDE,
                        data=datawrite,
@@ -3274,6 +3334,16 @@ class Alpide(Chip):
                        commitTransaction=commitTransaction,
                        verbose=verbose)
 
+    @staticmethod
+    def encode_analog_monitor_and_override(VoltageDACSel, CurrentDACSel, SWCNTL_DACMONI, SWCNTL_DACMONV, IRefBufferCurrent):
+        """Value of the Analog Monitor and Override Register, see setreg_analog_monitor_and_override.
+        To be written with write_regs/write_chip_regs, e.g. precompiled for a scan"""
+        return (((VoltageDACSel & 0XF) << 0) |
+                ((CurrentDACSel & 0X7) << 4) |
+                ((SWCNTL_DACMONI & 0X1) << 7) |
+                ((SWCNTL_DACMONV & 0X1) << 8) |
+                ((IRefBufferCurrent & 0X3) << 9))
+
     # Autogenerated function
     def getreg_analog_monitor_and_override(self, commitTransaction=None, log=None, verbose=False):
         """ Autogenerated function for Analog Monitor and Override Register
@@ -4447,13 +4517,13 @@ class Alpide(Chip):
             CompOut = dataout['CompOut']
 
         # Writedata generation
-        datawrite = (((Mode & 0X3) << 0) |
-                     ((SelInput & 0XF) << 2) |
-                     ((SetIComp & 0X3) << 6) |
-                     ((DiscriSign & 0X1) << 8) |
-                     ((RampSpd & 0X3) << 9) |
-                     ((HalfLSBTrim & 0X1) << 11) |
-                     ((CompOut & 0X1) << 15))
+        datawrite = self.encode_adc_ctrl(Mode=Mode,
+                                         SelInput=SelInput,
+                                         SetIComp=SetIComp,
+                                         DiscriSign=DiscriSign,
+                                         RampSpd=RampSpd,
+                                         HalfLSBTrim=HalfLSBTrim,
+                                         CompOut=CompOut)
 
         self.write_reg(address=Addr.ADC_CTRL,
                        data=datawrite,
@@ -4462,6 +4532,18 @@ class Alpide(Chip):
                        commitTransaction=commitTransaction,
                        verbose=verbose)
 
+    @staticmethod
+    def encode_adc_ctrl(Mode, SelInput, SetIComp, DiscriSign, RampSpd, HalfLSBTrim, CompOut=0):
+        """Value of the ADC Control Register, see setreg_adc_ctrl (CompOut is read-only).
+        To be written with write_regs/write_chip_regs, e.g. precompiled for a scan"""
+        return (((Mode & 0X3) << 0) |
+                ((SelInput & 0XF) << 2) |
+                ((SetIComp & 0X3) << 6) |
+                ((DiscriSign & 0X1) << 8) |
+                ((RampSpd & 0X3) << 9) |
+                ((HalfLSBTrim & 0X1) << 11) |
+                ((CompOut & 0X1) << 15))
+
     # Autogenerated function
     def getreg_adc_ctrl(self, commitTransaction=None, log=None, verbose=False):
         """ Autogenerated function for ADC Control Register
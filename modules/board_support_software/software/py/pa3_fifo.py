@@ -1,8 +1,11 @@
 """Implements the control for the pa3_fifo_wb_slave wishbone slave"""
 from enum import IntEnum, unique
 import logging
+import time
 import warnings
 
+import numpy as np
+
 from communication import WishboneReadError
 import pa3_fifo_monitor
 from wishbone_module import WishboneModule
@@ -23,6 +26,20 @@ class Pa3FifoAddress(IntEnum):
     FIFO_RESET = 9
 
 
+PA3_FIFO_DEPTH = 1024      # 16-bit words, depth of the FIFO of the pa3_fifo_wb_slave assumed by the flow control
+BULK_CHUNK_WORDS = 256     # words sent per flush by write_data_to_fifo_bulk
+# Words of the FIFO left free by write_data_to_fifo_bulk: room for the writes it does not account for
+# (write_data_to_fifo and write_data_to_fifo_opt* before the transfer), one chunk
+BULK_FIFO_MARGIN = BULK_CHUNK_WORDS
+BULK_MAX_IN_FLIGHT = PA3_FIFO_DEPTH - BULK_FIFO_MARGIN  # words written and not yet read by the PA3 before write_data_to_fifo_bulk waits
+BULK_TIMEOUT = 5           # s without any word read by the PA3 before write_data_to_fifo_bulk fails
+
+
+class Pa3FifoError(Exception):
+    """The PA3 FIFO did not receive the words of a bulk write"""
+    pass
+
+
 class Pa3Fifo(WishboneModule):
     """Send data to PA3 FIFO slave"""
     def __init__(self, moduleid, board_obj, monitor_module):
@@ -61,6 +78,7 @@ class Pa3Fifo(WishboneModule):
         does the same as write_data_to_fifo, but with significantly more speed.
         should be about 4x improvement by calling C code directly from here.
         This bypasses the software queing mechanism, so it should be used with some caution.
+        See write_data_to_fifo_bulk for writing whole payloads.
         """
         self.comm.roc_write(self._CRU_ADD_TX_LOW, (self._BASE_SWT_WRITE_MESSAGE | (data & 0xffff)))
         self.comm.roc_write(self._CRU_ADD_SWT_CONTROL, 1)
@@ -70,11 +88,81 @@ class Pa3Fifo(WishboneModule):
         does the same as write_data_to_fifo, but with significantly more speed.
         should be about 4x improvement by calling C code directly from here.
         This bypasses the software queing mechanism, so it should be used with some caution.
+        See write_data_to_fifo_bulk for writing whole payloads.
         """
         self.comm._roc.register_write(self._CRU_ADD_TX_LOW, (self._BASE_SWT_WRITE_MESSAGE | (data & 0xffff)))
         self.comm._roc.register_write(self._CRU_ADD_SWT_CONTROL, 1)
         self.comm._roc.register_write(self._CRU_ADD_SWT_CONTROL, 0)
 
+    def write_data_to_fifo_bulk(self, data, chunk_words=BULK_CHUNK_WORDS, max_in_flight=BULK_MAX_IN_FLIGHT,
+                                timeout=BULK_TIMEOUT):
+        """Writes a whole payload to the FIFO and returns the number of words written.
+
+        data is either bytes-like (16-bit little endian words, as the flash images) or an iterable of 16-bit words.
+        The writes go through the Communication queue, chunk_words per flush, with the communication locked
+        for the whole transfer. As for Communication.single_write, the transactions already queued are kept
+        in the queue for the next flush.
+        Flow control: when more than max_in_flight words may not have been read by the PA3 yet,
+        the FIFO_READ counter (bytes) is polled until there is room. max_in_flight=None disables it.
+        The FIFO_WRITE and FIFO_OVERFLOW counters are checked after the transfer: Pa3FifoError is raised
+        if words were dropped (e.g. max_in_flight larger than the actual FIFO depth).
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            payload = bytes(data)
+        else:
+            words = np.asarray(data)
+            assert words.size == 0 or (words.min() >= 0 and words.max() <= 0xFFFF), "Data must be 16-bit words"
+            payload = words.astype('<u2').tobytes()
+        assert len(payload) % 2 == 0, "Payload must contain an integer number of 16-bit words"
+        nwords = len(payload) // 2
+        assert chunk_words > 0
+        assert max_in_flight is None or max_in_flight >= chunk_words, "max_in_flight must be at least chunk_words"
+
+        modulo = {counter: 1 << self._monitor.get_counter_width(counter) for counter in ['FIFO_WRITE', 'FIFO_READ', 'FIFO_OVERFLOW']}
+        # the counters wrap around, but less than max_in_flight words are read between two polls
+        assert max_in_flight is None or 2*max_in_flight < modulo['FIFO_READ'], "max_in_flight too large for the FIFO_READ counter"
+
+        self.comm._lock_comm()
+        pending_buffer, pending_read_bytes = self.comm._buffer, self.comm._read_bytes
+        self.comm._buffer, self.comm._read_bytes = bytearray(), 0
+        try:
+            start = self._monitor.read_counters(counters=['FIFO_WRITE', 'FIFO_READ', 'FIFO_OVERFLOW'])
+            read_counter = start['FIFO_READ']
+            bytes_read = 0
+            words_read = 0
+            sent = 0
+            while sent < nwords:
+                chunk = min(chunk_words, nwords - sent)
+                if max_in_flight is not None and sent + chunk - words_read > max_in_flight:
+                    last_progress = time.time()
+                    while True:
+                        counter = self._monitor.read_counters(counters=['FIFO_READ'])['FIFO_READ']
+                        bytes_read += (counter - read_counter) % modulo['FIFO_READ']
+                        read_counter = counter
+                        if bytes_read // 2 > words_read:
+                            words_read = bytes_read // 2
+                            last_progress = time.time()
+                        if sent + chunk - words_read <= max_in_flight:
+                            break
+                        if time.time() - last_progress > timeout:
+                            raise TimeoutError(f"PA3 FIFO not read for {timeout} s, {sent - words_read} words pending")
+                self.comm.register_write_stream(self.moduleid, Pa3FifoAddress.WR_FIFO_DATA, payload[2*sent:2*(sent+chunk)])
+                self.comm.flush(lock=False)
+                sent += chunk
+            end = self._monitor.read_counters(counters=['FIFO_WRITE', 'FIFO_OVERFLOW'])
+        finally:
+            self.comm._buffer, self.comm._read_bytes = pending_buffer, pending_read_bytes
+            self.comm._unlock_comm()
+        overflows = (end['FIFO_OVERFLOW'] - start['FIFO_OVERFLOW']) % modulo['FIFO_OVERFLOW']
+        if overflows:
+            raise Pa3FifoError(f"PA3 FIFO overflow, {overflows} of {sent} words dropped (max_in_flight {max_in_flight}, "
+                               f"PA3_FIFO_DEPTH {PA3_FIFO_DEPTH})")
+        written = (end['FIFO_WRITE'] - start['FIFO_WRITE']) % modulo['FIFO_WRITE']
+        if written != sent % modulo['FIFO_WRITE']:
+            raise Pa3FifoError(f"PA3 FIFO received {written} words, expected {sent % modulo['FIFO_WRITE']} "
+                               f"(FIFO_WRITE modulo {modulo['FIFO_WRITE']})")
+        return sent
+
     def is_old_wb2fifo(self):
         """Does the FW have the old wb2fifo slave?"""
         exc_en = self.comm._enable_rderr_exception
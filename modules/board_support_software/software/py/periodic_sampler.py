@@ -0,0 +1,124 @@
+"""Base class of the samplers acquiring values periodically, in the foreground (run) or in a background thread (start/stop).
+
+The samples are stored in preallocated ring buffers, one per field of a sample (e.g. timestamps and values),
+the oldest samples being overwritten when they are full. The buffers can be read while sampling.
+
+A subclass declares its fields and implements _read, which acquires a sample and returns the value of each field:
+
+class MySampler(PeriodicSampler):
+    def __init__(self, board, rate=1., buffer_size=3600):
+        super().__init__(OrderedDict([('timestamps', ((), np.float64, 0.)),
+                                      ('values', ((4,), np.float64, np.nan))]),
+                         rate=rate, buffer_size=buffer_size)
+        self.board = board
+
+    def _read(self):
+        return time.time(), self.board.read_values()
+"""
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+
+class PeriodicSampler(object):
+    """Samples at rate [Hz] into ring buffers of buffer_size samples.
+
+    fields: OrderedDict {name: (shape of a sample, dtype, initial value)} of the buffers,
+            the first one holding the timestamps used by get_samples(since=...).
+            Each buffer [buffer_size, *shape] is an attribute of the sampler named after its field.
+    """
+
+    def __init__(self, fields, rate=1., buffer_size=3600):
+        assert rate > 0, "rate must be positive"
+        assert buffer_size > 0, "buffer_size must be positive"
+        self.period = 1./rate
+        self.buffer_size = buffer_size
+        self.count = 0
+        self.logger = logging.getLogger(type(self).__name__)
+        self._fields = list(fields)
+        for name, (shape, dtype, fill) in fields.items():
+            setattr(self, name, np.full((buffer_size,) + tuple(shape), fill, dtype=dtype))
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        """Acquires a sample, returns the value of each field"""
+        raise NotImplementedError
+
+    def sample(self):
+        """Acquires a single sample, stores it in the buffers and returns the value of each field"""
+        sample = self._read()
+        with self._lock:
+            index = self.count % self.buffer_size
+            for name, value in zip(self._fields, sample):
+                getattr(self, name)[index] = value
+            self.count += 1
+        return sample
+
+    def run(self, duration=None, nsamples=None):
+        """Samples at the configured rate for the given duration [s] or number of samples (blocking)"""
+        assert duration is not None or nsamples is not None or self._thread is not None, "Specify duration or nsamples"
+        start = time.time()
+        next_sample = start
+        count = 0
+        while not self._stop_event.is_set():
+            if duration is not None and time.time() - start >= duration:
+                break
+            if nsamples is not None and count >= nsamples:
+                break
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.error(f"Sampling failed: {e}")
+            count += 1
+            next_sample += self.period
+            delay = next_sample - time.time()
+            if delay < 0:
+                # Sampling slower than requested: do not try to catch up
+                next_sample = time.time()
+            else:
+                self._stop_event.wait(delay)
+        return count
+
+    def start(self):
+        """Starts sampling in a background thread"""
+        assert self._thread is None, "Sampling already running"
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the background sampling"""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+
+    def clear(self):
+        """Clears the buffers"""
+        with self._lock:
+            self.count = 0
+
+    def _get_buffers(self, index=()):
+        """Returns copies of the buffers in chronological order, each indexed by index after the sample axis"""
+        buffers = [getattr(self, name)[(slice(None),) + tuple(index)] for name in self._fields]
+        with self._lock:
+            if self.count <= self.buffer_size:
+                return [buffer[:self.count].copy() for buffer in buffers]
+            start = self.count % self.buffer_size
+            return [np.concatenate((buffer[start:], buffer[:start])) for buffer in buffers]
+
+    def get_samples(self, since=None, last=None, index=()):
+        """Returns copies of the buffers in chronological order, optionally only the samples taken after since
+        (timestamp) and/or the last ones. index selects a part of each sample (e.g. a RU, see _get_buffers)"""
+        buffers = self._get_buffers(index)
+        if since is not None:
+            selected = buffers[0] > since
+            buffers = [buffer[selected] for buffer in buffers]
+        if last is not None:
+            buffers = [buffer[-last:] for buffer in buffers]
+        return tuple(buffers)
@@ -15,6 +15,7 @@ from enum import IntEnum, unique
 import time
 
 from wishbone_module import WishboneModule
+from periodic_sampler import PeriodicSampler
 from pu_controller import PuController, TempInterlockEnable, PowerUnitRTDSensor, Adc
 from pu_monitor import PuMonitor
 
@@ -758,13 +759,8 @@ class PowerUnit(WishboneModule):
         if not self.controller.is_temperature_interlock_enabled(interlock=TempInterlockEnable.INTERNAL_PT100) and not suppress_warnings:
             self.logger.warning("Temperature interlock not active!")
         if self.controller.is_temperature_interlock_enabled(interlock=TempInterlockEnable.INTERNAL_PT100) and not use_i2c:
-            # under this condition all the values are mirrored
-            power_enable_status = self.controller.get_power_enable_status()
-            bias_enable_status = self.controller.get_bias_enable_status()
-            for module in module_list:
-                vdd_ret[module] = self.controller.get_power_adc_values(module)
-            bb_voltage = self.controller.read_bias_adc_channel(channel=Adc.V_BB)
-            bb_current = self.controller.read_bias_adc_channel(channel=Adc.I_BB)
+            # under this condition all the values are mirrored and can be read in a single sequence
+            return self.controller.read_values_modules(module_list=module_list)
         else:
             self.logger.debug(f"Using I2C to retrieve values!")
             power_enable_status = self.get_power_enable_status()
@@ -1554,3 +1550,77 @@ class PowerUnit(WishboneModule):
         self.logger.info(print_offset_digital)
 
         return offsets
+
+
+def read_power_units_values(power_units, module_list=range(8)):
+    """Reads enable status and power/bias ADC values of one or both power units of a RU
+    in a single wishbone sequence.
+    The values are the ones mirrored by the power unit controllers,
+    i.e. the temperature interlock on the internal PT100 needs to be enabled.
+
+    Returns a dictionary {power unit index: values}, values as in PowerUnit.get_values_modules
+    """
+    module_list = list(module_list)
+    board = power_units[0].board
+    for power_unit in power_units:
+        assert power_unit.board is board, "Power units need to be on the same RU"
+        power_unit.controller._request_values_modules(module_list)
+    length = 4 + 4*len(module_list)
+    results = board.flush_and_read_results(expected_length=length*len(power_units))
+    ret = OrderedDict()
+    for i, power_unit in enumerate(power_units):
+        ret[power_unit.index] = power_unit.controller._format_values_modules(results[i*length:(i+1)*length], module_list)
+    return ret
+
+
+class PowerUnitSampler(PeriodicSampler):
+    """Continuously samples the monitored values of the power units of a RU
+    into a fixed size ring buffer of timestamped samples.
+
+    Each sample is a single wishbone sequence (see read_power_units_values).
+    The communication is not thread safe: while sampling in the background (start/stop),
+    the RU must not be accessed by other threads of the same process.
+    """
+
+    AGGREGATED_KEYS = ("bb_voltage", "bb_current", "avdd_voltage", "avdd_current", "dvdd_voltage", "dvdd_current")
+
+    def __init__(self, power_units, module_list=range(8), rate=10., buffer_size=10000):
+        self.power_units = list(power_units)
+        self.module_list = list(module_list)
+        super(PowerUnitSampler, self).__init__(OrderedDict([('timestamps', ((), float, 0.)),
+                                                            ('values', ((), object, None))]),
+                                               rate=rate, buffer_size=buffer_size)
+        self.logger = self.power_units[0].logger
+
+    def _read(self):
+        return time.time(), read_power_units_values(self.power_units, module_list=self.module_list)
+
+    def get_samples(self, since=None, last=None):
+        """Returns a copy of the buffered samples as [(timestamp, values)] in chronological order,
+        optionally only those taken after since (timestamp) and/or the last ones"""
+        timestamps, values = super(PowerUnitSampler, self).get_samples(since=since, last=last)
+        return list(zip(timestamps.tolist(), values.tolist()))
+
+    def aggregate(self, since=None):
+        """Returns min/max/mean of the buffered ADC values (codes) as
+        {power unit index: {key: {"min": ., "max": ., "mean": .}}}
+        """
+        samples = self.get_samples(since=since)
+        ret = OrderedDict()
+        for _, values in samples:
+            for index, pu_values in values.items():
+                pu_ret = ret.setdefault(index, OrderedDict())
+                for key, value in pu_values.items():
+                    if not key.endswith(self.AGGREGATED_KEYS):
+                        continue
+                    if key not in pu_ret:
+                        pu_ret[key] = {"min": value, "max": value, "sum": 0, "n": 0}
+                    entry = pu_ret[key]
+                    entry["min"] = min(entry["min"], value)
+                    entry["max"] = max(entry["max"], value)
+                    entry["sum"] += value
+                    entry["n"] += 1
+        for pu_ret in ret.values():
+            for key, entry in pu_ret.items():
+                pu_ret[key] = {"min": entry["min"], "max": entry["max"], "mean": entry["sum"]/entry["n"]}
+        return ret
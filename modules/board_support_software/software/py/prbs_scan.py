@@ -0,0 +1,201 @@
+""" Parallel PRBS bit error rate scan of the transceiver lanes of several RUs
+
+The PRBS checkers of all the lanes run at the same time: for each setting of the scan the counters of all the RUs
+are reset together, then every dwell interval the error counters of all the lanes are read in one batched snapshot
+(a single wishbone sequence per RU, see GthFrontend.read_prbs_counter).
+A lane stops being read as soon as its BER is known to be below (pass) or above (fail) target_ber
+with the requested confidence, a setting ends when all the lanes are decided or after max_time.
+A lane whose BER is close to target_ber needs many times the time_to_pass of an error free lane to be decided:
+by default max_time is MAX_TIME_TO_PASS times time_to_pass.
+
+usage:
+scan = PrbsBerScan(rdo_list, line_rate=600e6, target_ber=1e-9, confidence=0.95)
+results = scan.run(settings=range(16), apply_setting=set_pll_dac)  # set_pll_dac(setting) configures all the chips
+results.column('ber_upper')
+results.save('prbs_scan.npz')
+"""
+
+import logging
+import math
+import time
+from collections import OrderedDict
+from enum import IntEnum
+from statistics import NormalDist
+
+import numpy as np
+
+# Default max_time in units of time_to_pass: a lane with BER 3x below (above) target_ber passes (fails)
+# with the default confidence within about this time, closer lanes end INCONCLUSIVE
+MAX_TIME_TO_PASS = 10.
+
+
+class LaneStatus(IntEnum):
+    RUNNING = 0
+    PASS = 1
+    FAIL = 2
+    INCONCLUSIVE = 3
+
+
+def poisson_cdf(k, mu):
+    """P(X <= k) for X Poisson distributed with mean mu"""
+    if mu <= 0:
+        return 1.
+    log_term = -mu
+    cdf = math.exp(log_term)
+    for i in range(1, k + 1):
+        log_term += math.log(mu / i)
+        cdf += math.exp(log_term)
+        if i > mu and log_term < -745:
+            break  # remaining terms underflow
+    return min(cdf, 1.)
+
+
+def poisson_upper_limit(k, confidence):
+    """Upper limit on the mean of a Poisson process after observing k events, at the given confidence"""
+    if k == 0:
+        return -math.log(1 - confidence)
+    if k > 100:
+        z = NormalDist().inv_cdf(confidence)
+        return k + z * math.sqrt(k) + 1
+    low, high = float(k), k + 10. * math.sqrt(k) + 10.
+    for _ in range(60):
+        mid = (low + high) / 2
+        if poisson_cdf(k, mid) > 1 - confidence:
+            low = mid
+        else:
+            high = mid
+    return high
+
+
+def lane_status(errors, bits, target_ber, confidence):
+    """Decides if the BER of a lane is below or above target_ber with the given confidence"""
+    expected = bits * target_ber
+    if expected <= 0:
+        return LaneStatus.RUNNING
+    if errors > 10 * expected + 100:
+        return LaneStatus.FAIL
+    if poisson_cdf(errors, expected) <= 1 - confidence:
+        return LaneStatus.PASS
+    if errors > 0 and 1 - poisson_cdf(errors - 1, expected) <= 1 - confidence:
+        return LaneStatus.FAIL
+    return LaneStatus.RUNNING
+
+
+class PrbsScanResults:
+    """Columnar table of the scan results, one row per (setting, RU, lane)"""
+
+    COLUMNS = ('setting', 'gbt_channel', 'lane', 'errors', 'bits', 'ber', 'ber_upper', 'status', 'duration')
+
+    def __init__(self, confidence):
+        self.confidence = confidence
+        self._columns = OrderedDict((name, []) for name in self.COLUMNS)
+
+    def __len__(self):
+        return len(self._columns['lane'])
+
+    def append(self, setting, gbt_channel, lane, errors, bits, status, duration):
+        self._columns['setting'].append(setting)
+        self._columns['gbt_channel'].append(gbt_channel)
+        self._columns['lane'].append(lane)
+        self._columns['errors'].append(errors)
+        self._columns['bits'].append(bits)
+        self._columns['ber'].append(errors / bits if bits else float('nan'))
+        self._columns['ber_upper'].append(poisson_upper_limit(errors, self.confidence) / bits if bits else float('nan'))
+        self._columns['status'].append(LaneStatus(status).name)
+        self._columns['duration'].append(duration)
+
+    def column(self, name):
+        """Returns a column as a numpy array"""
+        return np.array(self._columns[name])
+
+    def as_arrays(self):
+        return OrderedDict((name, self.column(name)) for name in self.COLUMNS)
+
+    def rows(self, **selection):
+        """Returns the rows (as dictionaries) matching the selection, e.g. rows(gbt_channel=3, status='FAIL')"""
+        ret = []
+        for i in range(len(self)):
+            row = OrderedDict((name, values[i]) for name, values in self._columns.items())
+            if all(row[key] == value for key, value in selection.items()):
+                ret.append(row)
+        return ret
+
+    def save(self, filename):
+        """Saves the table as a numpy .npz archive, one array per column"""
+        np.savez(filename, **self.as_arrays())
+
+
+class PrbsBerScan:
+    """PRBS BER scan of the GTH lanes (rdo.gth.transceivers) of the RUs, see module docstring.
+
+    line_rate: bit rate of a lane [bit/s]
+    target_ber, confidence: a lane passes when its BER is below target_ber with the given confidence
+    dwell: time between two snapshots of the counters [s]
+    max_time: maximum time per setting [s], lanes still undecided are INCONCLUSIVE,
+              by default MAX_TIME_TO_PASS times time_to_pass
+    """
+
+    def __init__(self, rdo_list, line_rate=600e6, target_ber=1e-12, confidence=0.95, dwell=1., max_time=None,
+                 logger=None):
+        assert 0 < confidence < 1, "confidence must be in (0, 1)"
+        assert target_ber > 0, "target_ber must be positive"
+        self.rdo_list = list(rdo_list)
+        self.line_rate = line_rate
+        self.target_ber = target_ber
+        self.confidence = confidence
+        self.dwell = dwell
+        self.max_time = max_time if max_time is not None else MAX_TIME_TO_PASS * self.time_to_pass()
+        self.logger = logger if logger is not None else logging.getLogger("PrbsBerScan")
+
+    def time_to_pass(self):
+        """Time needed for an error free lane to pass"""
+        return -math.log(1 - self.confidence) / (self.target_ber * self.line_rate)
+
+    def _reset_counters(self):
+        reset_time = []
+        for rdo in self.rdo_list:
+            rdo.gth.reset_prbs_counter(commitTransaction=True)
+            reset_time.append(time.monotonic())
+        return reset_time
+
+    def scan_setting(self, setting, results):
+        """Measures all the lanes at the current setting and appends them to results"""
+        reset_time = self._reset_counters()
+        start = time.monotonic()
+        lanes = [rdo.gth.get_transceivers() for rdo in self.rdo_list]
+        status = [[LaneStatus.RUNNING] * len(rdo_lanes) for rdo_lanes in lanes]
+        running = sum(len(rdo_lanes) for rdo_lanes in lanes)
+        while running:
+            time.sleep(self.dwell)
+            timeout = time.monotonic() - start >= self.max_time
+            for i, rdo in enumerate(self.rdo_list):
+                if LaneStatus.RUNNING not in status[i]:
+                    continue
+                counters = rdo.gth.read_prbs_counter()
+                elapsed = time.monotonic() - reset_time[i]
+                bits = int(elapsed * self.line_rate)
+                for j, errors in enumerate(counters):
+                    if status[i][j] != LaneStatus.RUNNING:
+                        continue
+                    lane_st = lane_status(errors, bits, self.target_ber, self.confidence)
+                    if lane_st == LaneStatus.RUNNING and timeout:
+                        lane_st = LaneStatus.INCONCLUSIVE
+                    if lane_st != LaneStatus.RUNNING:
+                        status[i][j] = lane_st
+                        running -= 1
+                        results.append(setting, rdo.get_gbt_channel(), lanes[i][j], errors, bits, lane_st, elapsed)
+        self.logger.info(f"Setting {setting}: done in {time.monotonic() - start:.2f} s, "
+                         f"{sum(st.count(LaneStatus.FAIL) for st in status)} lanes failing")
+
+    def run(self, settings=(None,), apply_setting=None):
+        """Scans the settings, apply_setting(setting) is called before measuring each setting.
+        The PRBS generators and checkers must be running (see Testbench.setup_all_prbs_test_gth).
+        Returns a PrbsScanResults table"""
+        results = PrbsScanResults(self.confidence)
+        self.logger.info(f"PRBS scan of {len(settings)} settings on {len(self.rdo_list)} RUs, "
+                         f"{self.time_to_pass():.2f} s per setting without errors")
+        for setting in settings:
+            if apply_setting is not None:
+                apply_setting(setting)
+            self.scan_setting(setting, results)
+        return results
@@ -35,11 +35,13 @@ class ProAsic3:
         self.sca_channel_used = ScaI2cChannelRU.PA3_0
 
         # to get nice python Fire interface:
-        conv_init = ConvenienceInitializer(self.write_reg, self.read_reg, self.logger)
+        conv_init = ConvenienceInitializer(self.write_reg, self.read_reg, self.logger, self.sca._lock_comm, self.sca._unlock_comm)
         self.config_controller = ConfigController(conv_init)
         self.start_scrubbing = self.config_controller.start_blind_scrubbing
         self.run_single_scrub = self.config_controller.run_single_scrub
         self.run_single_scrub_test = self.config_controller.run_single_scrub_test
+        self.single_scrub_steps = self.config_controller.single_scrub_steps
+        self.single_scrub_test_steps = self.config_controller.single_scrub_test_steps
         self.program_xcku = self.config_controller.program_xcku
         self.cfg_is_idle = self.config_controller.is_idle
 
@@ -63,6 +65,7 @@ class ProAsic3:
         self.get_scrub_block_location = self._FlashIf.get_scrub_block_location
         self.test_readback = self._FlashIf.test_readback
         self.flash_read_page = self._FlashIf.flash_read_page
+        self.flash_find_bad_blocks = self._FlashIf.find_bad_blocks
 
         self._Clock = Clock(conv_init)
         self.set_clock_mux_source_crystal = self._Clock.set_clock_mux_source_crystal
@@ -71,6 +74,8 @@ class ProAsic3:
         self._SelMap = ProAsic3Selmap(conv_init)
         self.smap_write_frame = self._SelMap.write_frames
         self.smap_read_frame = self._SelMap.read_frames
+        self.smap_read_frame_burst = self._SelMap.read_frame_burst
+        self.smap_readback_and_compare = self._SelMap.readback_and_compare
         self.smap_get_idcode = self._SelMap.get_idcode
         self.smap_read_address = self._SelMap.sm_read
 
@@ -84,13 +89,16 @@ class ProAsic3:
         self.set_scrub_block_address = self._Flash.set_scrub_block_address
         self.clear_scrub_block_address = self._Flash.clear_scrub_block_address
 
-    def initialize(self, ultrascale_write_f=None, verbose=False, reset=False, reset_force=False):
+    def initialize(self, ultrascale_write_f=None, verbose=False, reset=False, reset_force=False, ultrascale_bulk_write_f=None):
         """Initializes the class"""
         self.sca.initialize_i2c_channel(channel=ScaI2cChannelRU.PA3_0)
         self.sca.set_i2c_w_ctrl_reg(channel=ScaI2cChannelRU.PA3_0, speed=ScaI2cSpeed.f1MHz, nbytes=1, sclmode=0)
         self.sca.initialize_i2c_channel(channel=ScaI2cChannelRU.PA3_1)
         if callable(ultrascale_write_f):
             self.insert_ultrascale_fifo_write_function(ultrascale_write_f)
+        self._FlashIf.write_ultrascale_fifo_bulk = None
+        if callable(ultrascale_bulk_write_f):
+            self.insert_ultrascale_fifo_bulk_write_function(ultrascale_bulk_write_f)
         if reset:
             self.reset_pa3()
         elif reset_force:
@@ -108,6 +116,16 @@ class ProAsic3:
         else:
             raise ValueError("not a function")
 
+    def insert_ultrascale_fifo_bulk_write_function(self, write_function, verbose=False):
+        """load write function for fifo data transfer of a whole file. write function needs to take one parameter (the data as bytes).
+        When loaded, it is used instead of the one taking a single word"""
+        if callable(write_function):
+            if verbose:
+                self.logger.info("Loading Xilinx bulk write function into flash interface")
+            self._FlashIf.write_ultrascale_fifo_bulk = write_function
+        else:
+            raise ValueError("not a function")
+
     def set_i2c_channel(self, channel):
         """Changes the active SCA-I2C channel used"""
         channel = ScaI2cChannelRU(channel)
@@ -27,6 +27,16 @@ ADDRESS_MAX = PAGE_PER_BLOCK * BLOCK_COUNT
 PAGES_IN_SCRUB_FILE = 4504
 
 
+def run_steps(steps):
+    """Runs to completion a generator yielding the time (s) to wait before its next step, and returns its return value.
+    The *_steps generators allow a scheduler to serve other boards while one is waiting (e.g. ru_scrub_scheduler)"""
+    try:
+        while True:
+            time.sleep(next(steps))
+    except StopIteration as stop:
+        return stop.value
+
+
 class ConvenienceInitializer:
     """ send PA3 write, read, and logger methods to this
 
@@ -34,12 +44,15 @@ class ConvenienceInitializer:
     So this will look cleaner, and be easier to read.
     """
 
-    def __init__(self, write_f, read_f, logger):
+    def __init__(self, write_f, read_f, logger, lock_f=None, unlock_f=None):
         assert callable(write_f)
         assert callable(read_f)
         self.write_f = write_f
         self.read_f = read_f
         self.logger = logger
+        # Optional, to keep the communication locked over a sequence of accesses
+        self.lock_f = lock_f if lock_f is not None else lambda: None
+        self.unlock_f = unlock_f if unlock_f is not None else lambda: None
 
 
 class ConvenienceBase:
@@ -152,11 +165,16 @@ class ConfigController(ConvenienceBase):
 
     def run_single_scrub(self, max_trials=5, wait_sec=0.55, verbose=False):
         """Run a single scrub cycle"""
+        return run_steps(self.single_scrub_steps(max_trials=max_trials, wait_sec=wait_sec, verbose=verbose))
+
+    def single_scrub_steps(self, max_trials=5, wait_sec=0.55, verbose=False):
+        """Generator version of run_single_scrub, see run_steps.
+        Yields the time to wait before polling the PA3, returns True if the scrub cycle completed"""
         if self.is_pa3_fw_mature():
             self.arm_scrubbing()
         self.set_cc_command_register(CcCmdOpcode.SINGLE_SCRUB)
         for i in range(max_trials):
-            time.sleep(wait_sec)
+            yield wait_sec
             cc_status = self.get_cc_status()
             if verbose:
                 self.logger.debug(f"Scrubbing ongoing: {self.is_scrubbing(cc_status)}, Busy: {self.is_busy(cc_status)}")
@@ -174,8 +192,12 @@ class ConfigController(ConvenienceBase):
 
     def run_single_scrub_test(self, verbose=False):
         """Run a single scrub cycle in test mode, i.e. with the SMAP interface disabled"""
+        return run_steps(self.single_scrub_test_steps(verbose=verbose))
+
+    def single_scrub_test_steps(self, verbose=False):
+        """Generator version of run_single_scrub_test, see run_steps"""
         self.set_disable_programming()
-        success = self.run_single_scrub(verbose=verbose)
+        success = yield from self.single_scrub_steps(verbose=verbose)
         self.clear_disable_programming()
         return success
 
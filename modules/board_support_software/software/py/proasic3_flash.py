@@ -25,11 +25,13 @@ EXEC = 0x80
 class ProAsic3Flash(Flash, Fifo, Ecc):
     """Flash interface higher-level functions"""
 
-    def __init__(self, conv_init, write_fifo_f, write_ultrascale_fifo_f=None, reset_f=None):
+    def __init__(self, conv_init, write_fifo_f, write_ultrascale_fifo_f=None, reset_f=None, write_ultrascale_fifo_bulk_f=None):
         super(ProAsic3Flash, self).__init__(conv_init)
         self.write_fifo_reg_multi_byte = write_fifo_f  # expecting function that takes data
         self.write_ultrascale_fifo = write_ultrascale_fifo_f  # expecting function that takes data
+        self.write_ultrascale_fifo_bulk = write_ultrascale_fifo_bulk_f  # expecting function that takes the whole data (bytes)
         self.reset_pa3 = reset_f # expecting function with no parameters.
+        self._lock_comm, self._unlock_comm = conv_init.lock_f, conv_init.unlock_f
 
     def _get_page_size(self, ECC=False):
         if ECC or self.ecc_on():
@@ -97,11 +99,14 @@ class ProAsic3Flash(Flash, Fifo, Ecc):
             delta_l = page_size - (len(data) % page_size)
             data.extend([0xFF] * delta_l)
         if use_ultrascale_fifo:  # ultrascale transfer
-            if not callable(self.write_ultrascale_fifo):
+            if callable(self.write_ultrascale_fifo_bulk):
+                self.write_ultrascale_fifo_bulk(data)
+            elif callable(self.write_ultrascale_fifo):
+                for Bytes in grouper(data, 2):
+                    concat = int().from_bytes(Bytes, 'little')
+                    self.write_ultrascale_fifo(concat)
+            else:
                 raise ValueError("Xilinx fifo writing function not given or not callable.")
-            for Bytes in grouper(data, 2):
-                concat = int().from_bytes(Bytes, 'little')
-                self.write_ultrascale_fifo(concat)
         else:  # I2C slow transfer
             for Bytes in grouper(data, 16):
                 self.write_fifo_reg_multi_byte(Pa3Register.FIFO_DATA_WR, Bytes)
@@ -527,23 +532,25 @@ class ProAsic3Flash(Flash, Fifo, Ecc):
         else:
             return True
 
-    def find_bad_blocks(self) -> Dict[int, List[int]]:
-        """Scan both chips to get bad blocks"""
+    def find_bad_blocks(self, blocks=None) -> Dict[int, List[int]]:
+        """Scan both chips to get bad blocks, blocks defaults to all blocks but block 0"""
         bad_blocks = {}
         for ic, flash_device in zip([0b01, 0b10], [0, 1]):
             self.set_flash_select_ic(ic)
-            data = self._find_bad_blocks()
+            data = self._find_bad_blocks(blocks)
             bad_blocks[flash_device] = data
         return bad_blocks
 
-    def _find_bad_blocks(self) -> List[int]:
+    def _find_bad_blocks(self, blocks=None) -> List[int]:
         """Bad block info is in page 0 or 1 of every block, located at byte no 0x1000"""
+        if blocks is None:
+            blocks = range(1, BLOCK_COUNT)
         self.set_flash_page_size(0x1001)
         self.disable_ecc()  # clears ecc errors, clears read buffer of size 256
         bad_blocks = []
 
-        page_addresses = [page + offset for page
-                          in range(0x40, 2 ** 13 * 0x40, 0x40)
+        page_addresses = [block * PAGE_PER_BLOCK + offset for block
+                          in blocks
                           for offset in [0, 1]
                          ]
 
@@ -552,17 +559,23 @@ class ProAsic3Flash(Flash, Fifo, Ecc):
         self.set_flash_page_size(0x1001)  # trying to compensate for fw "effects"
         for page in page_addresses:  # loop all blocks [0,0x1000) = [0,256*16)
             # write address. and read123
-            self.disable_ecc()  # make sure that we are zeroed.
-            self.set_flash_address(whole_address=page)
-            self.write_reg(Pa3Register.FLASH_CTRL, FlashCmdOpcode.PAGE_READ | EXEC)  # read page cmd
-            for _ in page_range:  # loop single page, order is critical
-                while self.read_reg(Pa3Register.FIFO_STATUS) & 0xf == 8:
-                    pass
+            # the communication is held for a whole page, other boards sharing it interleave between pages
+            # (the threads of a process only with a CardLock on the card, see bad_blocks_store.scan_bad_blocks)
+            self._lock_comm()
+            try:
                 self.disable_ecc()  # make sure that we are zeroed.
-            # exit page loop to read final bytes
-            data = self.read_reg(Pa3Register.FIFO_DATA_RD)  # get 1 byte, automatically skip ecc bytes
+                self.set_flash_address(whole_address=page)
+                self.write_reg(Pa3Register.FLASH_CTRL, FlashCmdOpcode.PAGE_READ | EXEC)  # read page cmd
+                for _ in page_range:  # loop single page, order is critical
+                    while self.read_reg(Pa3Register.FIFO_STATUS) & 0xf == 8:
+                        pass
+                    self.disable_ecc()  # make sure that we are zeroed.
+                # exit page loop to read final bytes
+                data = self.read_reg(Pa3Register.FIFO_DATA_RD)  # get 1 byte, automatically skip ecc bytes
+            finally:
+                self._unlock_comm()
             if data != 0x00:
-                block_address = page // 0x40
+                block_address = page // PAGE_PER_BLOCK
                 bad_blocks.append(block_address)
         self.logger.info(f"Bad blocks data: \n{[hex(x) for x in bad_blocks]}")
         return bad_blocks
@@ -1,3 +1,8 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
 from proasic3_convenience import ConvenienceBase, ConvenienceInitializer
 from proasic3_enums import Pa3Register, \
      XIL_ADDR, SmapCmdOpcode
@@ -5,6 +10,28 @@ from proasic3_enums import Pa3Register, \
 NOOP = 0x20000000
 EXEC = 0x80
 
+WORDS_PER_FRAME = 123
+
+# Frame address (FAR) of the Kintex UltraScale: block type [25:23], row [22:17], column [16:7], minor [6:0].
+# The FAR auto-increments through the minor addresses of a column, then to the next column, row and block type.
+# The number of minor addresses depends on the column type, so only the frames of a column are known to be consecutive.
+FAR_MINOR_BITS = 7
+
+
+def make_far(block_type, row, column, minor):
+    """Returns the frame address of the fields"""
+    assert block_type | 0x7 == 0x7
+    assert row | 0x3F == 0x3F
+    assert column | 0x3FF == 0x3FF
+    assert minor | 0x7F == 0x7F
+    return block_type << 23 | row << 17 | column << 7 | minor
+
+
+def is_next_frame(far, next_far):
+    """True if next_far follows far in the auto-increment order within the same column"""
+    return next_far == far + 1 and next_far >> FAR_MINOR_BITS == far >> FAR_MINOR_BITS
+
+
 class SelectMapSpec():
     def type1_w(self, addr, size=1):
         return 0x30000000 | (addr << 13) | size
@@ -33,6 +60,16 @@ class ProAsic3Selmap(SelectMapSpec):
     def __init__(self, conv_init:ConvenienceInitializer):
         self.logger = conv_init.logger
         self.read_reg, self.write_reg = conv_init.read_f, conv_init.write_f
+        self._lock_comm, self._unlock_comm = conv_init.lock_f, conv_init.unlock_f
+
+    @contextmanager
+    def _locked(self):
+        """Keeps the communication locked for a whole selectmap sequence"""
+        self._lock_comm()
+        try:
+            yield
+        finally:
+            self._unlock_comm()
 
     def get_write_cnt(self):
         return self.sm_read(Pa3Register.SMAP_WRITE_CNT)
@@ -45,15 +82,43 @@ class ProAsic3Selmap(SelectMapSpec):
     def log_idcode(self):
         self.logger.info(f"Selectmap read of IDcode returns 0x{self.get_idcode():08X}")
 
-    def read_frames(self, address_list):
-        """write each frame to a list in a list"""
+    def read_frames(self, address_list, max_burst=1):
+        """write each frame to a list in a list.
+        With max_burst > 1, runs of consecutive frame addresses within a column are read in FDRO bursts
+        of up to max_burst frames, see read_frame_burst and is_next_frame"""
+        assert max_burst >= 1
         data = []
-        # todo check size
-        for i, adr in enumerate(address_list):
-            retval = self.configuration_memory_read_procedure(adr)
-            data.append(retval)
+        address_list = list(address_list)
+        i = 0
+        while i < len(address_list):
+            nframes = 1
+            while nframes < max_burst and i + nframes < len(address_list) and \
+                  is_next_frame(address_list[i + nframes - 1], address_list[i + nframes]):
+                nframes += 1
+            data += self.read_frame_burst(address_list[i], nframes)
+            i += nframes
         return data
 
+    def read_frame_burst(self, startaddr, nframes):
+        """Reads nframes frames starting at startaddr in a single FDRO read (type2_r), i.e. the frames
+        following startaddr in the FAR auto-increment order of the device.
+        Returns a list of frames, each a list of WORDS_PER_FRAME words"""
+        with self._locked():
+            data = self.configuration_memory_read_procedure(startaddr, nframes)
+        return [data[i*WORDS_PER_FRAME:(i+1)*WORDS_PER_FRAME] for i in range(nframes)]
+
+    def readback_and_compare(self, address_list, golden, mask=None, max_burst=64):
+        """Reads back the frames at the frame addresses of address_list, in bursts of up to max_burst frames
+        split at the column boundaries (see read_frames), and compares them with the golden frames,
+        ignoring the bits set in mask.
+        golden and mask are (len(address_list), WORDS_PER_FRAME) arrays, e.g. from load_readback_file.
+        Returns the result of compare_frames"""
+        address_list = list(address_list)
+        golden = np.asarray(golden, dtype=np.uint32).reshape(-1, WORDS_PER_FRAME)
+        assert len(address_list) == len(golden), f"{len(address_list)} frame addresses for {len(golden)} golden frames"
+        readback = np.array(self.read_frames(address_list, max_burst=max_burst), dtype=np.uint32)
+        return compare_frames(readback, golden, mask)
+
     def write_frames(self, address_list, datali):
         """use this function to write (a) frame(s)"""
         # [[d1],[d2]] and [adr1, adr2]
@@ -183,3 +248,37 @@ class ProAsic3Selmap(SelectMapSpec):
         for item in (last_steps):
             self.write4bytes(item)  # WRITE
         return data
+
+
+def load_readback_file(filename, skip_words=0):
+    """Loads a readback data (.rbd) or mask (.msk) file, ASCII with one 32 bit binary word per line.
+    Header lines are skipped, as well as the first skip_words words (e.g. pad frame).
+    Returns a (nframes, WORDS_PER_FRAME) array"""
+    with open(filename) as f:
+        words = [int(line, 2) for line in (l.strip() for l in f)
+                 if len(line) == 32 and set(line) <= {'0', '1'}]
+    words = np.array(words[skip_words:], dtype=np.uint32)
+    nframes = len(words) // WORDS_PER_FRAME
+    return words[:nframes*WORDS_PER_FRAME].reshape(nframes, WORDS_PER_FRAME)
+
+
+def compare_frames(readback, golden, mask=None):
+    """Compares readback frames with golden frames, ignoring the bits set in mask.
+    Returns an OrderedDict with the number of frames, words and bits mismatching,
+    the indexes of the mismatching frames and the list of (frame, word, read, expected) mismatches"""
+    readback = np.asarray(readback, dtype=np.uint32).reshape(-1, WORDS_PER_FRAME)
+    golden = np.asarray(golden, dtype=np.uint32).reshape(-1, WORDS_PER_FRAME)
+    assert readback.shape == golden.shape, f"Readback {readback.shape} and golden {golden.shape} differ in size"
+    diff = readback ^ golden
+    if mask is not None:
+        mask = np.asarray(mask, dtype=np.uint32).reshape(-1, WORDS_PER_FRAME)
+        assert mask.shape == golden.shape, f"Mask {mask.shape} and golden {golden.shape} differ in size"
+        diff &= ~mask
+    frames, words = np.nonzero(diff)
+    ret = OrderedDict()
+    ret['frames'] = len(golden)
+    ret['mismatched_frames'] = np.unique(frames).tolist()
+    ret['mismatched_words'] = len(words)
+    ret['mismatched_bits'] = int(np.unpackbits(diff[frames, words].view(np.uint8)).sum())
+    ret['mismatches'] = [(int(f), int(w), int(readback[f, w]), int(golden[f, w])) for f, w in zip(frames, words)]
+    return ret
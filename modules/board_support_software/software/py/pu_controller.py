@@ -463,6 +463,54 @@ class PuController(WishboneModule):
         ])
         return ret
 
+    def _values_modules_addresses(self, module_list):
+        """Addresses of the enable status and mirrored ADC values read by read_values_modules"""
+        addresses = [WsPuControllerAddress.ENABLE_PWR,
+                     WsPuControllerAddress.ENABLE_BIAS,
+                     WsPuControllerAddress.ADC_00 + Adc.V_BB,
+                     WsPuControllerAddress.ADC_00 + Adc.I_BB]
+        for module in module_list:
+            assert module in range(8), "module {0} not in range(8)".format(module)
+            addresses += [WsPuControllerAddress.ADC_00 + 4*module + i for i in range(4)]
+        return addresses
+
+    def _request_values_modules(self, module_list):
+        """WB read request"""
+        for address in self._values_modules_addresses(module_list):
+            self.read(address, commitTransaction=False)
+
+    def _format_values_modules(self, results, module_list):
+        addresses = self._values_modules_addresses(module_list)
+        assert len(results) == len(addresses)
+        for i, address in enumerate(addresses):
+            assert ((results[i][0] >> 8) & 0x7f) == self.moduleid, \
+                    "Requested to read module {0}, but got result for module {1}, iteration {2}".format(self.moduleid, ((results[i][0] >> 8) & 0x7f), i)
+            assert (results[i][0] & 0xff) == address, \
+                    "Requested to read address {0}, but got result for address {1}, iteration {2}".format(address, (results[i][0] & 0xff), i)
+        values = [result[1] for result in results]
+        ret = OrderedDict([
+            ("power_enable_status", values[0]),
+            ("bias_enable_status", self.power_unit._format_get_bias_enable_status(values[1])),
+            ("bb_voltage", values[2] >> 4), # 4LSB are not in use, see table 36 manual v1.5
+            ("bb_current", values[3] >> 4)
+        ])
+        for i, module in enumerate(module_list):
+            for j, key in enumerate(["avdd_voltage", "avdd_current", "dvdd_voltage", "dvdd_current"]):
+                ret["module_{0}_{1}".format(module, key)] = values[4 + 4*i + j] >> 4
+        return ret
+
+    def read_values_modules(self, module_list=range(8), commitTransaction=True):
+        """Reads the enable status and all the power and bias ADC values mirrored by the controller
+        in a single wishbone sequence.
+        Returns the same dictionary as PowerUnit.get_values_modules"""
+        module_list = list(module_list)
+        self._request_values_modules(module_list)
+        if commitTransaction:
+            results = self.board.flush_and_read_results(expected_length=4+4*len(module_list))
+            return self._format_values_modules(results, module_list)
+        else:
+            return None
+
     def get_tripped_power_enables(self):
         """Reads the power enable bits before a power interlock trip"""
         return self.read(WsPuControllerAddress.TRIPPED_PWR)
@@ -25,7 +25,7 @@ from i2c_gbtx_monitor import WsI2cGbtxMonitor
 from pu_monitor import PuMonitor
 from pa3_fifo import Pa3Fifo
 from pa3_fifo_monitor import Pa3FifoMonitor
-from power_unit import PowerUnit, PowerUnitAux
+from power_unit import PowerUnit, PowerUnitAux, PowerUnitSampler, read_power_units_values
 from pu_controller import PuController
 from ru_calibration_lane import CalibrationLane
 from ru_data_lane import DataLane
@@ -40,6 +40,7 @@ from sca_ru import Sca_RU
 from sysmon import Sysmon
 from trigger_handler import TriggerHandler
 from trigger_handler_monitor import TriggerHandlerMonitor
+from trigger_rate_sampler import TriggerRateSampler
 from wishbone_wait import WishboneWait
 from ws_can_hlp import WsCanHlp
 from ws_can_hlp_monitor import WsCanHlpMonitor
@@ -270,10 +271,10 @@ class Xcku(ReadoutBoard):
 
     from ru_flashing import flash_write_configfile_to_block, flash_write_scrubfile_to_block, \
                             flash_write_file_to_block, flash_bitfiles_to_block, flash_bitfiles_to_all_blocks, \
-                            get_bad_blocks, _check_bad_block_list, _check_block_validity
+                            get_bad_blocks, scan_bad_blocks, _check_bad_block_list, _check_block_validity
     from ru_scrubbing import configure_scrub_location, _configure_scrub_imagelocation, _configure_scrub_location, _configure_scrub_location_page0, run_scrub_cycle, \
-                             _run_scrub_cycle, _run_scrub_cycle_location, _run_scrub_cycle_page0, \
-                             run_scrub_loop, update_scrubbing_status_files, \
+                             _run_scrub_cycle, _run_scrub_cycle_steps, _run_scrub_cycle_location, _run_scrub_cycle_page0, \
+                             run_scrub_loop, scrub_loop_cycle_steps, update_scrubbing_status_files, \
                              get_pa3_post_scrub_metrics, determine_post_scrub_status, \
                              check_scrub_ok, check_and_update_scrub_status_iter_locations, reflash_scrub_block, _reflash_scrub_block_location, _reflash_scrub_block_page0, \
                              reflash_all_critical_locations, flash_all_not_programmed_locations, check_scrub_and_reflash, \
@@ -291,7 +292,8 @@ class Xcku(ReadoutBoard):
                  powerunit_2_offset_avdd,
                  powerunit_2_offset_dvdd,
                  layer,
-                 power_board_filter_50Hz_ac_power_mains_frequency=True):
+                 power_board_filter_50Hz_ac_power_mains_frequency=True,
+                 bad_block_store=None):
         super(Xcku, self).__init__(comm)
         self.logger = logging.getLogger(f"RU {self.get_gbt_channel()} XCKU")
 
@@ -300,6 +302,7 @@ class Xcku(ReadoutBoard):
         self.comm = comm
         self.ru_main_revision = ru_main_revision
         self.ru_minor_revision = ru_minor_revision
+        self.bad_block_store = bad_block_store # BadBlockStore of the flash scans, used with the bad block LUTs when flashing and scrubbing
 
         self._add_modules(power_board_version,
                           powerunit_resistance_offset_pt100,
@@ -503,14 +506,15 @@ class Xcku(ReadoutBoard):
         gbtx0_chargepump_setting = self.get_gbtx0_chargepump_custom_settings()
         return gbtx0_chargepump_setting <= self.gbtx0_swt.get_phase_detector_charge_pump()
 
-    def sc_core_reset(self, ultrascale_write_f=None, reset_pa3=False, reset_force=False):
+    def sc_core_reset(self, ultrascale_write_f=None, reset_pa3=False, reset_force=False, ultrascale_bulk_write_f=None):
         if type(self.comm) != can_hlp_comm.CanHlpComm:
             if type(self.comm) == FlxSwtCommunication:
                 self.cru.reset_sc_core(None)
             else:
                 self.cru.reset_sc_core(self.get_gbt_channel())
             self.sca.initialize()
-            self.pa3.initialize(ultrascale_write_f=ultrascale_write_f, reset=reset_pa3, reset_force=reset_force)
+            self.pa3.initialize(ultrascale_write_f=ultrascale_write_f, reset=reset_pa3, reset_force=reset_force,
+                                ultrascale_bulk_write_f=ultrascale_bulk_write_f)
 
     def git_tag(self):
         return git_hash_lut.get_ru_version(self.identity.get_git_hash())
@@ -588,6 +592,10 @@ class Xcku(ReadoutBoard):
     def log_trigger_rates(self):
         self.logger.info(self.format_trigger_rates())
 
+    def get_trigger_rate_sampler(self, rate=1., buffer_size=3600):
+        """Returns a TriggerRateSampler for continuous sampling of the trigger handler and GBT packer rates"""
+        return TriggerRateSampler([self], rate=rate, buffer_size=buffer_size)
+
     def log_clock_event(self):
         self.dna()
         self.uptime()
@@ -631,9 +639,19 @@ class Xcku(ReadoutBoard):
     def write_chip_reg(self, address, data, extended_chipid, commitTransaction=True, readback=None):
         self.alpide_control.write_chip_reg(address, data, extended_chipid, commitTransaction, readback)
 
+    def write_chip_regs(self, reg_list, commitTransaction=True):
+        """Writes a list of chip registers [(extended_chipid, address, data), ...] in a single sequence,
+        see AlpideControl.write_chip_regs"""
+        self.alpide_control.write_chip_regs(reg_list, commitTransaction=commitTransaction)
+
     def read_chip_reg(self, address, extended_chipid, disable_read=False, commitTransaction=True):
         return self.alpide_control.read_chip_reg(address, extended_chipid, disable_read, commitTransaction)
 
+    def read_chip_regs(self, reg_list):
+        """Reads a list of chip registers [(extended_chipid, address), ...] in a single sequence,
+        see AlpideControl.read_chip_regs"""
+        return self.alpide_control.read_chip_regs(reg_list)
+
     def write_chip_opcode(self, opcode, extended_chipid=0xF,commitTransaction=True):
         self.alpide_control.write_chip_opcode(opcode=opcode, extended_chipid=extended_chipid, commitTransaction=commitTransaction)
 
@@ -979,6 +997,19 @@ class Xcku(ReadoutBoard):
         if commitTransaction:
             self.flush()
 
+    def _get_powerunits(self, powerunits):
+        assert set(powerunits).issubset({1, 2}), f"Invalid power unit index in {powerunits}"
+        return [self.powerunit_1 if index == 1 else self.powerunit_2 for index in powerunits]
+
+    def get_powerunits_values(self, powerunits=(1,2), module_list=range(8)):
+        """Reads enable status and ADC values of the selected power units in a single wishbone sequence.
+        See power_unit.read_power_units_values"""
+        return read_power_units_values(self._get_powerunits(powerunits), module_list=module_list)
+
+    def get_powerunits_sampler(self, powerunits=(1,2), module_list=range(8), rate=10., buffer_size=10000):
+        """Returns a PowerUnitSampler for continuous sampling of the selected power units"""
+        return PowerUnitSampler(self._get_powerunits(powerunits), module_list=module_list, rate=rate, buffer_size=buffer_size)
+
     # NotImplemented
 
     def power_on_chip(self, avdd=1.8, dvdd=1.8, backbias=None):
@@ -6,9 +6,19 @@ AVDD,DVDD
 """
 
 import collections
+import math
 
 from wishbone_module import WishboneModule
 
+ADC_MAPPING = {0: "AVDD_CURRENT", 1: "DVDD", 2: "AVDD", 3: "DVDD_CURRENT"}
+ADC_ACK = 0x4
+# Worst case time between the start of a conversion and its acknowledge. The chip power ADC is an AD7091R-4
+# (register map of init_ADC, channel ID in the 3 MSBs of the result): the firmware starts the conversion,
+# waits for its BUSY indicator on GP0 (t_CONVERT max 650 ns in the datasheet) and reads the result in a
+# 16 bit SPI frame, assumed at 10 MHz or more.
+ADC_CONVERSION_TIME_MAX = 650e-9 + 16/10e6 # s
+ADC_CONVERSION_WAIT = int(math.ceil(ADC_CONVERSION_TIME_MAX/6.25e-9)) # in 6.25 ns steps, between the start of a conversion and the read of its status
+
 
 class ConversionParameter:
     """Simple class to store conversion parameters and convert values"""
@@ -33,7 +43,7 @@ class ChipPower(WishboneModule):
     """Class to handle chip power settings"""
 
     def __init__(self, comm, moduleId, ru_nr=0):
-        super(ChipPower, self).__init__(moduleId, comm, "ChipPower")
+        super(ChipPower, self).__init__(moduleid=moduleId, name="ChipPower", board_obj=comm)
         self.parameters = {}
         self._create_parameter_table(ru_nr)
 
@@ -122,10 +132,11 @@ class ChipPower(WishboneModule):
         dataread = self.read(6)
         cnt = 0
 
-        while dataread is not None and (dataread & 0x4 == 0) and cnt < maxCnt:
+        while dataread is not None and (dataread & ADC_ACK == 0) and cnt < maxCnt:
             dataread = self.read(6)
+            cnt += 1
 
-        return dataread & 0x4 != 0
+        return dataread is not None and (dataread & ADC_ACK) != 0
 
     def log_currents(self):
         """Logs ADC values (AVDD, DVDD currents and voltages)"""
@@ -133,8 +144,8 @@ class ChipPower(WishboneModule):
         self.logger.info(
             "ADC status:\tAVDD voltage %2.2f V,\tAVDD current %2.2f mA,\tDVDD voltage %2.2f V,\tDVDD current %2.2f mA",
             values['AVDD'],
-            values['DVDD'],
             values['AVDD_CURRENT'],
+            values['DVDD'],
             values['DVDD_CURRENT'])
         return values
 
@@ -147,28 +158,64 @@ class ChipPower(WishboneModule):
         """Convert raw ADC steps to voltage/current values"""
         self.logger.debug("Values raw:")
         self.logger.debug(values_raw)
-        adc_mapping = {0: "AVDD_CURRENT", 1: "DVDD", 2: "AVDD", 3: "DVDD_CURRENT"}
-
-        values = {adc_mapping[key]: self.parameters["ADC_" + adc_mapping[key]].step_to_value(
+        values = {ADC_MAPPING[key]: self.parameters["ADC_" + ADC_MAPPING[key]].step_to_value(
             value) for (key, value) in values_raw.items()}
         return values
 
-    def read_values_raw(self):
-        """Read raw ADC values for AVDD,DVDD (voltages, currents)"""
+    def _request_values_raw(self, nr_conversions=len(ADC_MAPPING), wait_value=ADC_CONVERSION_WAIT):
+        """Queues nr_conversions ADC conversions, each followed by a firmware wait of wait_value
+        and the reads of the ADC status and data, without committing them.
+        The channel sequencer converts the channels one after the other.
+        Returns the number of queued reads, see _format_values_raw"""
+        self.write(4, 0x00, commitTransaction=False)
+        for _ in range(nr_conversions):
+            self.write(6, 0x1, commitTransaction=False)
+            if wait_value:
+                self.firmware_wait(wait_value, commitTransaction=False)
+            self.read(6, commitTransaction=False)
+            self.read(5, commitTransaction=False)
+        return 2*nr_conversions
+
+    def _format_values_raw(self, results, values_raw=None):
+        """Returns the raw ADC values {adc channel: value, None if not converted}
+        from the results of the reads queued by _request_values_raw, updating values_raw if given"""
+        if values_raw is None:
+            values_raw = {0: None, 1: None, 2: None, 3: None}
+        assert len(results) % 2 == 0
+        for (_, status), (_, data) in zip(results[0::2], results[1::2]):
+            if status & ADC_ACK:
+                values_raw[data >> 13] = data & 0x0FFF
+            else:
+                self.logger.debug("ADC conversion not acknowledged, status {0:#06X}".format(status))
+        return values_raw
+
+    def read_values_raw(self, wait_value=ADC_CONVERSION_WAIT):
+        """Read raw ADC values for AVDD,DVDD (voltages, currents)
+        The conversions of all the channels are done in one sequence, each read wait_value after its start.
+        If some are not acknowledged by then, the sequence is repeated one conversion at a time,
+        polling the acknowledge of each conversion before reading it and starting the next one"""
         MAX_NR_TRIES = 8
         values_raw = {0: None, 1: None, 2: None, 3: None}
-        self.write(4, 0x00)
 
-        nr_tries = 0
-        while None in values_raw.values() and nr_tries < MAX_NR_TRIES:
-            self.write(6, 0x1)
-            self._wait_ack()
-            data = self.read(5)
+        length = self._request_values_raw(len(values_raw), wait_value)
+        results = self.board.flush_and_read_results(expected_length=length)
+        self._format_values_raw(results, values_raw)
 
-            nr = data >> 13
-            values_raw[nr] = data & 0x0FFF
-            self.logger.debug("Idx: {0}, nr: {1}, value: {2}".format(nr_tries, nr, values_raw[nr]))
-            nr_tries += 1
+        if None in values_raw.values():
+            self.logger.debug("ADC conversions not acknowledged within the wait, values: {0}".format(values_raw))
+            # the last conversion of the sequence can still be running
+            self._wait_ack()
+            self.write(4, 0x00)
+            nr_tries = 0
+            while None in values_raw.values() and nr_tries < MAX_NR_TRIES:
+                self.write(6, 0x1)
+                if not self._wait_ack():
+                    self.logger.error("ADC conversion not acknowledged after polling")
+                    break
+                data = self.read(5)
+                values_raw[data >> 13] = data & 0x0FFF
+                self.logger.debug("Tries: {0}, values: {1}".format(nr_tries, values_raw))
+                nr_tries += 1
 
         if None in values_raw.values():
             self.logger.error("Could not read all ADC values. None results still present")
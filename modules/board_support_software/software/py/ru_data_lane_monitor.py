@@ -155,8 +155,10 @@ class DataLaneMonitor(WsCounterMonitor):
         if commitTransaction:
             self.flush()
 
-    def read_counters(self,lanes=None,counters=None, force_latch=False):
-        """Read Counters(array) from lanes(array)"""
+    def _request_counters(self,lanes=None,counters=None,latch_first=None):
+        """Queues the latch (by default only for the master monitor) and the reads of Counters(array)
+        from lanes(array) without committing them.
+        Returns the (lanes, counters, registers) to be passed to _format_counters with the results"""
         if lanes is None:
             lanes = self.lanes
         if not isinstance(lanes,collections.abc.Iterable):
@@ -165,8 +167,10 @@ class DataLaneMonitor(WsCounterMonitor):
             counters = self.counter_mapping
         if isinstance(counters, str):
             counters = [ counters ]
+        if latch_first is None:
+            latch_first = self._is_master_monitor
 
-        if self._is_master_monitor or force_latch:
+        if latch_first:
             self.latch_all_counters(commitTransaction=False)
         registers = self._to_register_mapping(counters)
         offsets = [self.wb_register_mapping.index(reg) for reg in registers]
@@ -174,17 +178,34 @@ class DataLaneMonitor(WsCounterMonitor):
             lane_idx = self.nr_counter_regs * self.get_lane_idx(lane) + self.COUNTER_OFFSET
             for offset in offsets:
                 self.read(lane_idx + offset, False)
-        values = self.read_all()
+        return lanes, counters, registers
 
-        results = []
+    def _format_counters(self,request,results):
+        """Returns the list (per lane) of OrderedDict() {counter_name:counter_value}
+        from the results of the reads queued by _request_counters"""
+        lanes, counters, registers = request
         nr_registers = len(registers)
+        assert len(results) == len(lanes)*nr_registers, \
+            f"Expected {len(lanes)*nr_registers} results, got {len(results)}"
+        values = []
+        for res_address, value in results:
+            assert (res_address >> 8) & 0x7F == self.moduleid, \
+                f"Requested to read module {self.moduleid}, but got result for module {(res_address >> 8) & 0x7F}"
+            values.append(value)
+
+        ret = []
         for idx,lane in enumerate(lanes):
             lane_regs = collections.OrderedDict()
             for reg_idx,reg in enumerate(registers):
                 lane_regs[reg] = values[idx*nr_registers + reg_idx]
-            results.append(self._process_counters(lane_regs,counters))
+            ret.append(self._process_counters(lane_regs,counters))
+        return ret
 
-        return results
+    def read_counters(self,lanes=None,counters=None, force_latch=False):
+        """Read Counters(array) from lanes(array)"""
+        request = self._request_counters(lanes, counters, latch_first=self._is_master_monitor or force_latch)
+        results = self.board.flush_and_read_results(expected_length=len(request[0])*len(request[2]))
+        return self._format_counters(request, results)
 
     def read_counter(self,lanes,counter):
         results = self.read_counters(lanes,[counter])
@@ -92,13 +92,22 @@ def flash_write_file_to_block(
     file_size = os.path.getsize(filename)
 
     # If SWT is available, use optimized write function, x15 faster
+    # and write the whole file in batches of queued SWT writes, paced by the FIFO counters (not in the old FW)
+    bulk_write_f = None
+    if use_ultrascale_fifo and isinstance(self.comm, (CruSwtCommunication, FlxSwtCommunication)):
+        if not self.pa3fifo.is_old_wb2fifo():
+            bulk_write_f = self.pa3fifo.write_data_to_fifo_bulk
     if isinstance(self.comm, CruSwtCommunication):
         self.sc_core_reset(
-            ultrascale_write_f=self.pa3fifo.write_data_to_fifo_opt, reset_force=True
+            ultrascale_write_f=self.pa3fifo.write_data_to_fifo_opt,
+            ultrascale_bulk_write_f=bulk_write_f,
+            reset_force=True,
         )
     elif isinstance(self.comm, FlxSwtCommunication):
         self.sc_core_reset(
-            ultrascale_write_f=self.pa3fifo.write_data_to_fifo_opt_flx, reset_force=True
+            ultrascale_write_f=self.pa3fifo.write_data_to_fifo_opt_flx,
+            ultrascale_bulk_write_f=bulk_write_f,
+            reset_force=True,
         )
     else:
         self.sc_core_reset(
@@ -370,14 +379,42 @@ def load_1_1_bad_block_luts():
     return sn2bb_lut_1_1_manual, sn2bb_lut_1_1_c1, sn2bb_lut_1_1_c2
 
 
-def get_bad_blocks(self, ic=FlashSelectICOpcode.FLASH_BOTH_IC, manual=True):
-    """Returns the list of bad blocks in the flash memory from the lut"""
+def scan_bad_blocks(self, store, rescan=False):
+    """Returns the bad blocks of both flash chips ({flash_device: [blocks]}) from the BadBlockStore store,
+    scanning the flash and storing the result if the RU was not scanned yet or if rescan"""
+    dna = self.identity.get_dna()
+    sn = self.identity.decode_sn(dna)
+    if not rescan:
+        bad_blocks = store.lookup(dna=dna)
+        if bad_blocks is not None:
+            self.logger.debug(f"Bad blocks of RU DNA 0x{dna:024X} found in store")
+            return bad_blocks
+    self.logger.info(f"Scanning bad blocks of RU DNA 0x{dna:024X}")
+    bad_blocks = self.pa3.flash_find_bad_blocks()
+    store.store(bad_blocks, dna=dna, serial=sn)
+    return bad_blocks
+
+
+def get_bad_blocks(self, ic=FlashSelectICOpcode.FLASH_BOTH_IC, manual=True, store=None):
+    """Returns the list of bad blocks in the flash memory from the lut,
+    and from the scan results in the BadBlockStore store if given"""
+    bb_list = []
+    if store is not None:
+        try:
+            scanned = store.lookup(dna=self.identity.get_dna())
+        except Exception:
+            self.logger.warning("Could not get RU DNA, ignoring bad block store")
+            scanned = None
+        if scanned is not None:
+            for flash_device, flash_ic in zip([0, 1], [FlashSelectICOpcode.FLASH_IC1, FlashSelectICOpcode.FLASH_IC2]):
+                if ic in [flash_ic, FlashSelectICOpcode.FLASH_BOTH_IC]:
+                    # bitfile locations as in the LUT, a bad block invalidates its 0x100 block location
+                    bb_list.extend(block // 0x100 * 0x100 for block in scanned[flash_device])
     try:
         sn = self.identity.get_sn()
     except Exception:
-        self.logger.warning("Could not get RU SN, returning empty bad blocks list")
-        return []
-    bb_list = []
+        self.logger.warning("Could not get RU SN, returning bad blocks from store only")
+        return sorted(list(set(bb_list)))
 
     # Load bad block LUT from JSON files
     (
@@ -468,7 +505,7 @@ def get_bad_blocks(self, ic=FlashSelectICOpcode.FLASH_BOTH_IC, manual=True):
 
 def _check_bad_block_list(self, ic, blocks, current_default, current_golden, golden):
     """Checks if the blocks passed as input are good or bad"""
-    bad_blocks = self.get_bad_blocks(ic)
+    bad_blocks = self.get_bad_blocks(ic, store=self.bad_block_store)
     if bad_blocks is not None:
         if blocks[0] in bad_blocks:
             self.logger.warning(
@@ -154,6 +154,28 @@ class GbtPacker(WishboneModule):
         ret.append(self._monitor2.read_counter(counter=counter, latch_first=False, reset_after=False, commitTransaction=commitTransaction))
         return ret
 
+    def _request_counters(self, counters=None):
+        """Queues the latch and the reads of the counters of the three monitors without committing them.
+        Returns the register addresses read per monitor, see _format_counters"""
+        ret = []
+        ret.append(self._monitor0._request_counters(counters=counters, latch_first=True))
+        ret.append(self._monitor1._request_counters(counters=counters, latch_first=False))
+        ret.append(self._monitor2._request_counters(counters=counters, latch_first=False))
+        return ret
+
+    def _format_counters(self, counters, addresses, results):
+        """Returns the counter values of the three monitors from the results of the reads queued by _request_counters"""
+        ret = []
+        offset = 0
+        for monitor, monitor_addresses in zip((self._monitor0, self._monitor1, self._monitor2), addresses):
+            ret.append(monitor._format_counters(counters, monitor_addresses, results[offset:offset+len(monitor_addresses)]))
+            offset += len(monitor_addresses)
+        return ret
+
+    def get_counter_width(self, counter):
+        """Returns the number of bits of a counter"""
+        return self._monitor0.get_counter_width(counter)
+
     def read_all_counters(self):
         """Read all counters of monitor"""
         return self.read_counters()
@@ -0,0 +1,283 @@
+""" Crate-wide scrub scheduler, running the scrub loop of all the RUs of a crate from a single process
+
+Replaces one run_scrub_loop process per RU. The scrub cycles of the RUs are interleaved in a single thread:
+while the PA3 of a RU is scrubbing (~0.5 s per poll), the other RUs are served, so that the transactions of the RUs
+never overlap on the shared CRU/FELIX card and no locking between processes is needed.
+
+RUs whose scrub cycles recently reported errors (SB, DB or CRC) are started first when several are due, and are
+scrubbed more often. The scrubbing status of the RUs is kept in memory and written to the status files
+by a background thread.
+
+usage:
+scheduler = CrateScrubScheduler(rdo_list, sleep_sec=10)
+scheduler.run()  # end gracefully with Ctrl-C
+scheduler.get_stats()
+"""
+
+import heapq
+import logging
+import queue
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+from ru_scrubbing import write_scrubbing_status_file
+
+
+class ScrubbingStatusWriter:
+    """Writes the scrubbing status files in a background thread (from start to close),
+    only the latest status of each RU is written"""
+
+    def __init__(self, write_f=write_scrubbing_status_file):
+        self.logger = logging.getLogger("ScrubbingStatusWriter")
+        self._write_f = write_f
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self.writes = 0
+        self._thread = None
+
+    def start(self):
+        """Starts the thread, the status submitted before are written once started"""
+        assert self._thread is None, "Status writer already started"
+        self._thread = threading.Thread(target=self._run, name="ScrubbingStatusWriter", daemon=True)
+        self._thread.start()
+
+    def submit(self, ru_sn, status_json):
+        with self._lock:
+            new = ru_sn not in self._pending
+            self._pending[ru_sn] = status_json
+        if new:
+            self._queue.put(ru_sn)
+
+    def _run(self):
+        while True:
+            ru_sn = self._queue.get()
+            if ru_sn is None:
+                break
+            with self._lock:
+                status_json = self._pending.pop(ru_sn)
+            try:
+                self._write_f(ru_sn, status_json)
+                self.writes += 1
+            except Exception as e:
+                self.logger.error(f"Could not write scrubbing status of RU {ru_sn}: {e}")
+
+    def close(self):
+        """Writes the pending status files and stops the thread"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+class _RuScrubState:
+    """Scheduling state and statistics of a RU"""
+
+    def __init__(self, rdo):
+        self.rdo = rdo
+        self.gbt_channel = rdo.get_gbt_channel()
+        self.steps = None
+        self.wake = 0
+        self.due = 0
+        self.cycle_start = None
+        self.recent_errors = 0.
+        self.stopped = False
+        self.run_start_cycles = 0
+        self.stats = OrderedDict([('cycles', 0),
+                                  ('failed_tests', 0),
+                                  ('exceptions', 0),
+                                  ('sb_errors', 0),
+                                  ('db_errors', 0),
+                                  ('crc_errors', 0),
+                                  ('last_latency', None),
+                                  ('max_latency', 0.),
+                                  ('total_latency', 0.)])
+
+    def priority(self):
+        """Sort key for RUs due at the same time: recent errors first, then longest overdue"""
+        return (-self.recent_errors, self.due)
+
+
+class CrateScrubScheduler:
+    """Runs the scrub loop (see ru_scrubbing.run_scrub_loop) of several RUs, interleaving their scrub cycles.
+
+    sleep_sec: time between the end of a scrub cycle of a RU and the start of its next one
+    error_sleep_sec: same, for RUs with recent errors (default sleep_sec/2)
+    error_decay: factor applied to the recent errors count of a RU at each of its cycles
+    max_active: maximum number of RUs with a scrub cycle in progress (default all)
+    """
+
+    def __init__(self, rdo_list, with_test=True, sleep_sec=10, error_sleep_sec=None, error_decay=0.5,
+                 max_active=None, status_writer=None, logger=None):
+        self.logger = logger if logger is not None else logging.getLogger("CrateScrubScheduler")
+        self.with_test = with_test
+        self.sleep_sec = sleep_sec
+        self.error_sleep_sec = error_sleep_sec if error_sleep_sec is not None else sleep_sec / 2
+        self.error_decay = error_decay
+        self.max_active = max_active if max_active is not None else len(rdo_list)
+        self.status_writer = status_writer if status_writer is not None else ScrubbingStatusWriter()
+        self._rus = [_RuScrubState(rdo) for rdo in rdo_list]
+        self._terminate = False
+        self.crate_cycles = 0
+        self.last_crate_cycle_time = None
+        self.max_crate_cycle_time = 0.
+        self._crate_cycle_start = None
+        self._crate_cycle_done = set()
+
+    def stop(self):
+        """Stops the scheduler after the scrub cycles in progress"""
+        self._terminate = True
+
+    def _load_status(self):
+        for ru in self._rus:
+            ru.stopped = False
+            try:
+                loaded = ru.rdo.load_scrubbing_status(force=True)
+            except Exception as e:
+                self.logger.error(f"RU {ru.gbt_channel}: could not load scrubbing status: {e}")
+                loaded = False
+            if not loaded:
+                self.logger.error(f"RU {ru.gbt_channel}: no scrubbing status, not scrubbed")
+                ru.stopped = True
+
+    def _persist(self, ru):
+        status = ru.rdo.scrubbing_status
+        self.status_writer.submit(status.ru_sn, str(status))
+
+    def _start_cycle(self, ru, now):
+        ru.cycle_start = now
+        ru.steps = ru.rdo.scrub_loop_cycle_steps(with_test=self.with_test)
+        ru.wake = now
+
+    def _step(self, ru):
+        """Runs the cycle of ru until its next wait, returns True if the cycle ended"""
+        try:
+            ru.wake = time.monotonic() + next(ru.steps)
+            return False
+        except StopIteration as stop:
+            self._end_cycle(ru, stop.value)
+        except Exception as e:
+            self.logger.error(f"RU {ru.gbt_channel}: scrub cycle failed: {e}")
+            ru.stats['exceptions'] += 1
+            ru.recent_errors = ru.recent_errors * self.error_decay + 1
+            ru.due = time.monotonic() + self.error_sleep_sec
+        ru.steps = None
+        return True
+
+    def _end_cycle(self, ru, value):
+        safe, test_success, results = value
+        now = time.monotonic()
+        latency = now - ru.cycle_start
+        stats = ru.stats
+        stats['cycles'] += 1
+        stats['last_latency'] = latency
+        stats['max_latency'] = max(stats['max_latency'], latency)
+        stats['total_latency'] += latency
+        errors = 0
+        if results is not None:
+            errors = results['sb_errors'] + results['db_error'] + results['crc_error']
+            stats['sb_errors'] += results['sb_errors']
+            stats['db_errors'] += results['db_error']
+            stats['crc_errors'] += results['crc_error']
+        ru.recent_errors = ru.recent_errors * self.error_decay + errors
+        self._persist(ru)
+        if not safe:
+            self.logger.error(f"RU {ru.gbt_channel}: not safe for scrubbing, removed from scheduler")
+            ru.stopped = True
+        elif not test_success:
+            stats['failed_tests'] += 1
+            ru.due = now  # Get new image the next cycle
+        else:
+            ru.due = now + (self.error_sleep_sec if ru.recent_errors >= 1 else self.sleep_sec)
+        self._crate_cycle_done.add(ru.gbt_channel)
+        self._update_crate_cycle(now)
+
+    def _update_crate_cycle(self, now):
+        running = {ru.gbt_channel for ru in self._rus if not ru.stopped}
+        if running and running <= self._crate_cycle_done:
+            self.crate_cycles += 1
+            self.last_crate_cycle_time = now - self._crate_cycle_start
+            self.max_crate_cycle_time = max(self.max_crate_cycle_time, self.last_crate_cycle_time)
+            self.logger.info(f"Crate scrub cycle {self.crate_cycles} completed in {self.last_crate_cycle_time:.2f} s")
+            self._crate_cycle_start = now
+            self._crate_cycle_done = set()
+
+    def run(self, num_cycles=None, duration=None, handle_sigint=True):
+        """Runs the scrub loops until stopped (Ctrl-C), until each RU ran num_cycles cycles or for duration seconds.
+        The status files are written by the status writer from the start to the end of the run.
+        Returns False if no RU could be scrubbed"""
+        previous_sigint_handler = None
+        if handle_sigint:
+            previous_sigint_handler = signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        self._terminate = False
+        self.status_writer.start()
+        try:
+            self._load_status()
+            start = time.monotonic()
+            self._crate_cycle_start = start
+            self._crate_cycle_done = set()
+            for ru in self._rus:
+                ru.due = start
+                ru.steps = None
+                ru.run_start_cycles = ru.stats['cycles']
+            self.logger.info(f"Starting crate scrub loop on {len([ru for ru in self._rus if not ru.stopped])} RUs")
+            while True:
+                now = time.monotonic()
+                if duration is not None and now - start >= duration:
+                    self.stop()
+                if num_cycles is not None and all(ru.stopped or self._run_cycles(ru) >= num_cycles for ru in self._rus):
+                    self.stop()
+                active = [ru for ru in self._rus if ru.steps is not None]
+                if self._terminate and not active:
+                    break
+                # Serve the RUs whose PA3 finished waiting
+                for ru in sorted((ru for ru in active if ru.wake <= now), key=lambda ru: ru.wake):
+                    if self._step(ru):
+                        active.remove(ru)
+                # Start the cycles due, recent errors first
+                if not self._terminate:
+                    due = [ru for ru in self._rus
+                           if ru.steps is None and not ru.stopped and ru.due <= now
+                           and (num_cycles is None or self._run_cycles(ru) < num_cycles)]
+                    for ru in sorted(due, key=_RuScrubState.priority)[:max(0, self.max_active - len(active))]:
+                        self._start_cycle(ru, time.monotonic())
+                        if not self._step(ru):
+                            active.append(ru)
+                if all(ru.stopped for ru in self._rus):
+                    self.logger.error("No RU left to scrub")
+                    break
+                # Wait for the next wake up or due cycle
+                events = [ru.wake for ru in active]
+                if not self._terminate and len(active) < self.max_active:
+                    events += [ru.due for ru in self._rus if ru.steps is None and not ru.stopped]
+                if events:
+                    time.sleep(max(0, min(min(events), now + 1) - time.monotonic()))
+        finally:
+            self.status_writer.close()
+            if handle_sigint:
+                signal.signal(signal.SIGINT, previous_sigint_handler)
+        self.logger.info("Ended crate scrub loop gracefully")
+        return not all(ru.stopped for ru in self._rus)
+
+    @staticmethod
+    def _run_cycles(ru):
+        """Number of scrub cycles of ru in the current run"""
+        return ru.stats['cycles'] - ru.run_start_cycles
+
+    def get_stats(self):
+        """Returns the statistics of the scheduler and of each RU (latencies of the scrub cycles in s)"""
+        ret = OrderedDict()
+        ret['crate_cycles'] = self.crate_cycles
+        ret['last_crate_cycle_time'] = self.last_crate_cycle_time
+        ret['max_crate_cycle_time'] = self.max_crate_cycle_time
+        ret['status_writes'] = self.status_writer.writes
+        ret['rus'] = OrderedDict()
+        for ru in self._rus:
+            stats = OrderedDict(ru.stats)
+            stats['mean_latency'] = stats['total_latency'] / stats['cycles'] if stats['cycles'] else None
+            stats['recent_errors'] = ru.recent_errors
+            stats['stopped'] = ru.stopped
+            ret['rus'][ru.gbt_channel] = stats
+        return ret
@@ -9,6 +9,7 @@ import re
 
 import git_hash_lut
 
+from proasic3_convenience import run_steps
 from proasic3_enums import FlashSelectICOpcode
 from scrubbing_status import (
     ImageLocationStatus,
@@ -72,9 +73,11 @@ def create_and_store_new_scrubbing_status(
             for block in used_blocks:
                 potential_blocks.remove(block)
             # Remove bad blocks
-            bad_blocks = self.get_bad_blocks(ic=ic)
+            bad_blocks = self.get_bad_blocks(ic=ic, store=self.bad_block_store)
             for block in bad_blocks:
-                potential_blocks.remove(block)
+                # the scanned bad blocks can be in page0 or in a used block
+                if block in potential_blocks:
+                    potential_blocks.remove(block)
 
             for block in potential_blocks:
                 scrub_image_location_status = ImageLocationStatus()
@@ -109,11 +112,15 @@ def load_scrubbing_status(self, force=False):
 def update_scrubbing_status_files(self):
     """Update scrubbing status files"""
     assert self.scrubbing_status is not None
-    ru_sn = self.get_sn()
+    write_scrubbing_status_file(self.get_sn(), str(self.scrubbing_status))
+
+
+def write_scrubbing_status_file(ru_sn, status_json):
+    """Writes the JSON formatted scrubbing status of RU ru_sn"""
     if not os.path.exists(SCRUBBING_STATUS_DIR):
-        os.makedirs(SCRUBBING_STATUS_DIR)
+        os.makedirs(SCRUBBING_STATUS_DIR, exist_ok=True)
     with open(f"{SCRUBBING_STATUS_DIR}/{ru_sn}.json", "w") as outfile:
-        outfile.write(str(self.scrubbing_status))
+        outfile.write(status_json)
 
 
 # Scrub cycle configuration and execution methods
@@ -195,6 +202,11 @@ def run_scrub_cycle(self, location=None, test=True, update_scrubbing_status_file
 
 
 def _run_scrub_cycle(self, test=True, update_scrubbing_status_files=True):
+    return run_steps(self._run_scrub_cycle_steps(test=test, update_scrubbing_status_files=update_scrubbing_status_files))
+
+
+def _run_scrub_cycle_steps(self, test=True, update_scrubbing_status_files=True):
+    """Generator version of _run_scrub_cycle, yields while the PA3 is scrubbing (see proasic3_convenience.run_steps)"""
 
     if not self.load_scrubbing_status():
         raise ScrubbingStatusNotLoaded("Cannot scrub without scrubbing status loaded")
@@ -214,9 +226,9 @@ def _run_scrub_cycle(self, test=True, update_scrubbing_status_files=True):
     self.configure_scrub_location(image_location)
 
     if test:
-        scrub_complete = self.pa3.run_single_scrub_test()
+        scrub_complete = yield from self.pa3.single_scrub_test_steps()
     else:
-        scrub_complete = self.pa3.run_single_scrub()
+        scrub_complete = yield from self.pa3.single_scrub_steps()
 
     self.pa3.clear_scrub_block_address()
     success, results = self.determine_post_scrub_status()
@@ -295,49 +307,64 @@ def run_scrub_loop(self, with_test=True, sleep_sec=10):
             return False
 
         self.logger.info("Starting scrub cycle")
+        safe, test_success, _ = run_steps(self.scrub_loop_cycle_steps(with_test=with_test))
 
-        # Update RU scrub status
-        self.scrubbing_status.update_status()
-        self.scrubbing_status.update_current_image_location()
+        # Write files
+        self.update_scrubbing_status_files()
 
-        # Check if RU is ok
-        if not self.scrubbing_status.is_safe_for_scrubbing():
-            self.logger.error("RU scrubbing status: not safe for scrubbing, exiting...")
-            self.update_scrubbing_status_files()
+        if not safe:
             return False
+        if not test_success:
+            continue  # Get new image the next cycle
 
-        if with_test:
-            # Scrub test and update RU scrub status
-            self.logger.info("Run scrub test cycle")
-            _, success, _ = self.run_scrub_cycle(
-                test=True, update_scrubbing_status_files=False
-            )
+        time.sleep(sleep_sec)
+        self.logger.info("Scrub cycle completed")
+        if terminate_scrub:
+            break
+    self.logger.info("Endded scrubbing loop gracefully")
+    return True
 
-            if not success:
-                self.logger.error("Test scrub cycle failed")
-                self.update_scrubbing_status_files()
-                continue  # Get new image the next cycle
 
-            # Check if current image is fine, if not get next available
-            self.scrubbing_status.update_current_image_location()
+def scrub_loop_cycle_steps(self, with_test=True):
+    """Generator running one cycle of the scrub loop on the scrubbing status in memory, without writing the status files.
+    Yields while the PA3 is scrubbing (see proasic3_convenience.run_steps), used by run_scrub_loop and ru_scrub_scheduler.
 
-        self.pa3.smap_abort_and_verify()
+    Returns (safe, test_success, results):
+    safe is False if the RU is not safe for scrubbing (the loop must stop),
+    test_success is False if the test scrub cycle failed (a new image is used the next cycle),
+    results are the results of the last scrub cycle run, see determine_post_scrub_status
+    """
+    # Update RU scrub status
+    self.scrubbing_status.update_status()
+    self.scrubbing_status.update_current_image_location()
 
-        # Real scrub and update RU scrub status
-        self.logger.info("Run real scrub cycle")
-        _, success, _ = self.run_scrub_cycle(
-            test=False, update_scrubbing_status_files=False
+    # Check if RU is ok
+    if not self.scrubbing_status.is_safe_for_scrubbing():
+        self.logger.error("RU scrubbing status: not safe for scrubbing, exiting...")
+        return False, False, None
+
+    if with_test:
+        # Scrub test and update RU scrub status
+        self.logger.info("Run scrub test cycle")
+        _, success, results = yield from self._run_scrub_cycle_steps(
+            test=True, update_scrubbing_status_files=False
         )
 
-        # Write files
-        self.update_scrubbing_status_files()
+        if not success:
+            self.logger.error("Test scrub cycle failed")
+            return True, False, results
 
-        time.sleep(sleep_sec)
-        self.logger.info("Scrub cycle completed")
-        if terminate_scrub:
-            break
-    self.logger.info("Endded scrubbing loop gracefully")
-    return True
+        # Check if current image is fine, if not get next available
+        self.scrubbing_status.update_current_image_location()
+
+    self.pa3.smap_abort_and_verify()
+
+    # Real scrub and update RU scrub status
+    self.logger.info("Run real scrub cycle")
+    _, _, results = yield from self._run_scrub_cycle_steps(
+        test=False, update_scrubbing_status_files=False
+    )
+    return True, True, results
 
 
 # Post scrub update status methods
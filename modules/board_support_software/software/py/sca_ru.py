@@ -7,6 +7,7 @@ import traceback
 from wishbone_module import WishboneModule
 from gbt_sca import Sca
 from gbt_sca import ScaBadErrorFlagError
+from gbt_sca import ScaAdcCmd, ScaChannel
 
 class RuScaReg(IntEnum):
     """SCA wishbone module register mapping"""
@@ -46,6 +47,11 @@ class Sca_RU(Sca, WishboneModule):
     def _sca_write(self, channel, length, command, scadata, trid=0x12, commitTransaction=True, wait=500):
         if not commitTransaction:
             self.logger.warning("commitTransaction==False is ignored")
+        self._queue_sca_write(channel, length, command, scadata, trid=trid, wait=wait)
+        self.sca_write_check_results(trid=trid)
+
+    def _queue_sca_write(self, channel, length, command, scadata, trid=0x12, wait=500):
+        """Queues the wishbone transactions of a SCA write, without committing them"""
         assert (channel & 0xffffff00) == 0, "channel must be 8bit"
         assert (length & 0xffffff00) == 0, "length must be 8bit"
         assert (command & 0xffffff00) == 0, "command must be 8bit"
@@ -69,12 +75,34 @@ class Sca_RU(Sca, WishboneModule):
 
         if wait > 0:
             self.firmware_wait(wait, False)
-        self.sca_write_check_results(trid=trid)
 
-    def sca_write_check_results(self, trid=0x12):
+    def _queue_sca_write_status_reads(self):
         self.read(RuScaReg.CTRL_STATUS,False)  # status
         self.read(RuScaReg.TRID_CHANNEL,False) # TRID & CH
         self.read(RuScaReg.LENGTH_ERROR,False) # LEN & ERR
+
+    def _check_sca_write_status(self, results, trid=0x12):
+        """Checks the status, TRID and error flags read after a SCA write"""
+        ctrl_status_read = results[0]
+        trid_read = results[1]>>8
+        sca_error_flags = results[2]&0xff
+
+        assert (ctrl_status_read & 0x1) == 1, "Status register return incorrect {0:04X} expected 0x0001 (SCA DID NOT FINISH THE READ? => try waiting for longer time...)".format(ctrl_status_read)
+        if (sca_error_flags) != 0:
+            raise ScaBadErrorFlagError(sca_error_flags)
+        assert (trid_read) == (trid), \
+            "Transaction ID sent 0x{0:04X}, received 0x{1:04X}".format(trid,trid_read)
+
+    def _handle_assertion_error(self, ae, results):
+        self.logger.warning(traceback.format_exc())
+        message = ae.args[0]
+        message += "\n results value is {0}".format(results)
+        message += "\n Trying to read data from DP1"
+        message += "\n{0} bytes read (0 expected)".format(self.board.comm.discardall_dp1(10))
+        ae.args = (message,)
+
+    def sca_write_check_results(self, trid=0x12):
+        self._queue_sca_write_status_reads()
         results = self.read_all()
         retlen = len(results)
 
@@ -84,22 +112,9 @@ class Sca_RU(Sca, WishboneModule):
         # check the various status flags
         try:
             assert retlen==3, "returned {0} values, expected 3".format(retlen)
-            ctrl_status_read = results[retlen-3]
-            trid_read = results[retlen-2]>>8
-            sca_error_flags = results[retlen-1]&0xff
-
-            assert (ctrl_status_read & 0x1) == 1, "Status register return incorrect {0:04X} expected 0x0001 (SCA DID NOT FINISH THE READ? => try waiting for longer time...)".format(ctrl_status_read)
-            if (sca_error_flags) != 0:
-                raise ScaBadErrorFlagError(sca_error_flags)
-            assert (trid_read) == (trid), \
-                "Transaction ID sent 0x{0:04X}, received 0x{1:04X}".format(trid,trid_read)
+            self._check_sca_write_status(results[retlen-3:], trid=trid)
         except AssertionError as ae:
-            self.logger.warning(traceback.format_exc())
-            message = ae.args[0]
-            message += "\n results value is {0}".format(results)
-            message += "\n Trying to read data from DP1"
-            message += "\n{0} bytes read (0 expected)".format(self.board.comm.discardall_dp1(10))
-            ae.args = (message,)
+            self._handle_assertion_error(ae, results)
             raise ae
 
     def _sca_read(self):
@@ -115,16 +130,36 @@ class Sca_RU(Sca, WishboneModule):
         try:
             assert retlen==2, "returned {0} values, expected 2".format(retlen)
         except AssertionError as ae:
-            self.logger.warning(traceback.format_exc())
-            message = ae.args[0]
-            message += "\n results value is {0}".format(results)
-            message += "\n Trying to read data from DP1"
-            message += "\n{0} bytes read (0 expected)".format(self.board.comm.discardall_dp1(10))
-            ae.args = (message,)
+            self._handle_assertion_error(ae, results)
             raise ae
         # return the data 32bit formatted
         return ((results[retlen-1]<<16) | (results[retlen-2]))
 
+    def read_adc_channels(self, channels):
+        """Reads a list of ADC channels, pipelining the MUX and GO commands and the data reads
+        of all the channels in a single wishbone sequence.
+        Returns the list of ADC codes"""
+        for channel in channels:
+            assert channel in range(32), " Channel must be between 0 and 31"
+            self._queue_sca_write(channel=ScaChannel.ADC, length=4, command=ScaAdcCmd.ADC_W_MUX, scadata=channel)
+            self._queue_sca_write_status_reads()
+            self._queue_sca_write(channel=ScaChannel.ADC, length=4, command=ScaAdcCmd.ADC_GO, scadata=1, wait=20000) # ADC go command
+            self._queue_sca_write_status_reads()
+            self.read(RuScaReg.DATA_LSB,False)
+            self.read(RuScaReg.DATA_MSB,False)
+        results = self.read_all()
+        codes = []
+        try:
+            assert len(results) == 8*len(channels), "returned {0} values, expected {1}".format(len(results), 8*len(channels))
+            for i in range(0, len(results), 8):
+                self._check_sca_write_status(results[i:i+3])
+                self._check_sca_write_status(results[i+3:i+6])
+                codes.append((results[i+7]<<16) | results[i+6])
+        except AssertionError as ae:
+            self._handle_assertion_error(ae, results)
+            raise ae
+        return codes
+
     def init_communication(self):
         self.HDLC_reset(commitTransaction=True)
         self.HDLC_connect(commitTransaction=True)
@@ -1,6 +1,8 @@
 """Python to Systemverilog Simulation interface"""
 
+import asyncio
 import binascii
+import concurrent.futures
 import errno
 import logging
 import os
@@ -9,7 +11,7 @@ import time
 import random
 
 from queue import Queue, Empty  # python 3.x
-from threading import Thread, Lock
+from threading import Event, Thread, Lock
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.client import ServerProxy
 
@@ -49,12 +51,29 @@ class SimulationServer:
         """Start RPC server"""
         self.thrd.start()
 
+def _get_event_loop():
+    """Returns the event loop serving all simulation sockets, started on first use in a daemon thread"""
+    global _event_loop
+    with _event_loop_lock:
+        if _event_loop is None:
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, name="SimulationEventLoop", daemon=True).start()
+            _event_loop = loop
+    return _event_loop
+
+_event_loop = None
+_event_loop_lock = Lock()
+
 class SocketComm(object):
     """General low-level communication bridge between python and SystemVerilog simulations.
 
     This wrapper sends read/write actions to a socket, which
     will be checked by a simulation testbench and then forwarded to
     the simulation environment.
+
+    The sockets of all the instances are asyncio streams served by a single event loop
+    running in a background thread: received lines are queued as soon as they arrive
+    and fetch blocks on them without polling, flush waits for the write to be drained.
     """
 
     def __init__(self, host, verbose=0):
@@ -66,9 +85,13 @@ class SocketComm(object):
         num_con = len(self.host)
         self.conn = [None]*num_con
         self.sock = [None]*num_con
-        self.conn_thread = [None]*num_con
+        self.server = [None]*num_con
+        self.conn_event = [Event() for _ in range(num_con)]
+        self.rx_queue = [Queue() for _ in range(num_con)]
+        self.reader_task = [None]*num_con
         self.en_timeout = True
         self.stopped = False
+        self.loop = _get_event_loop()
         self.open()
         self.wait_for_connection()
 
@@ -96,95 +119,123 @@ class SocketComm(object):
         sock.listen(1) # Accept only single client
         return sock
 
+    def _run(self, coro, timeout=None):
+        """Runs a coroutine on the event loop and waits for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=timeout)
+
     def wait_for_connection(self):
         """Wait for a connection on a socket, non-blocking"""
         for i in range(len(self.sock)):
-            self.conn_thread[i] = Thread(target=self._wait_for_connection, args=(i,), daemon=True)
-            self.conn_thread[i].start()
-
-    def _wait_for_connection(self, con_num):
-        """Wait for a connection on a socket, non-blocking"""
-        count = 0
-        while self.conn[con_num] is None:
-            try:
-                self.conn[con_num], _ = self.sock[con_num].accept()
-            except BlockingIOError:
-                time.sleep(0.1)
-                count += 0.1
-                if count > GLOBAL_CONNECTION_TIMEOUT:
-                    return
-            except OSError:
-                return
+            self.server[i] = self._run(self._start_server(i))
+
+    async def _start_server(self, con_num):
+        return await asyncio.start_server(lambda reader, writer: self._on_connection(con_num, reader, writer),
+                                          sock=self.sock[con_num])
+
+    def _on_connection(self, con_num, reader, writer):
+        """Accepts the (single) simulation client of a socket"""
+        if self.conn[con_num] is not None or self.stopped:
+            writer.close()
+            return
+        self.conn[con_num] = writer
+        self.reader_task[con_num] = self.loop.create_task(self._reader(con_num, reader))
+        self.conn_event[con_num].set()
+
+    async def _reader(self, con_num, reader):
+        """Queues the complete lines received, None when the connection is closed"""
+        rx_queue = self.rx_queue[con_num]
+        pending = b''
+        try:
+            while True:
+                chunk = await reader.read(65536)
+                if chunk == b'':
+                    break
+                pending += chunk
+                if b'\n' in chunk:
+                    data, _, pending = pending.rpartition(b'\n')
+                    rx_queue.put(data + b'\n')
+        except (ConnectionResetError, OSError):
+            pass
+        finally:
+            rx_queue.put(None)
 
     def close(self):
         """Close socket to sim"""
+        if self.stopped:
+            return
         self.stopped = True
-        for conn in self.conn:
-            try:
-                if conn is not None: # Try to get sim to close socket so it can exit with good exit code
-                    sent = conn.send(bytearray(("EXIT\n").encode("utf-8"))) # If this is first socket to send, this will stop sim, other sockets will throw broken pipe here
-                    sent = conn.send(bytearray(("EXIT\n").encode("utf-8"))) # Should throw broken pipe if sim is not busy
-                    count = 0
-                    while(sent != 0 and count < 3): # if not wait a bit and try again
-                        time.sleep(0.5)
-                        sent = conn.send(bytearray(("EXIT\n").encode("utf-8")))
-                        count += 1
-                    conn.close() # Force close if still not closing remotely
-            except OSError:
-                pass
+        try:
+            self._run(self._close(), timeout=5)
+        except Exception:
+            pass
         for sock in self.sock:
             try:
                 if sock is not None:
-                    sock.shutdown(socket.SHUT_RDWR)
                     sock.close()
             except OSError:
                 pass
 
+    async def _close(self):
+        for con_num, conn in enumerate(self.conn):
+            try:
+                if conn is not None: # Try to get sim to close socket so it can exit with good exit code
+                    # If this is first socket to send, this will stop sim, the others see the sim closing the socket
+                    for _ in range(4):
+                        conn.write(("EXIT\n").encode("utf-8"))
+                        await conn.drain()
+                        if self.reader_task[con_num].done():
+                            break
+                        await asyncio.wait([self.reader_task[con_num]], timeout=0.5)
+                    conn.close() # Force close if still not closing remotely
+            except (ConnectionError, OSError):
+                pass
+        for server in self.server:
+            if server is not None:
+                server.close()
+
     def check_conn(self, conn_num=0):
         """Waits for client connection or errors out"""
         if self.conn[conn_num] is None:
-            self.conn_thread[conn_num].join(timeout=GLOBAL_CONNECTION_TIMEOUT)
+            self.conn_event[conn_num].wait(timeout=GLOBAL_CONNECTION_TIMEOUT)
             if self.conn[conn_num] is None:
                 # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
                 raise KeyboardInterrupt(f"\n\n**** ERROR: Python reached timeout of {GLOBAL_CONNECTION_TIMEOUT}s waiting for connection to sim, exiting ***\n\n")
         return self.conn[conn_num]
 
     def fetch(self, conn_num=0):
-        """Fetch lines from socket"""
-        conn = self.check_conn(conn_num)
-        data = b''
-        count = 0
-        while len(data) == 0 or data.decode()[-1] != '\n':
-            try:
-                chunk = conn.recv(1024)
-            except BlockingIOError:
-                if self.stopped:
-                    break
-                time.sleep(0.01)
-                if self.en_timeout:
-                    count += 0.01
-                    if count > GLOBAL_READ_TIMEOUT:
-                        # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-                        raise KeyboardInterrupt(f"\n\n**** ERROR: Python reached timeout of {GLOBAL_READ_TIMEOUT}s waiting response from sim, exiting ****\n\n")
-            except (ConnectionResetError, OSError):
+        """Fetch lines from socket, waiting for at least one"""
+        self.check_conn(conn_num)
+        rx_queue = self.rx_queue[conn_num]
+        try:
+            data = [rx_queue.get(timeout=GLOBAL_READ_TIMEOUT if self.en_timeout else None)]
+        except Empty:
+            # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
+            raise KeyboardInterrupt(f"\n\n**** ERROR: Python reached timeout of {GLOBAL_READ_TIMEOUT}s waiting response from sim, exiting ****\n\n")
+        try:
+            while data[-1] is not None:
+                data.append(rx_queue.get_nowait())
+        except Empty:
+            pass
+        if data[-1] is None:
+            rx_queue.put(None) # Connection stays closed for the next calls
+            data.pop()
+            if not data:
                 if self.stopped:
-                    break
+                    return []
                 # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
                 raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
-            else:
-                if chunk == b'':
-                    if self.stopped:
-                        break
-                    # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-                    raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
-                data += chunk
+        data = b''.join(data)
         if self.verbose:
             print(f"RX: {data}")
         data = data.decode()
         return data.split('\n')[:-1]
 
+    async def _write(self, conn, msg):
+        conn.write(msg)
+        await conn.drain()
+
     def flush(self, data=None, conn_num=0):
-        """Flush data to socket"""
+        """Flush data to socket, waiting until it is handed over to the socket (backpressure)"""
         conn = self.check_conn(conn_num)
         msg = ""
         if isinstance(data, str):
@@ -208,32 +259,21 @@ class SocketComm(object):
         assert msg.decode()[-1] == '\n', f"Missing newline at end of string {msg}"
         if self.verbose:
             print(f"TX: {msg}")
-        sent_tot = 0
-        count = 0
-        while sent_tot < len(msg):
-            try:
-                sent = conn.send(msg[sent_tot:])
-            except BlockingIOError:
-                if self.stopped:
-                    break
-                time.sleep(0.01)
-                if self.en_timeout:
-                    count += 0.01
-                    if count > GLOBAL_WRITE_TIMEOUT:
-                        # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-                        raise KeyboardInterrupt(f"\n\n**** ERROR: Python reached timeout of {GLOBAL_WRITE_TIMEOUT}s waiting for writing to sim, exiting ****\n\n")
-            except ConnectionResetError:
-                if self.stopped:
-                    break
-                # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-                raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
-            else:
-                if sent == 0:
-                    if self.stopped:
-                        break
-                    # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-                    raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
-                sent_tot += sent
+        if conn.is_closing():
+            if self.stopped:
+                return 0
+            # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
+            raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
+        try:
+            self._run(self._write(conn, bytes(msg)), timeout=GLOBAL_WRITE_TIMEOUT if self.en_timeout else None)
+        except concurrent.futures.TimeoutError:
+            # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
+            raise KeyboardInterrupt(f"\n\n**** ERROR: Python reached timeout of {GLOBAL_WRITE_TIMEOUT}s waiting for sim to read, exiting ****\n\n")
+        except (ConnectionError, OSError):
+            if self.stopped:
+                return 0
+            # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
+            raise KeyboardInterrupt("\n\n**** ERROR: Simulator closed connection, exiting ****\n\n")
         return 0
 
 class UsbCommSim(Communication, SocketComm):
@@ -255,7 +295,7 @@ class UsbCommSim(Communication, SocketComm):
         self.ctlOnly = ctlOnly
 
         self.dp0_queue = Queue()
-        self.dp_rx_queue = [Queue()]*3
+        self.dp_rx_queue = [Queue() for _ in range(3)]
 
     def flush_dp0(self):
         """Flush DP0: send data to fifo"""
@@ -288,35 +328,24 @@ class UsbCommSim(Communication, SocketComm):
             return None
 
     def _read_data_sim(self, fifo, length, max_count=10):
-        """Read data from fifo file"""
-        cnt = 0
+        """Read data from fifo socket.
+        Empty lines (keep alive from the simulation) are skipped, fetch blocks until new data arrives"""
         remaining = length
         assert length % 4 == 0
         msg = b""
-        last_read = False
-        seconds = 0
-        while (remaining > 0) and (seconds < GLOBAL_READ_TIMEOUT):
+        deadline = time.monotonic() + GLOBAL_READ_TIMEOUT
+        while remaining > 0:
+            if time.monotonic() > deadline:
+                # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
+                raise KeyboardInterrupt("\n\n**** ERROR: Python reached timeout of {0}s waiting for a GBT read, simulation possibly stuck, exiting ****\n\n".format(GLOBAL_READ_TIMEOUT))
             string = self._get_data(fifo)
-
-            hex_data = binascii.unhexlify(string)
-            chunk = bytearray(hex_data)
+            if string is None:
+                if self.stopped:
+                    break
+                continue
+            chunk = binascii.unhexlify(string)
             msg += chunk
             remaining -= len(chunk)
-            if remaining > 0:
-                if cnt >= max_count:
-                    #print("Read {0}, remaining: {1}".format(len(msg),remaining))
-                    if last_read:
-                        break
-                if len(chunk) == 0:
-                    #print(">> communication >> usbcommsim >> _read_data_sim >> ALIVE!, remaining: {0}".format(remaining))
-                    time.sleep(1)
-                    seconds += 1
-                    cnt += 1
-                else:
-                    cnt = 0 # Reset retry-counter
-        if seconds == GLOBAL_READ_TIMEOUT:
-            # Raise KeyboardInterrupt as it ends the whole unittest and doesn't continue
-            raise KeyboardInterrupt("\n\n**** ERROR: Python reached timeout of {0}s waiting for a GBT read, simulation possibly stuck, exiting ****\n\n".format(GLOBAL_READ_TIMEOUT))
         return msg
 
 def chunks(l, n):
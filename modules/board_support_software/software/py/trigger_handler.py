@@ -359,6 +359,18 @@ class TriggerHandler(WishboneModule):
         """latches and reads all the counters"""
         return self._monitor.read_counters(counters=counters, latch_first=latch_first, reset_after=reset_after, commitTransaction=commitTransaction)
 
+    def _request_counters(self, counters=None):
+        """Queues the latch and the reads of the counters without committing them, see _format_counters"""
+        return self._monitor._request_counters(counters=counters, latch_first=True)
+
+    def _format_counters(self, counters, addresses, results):
+        """Returns the counter values from the results of the reads queued by _request_counters"""
+        return self._monitor._format_counters(counters, addresses, results)
+
+    def get_counter_width(self, counter):
+        """Returns the number of bits of a counter"""
+        return self._monitor.get_counter_width(counter)
+
     def get_rate_cnts(self):
         cnt_pre = self.read_counters()
         time.sleep(2)
@@ -0,0 +1,181 @@
+"""Background sampler of the trigger handler and GBT packer counter rates of a list of RUs.
+
+Each snapshot of a RU is a single wishbone sequence (latch and read of the trigger handler
+and of the three GBT packer monitors, see read_trigger_counters).
+The rates [Hz] are computed from the difference between consecutive snapshots,
+taking into account the wraparound of the counters (32, 16 or 8 bits):
+the sampling period must be shorter than the time it takes a counter to wrap around.
+
+usage:
+sampler = TriggerRateSampler(rdo_list, rate=1.)
+sampler.start()
+...
+print(sampler.percentiles())  # does not access the hardware
+sampler.stop()
+"""
+
+import time
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from periodic_sampler import PeriodicSampler
+
+TRIGGER_HANDLER_COUNTERS = ('TRIGGER_SENT', 'PROCESSED_TRIGGERS', 'HB', 'HBR', 'PHYSICS', 'TF')
+GBT_PACKER_COUNTERS = ('TRIGGER_READ', 'SOP_SENT', 'EOP_SENT', 'PACKET_DONE', 'PACKET_EMPTY')
+NR_GBT_PACKERS = 3
+
+
+def nanpercentile(values, q):
+    """Percentiles q along the first axis ignoring NaN, as np.nanpercentile with linear interpolation.
+    Vectorized: np.nanpercentile falls back to a loop over the columns when there are NaN values"""
+    values = np.sort(values, axis=0)  # NaN are sorted last
+    valid = np.sum(~np.isnan(values), axis=0)
+    position = np.multiply.outer(np.asarray(q, dtype=np.float64) / 100., np.maximum(valid - 1, 0))
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, np.maximum(valid - 1, 0))
+    fraction = position - low
+    low_values = np.take_along_axis(values, low, axis=0)
+    high_values = np.take_along_axis(values, high, axis=0)
+    ret = low_values + (high_values - low_values) * fraction
+    ret[:, valid == 0] = np.nan
+    return ret
+
+
+def read_trigger_counters(rdo, th_counters=TRIGGER_HANDLER_COUNTERS, packer_counters=GBT_PACKER_COUNTERS):
+    """Reads the trigger handler and GBT packer counters of a RU in a single wishbone sequence.
+
+    Returns an OrderedDict {name: value}, the packer counters are named PACKER<i>_<counter>
+    """
+    th_counters = list(th_counters)
+    packer_counters = list(packer_counters)
+    th_addresses = rdo.trigger_handler._request_counters(th_counters)
+    packer_addresses = rdo.gbt_packer._request_counters(packer_counters)
+    length = len(th_addresses) + sum(len(addresses) for addresses in packer_addresses)
+    results = rdo.flush_and_read_results(expected_length=length)
+    ret = rdo.trigger_handler._format_counters(th_counters, th_addresses, results[:len(th_addresses)])
+    packers = rdo.gbt_packer._format_counters(packer_counters, packer_addresses, results[len(th_addresses):])
+    for i, values in enumerate(packers):
+        for counter, value in values.items():
+            ret[f"PACKER{i}_{counter}"] = value
+    return ret
+
+
+class TriggerRateSampler(PeriodicSampler):
+    """Periodically snapshots the trigger handler and GBT packer counters of the RUs in rdo_list
+    and stores the rates into a fixed size ring buffer.
+
+    The buffer is preallocated: timestamps [buffer_size] and rates [buffer_size, len(rdo_list), len(names)],
+    the oldest samples are overwritten when it is full. A RU which could not be read has NaN rates.
+    If both HB and HBR are sampled, the HBA rate (HB - HBR) is added.
+    The communication is not thread safe: while sampling in the background (start/stop),
+    the RUs must not be accessed by other threads of the same process.
+    """
+
+    def __init__(self, rdo_list, th_counters=TRIGGER_HANDLER_COUNTERS, packer_counters=GBT_PACKER_COUNTERS,
+                 rate=1., buffer_size=3600):
+        self.rdo_list = list(rdo_list)
+        self.th_counters = list(th_counters)
+        self.packer_counters = list(packer_counters)
+        self.counter_names = self.th_counters + [f"PACKER{i}_{counter}" for i in range(NR_GBT_PACKERS)
+                                                 for counter in self.packer_counters]
+        self._hba = 'HB' in self.th_counters and 'HBR' in self.th_counters
+        self.names = self.counter_names + (['HBA'] if self._hba else [])
+        super(TriggerRateSampler, self).__init__(OrderedDict([('timestamps', ((), np.float64, 0.)),
+                                                              ('rates', ((len(self.rdo_list), len(self.names)), np.float64, np.nan))]),
+                                                 rate=rate, buffer_size=buffer_size)
+        self._modulo = None
+        self._last = [None] * len(self.rdo_list)  # (time, counters) of the previous snapshot per RU
+
+    def _get_modulo(self):
+        if self._modulo is None:
+            rdo = self.rdo_list[0]
+            widths = [rdo.trigger_handler.get_counter_width(counter) for counter in self.th_counters]
+            widths += [rdo.gbt_packer.get_counter_width(counter) for _ in range(NR_GBT_PACKERS)
+                       for counter in self.packer_counters]
+            self._modulo = np.array([1 << width for width in widths], dtype=np.int64)
+        return self._modulo
+
+    def _snapshot(self, rdo):
+        values = read_trigger_counters(rdo, self.th_counters, self.packer_counters)
+        return time.time(), np.array([values[name] for name in self.counter_names], dtype=np.int64)
+
+    def _read(self):
+        """Snapshots the counters of all the RUs and returns the rates as (timestamp, rates).
+        The first snapshot of a RU only sets the reference, its rates are NaN"""
+        modulo = self._get_modulo()
+        timestamp = time.time()
+        rates = np.full((len(self.rdo_list), len(self.names)), np.nan, dtype=np.float64)
+        for i, rdo in enumerate(self.rdo_list):
+            try:
+                now, counters = self._snapshot(rdo)
+            except Exception as e:
+                self.logger.error(f"Failed to read the trigger counters of RU {i}: {e}")
+                self._last[i] = None
+                continue
+            if self._last[i] is not None:
+                last_time, last_counters = self._last[i]
+                deltas = (counters - last_counters) % modulo
+                rates[i, :len(self.counter_names)] = deltas / (now - last_time)
+            self._last[i] = (now, counters)
+        if self._hba:
+            rates[:, -1] = rates[:, self.names.index('HB')] - rates[:, self.names.index('HBR')]
+        return timestamp, rates
+
+    def clear(self):
+        """Clears the buffer, the next snapshot of each RU only sets the reference"""
+        with self._lock:
+            self.count = 0
+            self._last = [None] * len(self.rdo_list)
+
+    def _to_dict(self, array):
+        """Converts an array [len(rdo_list), len(names)] to {rdo index: {name: value}}"""
+        ret = OrderedDict()
+        for i in range(len(self.rdo_list)):
+            ret[i] = OrderedDict((name, float(array[i, j])) for j, name in enumerate(self.names))
+        return ret
+
+    def get_latest(self):
+        """Returns the rates of the last sample as {rdo index: {name: rate}}, None if there is none"""
+        _, rates = self.get_samples(last=1)
+        if len(rates) == 0:
+            return None
+        return self._to_dict(rates[0])
+
+    def moving_average(self, window=10):
+        """Returns the mean rates over the last window samples as {rdo index: {name: rate}}"""
+        _, rates = self.get_samples(last=window)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN slices
+            return self._to_dict(np.nanmean(rates, axis=0) if len(rates) else np.full(rates.shape[1:], np.nan))
+
+    def percentiles(self, q=(50, 90, 99), since=None):
+        """Returns percentiles of the buffered rates as {rdo index: {name: {q: rate}}}, NaN samples are ignored"""
+        _, rates = self.get_samples(since=since)
+        q = list(q)
+        if len(rates):
+            values = nanpercentile(rates, q)
+        else:
+            values = np.full((len(q),) + rates.shape[1:], np.nan)
+        ret = OrderedDict()
+        for i in range(len(self.rdo_list)):
+            ret[i] = OrderedDict((name, OrderedDict((p, float(values[k, i, j])) for k, p in enumerate(q)))
+                                 for j, name in enumerate(self.names))
+        return ret
+
+    def aggregate(self, since=None):
+        """Returns min/max/mean of the buffered rates as {rdo index: {name: {"min": ., "max": ., "mean": .}}}"""
+        _, rates = self.get_samples(since=since)
+        ret = OrderedDict()
+        if len(rates) == 0:
+            return ret
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            minimum, maximum, mean = np.nanmin(rates, axis=0), np.nanmax(rates, axis=0), np.nanmean(rates, axis=0)
+        for i in range(len(self.rdo_list)):
+            ret[i] = OrderedDict((name, OrderedDict([("min", float(minimum[i, j])),
+                                                     ("max", float(maximum[i, j])),
+                                                     ("mean", float(mean[i, j]))]))
+                                 for j, name in enumerate(self.names))
+        return ret
@@ -38,7 +38,7 @@ sys.path.append(modules_path)
 from module_includes import *
 
 from chip import ModeControlChipModeSelector
-from pALPIDE import Alpide
+from pALPIDE import Addr, Alpide
 
 import trigger_handler
 import testbench
@@ -286,9 +286,10 @@ class DaqTest(object):
     def program_Xcku(self):
         pass
 
-    def configure_run(self, config_file):
-        """Analyses the configuration and stores is as configuration for the test"""
-        self.config.configure_run(config_file=config_file, logdir=self.logdir)
+    def configure_run(self, config_file, compiled_config=None):
+        """Analyses the configuration and stores is as configuration for the test.
+        compiled_config: CompiledConfig of config_file (see DaqTestConfig.compile), compiled if None"""
+        self.config.configure_run(config_file=config_file, logdir=self.logdir, compiled=compiled_config)
 
     def on_test_start(self):
         pass
@@ -593,46 +594,48 @@ class DaqTest(object):
             dp.rdo_values[gbt_channel].timestamp = dp.timestamp
             dp.rdo_values[gbt_channel].gbt_channel = gbt_channel
         chipdata =  OrderedDict()
-        for ch in self.testbench.stave(gbt_channel):
-            if ch.chipid not in self.config.EXCLUDE_GTH_LIST:
-                try:
-                    lock = ch.getreg_dtu_pll_lock_1()[1]
-                    lock_counter = lock['LockCounter']
-                    lock_status = lock['LockStatus']
-                    lock_flag = lock['LockFlag']
-                    trigger_count = ch.getreg_fromu_status_1()[0]
-                    strobes_count = ch.getreg_fromu_status_2()[0]
-                    eventro_count = ch.getreg_fromu_status_3()[0]
-                    frame_count = ch.getreg_fromu_status_4()[0]
-                    fs5 = ch.getreg_fromu_status_5()[1]
-                    last_bc = fs5['BunchCounter']
-                    fs5_event_count = fs5['EventCounter']
-                    enable_strobe_generation = fs5['EnStrobeGeneration']
-
-                    seu_error_counter = ch.getreg_seu_counter()[0]
-                    cmu_dmu_status = ch.getreg_cmu_and_dmu_status()
-
-                    chipid = ch.chipid
-                    chipdata[chipid] = {}
-                    chipdata[chipid]['is_ib'] = ch.is_inner_barrel()
-                    chipdata[chipid]['is_ob_master'] = ch.is_outer_barrel_master()
-                    chipdata[chipid]['is_ob_slave'] = ch.is_outer_barrel_slave()
-                    if not ch.is_outer_barrel_slave():
-                        chipdata[chipid]['lock_counter'] = lock_counter
-                        chipdata[chipid]['lock_status'] = lock_status
-                        chipdata[chipid]['lock_flag'] = lock_flag
-                    chipdata[chipid]['trigger_count'] = trigger_count
-                    chipdata[chipid]['strobes_count'] = strobes_count
-                    chipdata[chipid]['eventro_count'] = eventro_count
-                    chipdata[chipid]['frame_count'] = frame_count
-                    chipdata[chipid]['last_bc'] = last_bc
-                    chipdata[chipid]['fromu_status_5_event_count'] = fs5_event_count
-                    chipdata[chipid]['enable_strobe_generation'] = enable_strobe_generation
-                    chipdata[chipid]['seu_count'] = seu_error_counter
-                    chipdata[chipid]['cmu_dmu_status'] = cmu_dmu_status
-                except Exception as e:
-                    self.logger.info(f"Chip {ch.chipid} read failed from RU {gbt_channel}")
-                    self.logger.info(e, exc_info=True)
+        chips = [ch for ch in self.testbench.stave(gbt_channel) if ch.chipid not in self.config.EXCLUDE_GTH_LIST]
+        # The status registers of all the chips of the stave in a single sequence
+        requests = [ch._request_status_regs() for ch in chips]
+        try:
+            results = rdo.flush_and_read_results(expected_length=2*sum(len(request) for request in requests))
+        except Exception as e:
+            self.logger.info(f"Chip reads failed from RU {gbt_channel}")
+            self.logger.info(e, exc_info=True)
+            results = None
+        offset = 0
+        for ch, request in zip(chips, requests):
+            chip_results = slice(offset, offset + 2*len(request))
+            offset = chip_results.stop
+            if results is None:
+                continue
+            try:
+                status = ch._format_status_regs(request, results[chip_results])
+            except Exception as e:
+                self.logger.info(f"Chip {ch.chipid} read failed from RU {gbt_channel}")
+                self.logger.info(e, exc_info=True)
+                continue
+            lock = status[Addr.DTU_PLL_LOCK_1][1]
+            fs5 = status[Addr.FROMU_STATUS_5][1]
+
+            chipid = ch.chipid
+            chipdata[chipid] = {}
+            chipdata[chipid]['is_ib'] = ch.is_inner_barrel()
+            chipdata[chipid]['is_ob_master'] = ch.is_outer_barrel_master()
+            chipdata[chipid]['is_ob_slave'] = ch.is_outer_barrel_slave()
+            if not ch.is_outer_barrel_slave():
+                chipdata[chipid]['lock_counter'] = lock['LockCounter']
+                chipdata[chipid]['lock_status'] = lock['LockStatus']
+                chipdata[chipid]['lock_flag'] = lock['LockFlag']
+            chipdata[chipid]['trigger_count'] = status[Addr.FROMU_STATUS_1][0]
+            chipdata[chipid]['strobes_count'] = status[Addr.FROMU_STATUS_2][0]
+            chipdata[chipid]['eventro_count'] = status[Addr.FROMU_STATUS_3][0]
+            chipdata[chipid]['frame_count'] = status[Addr.FROMU_STATUS_4][0]
+            chipdata[chipid]['last_bc'] = fs5['BunchCounter']
+            chipdata[chipid]['fromu_status_5_event_count'] = fs5['EventCounter']
+            chipdata[chipid]['enable_strobe_generation'] = fs5['EnStrobeGeneration']
+            chipdata[chipid]['seu_count'] = status[Addr.SEU_ERROR_COUNTER][0]
+            chipdata[chipid]['cmu_dmu_status'] = status[Addr.CMU_AND_DMU_STATUS]
         dp.rdo_values[gbt_channel].chipdata = chipdata
 
     def sensor_reads_ob_stave(self, dp, rdo=None):
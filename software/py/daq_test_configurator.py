@@ -1,11 +1,15 @@
 """File implementing the configuration of the daq_test.py"""
 
 from collections import OrderedDict
+from collections.abc import Mapping
 
 import configparser
+import copy
 import errno
+import hashlib
 import json
 import os
+import pickle
 import sys
 import warnings
 
@@ -27,8 +31,154 @@ import trigger_handler
 from pALPIDE import ModeControlIbSerialLinkSpeed
 
 
+CACHE_VERSION = 1 # increase when the format of the cached CompiledConfig changes
+_source_digests = {}
+
+
+class _FrozenList(tuple):
+    """List value of a CompiledConfig, set back as a list by DaqTestConfig.apply"""
+    pass
+
+
+class _FrozenDict(Mapping):
+    """Read-only and hashable dict value of a CompiledConfig, set back as a dict by DaqTestConfig.apply"""
+    __slots__ = ('_items', '_hash')
+
+    def __init__(self, items=()):
+        self._items = dict(items)
+        self._hash = hash(tuple(self._items.items()))
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (_FrozenDict, (tuple(self._items.items()),))
+
+    def __repr__(self):
+        return f"_FrozenDict({self._items!r})"
+
+
+class _FrozenSet(frozenset):
+    """Set value of a CompiledConfig, set back as a set by DaqTestConfig.apply"""
+    pass
+
+
+def _freeze(value):
+    """Returns an immutable copy of a configuration value, raises TypeError if it cannot be made hashable"""
+    if isinstance(value, list):
+        return _FrozenList(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return _FrozenDict((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, set):
+        return _FrozenSet(_freeze(item) for item in value)
+    hash(value)
+    return value
+
+
+def _thaw(value):
+    """Inverse of _freeze"""
+    if isinstance(value, _FrozenList):
+        return [_thaw(item) for item in value]
+    if isinstance(value, _FrozenDict):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, _FrozenSet):
+        return set(_thaw(item) for item in value)
+    return value
+
+
+def _digest(path):
+    """Returns the sha256 of the content of a file, None if it cannot be read"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _source_digest(path):
+    """Returns the digest of a source file, computed once per process as the code is loaded once"""
+    if path not in _source_digests:
+        _source_digests[path] = _digest(path)
+    return _source_digests[path]
+
+
+class CompiledConfig(Mapping):
+    """Validated, immutable and hashable configuration of a run, see DaqTestConfig.compile.
+
+    The values of the configuration are accessible as items or attributes, lists are stored as tuples,
+    dicts as read-only mappings and sets as frozensets.
+    key: digest of what the configuration was compiled from
+    json: test configuration as stored to test_config.json
+    warnings: messages of the warnings raised while compiling (only_warn)
+    dependencies: (path, digest) of the files read besides the configuration file
+    """
+    __slots__ = ('key', 'config_class', 'config_file', 'json', 'warnings', 'dependencies', '_values', '_hash')
+
+    def __init__(self, key, config_class, config_file, values, json, warnings=(), dependencies=()):
+        values = dict((name, _freeze(value)) for name, value in values)
+        for name, value in [('key', key), ('config_class', config_class), ('config_file', config_file),
+                            ('json', json), ('warnings', tuple(warnings)), ('dependencies', tuple(dependencies)),
+                            ('_values', values), ('_hash', hash((key, tuple(values.items()))))]:
+            object.__setattr__(self, name, value)
+
+    def __getitem__(self, name):
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(f"{self.config_class} has no option {name}") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledConfig is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledConfig is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, CompiledConfig):
+            return NotImplemented
+        return self.key == other.key and self._values == other._values
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (CompiledConfig, (self.key, self.config_class, self.config_file, tuple(self._values.items()),
+                                 self.json, self.warnings, self.dependencies))
+
+    def __repr__(self):
+        return f"CompiledConfig({self.config_class}, {self.config_file}, {self.key[:12]})"
+
+
 class DaqTestConfig(object):
-    """Configuration for the daq_test"""
+    """Configuration for the daq_test.
+
+    A configuration file is compiled once (see compile) into a CompiledConfig, kept in memory and
+    in CACHE_DIR: the following runs with the same files only load and apply it.
+    """
+    # Directory of the compiled configurations, None to only keep them in memory
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'daq_test_config')
+    _compiled = {} # CompiledConfig by key, shared by the subclasses
+
     def __init__(self, only_warn=False):
         self.only_warn = only_warn
         self._config = None
@@ -139,25 +289,126 @@ class DaqTestConfig(object):
         """Pass for daq_test, super used for obtest_configurator"""
         pass
 
-    def _parse_configuration_file(self, config_file):
-        """Retrieves the configuration from the config or from the specified local configuration file"""
-        self._config_file = config_file
+    @staticmethod
+    def _get_config_file_path(config_file):
+        """Returns the path of the config or of the specified local configuration file"""
         if config_file is not None:
             config_file = os.path.realpath(os.path.join(script_path, config_file))
         else:
             config_file = os.path.realpath(os.path.join(script_path, '../config/daq_test.cfg'))
         if not os.path.isfile(config_file):
             raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), config_file)
+        return config_file
 
+    def _parse_configuration_file(self, config_file):
+        """Retrieves the configuration from the config or from the specified local configuration file"""
+        self._config_file = config_file
         self._config = configparser.ConfigParser()
-        self._config.read(config_file)
+        self._config.read(self._get_config_file_path(config_file))
         return self._config
 
-    def configure_run(self, config_file, logdir):
-        """Defines the whole configuration from the config file"""
-        self._parse_configuration_file(config_file)
-        self._load_config()
-        self._store_configuration(logdir)
+    def configure_run(self, config_file, logdir, compiled=None):
+        """Defines the whole configuration from the config file, or from its CompiledConfig (see compile)"""
+        if compiled is None:
+            compiled = self.compile(config_file)
+        self.apply(compiled)
+        with open(logdir + '/test_config.json','w') as cfg_file:
+            cfg_file.write(compiled.json)
+
+    def compile(self, config_file=None, use_cache=True):
+        """Returns the CompiledConfig of the config file (see configure_run) for this object.
+        The configuration is parsed and validated only if it was not compiled before (in this process or in
+        CACHE_DIR) from the same config file, testbench yml files, configuration code, initial state and host.
+        Only the yml file and its _local variant are tracked (see _get_dependencies): after changing another file
+        read while loading the configuration, compile with use_cache=False or clear CACHE_DIR"""
+        config_path = self._get_config_file_path(config_file)
+        key = self._get_compiled_key(config_path)
+        if use_cache:
+            compiled = self._load_compiled(key)
+            if compiled is not None:
+                return compiled
+        config = copy.deepcopy(self)
+        messages = []
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                try:
+                    config._parse_configuration_file(config_file)
+                    config._load_config()
+                    cfg_json = config._get_configuration_json()
+                finally:
+                    messages = [str(w.message) for w in caught]
+        except Exception:
+            for message in messages:
+                warnings.warn(message)
+            raise
+        values = [(name, value) for name, value in vars(config).items() if not name.startswith('_')]
+        dependencies = [(path, _digest(path)) for path in config._get_dependencies()]
+        compiled = CompiledConfig(key, type(self).__qualname__, config_file, values, cfg_json,
+                                  warnings=messages, dependencies=dependencies)
+        if use_cache:
+            self._store_compiled(compiled)
+        return compiled
+
+    def apply(self, compiled):
+        """Sets the configuration from a CompiledConfig of this class, replaying its warnings"""
+        assert compiled.config_class == type(self).__qualname__, f"{compiled} is not a {type(self).__qualname__}"
+        for message in compiled.warnings:
+            warnings.warn(message)
+        for name, value in compiled.items():
+            setattr(self, name, _thaw(value))
+        self._config_file = compiled.config_file
+
+    def _get_compiled_key(self, config_path):
+        """Returns the digest of what the configuration is compiled from, except the files read while loading it"""
+        h = hashlib.sha256()
+        h.update(f"{CACHE_VERSION} {type(self).__module__}.{type(self).__qualname__} {os.uname().nodename} {config_path}\n".encode())
+        modules = [sys.modules[cls.__module__] for cls in type(self).__mro__ if issubclass(cls, DaqTestConfig)] + [testbench]
+        for module in modules:
+            h.update(f"{_source_digest(module.__file__)}\n".encode())
+        h.update(repr(sorted((name, value) for name, value in vars(self).items() if not name.startswith('_'))).encode())
+        with open(config_path, 'rb') as f:
+            h.update(f.read())
+        return h.hexdigest()
+
+    def _get_dependencies(self):
+        """Returns the files read while loading the configuration, besides the config file"""
+        yml = os.path.realpath(self.yml)
+        if not yml.endswith('.yml'):
+            return [yml]
+        return [yml, testbench._get_local_config_file_name(yml)]
+
+    def _load_compiled(self, key):
+        """Returns the CompiledConfig of key from memory or CACHE_DIR, None if there is none or it is out of date"""
+        compiled = DaqTestConfig._compiled.get(key)
+        if compiled is None and self.CACHE_DIR is not None:
+            try:
+                with open(os.path.join(self.CACHE_DIR, key + '.pickle'), 'rb') as f:
+                    compiled = pickle.load(f)
+            except Exception:
+                # missing or unreadable: compiled again
+                compiled = None
+        if not isinstance(compiled, CompiledConfig) or compiled.key != key:
+            return None
+        if any(_digest(path) != digest for path, digest in compiled.dependencies):
+            return None
+        DaqTestConfig._compiled[key] = compiled
+        return compiled
+
+    def _store_compiled(self, compiled):
+        """Keeps a CompiledConfig in memory and in CACHE_DIR"""
+        DaqTestConfig._compiled[compiled.key] = compiled
+        if self.CACHE_DIR is None:
+            return
+        filename = os.path.join(self.CACHE_DIR, compiled.key + '.pickle')
+        try:
+            os.makedirs(self.CACHE_DIR, exist_ok=True)
+            with open(f"{filename}.{os.getpid()}", 'wb') as f:
+                pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{filename}.{os.getpid()}", filename)
+        except OSError:
+            # the cache is optional
+            pass
 
     def _load_config(self):
         self._configure_yml()
@@ -526,6 +777,11 @@ class DaqTestConfig(object):
 
     def _store_configuration(self, logdir):
         """Stores the test configuration to file"""
+        with open(logdir + '/test_config.json','w') as cfg_file:
+            cfg_file.write(self._get_configuration_json())
+
+    def _get_configuration_json(self):
+        """Returns the test configuration as stored to file"""
         cfg = OrderedDict()
         cfg['yml'] = self.yml
 
@@ -616,9 +872,7 @@ class DaqTestConfig(object):
         cfg['SUBRACK'] = self.SUBRACK
 
         cfg = self.store_scan_specific_config(cfg)
-
-        with open(logdir + '/test_config.json','w') as cfg_file:
-            cfg_file.write(json.dumps(cfg, sort_keys=True, indent=4))
+        return json.dumps(cfg, sort_keys=True, indent=4)
 
     def store_scan_specific_config(self, cfg):
         """not used by daq test but used by ob tests"""
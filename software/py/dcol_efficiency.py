@@ -0,0 +1,93 @@
+"""Per double column efficiency of the dcol test (see dcol_tester.py), accumulated while the hits are streamed in.
+
+The chips are indexed as in the stave hitmaps (see stave_plotter.py): chip index = lane*CHIP_PER_LANE + chip in lane.
+Each injection in a row is expected to give one hit in both pixels of each double column:
+the efficiency of a double column is its number of hits over twice the number of injections.
+
+usage:
+efficiency = DcolEfficiency()
+efficiency.add_injections(row, ninj)           # done by the scan
+efficiency.add_hits(chip_index, col)           # e.g. from an online decoder
+for row, block in hitmap_chunks(filename):     # or from a hitmap file
+    efficiency.add_hitmap_block(row, block)
+bad_dcols = efficiency.get_bad_dcols()
+"""
+
+from collections import OrderedDict
+import os
+import sys
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+modules_path = os.path.join(
+    script_path, '../../modules/board_support_software/software/py/')
+sys.path.append(modules_path)
+
+from pALPIDE import ALPIDE_COLS, ALPIDE_ROWS
+
+ALPIDE_DCOLS = ALPIDE_COLS//2
+CHIP_PER_LANE = 7
+MAX_LANES = 28
+
+
+class DcolEfficiency(object):
+    """Accumulates the hits and injections of a dcol test, see module docstring"""
+
+    def __init__(self, nchips=MAX_LANES*CHIP_PER_LANE):
+        self.nchips = nchips
+        self.hits = np.zeros((nchips, ALPIDE_DCOLS), dtype=np.int64)
+        self.injections = np.zeros(ALPIDE_ROWS, dtype=np.int64)  # per row, the same for all the chips
+
+    def clear(self):
+        self.hits[:] = 0
+        self.injections[:] = 0
+
+    def add_injections(self, row, ninj):
+        """Records ninj injections in a row"""
+        self.injections[row] += ninj
+
+    def add_hits(self, chip, col, count=None):
+        """Adds hits given as arrays of chip index and column, optionally with their number of hits"""
+        chip = np.asarray(chip, dtype=np.int64)
+        col = np.asarray(col, dtype=np.int64)
+        index = chip*ALPIDE_DCOLS + col//2
+        self.hits += np.bincount(index, weights=count, minlength=self.hits.size).astype(np.int64).reshape(self.hits.shape)
+
+    def add_hitmap_block(self, first_row, block):
+        """Adds the hits of a block of a stave hitmap starting at first_row, see stave_plotter.hitmap_chunks"""
+        block = np.asarray(block)
+        assert block.shape[1] == CHIP_PER_LANE*ALPIDE_COLS, "Not a stave hitmap block"
+        for lane_row in range(first_row - first_row%ALPIDE_ROWS, first_row + block.shape[0], ALPIDE_ROWS):
+            lane = lane_row//ALPIDE_ROWS
+            start = max(lane_row, first_row) - first_row
+            stop = min(lane_row + ALPIDE_ROWS, first_row + block.shape[0]) - first_row
+            # [chip in lane, dcol] sums of the rows of the lane in the block
+            dcols = block[start:stop].sum(axis=0, dtype=np.int64).reshape(CHIP_PER_LANE, ALPIDE_DCOLS, 2).sum(axis=2)
+            self.hits[lane*CHIP_PER_LANE:(lane + 1)*CHIP_PER_LANE] += dcols
+
+    @property
+    def expected(self):
+        """Number of hits expected per double column"""
+        return 2*int(self.injections.sum())
+
+    def get_efficiency(self):
+        """Returns the [chip index, dcol] efficiencies, NaN before any injection"""
+        if self.expected == 0:
+            return np.full(self.hits.shape, np.nan)
+        return self.hits/self.expected
+
+    def get_bad_dcols(self, low=0.9, high=1.1, chips=None):
+        """Returns the double columns with an efficiency outside [low, high] as {chip index: [dcol, ...]},
+        only for the given chip indices if any (e.g. those of the lanes read out)"""
+        efficiency = self.get_efficiency()
+        bad = (efficiency < low) | (efficiency > high)
+        if chips is not None:
+            selected = np.zeros(self.nchips, dtype=bool)
+            selected[list(chips)] = True
+            bad &= selected[:, np.newaxis]
+        chip, dcol = np.nonzero(bad)
+        bad_dcols = OrderedDict()
+        for c, d in zip(chip.tolist(), dcol.tolist()):
+            bad_dcols.setdefault(c, []).append(d)
+        return bad_dcols
@@ -19,18 +19,30 @@ import trigger_handler
 from testbench import LayerList
 
 from daq_test import DaqTest, RuTriggeringMode
-from pALPIDE import Alpide
+from pALPIDE import ALPIDE_ROWS, Alpide
 
 import crate_mapping
 from daq_test_configurator import DaqTestConfig
+from dcol_efficiency import DcolEfficiency
 from threshold_scan import ThresholdScan, ThresholdConfig
 
 class DColTester(ThresholdScan):
     """Pulses every pixel once to provoke faulty double columns to fire.
+
+    The pixel configuration writes of all the rows are compiled at the start of the scan.
+    For each row, the RUs are configured and their sequencers started without waiting for any
+    answer, and the end of the injections is detected on the PACKET_DONE counters.
     """
     def __init__(self, testbench=None, name="DcolTester"):
         super().__init__(testbench=testbench, name=name);
         self._last = 0
+        self.row_regs = None
+        self.poll_interval = 0.001 # s between the reads of the counters once the injections should be done
+        self.row_timeout = 5. # s
+        self.efficiency = DcolEfficiency()
+        # callable returning the (chip index, column) arrays of the hits received since its previous call,
+        # e.g. from an online decoder, added to the efficiency after each row. None if the hits are only analysed offline
+        self.hit_source = None
 
     def load_config(self):
         self.config = ThresholdConfig()
@@ -65,7 +77,7 @@ class DColTester(ThresholdScan):
     def scan(self):
         self.scan_start()
 
-        for irow in range(512):
+        for irow in range(ALPIDE_ROWS):
             if irow%100==0:
                 self.logger.info(f'=============> Row {irow:3} <=============')
                 last_read = time.time()
@@ -75,105 +87,117 @@ class DColTester(ThresholdScan):
 
         self.scan_end()
 
+    def compile_rows(self):
+        """Returns per row the pixel configuration writes [(address, data), ...] moving the pulsing
+        from the previous row to the row, see Alpide.write_regs"""
+        row_regs = []
+        for irow in range(ALPIDE_ROWS):
+            regs = []
+            if irow > 0:
+                regs += Alpide.get_row_config_regs(irow-1, pulse_notmask=1, value=0)
+            regs += Alpide.get_row_config_regs(irow, pulse_notmask=1, value=1)
+            row_regs.append(regs)
+        return row_regs
+
+    def get_injection_duration(self):
+        """Returns the duration of the injections of a row in s: NINJ timeframes of TRIGGER_HBF_PER_TF orbits"""
+        return self.config.NINJ*self.config.TRIGGER_HBF_PER_TF*3564*25e-9
+
     def scan_start(self):
         self.logger.info(f'Running tuning scan with STEP_ROWS {self.config.STEP_ROWS},  Ninj={self.config.NINJ}')
 
-        self.gbt_packer_packet_done_counter = {rdo.get_gbt_channel():3*[0] for rdo in self.testbench.rdo_list}
         self.triggers_sent = 0
         self.last_irow = 0
         self.scan_start_time = time.time()
+        self.row_regs = self.compile_rows()
+        self.efficiency.clear()
 
         self.set_chips_in_configuration_mode(silent=True)
 
+        # all the pixels unmasked and not pulsed, as unmasking and disabling the pulsing row by row
         for rdo in self.testbench.rdo_list:
             ch = Alpide(rdo, chipid=0xF)
-            for i in range(512):
-                ch.unmask_row(i)
-                ch.pulse_row_disable(i)
-            ch.region_control_register_unmask_all_double_columns(broadcast=False)
+            ch.unmask_all_pixels(commitTransaction=False)
+            ch.pulse_all_pixels_disable(commitTransaction=False)
+            ch.region_control_register_unmask_all_double_columns(broadcast=False, commitTransaction=False)
+            rdo.flush()
+
+        self.gbt_packer_packet_done_counter = self.read_packet_done()
 
     def scan_row(self, irow):
         if self.config.TRIGGER_SOURCE != trigger_handler.TriggerSource.SEQUENCER:
             raise NotImplementedError("Not supported any longer")
 
-        if not self.config.DRY:
-            for rdo in self.testbench.rdo_list:
-                ch = Alpide(rdo, chipid=0xF)
-                if irow > 0:
-                    ch.pulse_row_disable(irow-1, commitTransaction=False)
-                ch.pulse_row_enable(irow, commitTransaction=True)
+        # Sets the data into the calibration lane (Calibration Data Word = CDW)
+        # From private discussion between @freidt and @mlupi
+        # Maskstage (row) in the 15:0 and setting in 31:16, 47:32 reserved for future use.
+        reserved  = (0    & 0xFFFF)<<32
+        settings  = (0    & 0xFFFF)<<16
+        maskstage = (irow & 0xFFFF)<<0
+        cdw_user_field = reserved | settings | maskstage
 
+        # The writes of a RU are executed in order: the pulsed row, the triggered mode and the CDW are set
+        # before the sequencer starts. All the RUs are started before waiting for any.
         for rdo in self.testbench.rdo_list:
             if not self.config.DRY:
+                Alpide(rdo, chipid=0xF).write_regs(self.row_regs[irow], commitTransaction=False)
                 self.set_chips_in_triggered_mode(rdo=rdo, silent=True)
-
-            # Sets the data into the calibration lane (Calibration Data Word = CDW)
-            # From private discussion between @freidt and @mlupi
-            # Maskstage (row) in the 15:0 and setting in 31:16, 47:32 reserved for future use.
-            reserved  = (0    & 0xFFFF)<<32
-            settings  = (0    & 0xFFFF)<<16
-            maskstage = (irow & 0xFFFF)<<0
-            cdw_user_field = reserved | settings | maskstage
-            rdo.calibration_lane.set_user_field(cdw_user_field)
-            rdo.calibration_lane.read(0) # waits for all commands to be executed before advancing
-
+            rdo.calibration_lane.set_user_field(cdw_user_field, commitTransaction=False)
             # Starts a certain number of TF (injections)
-            rdo.trigger_handler.sequencer_set_number_of_timeframes(self.config.NINJ)
-
-        wait25ns = int(self.config.NINJ*self.config.TRIGGER_HBF_PER_TF*3564/self.config.TRIGGER_PERIOD_BC)
-        self.testbench.rdo_list[0].wait(wait25ns*4)
-        time.sleep(wait25ns*25.e-9)
-
+            rdo.trigger_handler.sequencer_set_number_of_timeframes(self.config.NINJ, commitTransaction=False)
+            rdo.flush()
+        start = time.time()
         self.triggers_sent+=self.config.NINJ
 
+        self.wait_row_done(start)
+        self.efficiency.add_injections(irow, self.config.NINJ)
+        if self.hit_source is not None:
+            self.efficiency.add_hits(*self.hit_source())
 
-        # Polling to check that the injection is finished
-        done = False
-        retries = 0
-        max_retries = 500
-        while not done:
-            done = True
-            time.sleep(0.01)
-            for rdo in self.testbench.rdo_list:
-                done &= rdo.trigger_handler.sequencer_is_done_timeframes()
-                self.logger.debug(f"Done {done}, single {rdo.trigger_handler.sequencer_is_done_timeframes()}, TF left {rdo.trigger_handler.sequencer_get_number_of_timeframes()}, retries {retries}")
-            retries += 1
-            if retries >= max_retries:
-                self.logger.warning(f"Ending at {max_retries} retries...")
-                self.logger.warning(f"This is a demonstrator code, so it is okay, in a real thresholdscan it is not okay.")
-                self.test_pass = False
-                break
+        if not self.config.DRY:
+            self.set_chips_in_configuration_mode(silent=True)
 
-        # After all the triggers were sentm we need to check that all the data were received.
-        done = False
-        retries = 0
-        max_retries = 500
-        while not done:
+    def read_packet_done(self):
+        """Returns the PACKET_DONE counters of the GBT packers as {gbt_channel: [value per packer]}.
+        The reads of all the RUs are sent before reading any result"""
+        requests = []
+        for rdo in self.testbench.rdo_list:
+            requests.append(rdo.gbt_packer._request_counters(['PACKET_DONE']))
+            rdo.flush()
+        ret = {}
+        for rdo, addresses in zip(self.testbench.rdo_list, requests):
+            packers = rdo.gbt_packer._format_counters(['PACKET_DONE'], addresses, rdo.read_results())
+            ret[rdo.get_gbt_channel()] = [packer['PACKET_DONE'] for packer in packers]
+        return ret
+
+    def wait_row_done(self, start):
+        """Waits until all the GBT packers sent the NINJ packets of the row started at start:
+        waits for the duration of the injections, then polls the PACKET_DONE counters every poll_interval"""
+        delay = start + self.get_injection_duration() - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        width = self.testbench.rdo_list[0].gbt_packer.get_counter_width('PACKET_DONE')
+        timeout = time.time() + self.row_timeout
+        while True:
+            counters = self.read_packet_done()
             done = True
-            time.sleep(0.01)
-            for rdo in self.testbench.rdo_list:
-                c = rdo.gbt_packer.read_counter("PACKET_DONE")
-                for packer, value in enumerate(c):
+            for gbt_channel, values in counters.items():
+                for packer, value in enumerate(values):
                     if self.config.LAYER in [LayerList.MIDDLE,LayerList.OUTER] and packer==2:
                         continue # skip when not using this packer
+                    packets = (value - self.gbt_packer_packet_done_counter[gbt_channel][packer]) % (1 << width)
                     # Note the >= in the next line.
                     # This allows continuing taking data for issues such as
                     # RU_mainFPGA#339 (solved)
                     # The >= line allows running, but the test will fail!
-                    done_packer = value-self.gbt_packer_packet_done_counter[rdo.get_gbt_channel()][packer]>=self.config.NINJ
-                    if value-self.gbt_packer_packet_done_counter[rdo.get_gbt_channel()][packer]>self.config.NINJ:
+                    if packets > self.config.NINJ:
                         self.test_pass = False # RU_mainFPGA#339
-                    done &= done_packer
-                    self.logger.debug(f"Done {done}\t{rdo.identity.get_stave_name()} packer {packer}: done {done_packer},\tvalue {value:3}/{self.gbt_packer_packet_done_counter[rdo.get_gbt_channel()][packer]+self.config.NINJ:3}, retries {retries:3}")
-            retries += 1
-            if retries >= max_retries:
-                self.logger.warning(f"Ending at {max_retries} retries...")
-                self.logger.warning(f"This is a demonstrator code, so it is okay, in a real thresholdscan it is not okay.")
-                self.test_pass = False # RU_mainFPGA#339
+                    done &= packets >= self.config.NINJ
+            if done or time.time() > timeout:
                 break
-
-        # Done reading, now update the counter
-        self.gbt_packer_packet_done_counter = {rdo.get_gbt_channel():rdo.gbt_packer.read_counter("PACKET_DONE") for rdo in self.testbench.rdo_list}
-
-        if not self.config.DRY:
-            self.set_chips_in_configuration_mode(silent=True)
+            time.sleep(self.poll_interval)
+        if not done:
+            self.logger.warning(f"Packets of the row not received within {self.row_timeout} s: {counters}")
+            self.logger.warning(f"This is a demonstrator code, so it is okay, in a real thresholdscan it is not okay.")
+            self.test_pass = False
+        self.gbt_packer_packet_done_counter = counters
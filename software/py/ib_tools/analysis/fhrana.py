@@ -11,6 +11,8 @@ from matplotlib import pyplot as plt
 from matplotlib.colors import LogNorm
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+from hitmap import load_chip_maps
+
 
 def analyse_fhr(npyfile, jsonfile, outdir, noise_cut, mask, verbose=True):
     if not os.path.exists(outdir):
@@ -26,7 +28,7 @@ def analyse_fhr(npyfile, jsonfile, outdir, noise_cut, mask, verbose=True):
             print("Using a mask:")
             print(mask)
 
-    data_pixels = np.load(npyfile)
+    data_pixels = load_chip_maps(npyfile)
 
     eventTime = 4.455e-5 # 44.550 us
 
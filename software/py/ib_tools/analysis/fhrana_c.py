@@ -7,30 +7,24 @@ from matplotlib import pyplot as plt
 from matplotlib.colors import LogNorm
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+from hitmap import load_raw, to_chip_maps
+
 
 class HitMapReader:
     def __init__(self, filename):
         self.filename = filename
         self.data = None
-        self.f = open(self.filename, 'r')
 
     def main(self,noise_cut=10, ntrg=1e6):
 
         eventTime = 4.455e-5 # 44.550 us
         fname = os.path.basename(self.filename)
         noiseOccMap = np.zeros((512,1024), dtype=float)
-        self.data = np.fromfile(self.f, dtype=np.uint32)
-        self.f.close()
-
-        num_of_chips_in_file = len(self.data) // (512*1024)
+        self.data = load_raw(self.filename, dtype=np.uint32)
+        data_pixels = to_chip_maps(self.data)
+        num_of_chips_in_file = len(data_pixels)
 
         print("Number of chips in file: " + str(num_of_chips_in_file))
-        data_pixels = np.zeros((num_of_chips_in_file, 512,1024) , dtype=np.uint32)
-        # fill hitmap
-        for j in range(0,512):
-            for k in range(0,1024*num_of_chips_in_file):
-                i = k // 1024
-                data_pixels[i][j][k - i*1024] = self.data[j*3*1024 + k]
 
         print('filling histogram')
         total_hits = 0
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""Loader of the per pixel maps (hit counts, thresholds, noise) written by the decoder.
+
+The files are the row major [NROWS, nchips*NCOLS] arrays of the decoder: for each row,
+the columns of all the chips of the lane/stave one after the other.
+The maps are returned as [nchips, NROWS, NCOLS] views of a memory mapped file, without copying
+the data nor reading it before it is used. The mapping is copy-on-write: the maps can be modified
+in memory, the file is never changed. Streams (e.g. /dev/stdin) are read into memory.
+"""
+
+import os
+import stat
+
+import numpy as np
+
+NROWS = 512
+NCOLS = 1024
+
+
+def _is_regular_file(filename):
+    try:
+        return stat.S_ISREG(os.stat(filename).st_mode)
+    except (OSError, TypeError):
+        return False
+
+
+def load_raw(filename, dtype=np.uint32, mmap=True):
+    """Returns the content of the file as a flat array, memory mapped (copy-on-write) if possible"""
+    if mmap and _is_regular_file(filename):
+        count = os.path.getsize(filename) // np.dtype(dtype).itemsize  # as np.fromfile, ignores a partial item
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='c', shape=(count,))
+    # np.fromfile can not read pipes
+    with open(filename, 'rb') as f:
+        data = bytearray(f.read())
+    itemsize = np.dtype(dtype).itemsize
+    return np.frombuffer(data, dtype=dtype, count=len(data) // itemsize)
+
+
+def to_chip_maps(data, nchips=None):
+    """Converts the flat [NROWS, nchips*NCOLS] data to a [nchips, NROWS, NCOLS] view.
+    nchips defaults to the number of complete chips in the data, trailing data is ignored"""
+    if nchips is None:
+        nchips = len(data) // (NROWS*NCOLS)
+    assert len(data) >= nchips*NROWS*NCOLS, f"Expected {nchips} chips, the data has only {len(data)} pixels"
+    return data[:nchips*NROWS*NCOLS].reshape(NROWS, nchips, NCOLS).transpose(1, 0, 2)
+
+
+def load_chip_maps(filename, dtype=np.uint32, nchips=None, mmap=True):
+    """Returns the [nchips, NROWS, NCOLS] maps of a decoder file (see module docstring),
+    or of a .npy file already in this shape"""
+    if str(filename).endswith('.npy'):
+        return np.load(filename, mmap_mode='c' if mmap else None)
+    return to_chip_maps(load_raw(filename, dtype=dtype, mmap=mmap), nchips=nchips)
@@ -8,6 +8,8 @@ from matplotlib.patches import Rectangle
 from scipy.optimize import curve_fit
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
+from hitmap import load_raw, to_chip_maps
+
 
 def gaus(x,a,x0,sigma):
     return a*np.exp(-(x-x0)**2/(2*sigma**2))
@@ -17,8 +19,6 @@ class ThresholdScan:
     def __init__(self, thrmap, rmsmap):
         self.thrname = thrmap
         self.rmsname = rmsmap
-        self.fthr = open(self.thrname, 'r')
-        self.frms = open(self.rmsname, 'r')
         self.thrdata = None
         self.rmsdata = None
         
@@ -29,20 +29,10 @@ class ThresholdScan:
         if xmax == -1:  
             xmax = vf
         
-        self.thrdata = np.fromfile(self.fthr, dtype=np.float32)
-        self.rmsdata = np.fromfile(self.frms, dtype=np.float32)
-        self.fthr.close()
-        self.frms.close()
-        
-        thrmap = np.zeros((9, 512,1024), dtype=np.float32)
-        noisemap = np.zeros((9, 512,1024), dtype=np.float32)
-        
-        # fill maps
-        for j in range(512):
-            for k in range(1024*9):
-                i = k // 1024
-                thrmap[i][j][k - i*1024] = self.thrdata[j*9*1024 + k]
-                noisemap[i][j][k - i*1024] = self.rmsdata[j*9*1024 + k]
+        self.thrdata = load_raw(self.thrname, dtype=np.float32)
+        self.rmsdata = load_raw(self.rmsname, dtype=np.float32)
+        thrmap = to_chip_maps(self.thrdata, nchips=9)
+        noisemap = to_chip_maps(self.rmsdata, nchips=9)
         
         # thrmap_test = thrmap[0]
         # for i in range(512):
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3.9
+
+"""DAC scan engine: measures the DACs of the ALPIDE chips of several staves with the ADC of the chips.
+
+The measurements of a few DAC steps are a single wishbone sequence per stave: the broadcast DAC,
+analog monitor and ADC control writes, the ADCMEASURE commands followed by the firmware settling
+waits, and the reads of the ADC value of all the chips (board.alpide_control._request_chip_regs).
+The sequences of all the staves are sent before reading any result, so that the settling waits of
+the staves run concurrently. The results are stored in a dense [stave, chip, dac, input, step] array."""
+
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from pALPIDE import AdcIndex, Addr, Alpide, CommandRegisterOpcode
+
+DACS = [
+    'VRESETP',
+    'VRESETD',
+    'VCASP',
+    'VCASN',
+    'VPULSEH',
+    'VPULSEL',
+    'VCASN2',
+    'VCLIP',
+    'VTEMP',
+    'IAUX2',
+    'IRESET',
+    'IDB',
+    'IBIAS',
+    'ITHR',
+]
+
+VDACSel = {
+    'VCASN':0,
+    'VCASP':1,
+    'VPULSEH':2,
+    'VPULSEL':3,
+    'VRESETP':4,
+    'VRESETD':5,
+    'VCASN2':6,
+    'VCLIP':7,
+    'VTEMP':8,
+    'ADCDAC':9
+    }
+
+CDACSel = {
+    'IRESET':0,
+    'IAUX2':1,
+    'IBIAS':2,
+    'IDB':3,
+    'IREF':4,
+    'ITHR':5,
+    'IREFBuffer':6
+    }
+
+# DAC settings used during the scan of the other DACs (taken from new-alpide-software)
+NOMINAL_DACS = OrderedDict([
+    (Addr.VRESETP, 0x0a),
+    (Addr.VRESETD, 0x93),
+    (Addr.VCASP,   0x56),
+    (Addr.VCASN,   0x32),
+    (Addr.VPULSEH, 0xaa),
+    (Addr.VPULSEL, 0x6a),
+    (Addr.VCASN2,  0x39),
+    (Addr.VCLIP,   0x00),
+    (Addr.VTEMP,   0xc8),
+    (Addr.IAUX2,   0x65),
+    (Addr.IRESET,  0x65),
+    (Addr.IDB,     0x1d),
+    (Addr.IBIAS,   0x40),
+    (Addr.ITHR,    0x32),
+])
+
+INPUTS = ['Value', 'AVDD'] # DAC monitor and AVDD, measured at each step
+BROADCAST = 0xF
+ADC_SETTLING_TIME = 0.01 # s, >=5ms according to ALPIDE manual
+WB_CLK_FREQUENCY = 160e6
+
+
+def dac_address(dac):
+    return Addr.VRESETP + DACS.index(dac)
+
+
+def adc_input(dac):
+    """ADC input measuring the DAC: DACMONV for voltage DACs, DACMONI for current DACs"""
+    return AdcIndex.DACMONV if dac_address(dac) < Addr.IAUX2 else AdcIndex.DACMONI
+
+
+def analog_monitor_value(dac, i_ref=1):
+    """Analog Monitor and Override Register value selecting the DAC, as Alpide.setreg_analog_monitor_and_override"""
+    return Alpide.encode_analog_monitor_and_override(VoltageDACSel=VDACSel.get(dac, 0), CurrentDACSel=CDACSel.get(dac, 0),
+                                                     SWCNTL_DACMONI=0, SWCNTL_DACMONV=0, IRefBufferCurrent=i_ref)
+
+
+def adc_ctrl_value(sel_input, mode=0, set_icomp=2, discri_sign=0, ramp_spd=1, half_lsb_trim=0):
+    """ADC Control Register value, as Alpide.setreg_adc_ctrl"""
+    return Alpide.encode_adc_ctrl(Mode=mode, SelInput=sel_input, SetIComp=set_icomp, DiscriSign=discri_sign,
+                                  RampSpd=ramp_spd, HalfLSBTrim=half_lsb_trim)
+
+
+class DacScanResult:
+    """ADC values of a DAC scan: values[stave, chip, dac, input, step], -1 where the read failed"""
+    def __init__(self, staves, chipids, dacs, steps):
+        self.staves = list(staves)
+        self.chipids = list(chipids)
+        self.dacs = list(dacs)
+        self.steps = list(steps)
+        shape = (len(self.staves), len(self.chipids), len(self.dacs), len(INPUTS), len(self.steps))
+        self.values = np.full(shape, -1, dtype=np.int32)
+        self.valid = np.zeros(shape, dtype=bool)
+        self.sequences = 0 # number of wishbone sequences (round trips)
+        self.reads = 0     # number of chip register reads, including the retries
+        self.retries = 0   # number of failed chip register reads
+
+    def measured(self, dac, k='Value'):
+        """[stave, chip, step] values of a DAC"""
+        return self.values[:, :, self.dacs.index(dac), INPUTS.index(k), :]
+
+    def to_dict(self):
+        """Results in the format of DACScan: data{staveID}{chipID}{dac}{avdd/dac}[step], None if the read failed"""
+        ret = {}
+        for istave, stave in enumerate(self.staves):
+            ret[stave] = {}
+            for ichip, chipid in enumerate(self.chipids):
+                ret[stave][chipid] = {}
+                for idac, dac in enumerate(self.dacs):
+                    ret[stave][chipid][dac] = {}
+                    for k in ['AVDD', 'Value']:
+                        values = self.values[istave, ichip, idac, INPUTS.index(k)].tolist()
+                        valid = self.valid[istave, ichip, idac, INPUTS.index(k)].tolist()
+                        ret[stave][chipid][dac][k] = [v if ok else None for v, ok in zip(values, valid)]
+        ret['STEPS'] = self.steps
+        return ret
+
+    def save(self, filename):
+        np.savez_compressed(filename, values=self.values, valid=self.valid, staves=self.staves,
+                            chipids=self.chipids, dacs=self.dacs, steps=self.steps, inputs=INPUTS)
+
+
+class DacScanEngine:
+    """Measures DAC steps on several staves, see module docstring.
+
+    chipids: chips of each stave read after each ADC measurement
+    settling_time: firmware wait between ADCMEASURE and the read of the ADC values, in s
+    steps_per_sequence: number of DAC steps measured in a single wishbone sequence per stave
+    overlap_staves: send the sequences of all the staves before reading their results
+    max_read_tries: number of measurements of a step with failed reads
+    """
+    def __init__(self, chipids=range(9), settling_time=ADC_SETTLING_TIME, steps_per_sequence=8,
+                 overlap_staves=True, max_read_tries=2, log=None):
+        assert steps_per_sequence > 0
+        assert max_read_tries > 0
+        self.chipids = list(chipids)
+        self.settling_time = settling_time
+        self.steps_per_sequence = steps_per_sequence
+        self.overlap_staves = overlap_staves
+        self.max_read_tries = max_read_tries
+        self.log = log if log is not None else logging.getLogger('DacScanEngine')
+
+    def new_result(self, rus, dacs=DACS, steps=range(256)):
+        return DacScanResult([ru.name for ru in rus], self.chipids, dacs, steps)
+
+    def configure_dacs(self, rus, settings=NOMINAL_DACS):
+        """Sets all the DACs to settings {address: value}, one sequence per stave"""
+        for ru in rus:
+            ru.write_chip_regs([(BROADCAST, address, value) for address, value in settings.items()],
+                               commitTransaction=True)
+
+    def _request_measurements(self, ru, dac, measurements):
+        """Queues the measurements [(step, input), ...] of the DAC on all the chips of the stave.
+        Returns the list of the queued register reads"""
+        wait = int(WB_CLK_FREQUENCY*self.settling_time)
+        reg_list = [(chipid, Addr.ADC_AVSS_VALUE) for chipid in self.chipids]
+        address = dac_address(dac)
+        writes = [(BROADCAST, Addr.ANALOG_MONITOR_AND_OVERRIDE, analog_monitor_value(dac))]
+        requested = []
+        step = None
+        for new_step, k in measurements:
+            if new_step != step:
+                step = new_step
+                writes.append((BROADCAST, address, step))
+            sel_input = adc_input(dac) if k == 'Value' else AdcIndex.AVDD
+            writes.append((BROADCAST, Addr.ADC_CTRL, adc_ctrl_value(sel_input)))
+            writes.append((BROADCAST, Addr.CMD, CommandRegisterOpcode.ADCMEASURE))
+            ru.write_chip_regs(writes, commitTransaction=False)
+            ru.wait(wait, commitTransaction=False)
+            ru.alpide_control._request_chip_regs(reg_list)
+            requested += reg_list
+            writes = []
+        return requested
+
+    def _measure(self, rus, dac, measurements):
+        """Runs the measurements {ru: [(step, input), ...]} of the DAC.
+        Returns {ru: [read register, ...]} with the values of all the chips for each measurement"""
+        rus = [ru for ru in rus if measurements[ru]]
+        requested = {}
+        results = {}
+        if self.overlap_staves:
+            for ru in rus:
+                requested[ru] = self._request_measurements(ru, dac, measurements[ru])
+                ru.flush()
+            for ru in rus:
+                results[ru] = ru.read_results()
+        else:
+            for ru in rus:
+                requested[ru] = self._request_measurements(ru, dac, measurements[ru])
+                results[ru] = ru.flush_and_read_results(expected_length=2*len(requested[ru]))
+        return {ru: ru.alpide_control._format_chip_regs(requested[ru], results[ru]) for ru in rus}
+
+    def measure(self, rus, result, dac, step_indices):
+        """Measures the DAC at result.steps[i] for i in step_indices on all the staves,
+        steps_per_sequence steps per wishbone sequence"""
+        idac = result.dacs.index(dac)
+        istaves = {ru: result.staves.index(ru.name) for ru in rus}
+        nchips = len(self.chipids)
+        step_indices = list(step_indices)
+        for start in range(0, len(step_indices), self.steps_per_sequence):
+            pending = {ru: [(i, k) for i in step_indices[start:start+self.steps_per_sequence] for k in INPUTS]
+                       for ru in rus}
+            for itry in range(self.max_read_tries):
+                regs = self._measure(rus, dac, {ru: [(result.steps[i], k) for i, k in pending[ru]] for ru in rus})
+                result.sequences += len(regs)
+                for ru, ru_regs in regs.items():
+                    result.reads += len(ru_regs)
+                    failed = []
+                    for j, (i, k) in enumerate(pending[ru]):
+                        measurement = ru_regs[j*nchips:(j+1)*nchips]
+                        valid = np.array([reg['valid'] for reg in measurement])
+                        data = np.array([reg['data'] for reg in measurement])
+                        index = (istaves[ru], slice(None), idac, INPUTS.index(k), i)
+                        # a repeated measurement only replaces the failed reads
+                        update = valid | ~result.valid[index]
+                        result.values[index] = np.where(update, np.where(valid, data, -1), result.values[index])
+                        result.valid[index] |= valid
+                        if not valid.all():
+                            result.retries += int(np.count_nonzero(~valid))
+                        if not result.valid[index].all():
+                            failed.append((i, k))
+                    if failed:
+                        self.log.warning('Stave {}, DAC {}: {} measurements with failed reads (attempt {}/{})'
+                                         .format(ru.name, dac, len(failed), itry+1, self.max_read_tries))
+                    pending[ru] = failed
+                if not any(pending.values()):
+                    break
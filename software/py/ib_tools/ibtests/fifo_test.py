@@ -1,7 +1,9 @@
 #!/usr/bin/env python3.9
 
+import numpy as np
+
 from .ibtest import *
-import userdefinedexceptions
+from .region_memory import RegionMemoryTester
 
 PATTERNS=[
   ('ramp'         ,range(128*32)                          ),
@@ -22,8 +24,12 @@ class FIFOTest(IBTest):
         self._step = 0
 
         self._max_read_tries = 2
+        self._regions_per_sequence = 4
         self.n_read_retries = {}
         self.n_fifo_errors = {}
+        self.n_sequences = {}
+        self.error_maps = {}
+        self._region_memory = None
         
     def _configure_stave(self, ru):
         ch = Alpide(ru, chipid=0xF) # broadcast
@@ -82,7 +88,9 @@ class FIFOTest(IBTest):
                 for ch in chips:
                     self._steps.append([of, pattern, ch])
         self._step = 0
-        
+        self._region_memory = RegionMemoryTester(max_read_tries=self._max_read_tries,
+                                                 regions_per_sequence=self._regions_per_sequence, log=self.log)
+
         self._run_start_time = time.time()
         self._running = True
 
@@ -98,11 +106,14 @@ class FIFOTest(IBTest):
         self.log.info(self.name+' finished in {:.2f}s'.format(self._run_end_time-self._run_start_time) )
         for of in self._ofs:
             of.close()
+        self.log.info('Wishbone sequences per chip: {}'.format(self.n_sequences))
         counter_status = self.print_counters()
         if len(counter_status): self.log.warning(counter_status)
         self.set_return_code(0, 'Done')
 
         if self._fpath_out_prefix is not None:
+            if self._write_fifo_results_to_file:
+                np.savez_compressed(self._fpath_out_prefix+'fifo_test_error_maps.npz', **self.error_maps)
             self.dump_volt_temp(self._fpath_out_prefix+'chip_adcs_EOR.json')
             self.dump_chips_config('EOR')
 
@@ -129,53 +140,26 @@ class FIFOTest(IBTest):
     def _write_pattern(self, of, ch, name, pattern):
         self.log.info('Writing pattern "{}" on stave {} chipID {}'.format(name, ch.board.name, ch.chipid))
         of.write('    writing pattern "{}" on stave {} chipID {}\n'.format(name, ch.board.name, ch.chipid))
-        for region in range(32):
-            for addr in range(128):
-                data=pattern[region*128+addr]
-                ch.write_region_reg(region,1,addr,data>> 0&0xFFFF, commitTransaction=False)
-                ch.write_region_reg(region,2,addr,data>>16&0x00FF, commitTransaction=False)
-        ch.board.flush()
-
-    def _read_region_reg_chip(self, chip, rgn_add, base_add, sub_add):
-        ret = -1
-        itry = 0
-        while ret < 0 and itry < self._max_read_tries:
-            itry += 1
-            try:
-                ret = chip.read_region_reg(rgn_add,base_add,sub_add,commitTransaction=True)
-            except userdefinedexceptions.ChipidMismatchError:
-                ret = -1
-                ch_name = chip.board.name+'_'+str(chip.chipid)
-                self.log.warning('Failed to read from chip {} rgn {} base {} sub {} (attempt {}/{})!'
-                                 .format(ch_name, rgn_add, base_add, sub_add, itry, self._max_read_tries))
-                if ch_name in self.n_read_retries:
-                    self.n_read_retries[ch_name] += 1
-                else:
-                    self.n_read_retries[ch_name] = 1
-        return ret
-
-                
+        self._region_memory.write_pattern(ch, pattern)
+
     def _read_pattern(self, of, ch, name, pattern):
         self.log.debug('  reading pattern "{}" from stave {} chipID {}'.format(name, ch.board.name, ch.chipid))
         of.write('    reading pattern "{}" from stave {} chipID {}\n'.format(name, ch.board.name, ch.chipid))
-        nerr=0
-        for region in range(32):
-            for addr in range(128):
-                data_lo=self._read_region_reg_chip(ch,region,1,addr)
-                data_hi=self._read_region_reg_chip(ch,region,2,addr)
-                data=(data_hi&0xFF)<<16|data_lo
-                if data!=pattern[region*128+addr]:
-                    nerr+=1
-                    of.write('Error in chip %d, region %d, address 0x%02X: read 0x%06X instead of 0x%06X\n'
-                             %(ch.chipid,region,addr,data,pattern[region*128+addr]))
+        result = self._region_memory.verify_pattern(ch, pattern)
+        ch_name = result.chip_name
+        self.error_maps[ch_name+'_'+name.replace(' ', '_')] = result.error_map
+        self.n_sequences[ch_name] = self.n_sequences.get(ch_name, 0) + result.sequences
+        if result.retries:
+            self.n_read_retries[ch_name] = self.n_read_retries.get(ch_name, 0) + result.retries
+        for region, addr, data, expected in result.errors():
+            of.write('Error in chip %d, region %d, address 0x%02X: read 0x%06X instead of 0x%06X\n'
+                     %(ch.chipid,region,addr,data & 0xFFFFFF,expected))
+        nerr = result.nerrors
         if nerr==0:
             self.log.info('    -> Chip ID {} OK'.format(ch.chipid))
             of.write('OK: no read back errors\n')
         else:
-            self.log.warning('    -> {} errors in chip ID {}'.format(nerr, ch.chipid))
+            self.log.warning('    -> {} errors in chip ID {}, per region: {}'
+                             .format(nerr, ch.chipid, result.errors_per_region().tolist()))
             self.set_return_code(3, 'FIFO errors found')
-            ch_name = ch.board.name+'_'+str(ch.chipid)
-            if ch_name in self.n_fifo_errors:
-                self.n_fifo_errors[ch_name] += nerr
-            else:
-                self.n_fifo_errors[ch_name] = nerr
+            self.n_fifo_errors[ch_name] = self.n_fifo_errors.get(ch_name, 0) + nerr
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3.9
+
+"""Region memory test engine: writes and reads back the 32x128 24 bit words of the ALPIDE region memories
+with batched register writes/reads (Chip.write_regs, board.read_chip_regs), a few regions per wishbone sequence.
+The read back memory is compared to the expected pattern in bulk and only the failed reads are retried."""
+
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+NREGIONS = 32
+NADDRESSES = 128
+MEMORY_SIZE = NREGIONS*NADDRESSES
+BASE_LOW  = 1 # bits 15:0
+BASE_HIGH = 2 # bits 23:16
+
+
+def region_reg_address(rgn_add, base_add, sub_add):
+    """Register address of a region register, as in Chip.read_region_reg"""
+    return (rgn_add & 0x1F) << 11 | (base_add & 0x7) << 8 | sub_add & 0xFF
+
+
+class RegionMemoryResult:
+    """Result of the read back of the region memories of a chip"""
+    def __init__(self, chip_name, expected, read, unreadable, retries, sequences, reads):
+        self.chip_name = chip_name
+        self.expected = expected       # [NREGIONS, NADDRESSES]
+        self.read = read               # [NREGIONS, NADDRESSES], -1 if unreadable
+        self.unreadable = unreadable   # [NREGIONS, NADDRESSES] bool, read failed after the last try
+        self.error_map = read != expected
+        self.retries = retries         # number of failed register read attempts
+        self.sequences = sequences     # number of wishbone sequences (round trips)
+        self.reads = reads             # number of register reads, including the retries
+
+    @property
+    def nerrors(self):
+        return int(np.count_nonzero(self.error_map))
+
+    def errors(self):
+        """Yields (region, address, read, expected) of the words not matching the pattern"""
+        for region, address in zip(*np.nonzero(self.error_map)):
+            yield int(region), int(address), int(self.read[region, address]), int(self.expected[region, address])
+
+    def errors_per_region(self):
+        return self.error_map.sum(axis=1)
+
+    def summary(self):
+        return OrderedDict([('chip', self.chip_name),
+                            ('errors', self.nerrors),
+                            ('unreadable', int(np.count_nonzero(self.unreadable))),
+                            ('errors_per_region', self.errors_per_region().tolist()),
+                            ('retries', self.retries),
+                            ('sequences', self.sequences),
+                            ('reads', self.reads)])
+
+
+class RegionMemoryTester:
+    """Writes and verifies patterns in the region memories of ALPIDE chips.
+
+    max_read_tries: number of tries of a register read failing with a chipid mismatch or a bad status
+    regions_per_sequence: number of regions written/read in a single wishbone sequence
+    """
+    def __init__(self, max_read_tries=2, regions_per_sequence=4, log=None):
+        assert max_read_tries > 0
+        assert NREGIONS % regions_per_sequence == 0
+        self.max_read_tries = max_read_tries
+        self.regions_per_sequence = regions_per_sequence
+        self.log = log if log is not None else logging.getLogger('RegionMemoryTester')
+        # Addresses of the low and high words of each memory location (region*NADDRESSES+address), interleaved
+        self._addresses = np.array([region_reg_address(r, base, a)
+                                    for r in range(NREGIONS) for a in range(NADDRESSES) for base in (BASE_LOW, BASE_HIGH)])
+
+    @staticmethod
+    def chip_name(chip):
+        return chip.board.name+'_'+str(chip.chipid)
+
+    def write_pattern(self, chip, pattern):
+        """Writes the pattern (MEMORY_SIZE words) into the region memories, chip can be the broadcast chip.
+        Returns the number of wishbone sequences"""
+        pattern = np.asarray(pattern, dtype=np.int64).ravel()
+        assert pattern.size == MEMORY_SIZE
+        data = np.stack((pattern & 0xFFFF, (pattern >> 16) & 0xFF), axis=1).ravel()
+        step = 2*self.regions_per_sequence*NADDRESSES
+        sequences = 0
+        for start in range(0, len(data), step):
+            chip.write_regs(zip(self._addresses[start:start+step].tolist(), data[start:start+step].tolist()),
+                            commitTransaction=True)
+            sequences += 1
+        return sequences
+
+    def _read_registers(self, chip, addresses):
+        """Reads the register addresses in sequences of at most regions_per_sequence regions.
+        Returns (data, valid) arrays, and the number of sequences"""
+        data = np.zeros(len(addresses), dtype=np.int64)
+        valid = np.zeros(len(addresses), dtype=bool)
+        step = 2*self.regions_per_sequence*NADDRESSES
+        sequences = 0
+        for start in range(0, len(addresses), step):
+            regs = chip.board.read_chip_regs([(chip.extended_chipid, address)
+                                              for address in addresses[start:start+step].tolist()])
+            data[start:start+step] = [reg['data'] for reg in regs]
+            valid[start:start+step] = [reg['valid'] for reg in regs]
+            sequences += 1
+        return data, valid, sequences
+
+    def verify_pattern(self, chip, pattern):
+        """Reads back the region memories of chip and compares them to pattern (MEMORY_SIZE words).
+        Returns a RegionMemoryResult"""
+        expected = np.asarray(pattern, dtype=np.int64).reshape(NREGIONS, NADDRESSES)
+        addresses = self._addresses
+        data, valid, sequences = self._read_registers(chip, addresses)
+        reads = len(addresses)
+        retries = 0
+        for itry in range(1, self.max_read_tries):
+            failed = np.flatnonzero(~valid)
+            if len(failed) == 0:
+                break
+            retries += len(failed)
+            self.log.warning('Failed to read {} registers from chip {} (attempt {}/{}), retrying them'
+                             .format(len(failed), self.chip_name(chip), itry, self.max_read_tries))
+            data[failed], valid[failed], retry_sequences = self._read_registers(chip, addresses[failed])
+            sequences += retry_sequences
+            reads += len(failed)
+        failed = np.count_nonzero(~valid)
+        if failed:
+            retries += failed
+            self.log.warning('Failed to read {} registers from chip {} after {} attempts'
+                             .format(failed, self.chip_name(chip), self.max_read_tries))
+        low, high = data[0::2], data[1::2]
+        unreadable = ~(valid[0::2] & valid[1::2])
+        read = np.where(unreadable, -1, (high & 0xFF) << 16 | low).reshape(NREGIONS, NADDRESSES)
+        return RegionMemoryResult(self.chip_name(chip), expected, read, unreadable.reshape(NREGIONS, NADDRESSES),
+                                  retries, sequences, reads)
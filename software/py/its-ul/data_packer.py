@@ -2,9 +2,13 @@
 """Convert file of lines of hex data (from UVM simulation) to binary format"""
 
 import argparse
+import functools
 import logging
 import sys
 import os
+import time
+
+import numpy as np
 
 script_path = os.path.dirname(os.path.realpath(__file__))
 modules_path = os.path.join(
@@ -26,34 +30,25 @@ VERBOSE = False
 PADDED_BYTES = 6
 WORD_SIZE = 10
 
-W0_POS_0_START = 0
-W0_POS_0_STOP = WORD_SIZE
-W0_POS_1_START = W0_POS_0_STOP
-W0_POS_1_STOP = W0_POS_1_START+6
+# Rotation of the 10 bytes of the 80 bit words when packed in 128 bit words,
+# for each of the 8 words of a cycle of 5 words of 128 bits
+GEARBOX_ROTATION = np.array([0, 4, 0, 8, 2, 0, 6, 0])
 
-W1_POS_0_START = 0
-W1_POS_0_STOP = 4
-W1_POS_1_START = W1_POS_0_STOP
-W1_POS_1_STOP = W1_POS_0_STOP+WORD_SIZE
-W1_POS_2_START = W1_POS_1_STOP
-W1_POS_2_STOP = W1_POS_2_START+2
 
-W2_POS_0_START = 0
-W2_POS_0_STOP = WORD_SIZE-2
-W2_POS_1_START = W2_POS_0_STOP
-W2_POS_1_STOP = W2_POS_1_START+8
+@functools.lru_cache(maxsize=None)
+def _gearbox_index(nwords):
+    """Index of the input byte of each packed byte for nwords 80 bit words"""
+    rotation = GEARBOX_ROTATION[np.arange(nwords) % len(GEARBOX_ROTATION)]
+    index = (np.arange(WORD_SIZE) + rotation[:, np.newaxis]) % WORD_SIZE
+    return (index + B_PER_GBT_WORD*np.arange(nwords)[:, np.newaxis]).ravel()
 
-W3_POS_0_START = 0
-W3_POS_0_STOP = 2
-W3_POS_1_START = W3_POS_0_STOP
-W3_POS_1_STOP = W3_POS_1_START+WORD_SIZE
-W3_POS_2_START = W3_POS_1_STOP
-W3_POS_2_STOP = W3_POS_2_START+4
 
-W4_POS_0_START = 0
-W4_POS_0_STOP = WORD_SIZE-4
-W4_POS_1_START = W4_POS_0_STOP
-W4_POS_1_STOP = W4_POS_1_START+WORD_SIZE
+@functools.lru_cache(maxsize=None)
+def _reverse_gearbox_index(nwords):
+    """Index of the packed byte of each byte of nwords 80 bit words, shaped (nwords, WORD_SIZE)"""
+    rotation = GEARBOX_ROTATION[np.arange(nwords) % len(GEARBOX_ROTATION)]
+    index = (np.arange(WORD_SIZE) - rotation[:, np.newaxis]) % WORD_SIZE
+    return index + WORD_SIZE*np.arange(nwords)[:, np.newaxis]
 
 
 class Packer():
@@ -64,225 +59,58 @@ class Packer():
         self.print_interval = print_interval
 
     def gearbox80128(self, data):
+        """Packs the 80 bit GBT words (one per 128 bit word) into 128 bit words.
+        The 10 bytes of each word are rotated depending on their position in a
+        cycle of 8 words (5 words of 128 bits)"""
         if len(data) <= 0:
             return data
-        self.logger.info("Gearboxing...")
-
-        buf_pos = 0
-        new_data = bytearray()
-
-        for i in range(0, len(data), 16):
-            if buf_pos % 8 == 0:
-                word = data[i:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 1:
-                word = data[i+4:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-                word = data[i:i+4]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 2:
-                word = data[i:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 3:
-                word = data[i+8:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-                word = data[i:i+8]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 4:
-                word = data[i+2:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-                word = data[i:i+2]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 5:
-                word = data[i:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 6:
-                word = data[i+6:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-                word = data[i:i+6]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-            elif buf_pos % 8 == 7:
-                word = data[i:i+WORD_SIZE]
-                #print(f"{word.hex()}, {len(word)}")
-                new_data.extend(word)
-
-            buf_pos += 1
+        self.logger.debug("Gearboxing...")
+
+        nwords = len(data) // B_PER_GBT_WORD
+        new_data = bytearray(np.frombuffer(data, dtype=np.uint8)[_gearbox_index(nwords)].tobytes())
+
+        # Last incomplete word
+        if len(data) % B_PER_GBT_WORD != 0:
+            shift = GEARBOX_ROTATION[nwords % len(GEARBOX_ROTATION)]
+            i = nwords*B_PER_GBT_WORD
+            new_data.extend(data[i+shift:i+WORD_SIZE])
+            new_data.extend(data[i:i+shift])
 
         # Pad bytes if uneven packet
         if len(new_data) % 16 != 0:
             new_data.extend(bytes([255])*(16 - (len(new_data) % 16)))
 
-        # print("result")
-        # for i in range(0, len(new_data), 16):
-        #     print(new_data[i:i+16].hex())
-
         return new_data
 
     def gearbox12880(self, data):
+        """Unpacks the 128 bit words into 80 bit GBT words, one per 128 bit word padded with zeros.
+        Stops at the first word marked as padding (0xFF control byte), the first word of each cycle excluded"""
         if len(data) <= 0:
             return data
-        self.logger.info("Reverse gearboxing...")
-
-        buf_pos = 0
-        word_pos = 0
-        new_data = bytearray()
-        partial_word = bytearray()
-        padding = bytearray([0x0, 0x0, 0x0, 0x0, 0x0, 0x0])
-
-        for i in range(0, len(data), 16):
-            if buf_pos % 5 == 0:
-                print(f"{data[i:i+16].hex()}")
-
-                if word_pos == 0:
-                    word = data[i:i+W0_POS_0_STOP]
-                    self.logger.info(f"Getting word 0 pos 0, ctrl word {hex(word[W0_POS_0_STOP-W0_POS_0_START-1])}")
-                    new_data.extend(word)
-                    new_data.extend(padding)
-                    word_pos += 1
-
-                if word_pos == 1:
-                    if data[i+W0_POS_1_STOP-1] != 0xFF:
-                        partial_word = bytearray(data[i+W0_POS_1_START:i+W0_POS_1_STOP])
-                        self.logger.info(f"Getting word 0 pos 1, ctrl word {hex(partial_word[W0_POS_1_STOP-W0_POS_1_START-1])}")
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-            elif buf_pos % 5 == 1:
-                print(f"{data[i:i+16].hex()}")
-
-                if word_pos == 1:
-                    self.logger.info("Getting word 1 pos 0")
-                    word = data[i:i+W1_POS_0_STOP]
-                    partial_word[0:0] = word # insert in front
-                    new_data.extend(partial_word)
-                    new_data.extend(padding)
-                    word_pos += 1
-
-                if word_pos == 2:
-                    if data[i+W1_POS_1_STOP-1] != 0xFF:
-                        word = data[i+W1_POS_1_START:i+W1_POS_1_STOP]
-                        self.logger.info(f"Getting word 1 pos 1, ctrl word {hex(word[W1_POS_1_STOP-W1_POS_1_START-1])}")
-                        new_data.extend(word)
-                        new_data.extend(padding)
-                        word_pos += 1
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-                if word_pos == 3:
-                    if data[i+W1_POS_2_STOP-1] != 0xFF:
-                        partial_word = bytearray(data[i+W1_POS_2_START:i+W1_POS_2_STOP])
-                        self.logger.info(f"Getting word 1 pos 2, ctrl word {hex(partial_word[(W1_POS_2_STOP-W1_POS_2_START)-1])}")
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-            elif buf_pos % 5 == 2:
-                print(f"{data[i:i+16].hex()}")
-
-                if word_pos == 3:
-                    self.logger.info("Getting word 2 pos 0")
-                    word = data[i:i+W2_POS_0_STOP]
-                    partial_word[0:0] = word # insert in front
-                    new_data.extend(partial_word)
-                    new_data.extend(padding)
-                    word_pos += 1
-
-                if word_pos == 4:
-                    if data[i+W2_POS_1_STOP-1] != 0xFF:
-                        partial_word = bytearray(data[i+W2_POS_1_START:i+W2_POS_1_STOP])
-                        self.logger.info(f"Getting word 2 pos 1, ctrl word {hex(partial_word[W2_POS_1_STOP-W2_POS_1_START-1])}")
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-            elif buf_pos % 5 == 3:
-                print(f"{data[i:i+16].hex()}")
-
-                if word_pos == 4:
-                    self.logger.info("Getting word 3 pos 0")
-                    word = data[i:i+W3_POS_0_STOP]
-                    partial_word[0:0] = word # insert in front
-                    new_data.extend(partial_word)
-                    new_data.extend(padding)
-                    word_pos += 1
-
-                if word_pos == 5:
-                    if data[i+W3_POS_1_STOP-1] != 0xFF:
-                        word = data[i+W3_POS_1_START:i+W3_POS_1_STOP]
-                        self.logger.info(f"Getting word 3 pos 1, ctrl word {hex(word[W3_POS_1_STOP-W3_POS_1_START-1])}")
-                        new_data.extend(word)
-                        new_data.extend(padding)
-                        word_pos += 1
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-                if word_pos == 6:
-                    if data[i+W3_POS_2_STOP-1] != 0xFF:
-                        partial_word = bytearray(data[i+W3_POS_2_START:i+W3_POS_2_STOP])
-                        self.logger.info(f"Getting word 3 pos 2, ctrl word {hex(partial_word[W3_POS_2_STOP-W3_POS_2_START-1])}")
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-
-            elif buf_pos % 5 == 4:
-                print(f"{data[i:i+16].hex()}")
-
-                if word_pos == 6:
-                    self.logger.info("Getting word 4 pos 0")
-                    word = data[i:i+W4_POS_0_STOP]
-                    partial_word[0:0] = word # insert in front
-                    new_data.extend(partial_word)
-                    new_data.extend(padding)
-                    word_pos += 1
-
-                if word_pos == 7:
-                    if data[i+W4_POS_1_STOP-1] != 0xFF:
-                        word = bytearray(data[i+W4_POS_1_START:i+W4_POS_1_STOP])
-                        self.logger.info(f"Getting word 4 pos 1, ctrl word {hex(word[W4_POS_1_STOP-W4_POS_1_START-1])}")
-                        new_data.extend(word)
-                        new_data.extend(padding)
-                        word_pos = 0
-                    else:
-                        self.logger.info("Found padding, no more data read")
-                        break
-
-            buf_pos += 1
+        self.logger.debug("Reverse gearboxing...")
 
-        # Pad bytes if uneven packet
-        if len(new_data) % 16 != 0:
-            new_data.extend(bytes([255])*(16 - (len(new_data) % 16)))
+        nwords = len(data) // WORD_SIZE
+        words = np.frombuffer(data, dtype=np.uint8)[_reverse_gearbox_index(nwords)]
 
-        # print("result")
-        # for i in range(0, len(new_data), 16):
-        #     print(new_data[i:i+16].hex())
+        padding = words[:, WORD_SIZE-1] == 0xFF
+        padding[::len(GEARBOX_ROTATION)] = False
+        if padding.any():
+            self.logger.debug("Found padding, no more data read")
+            words = words[:padding.argmax()]
 
-        return new_data
+        new_data = np.zeros((len(words), B_PER_GBT_WORD), dtype=np.uint8)
+        new_data[:, :WORD_SIZE] = words
+        return bytearray(new_data.tobytes())
 
     def ul_convert(self, rdh, data, unpack=True):
-        self.logger.info("Converting data....")
-        print(rdh)
+        self.logger.debug(f"Converting data.... {rdh}")
         if unpack:
             data = self.gearbox12880(data)
         else:
             data = self.gearbox80128(data)
         rdh['next_packet_offset'] = len(data) + RDH_SIZE
         rdh['memory_size'] = len(data) + RDH_SIZE
-        print(rdh)
+        self.logger.debug(rdh)
         return rdh, data
 
 
@@ -450,11 +278,41 @@ class Packer():
         assert trigger.BitMap.CAL.name not in triggers, "CAL not expected {0}".format(triggers)
         return rdh
 
+def synthetic_pages(pages, seed=0):
+    """Returns pages of random GBT words (one per 128 bit word, padded with zeros), as read by gearbox12880"""
+    rng = np.random.default_rng(seed)
+    max_words = (BLOCK_SIZE-RDH_SIZE)//B_PER_GBT_WORD
+    data = []
+    for nwords in rng.integers(1, max_words+1, size=pages):
+        words = np.zeros((nwords, B_PER_GBT_WORD), dtype=np.uint8)
+        words[:, :WORD_SIZE-1] = rng.integers(0, 0x100, size=(nwords, WORD_SIZE-1))
+        words[:, WORD_SIZE-1] = rng.integers(0, 0xFF, size=nwords) # 0xFF marks padding
+        data.append(bytearray(words.tobytes()))
+    return data
+
+def benchmark(logger, pages=2000, seed=0):
+    """Throughput of the gearboxes on synthetic pages of random GBT words"""
+    packer = Packer(logger, filename=os.devnull)
+    data = synthetic_pages(pages, seed)
+    size = sum(len(d) for d in data)
+
+    start = time.time()
+    packed = [packer.gearbox80128(d) for d in data]
+    pack_time = time.time() - start
+    start = time.time()
+    for p in packed:
+        packer.gearbox12880(p)
+    unpack_time = time.time() - start
+
+    logger.info(f"gearbox80128: {size/pack_time/1e6:.1f} MB/s")
+    logger.info(f"gearbox12880: {sum(len(p) for p in packed)/unpack_time/1e6:.1f} MB/s")
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("-i", "--inputfile", required=False, help="Path to file to analyse", default="/dev/stdin")
     parser.add_argument("-o", "--outputfile", required=False, help="Path to file to write", default="output.bin")
     parser.add_argument("-u", "--unpack", required=False, help="Switch, if set unpack instead of pack", action='store_true')
+    parser.add_argument("-b", "--benchmark", required=False, help="Run throughput benchmark on synthetic data", action='store_true')
 
     args = parser.parse_args()
     input = args.inputfile
@@ -464,6 +322,10 @@ if __name__ == '__main__':
     logging.basicConfig(stream=sys.stdout, level=logging.INFO)
     logger = logging.getLogger("packer")
 
+    if args.benchmark:
+        benchmark(logger)
+        sys.exit(0)
+
     packer = Packer(logger, input)
     if not unpack:
         block = packer.pack()
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3.9
+"""Long running exporter of RU, CRU/FELIX and power unit monitoring values.
+
+The values are polled in groups, each at its own period, and served in the
+Prometheus text format over HTTP on localhost, e.g.
+
+    ./metrics_exporter.py -c ../config/testbench_mvtx.yml -p 9110 -g trigger_handler=1 -g pu=5
+
+Counters are exported as <name>_total together with the delta and the rate
+computed from the previous poll.
+
+Every group poll on a RU is one LLA locked access, so that the exporter can share the card
+with test scripts. The fraction of time the exporter spends on the hardware is limited to
+--max_duty_cycle and the exporter reports its own polling cost (its_exporter_* metrics).
+"""
+
+import argparse
+import collections
+import contextlib
+import heapq
+import http.server
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+modules_path = os.path.join(script_path, '../../modules/board_support_software/software/py/')
+sys.path.append(modules_path)
+
+import testbench
+
+DEFAULT_PERIODS = collections.OrderedDict([
+    ("trigger_handler", 1.),
+    ("gbt_packer",      1.),
+    ("datalane",        5.),
+    ("pu",              2.),
+    ("sysmon",          10.),
+    ("cru",             1.),
+])
+
+
+def _sanitize(name):
+    """Returns a valid Prometheus metric/label name"""
+    return re.sub(r'[^a-zA-Z0-9_]', '_', str(name)).lower()
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class MetricsRegistry(object):
+    """Thread safe store of the latest values, rendered in the Prometheus text format.
+
+    For counters the delta and rate with respect to the previous update are computed.
+    A counter decreasing (reset or wraparound) restarts the delta from the new value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = collections.OrderedDict()
+        self._values = collections.OrderedDict()
+        self._previous = {}
+
+    def _set(self, name, labels, value, kind):
+        name = _sanitize(name)
+        self._types.setdefault(name, kind)
+        self._values.setdefault(name, collections.OrderedDict())[labels] = value
+
+    def gauge(self, name, value, timestamp=None, **labels):
+        labels = tuple((_sanitize(k), str(v)) for k, v in labels.items())
+        with self._lock:
+            self._set(name, labels, value, "gauge")
+
+    def counter(self, name, value, timestamp=None, **labels):
+        if timestamp is None:
+            timestamp = time.time()
+        labels = tuple((_sanitize(k), str(v)) for k, v in labels.items())
+        key = (name, labels)
+        with self._lock:
+            self._set(f"{name}_total", labels, value, "counter")
+            previous = self._previous.get(key)
+            if previous is not None:
+                previous_value, previous_timestamp = previous
+                delta = value - previous_value
+                if delta < 0:
+                    delta = value
+                self._set(f"{name}_delta", labels, delta, "gauge")
+                if timestamp > previous_timestamp:
+                    self._set(f"{name}_rate", labels, delta/(timestamp-previous_timestamp), "gauge")
+            self._previous[key] = (value, timestamp)
+
+    def add(self, name, value, **labels):
+        """Increments a counter owned by the exporter itself"""
+        labels = tuple((_sanitize(k), str(v)) for k, v in labels.items())
+        with self._lock:
+            current = self._values.get(_sanitize(name), {}).get(labels, 0)
+            self._set(name, labels, current + value, "counter")
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, kind in self._types.items():
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in self._values[name].items():
+                    if labels:
+                        label_str = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                        lines.append(f"{name}{{{label_str}}} {value}")
+                    else:
+                        lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(object):
+    """Polls the declared groups of values of a Testbench and serves them over HTTP"""
+
+    def __init__(self, tb, periods=DEFAULT_PERIODS, host="127.0.0.1", port=9110,
+                 max_duty_cycle=0.2, powerunits=(1,)):
+        assert 0 < max_duty_cycle <= 1, "max_duty_cycle must be in (0,1]"
+        self.logger = logging.getLogger("MetricsExporter")
+        self.tb = tb
+        self.host = host
+        self.port = port
+        self.max_duty_cycle = max_duty_cycle
+        self.powerunits = powerunits
+        self.registry = MetricsRegistry()
+        self.collectors = {
+            "trigger_handler": self.collect_trigger_handler,
+            "gbt_packer":      self.collect_gbt_packer,
+            "datalane":        self.collect_datalane,
+            "pu":              self.collect_pu,
+            "sysmon":          self.collect_sysmon,
+            "cru":             self.collect_cru,
+        }
+        self.periods = collections.OrderedDict()
+        for group, period in periods.items():
+            assert group in self.collectors, f"Unknown group {group}, allowed {list(self.collectors.keys())}"
+            if period > 0:
+                self.periods[group] = period
+        self._start_time = None
+        self._busy_time = 0.
+        self._server = None
+        self._stop_event = threading.Event()
+
+    # Hardware access
+
+    @contextlib.contextmanager
+    def _locked(self, comm):
+        """Keeps the LLA lock for the duration of a group poll on a card/RU"""
+        comm._lock_comm()
+        try:
+            yield
+        finally:
+            comm._unlock_comm()
+
+    def _rdo_label(self, rdo):
+        return rdo.get_gbt_channel()
+
+    def collect_trigger_handler(self, timestamp):
+        for rdo in self.tb.rdo_list:
+            with self._locked(rdo.comm):
+                counters = rdo._trigger_handler_monitor.read_counters()
+            for counter, value in counters.items():
+                self.registry.counter("its_ru_trigger_handler", value, timestamp, ru=self._rdo_label(rdo), counter=counter)
+
+    def collect_gbt_packer(self, timestamp):
+        for rdo in self.tb.rdo_list:
+            with self._locked(rdo.comm):
+                monitors = rdo.gbt_packer.read_counters()
+            for index, counters in enumerate(monitors):
+                for counter, value in counters.items():
+                    self.registry.counter("its_ru_gbt_packer", value, timestamp, ru=self._rdo_label(rdo), packer=index, counter=counter)
+
+    def collect_datalane(self, timestamp):
+        for rdo in self.tb.rdo_list:
+            for barrel, monitor in [("ib", rdo.datapath_monitor_ib), ("ob", rdo.datapath_monitor_ob)]:
+                with self._locked(rdo.comm):
+                    lanes = monitor.read_counters()
+                for lane, counters in zip(monitor.lanes, lanes):
+                    for counter, value in counters.items():
+                        self.registry.counter("its_ru_datalane", value, timestamp, ru=self._rdo_label(rdo), barrel=barrel, lane=lane, counter=counter)
+
+    def collect_pu(self, timestamp):
+        for rdo in self.tb.rdo_list:
+            with self._locked(rdo.comm):
+                values = rdo.get_powerunits_values(powerunits=self.powerunits)
+            for index, pu_values in values.items():
+                pu = rdo.powerunit_1 if index == 1 else rdo.powerunit_2
+                ru = self._rdo_label(rdo)
+                self.registry.gauge("its_pu_power_enable_status", pu_values["power_enable_status"], ru=ru, pu=index)
+                self.registry.gauge("its_pu_bias_enable_status", pu_values["bias_enable_status"], ru=ru, pu=index)
+                self.registry.gauge("its_pu_bias_voltage_volts", pu._code_to_vbias(pu_values["bb_voltage"]), ru=ru, pu=index)
+                self.registry.gauge("its_pu_bias_current_milliamperes", pu._code_to_ibias(pu_values["bb_current"]), ru=ru, pu=index)
+                for module in range(8):
+                    for rail in ["avdd", "dvdd"]:
+                        voltage = pu_values[f"module_{module}_{rail}_voltage"]
+                        current = pu_values[f"module_{module}_{rail}_current"]
+                        self.registry.gauge("its_pu_voltage_volts", pu._code_to_vpower(voltage), ru=ru, pu=index, module=module, rail=rail)
+                        self.registry.gauge("its_pu_current_milliamperes", pu._code_to_i(current), ru=ru, pu=index, module=module, rail=rail)
+
+    def collect_sysmon(self, timestamp):
+        for rdo in self.tb.rdo_list:
+            with self._locked(rdo.comm):
+                temperature = rdo.sysmon.get_temperature()
+                vcc_int = rdo.sysmon.get_vcc_int()
+                vcc_aux = rdo.sysmon.get_vcc_aux()
+            ru = self._rdo_label(rdo)
+            self.registry.gauge("its_ru_temperature_celsius", temperature, ru=ru)
+            self.registry.gauge("its_ru_vcc_int_volts", vcc_int, ru=ru)
+            self.registry.gauge("its_ru_vcc_aux_volts", vcc_aux, ru=ru)
+
+    def collect_cru(self, timestamp):
+        cru = self.tb.cru
+        if cru is None or not hasattr(cru, "dwrapper"):
+            # FELIX has no datapath wrapper counters
+            return
+        with self._locked(cru):
+            dropped = cru.dwrapper.get_dropped_packets()
+            total = cru.dwrapper.get_total_packets()
+            links = cru.dwrapper.get_datapath_counters() if cru.dwrapper.data_link_list is not None else {}
+        self.registry.counter("its_cru_dropped_packets", dropped, timestamp)
+        self.registry.counter("its_cru_total_packets", total, timestamp)
+        for link, counters in links.items():
+            for counter, value in counters.items():
+                self.registry.counter("its_cru_link", value, timestamp, link=link, counter=counter)
+
+    # Scheduling
+
+    def poll(self, group):
+        """Polls a group once and records the polling cost"""
+        start = time.time()
+        try:
+            self.collectors[group](start)
+        except Exception as e:
+            self.registry.add("its_exporter_poll_errors_total", 1, group=group)
+            self.logger.warning(f"Polling {group} failed: {e!r}")
+        duration = time.time() - start
+        self._busy_time += duration
+        self.registry.add("its_exporter_polls_total", 1, group=group)
+        self.registry.add("its_exporter_poll_seconds_total", duration, group=group)
+        self.registry.gauge("its_exporter_last_poll_duration_seconds", duration, group=group)
+        self.registry.gauge("its_exporter_duty_cycle", self._busy_time/max(time.time()-self._start_time, 1e-9))
+        return duration
+
+    def run(self, duration=None):
+        """Polls the groups at their periods until stop() is called or duration [s] elapsed.
+
+        After each poll lasting d, the exporter leaves the hardware alone for at least
+        d*(1/max_duty_cycle-1), hence postponing groups if needed.
+        """
+        self._start_time = time.time()
+        schedule = [(self._start_time, group) for group in self.periods]
+        heapq.heapify(schedule)
+        holdoff_until = self._start_time
+        while schedule and not self._stop_event.is_set():
+            due, group = heapq.heappop(schedule)
+            now = time.time()
+            if duration is not None and now - self._start_time >= duration:
+                break
+            wait = max(due, holdoff_until) - now
+            if wait > 0 and self._stop_event.wait(wait):
+                break
+            poll_duration = self.poll(group)
+            end = time.time()
+            holdoff_until = end + poll_duration*(1./self.max_duty_cycle - 1)
+            heapq.heappush(schedule, (max(due + self.periods[group], end), group))
+
+    def start_server(self):
+        """Serves the metrics on http://host:port/metrics in a background thread"""
+        registry = self.registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, name="MetricsExporterHttp", daemon=True)
+        thread.start()
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _parse_period(value):
+    group, period = value.split("=")
+    return group, float(period)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config_file", required=True, help="Testbench configuration file")
+    parser.add_argument("-p", "--port", required=False, help="HTTP port on localhost", type=int, default=9110)
+    parser.add_argument("-g", "--group", required=False, help="Polling period of a group as group=seconds, 0 disables it. Groups: " + ", ".join(DEFAULT_PERIODS.keys()),
+                        action="append", type=_parse_period, default=[])
+    parser.add_argument("-d", "--max_duty_cycle", required=False, help="Maximum fraction of time spent polling the hardware", type=float, default=0.2)
+    parser.add_argument("-u", "--powerunits", required=False, help="Power units to monitor", type=int, nargs="+", default=[1])
+    args = parser.parse_args()
+
+    periods = collections.OrderedDict(DEFAULT_PERIODS)
+    periods.update(args.group)
+
+    tb = testbench.configure_testbench(config_file_path=args.config_file, run_standalone=True)
+    exporter = MetricsExporter(tb, periods=periods, port=args.port,
+                               max_duty_cycle=args.max_duty_cycle, powerunits=tuple(args.powerunits))
+    try:
+        exporter.start_server()
+        exporter.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        exporter.stop()
+        tb.stop()
@@ -20,6 +20,8 @@ if __name__ == '__main__':
     parser.add_argument("-y", "--yaml_filename", required=False, help="Filename of yml file with vcasn values", default="nameless")
     parser.add_argument("-d", "--debug", required=False, help="Activates the generation of single chip plots", action='store_true')
     parser.add_argument("-r", "--rewrite_masks", required=False, help="Rewrite the noise and double column masks", action='store_true')
+    parser.add_argument("-j", "--processes", required=False, help="Number of processes used to read the input files", type=int, default=1)
+    parser.add_argument("-s", "--file_stats", required=False, help="Print hits and hit pixels of every input file", action='store_true')
 
 
     args = parser.parse_args()
@@ -33,6 +35,8 @@ if __name__ == '__main__':
     yaml_filename = args.yaml_filename
     debug = args.debug
     rewrite_masks = args.rewrite_masks
+    processes = args.processes
+    file_stats = args.file_stats
 
     # analyse
     plotter = FHRateStavePlotter(filename=filename,
@@ -41,7 +45,9 @@ if __name__ == '__main__':
                                  plot_extension=plot_extension,
                                  plot_name=output_file_name,
                                  yaml_filename=yaml_filename,
-                                 rewrite_masks=rewrite_masks)
+                                 rewrite_masks=rewrite_masks,
+                                 processes=processes,
+                                 file_stats=file_stats)
 
     # analysis, needs the unmodified data!
     plotter.calculate_fhr()
@@ -1,148 +1,393 @@
 #!/usr/bin/env python
+"""Run Control Server acting as fake ECS.
+
+Each client connection sends one command and receives "<CMD> <result>\\n".
+The clients are served concurrently by an asyncio event loop:
+- the hardware commands (SETUP_NEW_RUN, PREPARE_FOR_TRIGGERS, START_RUN, TEAR_DOWN, STOP_READOUT, STOP)
+  are executed one at a time by a worker thread, the client waits for their result
+- MOVE_DATA starts the data move as a background job and returns its id immediately
+- SUBMIT <CMD> runs a hardware command as a background job
+- JOBS, JOB <id>, CANCEL <id>, WAIT <id>, WAIT_JOBS and PING give the status of the jobs and the server,
+  and are answered immediately, also while hardware commands or data moves are running.
+"""
 
 import os, sys, time, shutil
 import glob, json, logging, datetime
 import argparse
+import asyncio
 import configparser
-import socketserver
-import subprocess
+import re
 import traceback
 import smtplib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 script_path=os.path.dirname(os.path.realpath(__file__))+'/'
 genconf = configparser.ConfigParser()
 genconf.read(script_path+'../../config/rcs_setup.cfg')
 
-path_cru_its = genconf.get('DEFAULT', 'path_cru_its')
-sys.path.append(path_cru_its+'software/py/')
+HARDWARE_COMMANDS = ['SETUP_NEW_RUN', 'PREPARE_FOR_TRIGGERS', 'START_RUN', 'TEAR_DOWN', 'STOP_READOUT', 'STOP']
+
+def make_test():
+    """Imports the testbench modules (only needed once a run is set up) and returns the test"""
+    path_cru_its = genconf.get('DEFAULT', 'path_cru_its')
+    sys.path.append(path_cru_its+'software/py/')
 
-import testbench
-from fakehitrate import FakeHitRate
-from obtest import ObTest
+    import testbench
+    from fakehitrate import FakeHitRate
+    from obtest import ObTest
+
+    class FakeHitScan(ObTest, FakeHitRate):
+        pass
 
-class FakeHitScan(ObTest, FakeHitRate):
+    return FakeHitScan()
+
+class ProcessError(Exception):
+    """Non zero return code of a process run with run_process(check=True)"""
     pass
 
-class RunControlServer(socketserver.BaseRequestHandler):
+
+async def run_process(args, job=None, progress=(0, 100), shell=False, check=False):
+    """Runs a subprocess without blocking the event loop, returns (returncode, output).
+    The percentages printed by the process (e.g. rsync --info=progress2) update the progress of job,
+    scaled to the progress range. The process is killed if the job is cancelled.
+    If check, raises a ProcessError with the last lines of the output if the process failed."""
+    if shell:
+        proc = await asyncio.create_subprocess_shell(args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    else:
+        proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    output = b''
+    try:
+        while True:
+            chunk = await proc.stdout.read(4096)
+            if not chunk:
+                break
+            output += chunk
+            percents = re.findall(rb'(\d+)%', chunk)
+            if job is not None and percents:
+                job.progress = progress[0] + (progress[1]-progress[0])*min(int(percents[-1]), 100)/100
+        await proc.wait()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    output = output.decode('utf-8', errors='replace')
+    if check and proc.returncode != 0:
+        program = (args.split() if shell else args)[0]
+        lines = [line.strip() for line in output.splitlines() if line.strip()]
+        raise ProcessError(f"{program} returned {proc.returncode}: {' | '.join(lines[-5:])}")
+    if job is not None:
+        job.progress = progress[1]
+    return proc.returncode, output
+
+
+class Job:
+    """Background job of the run control server"""
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = 'QUEUED'
+        self.progress = 0.
+        self.stage = ''
+        self.result = None
+        self.start_time = None
+        self.end_time = None
+        self.task = None
+        self.future = None
+        self.reported = False
+
+    def is_done(self):
+        return self.state in ['DONE', 'FAILED', 'CANCELLED']
+
+    def describe(self):
+        end = self.end_time if self.end_time is not None else time.time()
+        duration = end-self.start_time if self.start_time is not None else 0
+        ret = '{} {} {} {:.0f}% {:.1f}s'.format(self.id, self.name, self.state, self.progress, duration)
+        if self.stage:
+            ret += ' '+self.stage
+        if self.result is not None and self.is_done():
+            ret += ': '+self.result
+        return ret
+
+
+class RunControl:
+    """Hardware commands of the run control, executed by the worker thread of the server (except move_raw_data)"""
+    def __init__(self, setup, conf, log):
+        self.setup = setup
+        self.conf = conf
+        self.log = log
+        self.test = None
+
     #__________________________________________
     def setup_new_run(self):
-        self.server.test = FakeHitScan()
-        self.server.test.activate_tuning()
-        self.server.test.setup_logging(main=True, prefix=self.server.conf.get(self.server.setup, 'log_prefix'))
-        self.server.test.configure_run(config_file=self.server.conf.get(self.server.setup, 'external_daqtest_config'))
-        self.server.test.setup_links(staves=json.loads(self.server.conf.get(self.server.setup, 'staves')))
-        self.server.test.initialize_testbench()
-        self.server.test.testbench.setup_cru()
-        self.server.test.testbench.setup_ltu()
-        self.server.test.setup_comms()
-        self.server.test.testbench.clean_all_datapaths()
+        self.test = make_test()
+        self.test.activate_tuning()
+        self.test.setup_logging(main=True, prefix=self.conf.get(self.setup, 'log_prefix'))
+        self.test.configure_run(config_file=self.conf.get(self.setup, 'external_daqtest_config'))
+        self.test.setup_links(staves=json.loads(self.conf.get(self.setup, 'staves')))
+        self.test.initialize_testbench()
+        self.test.testbench.setup_cru()
+        self.test.testbench.setup_ltu()
+        self.test.setup_comms()
+        self.test.testbench.clean_all_datapaths()
 
         try:
-            self.server.test.testbench.cru.initialize(gbt_ch=self.server.test.config.CTRL_AND_DATA_LINK_LIST[0])
+            self.test.testbench.cru.initialize(gbt_ch=self.test.config.CTRL_AND_DATA_LINK_LIST[0])
             time.sleep(1)
             try:
-                self.server.test.testbench.setup_rdos(connector_nr=self.server.test.config.MAIN_CONNECTOR)
-                for rdo in self.server.test.testbench.rdo_list:
+                self.test.testbench.setup_rdos(connector_nr=self.test.config.MAIN_CONNECTOR)
+                for rdo in self.test.testbench.rdo_list:
                     rdo.initialize()
                     gbt_channel = rdo.comm.get_gbt_channel()
-                    if self.server.test.config.PA3_READ_VALUES or self.server.test.config.PA3_SCRUBBING_ENABLE:
-                        self.server.test.testbench.cru.pa3.initialize()
-                        self.server.test.testbench.cru.pa3.config_controller.clear_scrubbing_counter()
-                    if self.server.test.config.PA3_SCRUBBING_ENABLE:
-                        self.server.test.testbench.cru.pa3.config_controller.start_blind_scrubbing()
-                        self.server.test.logger.info(f"Running blind scrubbing on RDO {gbt_channel}")
+                    if self.test.config.PA3_READ_VALUES or self.test.config.PA3_SCRUBBING_ENABLE:
+                        self.test.testbench.cru.pa3.initialize()
+                        self.test.testbench.cru.pa3.config_controller.clear_scrubbing_counter()
+                    if self.test.config.PA3_SCRUBBING_ENABLE:
+                        self.test.testbench.cru.pa3.config_controller.start_blind_scrubbing()
+                        self.test.logger.info(f"Running blind scrubbing on RDO {gbt_channel}")
             except Exception as e:
                 raise e
         except Exception as e:
-            self.server.test.logger.exception("Exception in Run")
+            self.test.logger.exception("Exception in Run")
         finally:
-            self.server.test.testbench.stop()
-            self.server.test.stop()
+            self.test.testbench.stop()
+            self.test.stop()
 
 
         return 'Done starting run'
-    
+
     #__________________________________________
     def prepare_for_triggers(self):
-        self.server.test.prepare_for_triggers()
+        self.test.prepare_for_triggers()
         return ('Done')
     #__________________________________________
     def run(self):
-        self.server.test.logger.info(f"ltu master conf {self.server.conf.getboolean(self.server.setup, 'ltu_master')}")
-        self.server.test.run(rcs=True, ltu_master=self.server.conf.getboolean(self.server.setup, 'ltu_master'))
+        self.test.logger.info(f"ltu master conf {self.conf.getboolean(self.setup, 'ltu_master')}")
+        self.test.run(rcs=True, ltu_master=self.conf.getboolean(self.setup, 'ltu_master'))
         return ('Done')
     #__________________________________________
     def tear_down(self):
-        self.server.test.tearDown()
+        self.test.tearDown()
         return ('Done')
     #__________________________________________
     def stop_readout(self):
-        self.server.test.stop()
+        self.test.stop()
         return ('Done')
     #__________________________________________
     def stop(self):
-        self.server.test.testbench.stop()
+        self.test.testbench.stop()
         return ('Done')
 
     #__________________________________________
-    def move_raw_data(self):
-        ls_command = "ls -td -- ./logs/*/ | grep "+self.server.conf.get(self.server.setup, 'log_prefix')+" | head -n 1 | cut -d'/' -f3"
-        self.server.test.logger.info(ls_command)
-        log_name = subprocess.run(ls_command, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8').rstrip()
-        
-        subprocess.run(["mkdir", "-p", "/data/ob_comm/raw/"+log_name])
-        subprocess.run(["mkdir", "-p", "/data/ob_comm/logs/"+log_name])
-        rsync_command = "rsync -a logs/"+log_name+" /data/ob_comm/logs/"+log_name
-        subprocess.run(rsync_command, shell=True, stdout=subprocess.PIPE)
-        self.server.test.logger.info(rsync_command)
-
-        find_raw_data_command = "cat "+self.server.conf.get(self.server.setup, 'external_readout_config')+" | grep fileName | grep lz4"
-        raw_data_path = subprocess.run(find_raw_data_command, shell=True, stdout=subprocess.PIPE).stdout.decode('utf-8').rstrip().strip('fileName=')
-        mv_raw_data_command = "mv "+raw_data_path+" /data/ob_comm/raw/"+log_name+"/"
-        self.server.test.logger.info(f"move rae data command {mv_raw_data_command}")
-        subprocess.run(mv_raw_data_command, shell=True, stdout=subprocess.PIPE)
-        
+    def execute(self, cmd):
+        """Executes a hardware command"""
+        if cmd == 'SETUP_NEW_RUN':
+            return self.setup_new_run()
+        elif cmd == 'PREPARE_FOR_TRIGGERS':
+            return self.prepare_for_triggers()
+        elif cmd == 'START_RUN':
+            return self.run()
+        elif cmd == 'TEAR_DOWN':
+            return self.tear_down()
+        elif cmd == 'STOP_READOUT':
+            return self.stop_readout()
+        elif cmd == 'STOP':
+            return self.stop()
+        raise ValueError(cmd)
+
+    #__________________________________________
+    async def move_raw_data(self, job):
+        """Moves the logs and the raw data of the last run to /data/ob_comm, run as a background job"""
+        ls_command = "ls -td -- ./logs/*/ | grep "+self.conf.get(self.setup, 'log_prefix')+" | head -n 1 | cut -d'/' -f3"
+        self.log.info(ls_command)
+        _, log_name = await run_process(ls_command, shell=True)
+        log_name = log_name.rstrip()
+
+        os.makedirs("/data/ob_comm/raw/"+log_name, exist_ok=True)
+        os.makedirs("/data/ob_comm/logs/"+log_name, exist_ok=True)
+        job.stage = 'logs'
+        rsync_command = ["rsync", "-a", "--info=progress2", "logs/"+log_name, "/data/ob_comm/logs/"+log_name]
+        self.log.info(" ".join(rsync_command))
+        await run_process(rsync_command, job=job, progress=(0, 50), check=True)
+
+        job.stage = 'raw data'
+        find_raw_data_command = "cat "+self.conf.get(self.setup, 'external_readout_config')+" | grep fileName | grep lz4"
+        _, raw_data_path = await run_process(find_raw_data_command, shell=True, check=True)
+        raw_data_path = raw_data_path.rstrip().strip('fileName=')
+        mv_raw_data_command = ["mv", raw_data_path, "/data/ob_comm/raw/"+log_name+"/"]
+        self.log.info(f"move raw data command {' '.join(mv_raw_data_command)}")
+        await run_process(mv_raw_data_command, job=job, progress=(50, 100), check=True)
+
         return ('Done')
 
+
+class RunControlServer:
+    """Serves the commands of the clients concurrently, see module docstring"""
+    def __init__(self, run_control, log):
+        self.run_control = run_control
+        self.log = log
+        self.jobs = OrderedDict()
+        self.last_ret = None
+        self._next_job_id = 1
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rcs_hardware')
+        self._server = None
+
+    async def start(self, host, port):
+        """Starts listening, returns the port (useful with port=0)"""
+        self._server = await asyncio.start_server(self.handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        for job in self.jobs.values():
+            self.cancel(job)
+        if self._server is not None:
+            self._server.close()
+        self._executor.shutdown(wait=False)
+
     #__________________________________________
-    def handle(self):
-        data = self.request.recv(1024).strip().decode('utf-8').split()
-        if len(data) == 0: return
-        cmd = data[0].upper()
-
-        # Run Control Server part
-        start_time = time.time()
-        ret = 'ERROR'
-        self.server.log.info(cmd + ' request received')
-        
+    def _new_job(self, name):
+        job = Job(self._next_job_id, name)
+        self._next_job_id += 1
+        self.jobs[job.id] = job
+        return job
+
+    async def _run_job(self, job, coro):
+        if job.future is None:
+            job.start_time = time.time()
+            job.state = 'RUNNING'
         try:
-            if cmd == 'SETUP_NEW_RUN': 
-                ret = self.setup_new_run()
-            elif cmd == 'PREPARE_FOR_TRIGGERS':
-                ret = self.prepare_for_triggers()
-            elif cmd == 'START_RUN':
-                ret = self.run()
-            elif cmd == 'TEAR_DOWN':
-                ret = self.tear_down()
-            elif cmd == 'STOP_READOUT':
-                ret = self.stop_readout()
-            elif cmd == 'STOP':
-                ret = self.stop()
-            elif cmd == 'MOVE_DATA':
-                ret = self.move_raw_data()
-            else:
-                ret = 'ERROR unknown command'
-
-        except:
-            traceback.print_stack()
-            self.server.log.exception(f'Command {cmd} failed!') # TODO: add exception handling and recover software/hardware
-            
-        self.server.log.info(cmd + ' returned ' + ret + ' (executed in {:.1f}s)'.format(time.time()-start_time))
-
-        ret = cmd +' '+ ret + '\n'
-        self.request.sendall(bytes(ret, "utf-8"))
-        self.server.last_ret = ret
-                 
+            job.result = await coro
+            job.state = 'DONE'
+            job.progress = 100.
+        except asyncio.CancelledError:
+            job.state = 'CANCELLED'
+        except Exception as e:
+            self.log.exception(f'Job {job.id} {job.name} failed!')
+            job.result = 'ERROR {}'.format(e)
+            job.state = 'FAILED'
+        job.end_time = time.time()
+        self.log.info('Job '+job.describe())
+
+    def submit_move_data(self):
+        job = self._new_job('MOVE_DATA')
+        job.task = asyncio.ensure_future(self._run_job(job, self.run_control.move_raw_data(job)))
+        return job
+
+    def submit_hardware(self, cmd):
+        job = self._new_job(cmd)
+        job.future = self._executor.submit(self._execute_hardware_job, job, cmd)
+        job.task = asyncio.ensure_future(self._run_job(job, asyncio.wrap_future(job.future)))
+        return job
+
+    def _execute_hardware_job(self, job, cmd):
+        job.start_time = time.time()
+        job.state = 'RUNNING'
+        return self.run_control.execute(cmd)
+
+    def cancel(self, job):
+        """Cancels a job, hardware commands can only be cancelled before they start"""
+        if job.is_done():
+            return False
+        if job.future is not None and not job.future.cancel():
+            return False
+        job.task.cancel()
+        return True
+
+    def _get_job(self, args):
+        if len(args) != 1 or not args[0].isdigit() or int(args[0]) not in self.jobs:
+            raise KeyError('unknown job {}'.format(' '.join(args)))
+        return self.jobs[int(args[0])]
+
+    #__________________________________________
+    async def execute(self, cmd, args):
+        if cmd in HARDWARE_COMMANDS:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self.run_control.execute, cmd)
+        elif cmd == 'MOVE_DATA':
+            return 'Started job {}'.format(self.submit_move_data().id)
+        elif cmd == 'SUBMIT':
+            if len(args) != 1 or args[0].upper() not in HARDWARE_COMMANDS:
+                return 'ERROR unknown command'
+            return 'Started job {}'.format(self.submit_hardware(args[0].upper()).id)
+        elif cmd == 'JOBS':
+            return '; '.join(job.describe() for job in self.jobs.values()) or 'No jobs'
+        elif cmd == 'JOB':
+            return self._get_job(args).describe()
+        elif cmd == 'CANCEL':
+            job = self._get_job(args)
+            if not self.cancel(job):
+                return 'ERROR job {} cannot be cancelled ({})'.format(job.id, job.state)
+            await asyncio.wait([job.task])
+            return job.describe()
+        elif cmd == 'WAIT':
+            job = self._get_job(args)
+            await asyncio.wait([job.task])
+            return job.describe() if job.state == 'DONE' else 'ERROR '+job.describe()
+        elif cmd == 'WAIT_JOBS':
+            tasks = [job.task for job in self.jobs.values() if not job.is_done()]
+            if tasks:
+                await asyncio.wait(tasks)
+            # failed jobs are reported once
+            failed = [job.describe() for job in self.jobs.values() if job.state in ['FAILED', 'CANCELLED'] and not job.reported]
+            for job in self.jobs.values():
+                job.reported = job.is_done()
+            return 'ERROR '+'; '.join(failed) if failed else 'Done'
+        elif cmd == 'PING':
+            return 'Done'
+        return 'ERROR unknown command'
+
+    async def handle(self, reader, writer):
+        try:
+            data = (await reader.read(1024)).strip().decode('utf-8').split()
+            if len(data) == 0: return
+            cmd = data[0].upper()
+
+            # Run Control Server part
+            start_time = time.time()
+            ret = 'ERROR'
+            self.log.info(cmd + ' request received')
+
+            try:
+                ret = await self.execute(cmd, data[1:])
+            except KeyError as e:
+                ret = 'ERROR '+e.args[0]
+            except Exception:
+                traceback.print_exc()
+                self.log.exception(f'Command {cmd} failed!') # TODO: add exception handling and recover software/hardware
+
+            self.log.info(cmd + ' returned ' + ret + ' (executed in {:.1f}s)'.format(time.time()-start_time))
+
+            ret = cmd +' '+ ret + '\n'
+            writer.write(bytes(ret, "utf-8"))
+            await writer.drain()
+            self.last_ret = ret
+        except ConnectionError as e:
+            self.log.warning(f'Client connection lost: {e}')
+        finally:
+            writer.close()
+
+
+async def serve(setup, conf, log):
+    HOST = conf.get(setup, 'host')
+    PORT = conf.getint(setup, 'port')
+    server = RunControlServer(RunControl(setup, conf, log), log)
+    while True:
+        try:
+            await server.start(HOST, PORT)
+            break
+        except OSError:
+            wait = 3
+            log.info('Port {} not available, waiting {}s and retrying...'.format(PORT,wait))
+            await asyncio.sleep(wait)
+    log.info('Listening on port {:d}'.format(PORT))
+    try:
+        await server.serve_forever()
+    finally:
+        server.close()
+
 
 ###################################################################
 if __name__ == "__main__":
@@ -155,17 +400,17 @@ if __name__ == "__main__":
                        datetime.datetime.today().strftime('%Y-%m-%d')+'_'
     log_format = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     logging.getLogger().setLevel(logging.INFO)
-    
+
     sh = logging.StreamHandler()
     sh.setLevel(logging.INFO)
     sh.setFormatter(log_format)
     logging.getLogger().addHandler(sh)
-    
+
     log_file = logging.FileHandler(log_fname_prefix+'info.log', mode='a')
     log_file.setLevel(logging.INFO)
     log_file.setFormatter(log_format)
     logging.getLogger().addHandler(log_file)
-    
+
     log_file_err = logging.FileHandler(log_fname_prefix+'error.log', mode='a')
     log_file_err.setLevel(logging.WARNING)
     log_file_err.setFormatter(log_format)
@@ -173,7 +418,7 @@ if __name__ == "__main__":
 
     log = logging.getLogger('run_control')
     log.setLevel(logging.DEBUG)
-    
+
     try:
         os.unlink(genconf.get(margs.setup, 'path_logs')+'rcs_' + margs.setup+'_info.log')
         os.unlink(genconf.get(margs.setup, 'path_logs')+'rcs_' + margs.setup+'_error.log')
@@ -182,27 +427,7 @@ if __name__ == "__main__":
     os.symlink(log_fname_prefix+'info.log', genconf.get(margs.setup, 'path_logs')+'rcs_' + margs.setup+'_info.log')
     os.symlink(log_fname_prefix+'error.log', genconf.get(margs.setup, 'path_logs')+'rcs_' + margs.setup+'_error.log')
 
-    HOST = genconf.get(margs.setup, 'host')
-    PORT = genconf.getint(margs.setup, 'port')
     try:
-        server_running = False
-        while(not server_running):
-            try:
-                with socketserver.TCPServer((HOST, PORT), RunControlServer) as server:
-                    server.setup = margs.setup
-                    server.conf = genconf
-                    server.log = log
-                    server.tb = None
-                    server.test = None
-                    server.last_ret = None
-                    server.last_cmd = None
-                    log.info('Listening on port {:d}'.format(PORT))
-                    server_running = True
-                    server.serve_forever()
-            except OSError:
-                wait = 3
-                log.info('Port {} not available, waiting {}s and retrying...'.format(PORT,wait))
-                time.sleep(wait)
+        asyncio.run(serve(margs.setup, genconf, log))
     except KeyboardInterrupt:
         log.info('User exit')
-
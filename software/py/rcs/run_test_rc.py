@@ -78,7 +78,7 @@ if __name__ == "__main__":
     logging.getLogger().addHandler(sh)
 
     # run procedure
-    for cmd in ['SETUP_NEW_RUN', 'PREPARE_FOR_TRIGGERS', 'START_RUN', 'TEAR_DOWN', 'STOP_READOUT', 'STOP', 'MOVE_DATA']:
+    for cmd in ['SETUP_NEW_RUN', 'PREPARE_FOR_TRIGGERS', 'START_RUN', 'TEAR_DOWN', 'STOP_READOUT', 'STOP', 'MOVE_DATA', 'WAIT_JOBS']:
         snd_rcv(cmd)
         
     logging.info('Finished')
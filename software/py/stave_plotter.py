@@ -13,8 +13,10 @@ import numpy as np
 from scipy import stats
 
 import argparse
+import functools
 import gzip
 import os
+from multiprocessing import Pool
 import re
 import sys
 import yaml
@@ -49,6 +51,9 @@ CUT_HIT_PIXELS_PER_DCOL = 50
 NOISE_CUT = 1e-6
 N_EVENTS_FHR = 3360000 # TODO: replace this by a parameter. 300s data taking for FHR at 11.2kHz
 
+HITMAP_SHAPE = (ALPIDE_ROWS*MAX_LANES, ALPIDE_COLS*CHIP_PER_LANE)
+HITMAP_CHUNK_ROWS = ALPIDE_ROWS # one lane at a time
+
 # careful: this is the module index, not the ID: moduleID := moduleIndex + 1
 link2module_lut = {6:0,  7:0, 20:0, 21:0,
                    5:1,  8:1, 19:1, 22:1,
@@ -67,6 +72,72 @@ link2master_chip_id_lut = {6:24,   7:16,  20:152, 21:144,
                            1:104, 12:96,  15:232, 26:224,
                            0:120, 13:112, 14:248, 27:240}
 
+def hitmap_chunks(filename, chunk_rows=HITMAP_CHUNK_ROWS):
+    """Yields (first row, int32 block) of a hitmap file without loading it in memory.
+    Uncompressed files are memory mapped, gzipped files are decompressed chunk by chunk."""
+    if filename.endswith('.gz'):
+        row_bytes = HITMAP_SHAPE[1]*np.dtype(np.int32).itemsize
+        row = 0
+        with gzip.open(filename, 'rb') as f:
+            while True:
+                buf = f.read(row_bytes*chunk_rows)
+                if not buf:
+                    break
+                assert len(buf)%row_bytes == 0, f"{filename}: truncated hitmap"
+                block = np.frombuffer(buf, dtype=np.int32).reshape((-1, HITMAP_SHAPE[1]))
+                yield row, block
+                row += block.shape[0]
+        assert row == HITMAP_SHAPE[0], f"{filename}: {row} rows instead of {HITMAP_SHAPE[0]}"
+    else:
+        data = np.memmap(filename, dtype=np.int32, mode='r', shape=HITMAP_SHAPE)
+        for row in range(0, HITMAP_SHAPE[0], chunk_rows):
+            yield row, data[row:row+chunk_rows]
+
+
+def _accumulate_hitmaps(filename_list, file_stats=False):
+    """Sums the files into one int32 total, returns it with the per file [filename, hits, hit pixels]"""
+    total = np.zeros(HITMAP_SHAPE, dtype=np.int32)
+    stats = []
+    for filename in filename_list:
+        hits = 0
+        hit_pixels = 0
+        for row, block in hitmap_chunks(filename):
+            view = total[row:row+block.shape[0]]
+            np.add(view, block, out=view)
+            if file_stats:
+                hits += int(np.sum(block, dtype=np.int64))
+                hit_pixels += int(np.count_nonzero(block))
+        stats.append([filename, hits, hit_pixels])
+    return total, stats
+
+
+def accumulate_hitmaps(filename_list, processes=1, file_stats=False):
+    """Sums the hitmap files (one per FEEID/run) into a single int32 array.
+
+    Only one chunk per file is resident at a time. With processes > 1 the files are split
+    among worker processes, each one summing into its own partial total, so the memory
+    needed scales with the number of processes and not with the number of files.
+
+    Returns the total and a list of [filename, hits, hit pixels] per file
+    (hits and hit pixels are only computed if file_stats is set).
+    """
+    filename_list = [os.path.realpath(filename) for filename in filename_list]
+    for filename in filename_list:
+        assert os.path.isfile(filename), f"{filename} not existing"
+    processes = max(1, min(processes, len(filename_list)))
+    if processes == 1:
+        return _accumulate_hitmaps(filename_list, file_stats)
+
+    total = np.zeros(HITMAP_SHAPE, dtype=np.int32)
+    stats = []
+    with Pool(processes) as pool:
+        groups = [filename_list[i::processes] for i in range(processes)]
+        for partial_total, partial_stats in pool.imap(functools.partial(_accumulate_hitmaps, file_stats=file_stats), groups):
+            np.add(total, partial_total, out=total)
+            stats += partial_stats
+    return total, stats
+
+
 class StavePlotter:
     """Class used for plotting the output of decoder.c (by @mmager)"""
     def __init__(self,
@@ -74,7 +145,9 @@ class StavePlotter:
                  filename2,
                  middle_layer,
                  plot_extension,
-                 stave_name):
+                 stave_name,
+                 processes=1,
+                 file_stats=False):
         if middle_layer:
             self.modules = ML_MODULES
             self.lane_list = (3,4,5,6,7,8,9,10,17,18,19,20,21,22,23,24)
@@ -91,9 +164,8 @@ class StavePlotter:
         self.hit_counts = []
 
         self.is_fhrate = False
-        self.get_data(filename=filename, append=False)
-        if filename2 != "":
-            self.get_data(filename=filename2, append=True)
+        filename_list = [filename] if filename2 == "" else [filename, filename2]
+        self.get_data(filename=filename_list, append=False, processes=processes, file_stats=file_stats)
         assert np.count_nonzero(self.data<0) == 0
 
         print(f"Entries below 0: {np.count_nonzero(self.data<0)}")
@@ -102,12 +174,12 @@ class StavePlotter:
         print(f"Minimum: {np.min(self.data)}")
         print(f"Sum: {np.sum(self.data)}")
 
-    def get_data(self, filename, append=False):
-        """Parses the file and retrieves the data"""
-        filename = os.path.realpath(filename)
-        print(filename)
-        assert os.path.isfile(filename), f"{filename} not existing"
-        self.filename = filename
+    def get_data(self, filename, append=False, processes=1, file_stats=False):
+        """Parses the file(s) and retrieves the data.
+        filename can be a single file or a list of files, which are summed up."""
+        filename_list = [filename] if isinstance(filename, str) else list(filename)
+        self.filename = os.path.realpath(filename_list[-1])
+        print(self.filename)
         match = re.match( r'hitmap(\d*).*', os.path.split(self.filename)[1])
         if match:
             feeid = match.group(1)
@@ -115,23 +187,16 @@ class StavePlotter:
         else:
             self.feeid = ""
 
-        if self.filename.endswith('.gz'):
-            d=np.fromstring(gzip.open(self.filename,'r').read(),dtype=np.int32).reshape((ALPIDE_ROWS*MAX_LANES/2,ALPIDE_COLS*CHIP_PER_LANE))
-        else:
-            d=np.fromfile(self.filename,dtype=np.int32).reshape((ALPIDE_ROWS*MAX_LANES,ALPIDE_COLS*CHIP_PER_LANE))
-
+        d, stats = accumulate_hitmaps(filename_list, processes=processes, file_stats=file_stats)
+        for f, hits, hit_pixels in stats:
+            if file_stats:
+                print(f"{f}: hit pixels {hit_pixels}, hits {hits}")
+            self.hit_counts.append(hits)
 
-        print(f"Hit Pixels input file: {np.count_nonzero(d)}")
-        print(f"Hits input file: {np.sum(d)}")# / {self.hit_counts[-1]}")
-
-        if self.data is not None or append:
-            self.data = np.add(self.data, d)
+        if self.data is not None and append:
+            np.add(self.data, d, out=self.data)
         else:
             self.data = d
-        self.hit_counts.append(np.sum(d))
-        print(f"Total hits: {np.sum(self.data)}")
-        print(f"Total hit pixels: {np.count_nonzero(self.data)}")
-        print(f"Hits between 0 and 1: {np.count_nonzero(self.data<1)-np.count_nonzero(self.data==0)}")
         # data is an array with each element representing a pixel.
         # Array is arranged such that each master and 6 slaves are stacked on top of one another.
 
@@ -379,12 +444,14 @@ class THTuneStavePlotter(StavePlotter):
 class FHRateStavePlotter(StavePlotter):
     """Class used for plotting the output of decoder.c (by @mmager)"""
 
-    def __init__(self, filename, filename2, middle_layer, plot_extension, plot_name, yaml_filename, rewrite_masks):
+    def __init__(self, filename, filename2, middle_layer, plot_extension, plot_name, yaml_filename, rewrite_masks, processes=1, file_stats=False):
         super(FHRateStavePlotter, self).__init__(filename=filename,
                                                  filename2=filename2,
                                                  middle_layer=middle_layer,
                                                  plot_extension=plot_extension,
-                                                 stave_name=yaml_filename)
+                                                 stave_name=yaml_filename,
+                                                 processes=processes,
+                                                 file_stats=file_stats)
         self.basename = plot_name
         self.is_fhrate = True
         self.n_events= N_EVENTS_FHR
@@ -455,70 +522,121 @@ class FHRateStavePlotter(StavePlotter):
         print(f"Image stored in {filename}")
         plt.savefig(filename, bbox_inches='tight', dpi=1200)
 
+    def compute_hit_statistics(self):
+        """Vectorised analysis core: finds the fired pixels of all the lanes at once
+        and derives the per chip and per double column statistics from them.
+
+        Returns a dictionary of arrays:
+        - lane, chip, row, col: position of every fired pixel (sorted by lane, chip, row, col)
+        - rate:                 hits / event of every fired pixel (capped at 1)
+        - noisy:                mask of the fired pixels above the noise threshold
+        - hits:                 (MAX_LANES, CHIP_PER_LANE) fake-hit rate / pixel / event
+        - dcol_hits:            (MAX_LANES*CHIP_PER_LANE, 512) hits / event / double column normalised to pixel
+        - dcol_hit_pixels:      (MAX_LANES*CHIP_PER_LANE, 512) fired pixels / double column
+        """
+        assert np.count_nonzero(self.data<0) == 0
+        dcols = ALPIDE_COLS//2
+        n_chips = MAX_LANES*CHIP_PER_LANE
+        # (lane, row, chip, col) -> (lane, chip, row, col), view only
+        chips = self.data.reshape(MAX_LANES, ALPIDE_ROWS, CHIP_PER_LANE, ALPIDE_COLS).transpose(0, 2, 1, 3)
+        lane, chip, row, col = np.nonzero(chips)
+        in_lanes = np.isin(lane, list(self.lane_list))
+        lane, chip, row, col = lane[in_lanes], chip[in_lanes], row[in_lanes], col[in_lanes]
+        counts = chips[lane, chip, row, col]
+        print(f"Pixels>1: {np.count_nonzero(counts>self.n_events)}")
+        rate = np.minimum(counts.astype(float) / self.n_events, 1.)
+
+        chip_index = lane*CHIP_PER_LANE + chip
+        dcol_index = chip_index*dcols + col//2
+        hits = np.bincount(chip_index, weights=rate, minlength=n_chips)
+        dcol_hits = np.bincount(dcol_index, weights=rate, minlength=n_chips*dcols)
+        dcol_hit_pixels = np.bincount(dcol_index, minlength=n_chips*dcols)
+        return {'lane': lane,
+                'chip': chip,
+                'row': row,
+                'col': col,
+                'rate': rate,
+                'noisy': rate>self.noise_threshold,
+                'hits': hits.reshape(MAX_LANES, CHIP_PER_LANE)/ALPIDE_COLS/ALPIDE_ROWS,
+                'dcol_hits': dcol_hits.reshape(n_chips, dcols)/ALPIDE_COLS,
+                'dcol_hit_pixels': dcol_hit_pixels.reshape(n_chips, dcols)}
+
+    @staticmethod
+    def _chipids(lane, chip):
+        """Converts (lane, chip position in lane) arrays into chipid array"""
+        master_chip_ids = np.array([link2master_chip_id_lut[link] for link in range(MAX_LANES)])
+        return master_chip_ids[lane] + chip
+
+    def get_bad_pixels(self, stats):
+        """Returns the noisy pixels as {chipid: [[column, row, rate], ...]}"""
+        noisy = stats['noisy']
+        chipids = self._chipids(stats['lane'][noisy], stats['chip'][noisy])
+        entries = zip(stats['col'][noisy].tolist(), stats['row'][noisy].tolist(), stats['rate'][noisy].tolist())
+        bad_pixels = {}
+        for chipid, (col, row, rate) in zip(chipids.tolist(), entries):
+            bad_pixels.setdefault(chipid, []).append([col, row, rate])
+        return bad_pixels
+
+    def get_bad_dcols(self, stats):
+        """Returns the double columns above cut as {chipid: [dcol, ...]}"""
+        chip_index, dcol = np.nonzero(stats['dcol_hit_pixels'] > CUT_HIT_PIXELS_PER_DCOL)
+        chipids = self._chipids(chip_index//CHIP_PER_LANE, chip_index%CHIP_PER_LANE)
+        bad_dcols = {}
+        for chipid, dc in zip(chipids.tolist(), dcol.tolist()):
+            bad_dcols.setdefault(chipid, []).append(dc)
+        return bad_dcols
+
+    def get_empty_chips(self, stats):
+        """Returns the chipids of the chips without hits"""
+        lane_list = np.array(list(self.lane_list))
+        empty = stats['hits'][lane_list] == 0
+        lane, chip = np.nonzero(empty)
+        return self._chipids(lane_list[lane], chip).tolist()
+
+    def get_noise_list(self, stats):
+        """Returns the fired pixels as [column, row, rate, fhr] sorted by decreasing rate,
+        where fhr is the residual fake-hit rate / pixel / event when masking all the pixels before it"""
+        order = np.argsort(-stats['rate'], kind='stable')
+        rate = stats['rate'][order]
+        fhr = np.cumsum(rate[::-1])[::-1]/ALPIDE_COLS/ALPIDE_ROWS/float(self.lanes)/CHIP_PER_LANE
+        return np.column_stack([stats['col'][order], stats['row'][order], rate, fhr])
+
     def analyse_hits(self, yaml_filename, debug=False):
         """Mask double columns with a high number of hits
         """
-        dcol_hits       = np.zeros(shape=(28*CHIP_PER_LANE,512))
-        dcol_hit_pixels = np.zeros(shape=(28*CHIP_PER_LANE,512))
-        hits            = np.zeros(shape=(28,CHIP_PER_LANE))
-        bad_dcols   = {}
-        bad_pixels  = {}
-        bad_dcol_cnt = 0
-        bad_pixel_cnt = 0
-        empty_chips = []
-        noise_list = np.array([[0,0,0,0]])
-
-        assert np.count_nonzero(self.data<0) == 0
-        data = self.data.astype(float) / self.n_events
-        print(f"Pixels>1: {np.count_nonzero(data>1)}")
-        data[data>1] = 1
-        #data[data==0] = np.nan
-        print(f"Entries below 0: {np.count_nonzero(data<0)}")
-        print(f"Non-zero entries 0: {np.count_nonzero(data)}")
-        print(f"Maximum: {np.max(data)}")
-        print(f"Minimum: {np.min(data)}")
-        print(f"Sum: {np.sum(data)}")
+        stats = self.compute_hit_statistics()
+        hits = stats['hits']
+        dcol_hits = stats['dcol_hits']
+        dcol_hit_pixels = stats['dcol_hit_pixels']
+        bad_pixels = self.get_bad_pixels(stats)
+        bad_dcols = self.get_bad_dcols(stats)
+        empty_chips = self.get_empty_chips(stats)
+        noise_list = self.get_noise_list(stats)
+        bad_pixel_cnt = int(np.count_nonzero(stats['noisy']))
+        bad_dcol_cnt = sum(len(dcols) for dcols in bad_dcols.values())
+
+        print(f"Non-zero entries 0: {len(stats['rate'])}")
+        print(f"Maximum: {np.max(stats['rate'], initial=0)}")
+        print(f"Sum: {np.sum(stats['rate'])}")
 
         for link in self.lane_list:
-            print(f"#### Link : {link} ####")
             chipids = [i for i in range(link2master_chip_id_lut[link], link2master_chip_id_lut[link]+7)]
             for chipid in range(CHIP_PER_LANE):
-                print(f"### ChipID: {chipids[chipid]}")
-                chip_bad_dcols = []
-                chip_bad_pixels = []
-                chip=data[link*ALPIDE_ROWS:(link+1)*ALPIDE_ROWS,chipid*ALPIDE_COLS:(chipid+1)*ALPIDE_COLS]
-
-                # noisy pixels
-                x, y = np.where(chip>self.noise_threshold)
-                for i in range(len(y)):
-                    chip_bad_pixels.append([int(y[i]), int(x[i]), float(chip[x[i], y[i]])])
-                    bad_pixel_cnt += 1
-                    if debug:
-                        print(f"BAD PIXEL: chipid {chipids[chipid]}, row {y[i]}, column {x[i]}, hits {chip[x[i],y[i]]}")
-
-                x, y = np.where(chip>0)
-                for i in range(len(y)):
-                    noise_list=np.vstack([noise_list, [int(y[i]), int(x[i]), float(chip[x[i], y[i]]), 0.]])
-
-
+                chip_bad_pixels = bad_pixels.get(chipids[chipid], [])
+                chip_bad_dcols = bad_dcols.get(chipids[chipid], [])
                 if len(chip_bad_pixels) > 0:
-                    bad_pixels.update({chipids[chipid]:chip_bad_pixels})
-                    #print(f"BAD PIXELS: {chip_bad_pixels}")
-                    print(f"BAD PIXEL COUNT: {len(chip_bad_pixels)}")
-
-                hits[link,chipid]=np.sum(chip)/1024./512.
+                    print(f"ChipID {chipids[chipid]} (link {link}): BAD PIXEL COUNT: {len(chip_bad_pixels)}")
+                    if debug:
+                        for col, row, rate in chip_bad_pixels:
+                            print(f"BAD PIXEL: chipid {chipids[chipid]}, row {row}, column {col}, hits {rate}")
+                for dcol in chip_bad_dcols:
+                    print(f"BAD DCOL: chipid {chipids[chipid]}, double column {dcol}, hit pixels {dcol_hit_pixels[link*CHIP_PER_LANE+chipid,dcol]}")
+                if len(chip_bad_dcols) > 0:
+                    print(f"ChipID {chipids[chipid]} (link {link}): BAD DCOLS COUNT: {len(chip_bad_dcols)}")
 
                 if debug or hits[link,chipid]>1e-7:
-                    chip_map=self.interpolate(chip, scale=5)
-                    #plt.figure()
-                    #plt.imshow(chip_map)
-                    #plt.xlabel("Columns")
-                    #plt.ylabel("Rows")
-                    #plt.colorbar()
-                    #filename = f"{self.basename}_MAP_{self.feeid}_link{link}_chip{chipid}_chipId{chipids[chipid]}.{self._plot_extension}"
-                    #plt.savefig(filename, bbox_inches='tight', dpi=600)
-                    #plt.close()
-
+                    chip=self.data[link*ALPIDE_ROWS:(link+1)*ALPIDE_ROWS,chipid*ALPIDE_COLS:(chipid+1)*ALPIDE_COLS]
+                    chip_map=self.interpolate(np.minimum(chip.astype(float)/self.n_events, 1.), scale=5)
                     plt.figure()
                     plt.imshow(chip_map,cmap="tab20c",norm=mpl.colors.LogNorm(vmin=1./float(self.n_events), vmax=1.))
                     plt.xlabel("Columns")
@@ -529,26 +647,10 @@ class FHRateStavePlotter(StavePlotter):
                     plt.savefig(filename, bbox_inches='tight', dpi=300)
                     plt.close()
 
-                ## Bad double columns
-                for dcol in range(512):
-                    dcol_hit_pixels[link*CHIP_PER_LANE+chipid,dcol]=np.count_nonzero(chip[:,2*dcol:2*(dcol+1)]>0)
-                    dcol_hits[link*CHIP_PER_LANE+chipid,dcol]=np.sum(chip[:,2*dcol:2*(dcol+1)]) / 1024. # normalise to pixel/hit/event
-                    dcol_hit_pixels[link*CHIP_PER_LANE+chipid,dcol]=np.count_nonzero(chip[:,2*dcol:2*(dcol+1)])
-                    if dcol_hit_pixels[link*CHIP_PER_LANE+chipid,dcol] > CUT_HIT_PIXELS_PER_DCOL:
-                        chip_bad_dcols.append(dcol)
-                        bad_dcol_cnt +=1
-                        print(f"BAD DCOL: chipid {chipids[chipid]}, double column {dcol}, hit pixels {dcol_hit_pixels[link*CHIP_PER_LANE+chipid,dcol]}")
-
-                if len(chip_bad_dcols) > 0:
-                    bad_dcols.update({chipids[chipid]:chip_bad_dcols})
-                    #print(f"BAD DCOLS: {chip_bad_dcols}")
-                    print(f"BAD DCOLS COUNT: {len(chip_bad_dcols)}")
-
-
                 x=[i for i in range(512)]
                 if debug or len(chip_bad_dcols):
                     plt.figure()
-                    y=(dcol_hit_pixels[link*CHIP_PER_LANE+chipid:link*CHIP_PER_LANE+chipid+1,:])[0]
+                    y=dcol_hit_pixels[link*CHIP_PER_LANE+chipid,:]
                     plt.plot(x, y )
                     plt.xlabel("Double Column")
                     plt.ylabel("Hit Pixels")
@@ -561,7 +663,7 @@ class FHRateStavePlotter(StavePlotter):
 
                 if debug or hits[link,chipid]>1e-7:
                     plt.figure()
-                    y=(dcol_hits[link*CHIP_PER_LANE+chipid:link*CHIP_PER_LANE+chipid+1,:])[0]
+                    y=dcol_hits[link*CHIP_PER_LANE+chipid,:]
                     plt.plot(x, y)
                     plt.xlabel("Double Column")
                     plt.ylabel("Hits")
@@ -572,14 +674,7 @@ class FHRateStavePlotter(StavePlotter):
                     plt.savefig(filename, bbox_inches='tight', dpi=300)
                     plt.close()
 
-        ## Detect empty chips
-        for link in self.lane_list:
-            chipids = [i for i in range(link2master_chip_id_lut[link], link2master_chip_id_lut[link]+7)]
-            for chipid in range(CHIP_PER_LANE):
-                if hits[link,chipid]==0:
-                    empty_chips.append(chipids[chipid])
-                    if debug:
-                        print(f"chipid {chipids[chipid]} (lane {link}, chipid {chipid}) found empty")
+        print(f"Bad double columns: {bad_dcol_cnt}")
         print(f"Empty chips: {empty_chips}")
 
         ## Hits chip by chip
@@ -627,16 +722,11 @@ class FHRateStavePlotter(StavePlotter):
         print(f"Masking fraction of {float(bad_pixel_cnt)/self.lanes/7./1024./512.} pixels with a firing frequency larger than 1e-6/event")
 
 
-        noise_list = np.delete(noise_list, (0), axis=0)
-        noise_list = noise_list[(-noise_list[:,2]).argsort()] # sort in decending order
-        noise_list[-1][3] = noise_list[-1][2]/1024./512./float(self.lanes)/7.
-        for i in range(len(noise_list)-2, -1, -1):
-            noise_list[i][3] = noise_list[i+1][3]+noise_list[i][2]/1024./512./float(self.lanes)/7.
-
-        print(f"Resulting FHR of {noise_list[bad_pixel_cnt][3]}")
+        residual_fhr = noise_list[bad_pixel_cnt][3] if bad_pixel_cnt < len(noise_list) else 0.
+        print(f"Resulting FHR of {residual_fhr}")
         print("")
         with open(f"{self.basename}_working_point.txt", 'w') as f:
-            f.write(f"{self.calculate_fhr()}\t{bad_pixel_cnt}\t{float(bad_pixel_cnt)/self.lanes/7./1024./512.}\t{noise_list[bad_pixel_cnt][3]}\t{self.yaml_filename}\n")
+            f.write(f"{self.calculate_fhr()}\t{bad_pixel_cnt}\t{float(bad_pixel_cnt)/self.lanes/7./1024./512.}\t{residual_fhr}\t{self.yaml_filename}\n")
 
         np.savetxt(f"{self.basename}_noisehits.txt", noise_list, delimiter=',')
 
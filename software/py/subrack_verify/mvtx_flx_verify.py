@@ -20,6 +20,7 @@ sys.path.append(os.path.join(
     script_path, '../.'))
 import testbench
 import crate_mapping
+import verify_runner
 from pALPIDE import ModeControlIbSerialLinkSpeed
 
 
@@ -38,6 +39,9 @@ class TestcaseBase(unittest.TestCase):
     gbt_channel = None
     rdo_githash = None
     pa3_githash = None
+    # True when the RUs are verified concurrently (see run_parallel):
+    # the card is initialized and the EOT sent once instead of around each test
+    share_card = False
 
     def setUp(self, ctrl=True):
         self.tb = tb_global
@@ -81,12 +85,14 @@ class RdoBaseTest:
         def setUp(self):
             super().setUp()
             assert self.gbt_channel is not None
-            self.cru.initialize()
+            if not self.share_card:
+                self.cru.initialize()
 
         def tearDown(self):
             super().tearDown()
             self.rdo.trigger_handler.set_opcode_gating(0)
-            self.cru.send_eot()
+            if not self.share_card:
+                self.cru.send_eot()
 
         def set_parameters(self):
             self.layer, self.ru_sn, self.stave, self.rdo_githash, self.pa3_githash= ru_parameter_dict_global[self.gbt_channel]
@@ -109,6 +115,7 @@ class RdoBaseTest:
             self.ib_broken_chips = {}
             self.dctrl_tests_ib = 1000
 
+        @verify_runner.uses_card
         def test_AA_initialize_rdo(self):
             """Initialises the RDO"""
             cp_set = self.rdo.GBTx0_CHARGEPUMP_DEFAULT
@@ -307,6 +314,7 @@ class RdoBaseTest:
             errors_dict, _ = tb_global.test_chips(nrtests=nrtests, is_on_ob=False, rdo=self.rdo)
             self._assert_equal_dict_excluded_keys(expected, errors_dict, self.ib_broken_chips)
 
+        @verify_runner.uses_card
         def test_zz0_poweron_stave(self):
             """Power On stave"""
             if not self.test_stv or not self.test_pu1:
@@ -317,16 +325,21 @@ class RdoBaseTest:
                                         rdo=self.rdo)
             tb_global.log_values_ib_stave(rdo=self.rdo)
 
+        @verify_runner.uses_card
+        @verify_runner.requires('test_zz0_poweron_stave')
         def test_zz1_chips_no_manchester(self):
             if not self.test_stv or not self.test_pu1:
                 self.skipTest('Skipping Stave tests')
             self._test_chips_ib(disable_manchester=True, nrtests=self.dctrl_tests_ib)
 
+        @verify_runner.uses_card
+        @verify_runner.requires('test_zz0_poweron_stave')
         def test_zz2_chips_manchester(self):
             if not self.test_stv or not self.test_pu1:
                 self.skipTest('Skipping Stave tests')
             self._test_chips_ib(disable_manchester=False, nrtests=self.dctrl_tests_ib)
 
+        @verify_runner.uses_card
         def test_zz9_poweroff_stave(self):
             if not self.test_stv or not self.test_pu1:
                 self.skipTest('Skipping Stave tests')
@@ -553,8 +566,43 @@ def check_subrack(parameter_list):
     return {gbt_ch: (layer, ru_sn, stave, rdo_githash, pa3_githash) for _,_,layer,gbt_ch,ru_sn,stave,rdo_githash, pa3_githash in parameter_list}
 
 
+def get_test_case_classes():
+    """Returns the test case classes of the RUs and of the GBT uplinks, in the order they are defined"""
+    return [test_case_class for test_case_class in globals().values()
+            if isinstance(test_case_class, type) and
+            test_case_class not in (RdoBaseTest.TestRuOnChannel, GbtChannelBaseTest.TestGbtOnChannel) and
+            issubclass(test_case_class, (RdoBaseTest.TestRuOnChannel, GbtChannelBaseTest.TestGbtOnChannel))]
+
+
+def run_parallel(report_file=None, max_workers=None):
+    """Runs the tests of the RUs and of the GBT uplinks concurrently (see verify_runner),
+    writes the report as json to report_file and returns it"""
+    runner = verify_runner.VerificationRunner(card=tb_global.cru, max_workers=max_workers)
+    for test_case_class in get_test_case_classes():
+        if issubclass(test_case_class, RdoBaseTest.TestRuOnChannel):
+            runner.add_test_case(test_case_class, setup_check='test_AA_initialize_rdo')
+        else:
+            runner.add_test_case(test_case_class)
+    TestcaseBase.share_card = True
+    try:
+        report = runner.run()
+    finally:
+        TestcaseBase.share_card = False
+    tb_global.cru.send_eot()
+    if report_file is not None:
+        runner.write_report(report_file)
+    for check in report['checks']:
+        print(f"{check['target']} {check['name']} ... {check['status']} ({check['duration'] or 0:.2f} s)")
+    summary = ', '.join(f"{count} {status}" for status, count in report['summary'].items())
+    print(f"Ran {len(report['checks'])} checks in {report['duration']:.1f} s: {summary}")
+    return report
+
+
 def main(config_file,
-         unit_argv):
+         unit_argv,
+         parallel=False,
+         report_file=None,
+         max_workers=None):
     """Main method parsing the input parameters"""
     global tb_global
     tb_global = testbench.configure_testbench(config_file_path=config_file,
@@ -580,9 +628,15 @@ def main(config_file,
         sys.stdout.flush()
         os._exit(1)
 
+    passed = True
     try:
         logger.info("Start Test")
-        unittest.main(verbosity=2, exit=True, argv=unit_argv)
+        if parallel:
+            if report_file is None:
+                report_file = f"logs/subrack_verify_{subrack.replace('/','-')}.json"
+            passed = run_parallel(report_file=report_file, max_workers=max_workers)['passed']
+        else:
+            unittest.main(verbosity=2, exit=True, argv=unit_argv)
     except KeyboardInterrupt as ki:
         logger.error("Test interrupted with KeyboardInterrupt")
         logger.info(ki, exc_info=True)
@@ -600,6 +654,8 @@ def main(config_file,
         os._exit(1)
 
     logger.info(f"Done testing on {subrack}")
+    if not passed:
+        sys.exit(1)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -608,6 +664,9 @@ if __name__ == '__main__':
     parser.add_argument("-pu2", "--test_powerunit_2", required=False, help="Flag to enable the run with powerunit_2", action='store_true')
     parser.add_argument("-trg", "--test_trigger", required=False, help="Flag to mark if to run with trigger", action='store_true')
     parser.add_argument("-stv", "--test_stave", required=False, help="Flag to mark if to run with stave", action='store_true')
+    parser.add_argument("-p", "--parallel", required=False, help="Flag to verify the RUs concurrently", action='store_true')
+    parser.add_argument("-r", "--report_file", required=False, help="Json report of the parallel verification, default in logs", default=None)
+    parser.add_argument("-w", "--max_workers", required=False, help="Maximum number of RUs verified at the same time in parallel", type=int, default=None)
     options, unittest_args = parser.parse_known_args()
     unit_argv = [sys.argv[0]] + unittest_args;
 
@@ -618,4 +677,7 @@ if __name__ == '__main__':
     test_stv = options.test_stave
 
     main(config_file=config_file,
-         unit_argv=unit_argv)
+         unit_argv=unit_argv,
+         parallel=options.parallel,
+         report_file=options.report_file,
+         max_workers=options.max_workers)
@@ -0,0 +1,261 @@
+"""Parallel runner of the verification checks of the RUs of a subrack, with a machine readable report.
+
+The checks form a dependency graph:
+- the checks of a target (e.g. the tests of a RU) run one after the other, in the order they were added,
+- a check runs only after the checks it requires and is skipped if one of them did not pass,
+- the checks of different targets run concurrently in a pool of threads,
+- a check using the card (card initialization, triggers, I2C of the card, shared testbench state)
+  runs alone: it starts once the running checks are finished and no other check starts before it is done.
+  The checks using the card which are ready run before the others.
+
+The transactions of the RUs on the shared FELIX/CRU card are serialized by a CardLock.
+The SWT FIFOs being per link, a RU can flush its requests and read the results in separate transactions.
+
+A check is a function raising AssertionError when it fails and unittest.SkipTest when it does not apply.
+The test methods of unittest.TestCase classes are added with add_test_case, see the decorators uses_card and requires.
+
+usage:
+runner = VerificationRunner(card=tb.cru)
+runner.add_check('initialize', tb.cru.initialize, uses_card=True)
+runner.add_test_case(TestRuOnChannel0, setup_check='test_AA_initialize_rdo', requires=[(None, 'initialize')])
+report = runner.run()
+runner.write_report('report.json')
+"""
+
+import json
+import logging
+import time
+import unittest
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from card_lock import CardLock
+
+PASSED = 'passed'
+FAILED = 'failed'
+ERROR = 'error'
+SKIPPED = 'skipped'
+STATUSES = (PASSED, FAILED, ERROR, SKIPPED)
+
+
+class CheckError(Exception):
+    """Error (not a failure) of a test method run as a check"""
+    pass
+
+
+def uses_card(function):
+    """Decorator marking a test method which accesses the card beyond the SWTs of its RU: it runs alone"""
+    function.uses_card = True
+    return function
+
+
+def requires(*names):
+    """Decorator adding test methods of the same class which have to pass before a test method runs"""
+    def decorator(function):
+        function.requires = names
+        return function
+    return decorator
+
+
+def run_test_method(test_case_class, name):
+    """Returns a check function running a test method of a unittest.TestCase class, with its setUp and tearDown"""
+    def check():
+        result = unittest.TestResult()
+        test_case_class(name).run(result)
+        if result.errors:
+            raise CheckError(result.errors[0][1])
+        if result.failures:
+            raise AssertionError(result.failures[0][1])
+        if result.skipped:
+            raise unittest.SkipTest(result.skipped[0][1])
+    return check
+
+
+class Check(object):
+    """A check of a target, see module docstring"""
+
+    def __init__(self, target, name, function, requires=(), uses_card=False):
+        self.target = target
+        self.name = name
+        self.function = function
+        self.requires = list(requires)
+        self.uses_card = uses_card
+        self.reset()
+
+    def reset(self):
+        self.status = None
+        self.message = ""
+        self.start = None
+        self.duration = None
+
+    @property
+    def key(self):
+        return (self.target, self.name)
+
+    def to_dict(self):
+        return OrderedDict([('target', self.target),
+                            ('name', self.name),
+                            ('status', self.status),
+                            ('start', self.start),
+                            ('duration', self.duration),
+                            ('requires', [list(key) for key in self.requires]),
+                            ('uses_card', self.uses_card),
+                            ('message', self.message)])
+
+
+class VerificationRunner(object):
+    """Runs the checks of several targets concurrently, see module docstring.
+
+    card: FELIX/CRU card shared by the RUs, its transactions are serialized while running (see CardLock)
+    max_workers: maximum number of checks running at the same time, by default one per target
+    """
+
+    def __init__(self, card=None, max_workers=None):
+        self.card_lock = CardLock(card) if card is not None else None
+        self.max_workers = max_workers
+        self.checks = OrderedDict()
+        self.start_time = None
+        self.duration = None
+        self.logger = logging.getLogger("VerificationRunner")
+
+    def add_check(self, name, function, target=None, requires=(), uses_card=False):
+        """Adds a check to a target (None for the card).
+        requires: names of checks of the same target or (target, name) of checks of any target"""
+        check = Check(target, name, function, uses_card=uses_card,
+                      requires=[key if isinstance(key, tuple) else (target, key) for key in requires])
+        assert check.key not in self.checks, f"Check {name} of {target} already added"
+        self.checks[check.key] = check
+        return check
+
+    def add_test_case(self, test_case_class, target=None, setup_check=None, requires=()):
+        """Adds the test methods of a unittest.TestCase class as checks of a target (by default the class name),
+        in the order unittest runs them.
+        All the checks require setup_check (a test method) and requires (see add_check)"""
+        if target is None:
+            target = test_case_class.__name__
+        names = unittest.TestLoader().getTestCaseNames(test_case_class)
+        assert setup_check is None or setup_check in names, f"{setup_check} not a test of {test_case_class.__name__}"
+        for name in names:
+            method = getattr(test_case_class, name)
+            required = list(requires) + list(getattr(method, 'requires', ()))
+            if setup_check is not None and name != setup_check:
+                required.append(setup_check)
+            self.add_check(name, run_test_method(test_case_class, name), target=target, requires=required,
+                           uses_card=getattr(method, 'uses_card', False))
+
+    def _get_graph(self):
+        """Returns {key: keys of the checks which have to be done before} after validating the graph"""
+        graph = OrderedDict()
+        last = {}
+        for key, check in self.checks.items():
+            for required in check.requires:
+                if required not in self.checks:
+                    raise ValueError(f"Check {check.name} of {check.target} requires unknown check {required}")
+            graph[key] = set(check.requires)
+            if check.target in last:
+                graph[key].add(last[check.target])
+            last[check.target] = key
+        # Kahn: all the checks have to be sorted
+        remaining = {key: set(before) for key, before in graph.items()}
+        done = set()
+        while remaining:
+            ready = [key for key, before in remaining.items() if before <= done]
+            if not ready:
+                raise ValueError(f"Dependency cycle between the checks {sorted(remaining, key=str)}")
+            for key in ready:
+                del remaining[key]
+                done.add(key)
+        return graph
+
+    def _run_check(self, check):
+        check.start = time.time() - self.start_time
+        start = time.perf_counter()
+        try:
+            check.function()
+            check.status = PASSED
+        except unittest.SkipTest as e:
+            check.status = SKIPPED
+            check.message = str(e)
+        except AssertionError as e:
+            check.status = FAILED
+            check.message = str(e)
+        except Exception as e:
+            check.status = ERROR
+            check.message = str(e) if isinstance(e, CheckError) else f"{type(e).__name__}: {e}"
+        check.duration = time.perf_counter() - start
+        if check.status in (FAILED, ERROR):
+            self.logger.error(f"{check.target} {check.name}: {check.status} in {check.duration:.2f} s\n{check.message}")
+        else:
+            self.logger.info(f"{check.target} {check.name}: {check.status} in {check.duration:.2f} s")
+        return check
+
+    def run(self):
+        """Runs all the checks and returns the report, see report"""
+        graph = self._get_graph()
+        for check in self.checks.values():
+            check.reset()
+        remaining = OrderedDict((key, set(before)) for key, before in graph.items())
+        done = set()
+        running = {}
+        max_workers = self.max_workers or max(1, len(set(check.target for check in self.checks.values())))
+        if self.card_lock is not None:
+            self.card_lock.install()
+        self.start_time = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="VerificationRunner") as executor:
+                while remaining or running:
+                    ready = []
+                    skipped = True
+                    while skipped:
+                        skipped = False
+                        for key in [key for key, before in remaining.items() if before <= done]:
+                            check = self.checks[key]
+                            del remaining[key]
+                            failed = [required for required in check.requires if self.checks[required].status != PASSED]
+                            if failed:
+                                check.status = SKIPPED
+                                check.message = f"Required check(s) did not pass: {failed}"
+                                done.add(key)
+                                skipped = True
+                            else:
+                                ready.append(check)
+                    # the checks using the card first, alone: nothing else starts while one is waiting
+                    ready.sort(key=lambda check: not check.uses_card)
+                    blocked = any(check.uses_card for check in running.values())
+                    for check in ready:
+                        if not blocked and len(running) < max_workers and not (check.uses_card and running):
+                            running[executor.submit(self._run_check, check)] = check
+                            blocked = check.uses_card
+                        else:
+                            remaining[check.key] = set()
+                            blocked = blocked or check.uses_card
+                    if not running:
+                        continue
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        future.result()
+                        done.add(running.pop(future).key)
+        finally:
+            self.duration = time.time() - self.start_time
+            if self.card_lock is not None:
+                self.card_lock.uninstall()
+        return self.report()
+
+    def report(self):
+        """Returns the report as a dictionary: start time, duration [s], passed (no check failed or had an error),
+        number of checks per status and the checks (target, name, status, start [s from the start of the run],
+        duration [s], required checks, use of the card, message)"""
+        summary = OrderedDict((status, 0) for status in STATUSES)
+        for check in self.checks.values():
+            if check.status is not None:
+                summary[check.status] += 1
+        return OrderedDict([('start_time', self.start_time),
+                            ('duration', self.duration),
+                            ('passed', summary[FAILED] == 0 and summary[ERROR] == 0),
+                            ('summary', summary),
+                            ('checks', [check.to_dict() for check in self.checks.values()])])
+
+    def write_report(self, filename):
+        """Writes the report as json"""
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=4)
@@ -18,6 +18,7 @@ import os
 import pprint
 import random
 import select
+import sqlite3
 import sys
 import time
 import traceback
@@ -72,6 +73,9 @@ from proasic3 import Pa3Register
 from proasic3_enums import CcCmdOpcode, FlashSelectICOpcode
 from ws_gbt_prbs_chk import PrbsMode
 from proasic3_convenience import ScrubbingStuckOn, DoubleBitError
+from bad_blocks_store import BadBlockStore, scan_bad_blocks
+from ru_scrub_scheduler import CrateScrubScheduler
+from prbs_scan import PrbsBerScan
 
 import communication
 import cru_board
@@ -443,6 +447,8 @@ class Testbench(object):
         self.powerunit_resistance_offset_pt100 = powerunit_resistance_offset_pt100
         self._pu_calibration_fpath = os.path.join(script_path, "../config/pu_calibration.json")
         self._pu_calibration = None
+        self._bad_block_store_fpath = os.path.join(script_path, "../config/bad_blocks.db")
+        self._bad_block_store = None
 
         self.layer = layer
 
@@ -972,7 +978,8 @@ class Testbench(object):
                                  powerunit_1_offset_dvdd=None,
                                  powerunit_2_offset_avdd=None,
                                  powerunit_2_offset_dvdd=None,
-                                 layer=self.layer)
+                                 layer=self.layer,
+                                 bad_block_store=self.get_bad_block_store())
         self.set_dctrl_connectors(connector_nr, rdo=self.rdo)
         self.chips = [Alpide(self.rdo, chipid=i) for i in self._chipids_ib]
         return self
@@ -1071,7 +1078,8 @@ class Testbench(object):
                                 powerunit_1_offset_dvdd=offsets[1]['dvdd'],
                                 powerunit_2_offset_avdd=offsets[2]['avdd'],
                                 powerunit_2_offset_dvdd=offsets[2]['dvdd'],
-                                layer=self.layer)
+                                layer=self.layer,
+                                bad_block_store=self.get_bad_block_store())
             self.setup_stave(rdo=rdo)
             self.set_dctrl_connectors(connector_nr, rdo=rdo)
             self.stave_list.append([Alpide(rdo, chipid=chipid) for chipid in self._chipids_ib])
@@ -1437,6 +1445,18 @@ class Testbench(object):
                     self.logger.error(f"RDO {rdo.get_gbt_channel()}\tCould not program XCKU")
         self.initialize_boards()
 
+    def run_scrub_loop_all(self, with_test=True, sleep_sec=10, max_active=None):
+        """Runs the scrub loop of all RUs from a single scheduler, interleaving their scrub cycles.
+        End gracefully with Ctrl-C"""
+        scheduler = CrateScrubScheduler(self.rdo_list, with_test=with_test, sleep_sec=sleep_sec,
+                                        max_active=max_active, logger=self.logger)
+        scheduler.run()
+        stats = scheduler.get_stats()
+        for gbt_channel, ru_stats in stats['rus'].items():
+            self.logger.info(f"RU {gbt_channel}: {ru_stats['cycles']} scrub cycles, mean latency {ru_stats['mean_latency']} s, "
+                             f"SB/DB/CRC errors {ru_stats['sb_errors']}/{ru_stats['db_errors']}/{ru_stats['crc_errors']}")
+        return stats
+
     def enable_all_scrubbing(self):
         """Starts scrubbing for all XCKU"""
         for rdo in self.rdo_list:
@@ -1539,6 +1559,34 @@ class Testbench(object):
             value = (value,)
         return tuple(value)
 
+    def get_bad_block_store(self):
+        """Returns the BadBlockStore of the flash bad block scans (config/bad_blocks.db), opened on first use.
+        It is given to the RUs, which use it with the bad block LUTs when flashing and scrubbing"""
+        if self._bad_block_store is None:
+            self._bad_block_store = BadBlockStore(self._bad_block_store_fpath)
+        return self._bad_block_store
+
+    def import_legacy_bad_blocks(self, legacy_db_file):
+        """Imports the bad blocks of a legacy bad_blocks_io database (e.g. the ITS_WP10_RU_board_badblocks.db
+        used by find_bad_blocks.py) into the bad block store"""
+        conn = sqlite3.connect(legacy_db_file)
+        try:
+            nr_boards = self.get_bad_block_store().import_legacy_db(conn)
+        finally:
+            conn.close()
+        self.logger.info(f"Imported the bad blocks of {nr_boards} boards from {legacy_db_file}")
+        return nr_boards
+
+    def scan_all_bad_blocks(self, rescan=False, max_workers=None):
+        """Scans the flash bad blocks of all RUs concurrently and stores them in the bad block store.
+        RUs already in the store are not rescanned unless rescan."""
+        bad_blocks = scan_bad_blocks(self.rdo_list, self.get_bad_block_store(), rescan=rescan, max_workers=max_workers,
+                                     logger=self.logger)
+        for gbt_channel, bad_blocks_d in bad_blocks.items():
+            for flash_device, blocks in bad_blocks_d.items():
+                self.logger.info(f"RU {gbt_channel} flash {flash_device}: bad blocks [{', '.join(hex(b) for b in blocks)}]")
+        return bad_blocks
+
     def flash_all_rdo_bitfiles(self,
                                filename,
                                bitfile_block=None,
@@ -2833,6 +2881,33 @@ class Testbench(object):
                     all_errors += cnt
         self.logger.info(f"{self.subrack}: Total PRBS errors observed so far: {all_errors}")
 
+    def scan_pll_dac_ber_gth(self, chips=None, pll_dacs=range(16), prbs_rate=600,
+                             target_ber=1e-12, confidence=0.95, dwell=1, max_time=None, filename=None):
+        """Scans the PLL DAC of the chips of all RU's, measuring the PRBS BER of all the lanes in parallel
+        (see prbs_scan.PrbsBerScan). Requires the PRBS test to be set up (setup_all_prbs_test_gth).
+        Returns the results table, optionally saved to filename (.npz)"""
+        assert prbs_rate in [600, 1200], "Link Speed for IB must be 600 or 1200"
+        if chips is None:
+            chips = self._chipids_ib
+
+        def set_pll_dac(pll_dac):
+            for rdo in self.rdo_list:
+                for chipid in chips:
+                    Alpide(rdo, chipid=chipid).setreg_dtu_dacs(PLLDAC=pll_dac)
+
+        scan = PrbsBerScan(self.rdo_list, line_rate=prbs_rate*1e6, target_ber=target_ber,
+                           confidence=confidence, dwell=dwell, max_time=max_time)
+        try:
+            results = scan.run(settings=list(pll_dacs), apply_setting=set_pll_dac)
+        finally:
+            set_pll_dac(0x8)
+        for row in results.rows(status='FAIL'):
+            self.logger.warning(f"{self.subrack} RDO {row['gbt_channel']} Link {row['lane']}: PLL DAC 0x{row['setting']:1X} "
+                                f"BER {row['ber']:.2e} ({row['errors']} errors)")
+        if filename is not None:
+            results.save(filename)
+        return results
+
     def setup_all_prbs_stress_test_gth(self, pll_dac=15, driver_dac=5, pre_dac=15,
                                        chips=None,
                                        prbs_rate=600,
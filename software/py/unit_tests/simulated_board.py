@@ -0,0 +1,402 @@
+"""Simulated RU for the unit tests.
+
+SimulatedCommunication executes the wishbone transactions of each flush on simulated wishbone slaves,
+so that the actual RU modules (Xcku built by make_ru) are tested without hardware.
+The transactions are executed in firmware time: a flush reaches the RU half a round trip latency after
+it is sent, the firmware waits (FW_WAIT module) advance the firmware time, and the results of a flush
+are available half a round trip latency after its last transaction.
+
+The timing of the tests is only printed when the environment variable UNIT_TEST_TIMING is set.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+script_path = os.path.dirname(os.path.realpath(__file__))
+modules_path = os.path.join(script_path, '../../../modules/board_support_software/software/py/')
+sys.path.append(modules_path)
+sys.path.append(os.path.join(script_path, '../'))
+from module_includes import *
+
+from alpide_control import WsAlpideControlAddress
+from communication import Communication
+from power_unit import PowerUnitVersion
+from ru_board import Xcku, XckuModuleid
+from ru_transition_board import TransitionBoardVersion
+from wishbone_wait import WsWishboneWaitAddress
+
+TIMING = bool(os.environ.get('UNIT_TEST_TIMING'))
+
+
+def report(message):
+    """Prints the timing message of a test if UNIT_TEST_TIMING is set"""
+    if TIMING:
+        print(message)
+
+
+def timed(f, *args, **kwargs):
+    """Returns the return value of f and its duration in s"""
+    start = time.perf_counter()
+    ret = f(*args, **kwargs)
+    return ret, time.perf_counter() - start
+
+
+class SimulatedModule(object):
+    """Wishbone slave storing the written values, a read returns the last value written.
+    now is the firmware time (perf_counter) of the transaction"""
+
+    def __init__(self, registers=None):
+        self.registers = dict(registers or {})
+
+    def write(self, address, data, now):
+        self.registers[address] = data
+
+    def read(self, address, now):
+        return self.registers.get(address, 0)
+
+
+class SimulatedChips(object):
+    """Registers of the chips connected to the ALPIDE control, chipid 0xF is the broadcast"""
+
+    def __init__(self, chipids):
+        self.registers = {chipid: {} for chipid in chipids}
+
+    def write(self, chipid, address, data, now):
+        for target in (list(self.registers) if chipid == 0xF else [chipid]):
+            if target in self.registers:
+                self.write_chip(target, address, data, now)
+
+    def write_chip(self, chipid, address, data, now):
+        self.registers[chipid][address] = data
+
+    def read(self, chipid, address, now):
+        """Returns the data of the register, None if the chip does not answer"""
+        if chipid not in self.registers:
+            return None
+        return self.registers[chipid].get(address, 0)
+
+
+class SimulatedAlpideControl(SimulatedModule):
+    """ALPIDE control slave executing the chip writes and reads of WRITE_CTRL on the chips"""
+
+    WRITE_OPCODE = 0x9C
+    READ_OPCODE = 0x4E
+
+    def __init__(self, chips):
+        super(SimulatedAlpideControl, self).__init__()
+        self.chips = chips
+        self.chip_writes = 0
+        self.chip_reads = 0
+        self._status = 0
+        self._data = 0
+
+    def write(self, address, data, now):
+        super(SimulatedAlpideControl, self).write(address, data, now)
+        if address != WsAlpideControlAddress.WRITE_CTRL:
+            return
+        chipid = data & 0x7F
+        chip_address = self.registers.get(WsAlpideControlAddress.WRITE_ADDRESS, 0)
+        if data >> 8 == self.WRITE_OPCODE:
+            self.chip_writes += 1
+            self.chips.write(chipid, chip_address, self.registers.get(WsAlpideControlAddress.WRITE_DATA, 0), now)
+        elif data >> 8 == self.READ_OPCODE:
+            self.chip_reads += 1
+            value = self.chips.read(chipid, chip_address, now)
+            if value is None:
+                self._status, self._data = 0x3F << 7 | 0x7F, 0xFFFF  # no answer: chipid mismatch
+            else:
+                self._status, self._data = 0x3F << 7 | chipid, value
+
+    def read(self, address, now):
+        if address == WsAlpideControlAddress.READ_STATUS:
+            return self._status
+        elif address == WsAlpideControlAddress.READ_DATA:
+            return self._data
+        return super(SimulatedAlpideControl, self).read(address, now)
+
+
+class SimulatedCounterMonitor(SimulatedModule):
+    """Counter monitor whose counters run at fixed rates (counts/s) from offsets and wrap around at modulo,
+    latched by a write to address 0 (LATCH_COUNTERS) together with its slaves.
+    rates, offsets and modulo are arrays of the same shape, decode(address, latched) returns the register value"""
+
+    def __init__(self, rates, offsets, modulo, decode, t0=None):
+        super(SimulatedCounterMonitor, self).__init__()
+        self.rates = np.asarray(rates, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.modulo = np.asarray(modulo, dtype=np.int64)
+        self.decode = decode
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.slaves = []
+        self.latches = []  # firmware time of the latches
+        self.latched = self.counters_at(self.t0)
+
+    def counters_at(self, t):
+        """Values of the counters at time t"""
+        return (self.offsets + np.floor(self.rates*(t - self.t0)).astype(np.int64)) % self.modulo
+
+    def latch(self, now):
+        self.latched = self.counters_at(now)
+        self.latches.append(now)
+
+    def write(self, address, data, now):
+        if address == 0:
+            for monitor in [self] + self.slaves:
+                monitor.latch(now)
+        else:
+            super(SimulatedCounterMonitor, self).write(address, data, now)
+
+    def read(self, address, now):
+        return self.decode(address, self.latched)
+
+
+def counter_decoder(monitor, names):
+    """Returns the decode function of a SimulatedCounterMonitor emulating the registers of the WsCounterMonitor
+    monitor, the latched values being the counters names"""
+    def decode(address, latched):
+        name = monitor.registers(address).name
+        value = 0
+        for counter, latched_value in zip(names, latched.tolist()):
+            if counter in monitor.counters_32b:
+                lsb, msb = monitor.counters_32b[counter]
+                if name == lsb:
+                    value |= latched_value & 0xFFFF
+                elif name == msb:
+                    value |= latched_value >> 16
+            elif monitor.counters_8b_low.get(counter) == name:
+                value |= latched_value & 0xFF
+            elif monitor.counters_8b_high.get(counter) == name:
+                value |= (latched_value & 0xFF) << 8
+            elif counter == name:
+                value |= latched_value & 0xFFFF
+        return value
+    return decode
+
+
+def simulate_counter_monitor(comm, monitor, rates, offsets=None, t0=None):
+    """Adds to comm a SimulatedCounterMonitor emulating the WsCounterMonitor monitor,
+    rates and offsets: {counter: counts/s} and {counter: value at t0}"""
+    names = list(rates)
+    modulo = [1 << monitor.get_counter_width(name) for name in names]
+    offsets = [(offsets or {}).get(name, 0) for name in names]
+    return comm.add_module(monitor.moduleid, SimulatedCounterMonitor([rates[name] for name in names], offsets, modulo,
+                                                                     counter_decoder(monitor, names), t0))
+
+
+class SimulatedCommunication(Communication):
+    """Communication executing the wishbone transactions on simulated slaves, see module docstring.
+
+    modules: {moduleid: SimulatedModule}, the reads of other modules return 0
+    latency: round trip latency in s
+    """
+
+    def __init__(self, modules=None, latency=0):
+        super(SimulatedCommunication, self).__init__()
+        self.modules = dict(modules or {})
+        self.latency = latency
+        self.flushes = 0       # flushes with transactions, i.e. round trips
+        self.result_reads = 0
+        self.transactions = 0
+        self.fail_reads = 0    # number of the next flushes with reads whose results are lost
+        self.fail_every = 0    # the results of every fail_every-th flush with reads are lost
+        self.read_flushes = 0
+        self.busy_until = 0.
+        self.ready_at = 0.
+        self._response = bytearray()
+
+    def add_module(self, moduleid, module):
+        self.modules[moduleid] = module
+        return module
+
+    def _do_write_dp0(self, data):
+        if not data:
+            return
+        self.flushes += 1
+        now = max(time.perf_counter() + self.latency/2, self.busy_until)  # firmware time
+        response = bytearray()
+        for i in range(0, len(data), 4):
+            data_low, data_high, address, module = data[i:i+4]
+            self.transactions += 1
+            is_write = module & 0x80
+            module &= 0x7F
+            value = data_high << 8 | data_low
+            if is_write:
+                if module == XckuModuleid.FW_WAIT and address == WsWishboneWaitAddress.WAIT_VALUE:
+                    now += value/160e6
+                elif module in self.modules:
+                    self.modules[module].write(address, value, now)
+            else:
+                value = self.modules[module].read(address, now) if module in self.modules else 0
+                response += bytearray([*(int(value) & 0xFFFF).to_bytes(2, 'little'), address, module])
+        if response:
+            self.read_flushes += 1
+            if self.fail_reads > 0 or (self.fail_every and self.read_flushes % self.fail_every == 0):
+                self.fail_reads = max(self.fail_reads - 1, 0)
+                response = bytearray()
+        self._response += response
+        self.busy_until = now
+        self.ready_at = now + self.latency/2
+
+    def _do_read_dp1(self, size):
+        self.result_reads += 1
+        delay = self.ready_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        ret = self._response[:size]
+        self._response = self._response[size:]
+        return ret
+
+
+class SimulatedCard(object):
+    """FELIX/CRU card with one SWT FIFO per link, a single selected GBT channel and a transaction counter as the
+    LLA lock. It records in violations the accesses breaking its rules: a transaction of a thread while another
+    thread is within a transaction, a card initialization while a RU has results to read, concurrent I2C accesses.
+    latency: round trip latency of a SWT in s"""
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.violations = []
+        self.initializations = 0
+        self.eots = 0
+        self.optical_power = {}  # uW per channel, 400 by default
+        self._lla_lock_count = 0
+        self._owner = None
+        self._selected_gbt_channel = None
+        self._fifos = {}  # gbt channel: deque of (ready time, response)
+        self._i2c_busy = False
+        self._state_lock = threading.Lock()
+
+    def _violation(self, message):
+        self.violations.append(message)
+
+    def _lock_comm(self):
+        with self._state_lock:
+            if self._lla_lock_count > 0 and self._owner is not threading.current_thread():
+                self._violation(f"{threading.current_thread().name} locked the card within a transaction of {self._owner.name}")
+            self._owner = threading.current_thread()
+            self._lla_lock_count += 1
+        return True
+
+    def _unlock_comm(self, force=False):
+        with self._state_lock:
+            self._lla_lock_count = 0 if force else max(0, self._lla_lock_count - 1)
+            if self._lla_lock_count == 0:
+                self._owner = None
+
+    def check_owner(self, action):
+        """Records a violation if the calling thread is not within a transaction"""
+        if self._owner is not threading.current_thread():
+            self._violation(f"{threading.current_thread().name} {action} outside of its transaction")
+
+    def set_gbt_channel(self, gbt_channel):
+        self.check_owner("selected a gbt channel")
+        self._selected_gbt_channel = gbt_channel
+
+    def write_swt(self, gbt_channel, responses):
+        self.check_owner("wrote SWTs")
+        assert self._selected_gbt_channel == gbt_channel
+        ready_at = time.perf_counter() + self.latency
+        self._fifos.setdefault(gbt_channel, deque()).extend((ready_at, response) for response in responses)
+
+    def read_swt(self, gbt_channel, nwords):
+        self.check_owner("read SWTs")
+        assert self._selected_gbt_channel == gbt_channel
+        fifo = self._fifos.get(gbt_channel, deque())
+        ret = bytearray()
+        for _ in range(min(nwords, len(fifo))):
+            ready_at, response = fifo.popleft()
+            delay = ready_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ret += response
+        return ret
+
+    def initialize(self):
+        self._lock_comm()
+        try:
+            pending = [gbt_channel for gbt_channel, fifo in self._fifos.items() if fifo]
+            if pending:
+                self._violation(f"Card initialized with results pending on {pending}")
+            self._fifos = {}
+            self.initializations += 1
+            time.sleep(0.005)
+        finally:
+            self._unlock_comm()
+
+    def send_eot(self):
+        self._lock_comm()
+        try:
+            self.eots += 1
+            time.sleep(0.001)
+        finally:
+            self._unlock_comm()
+
+    def get_optical_power(self):
+        if self._i2c_busy:
+            self._violation("Concurrent I2C accesses")
+        self._i2c_busy = True
+        time.sleep(0.005)
+        self._i2c_busy = False
+        return [self.optical_power.get(gbt_channel, 400.) for gbt_channel in range(24)]
+
+
+class SimulatedSwtCommunication(Communication):
+    """SWT communication of a RU through a SimulatedCard, the reads return their address"""
+
+    def __init__(self, card, gbt_channel):
+        super(SimulatedSwtCommunication, self).__init__()
+        self.card = card
+        self.gbt_channel = gbt_channel
+
+    def _lock_comm(self):
+        self.card._lock_comm()
+
+    def _unlock_comm(self):
+        self.card._unlock_comm()
+
+    def _do_write_dp0(self, data):
+        if not data:
+            return
+        self.card.set_gbt_channel(self.gbt_channel)
+        responses = []
+        for i in range(0, len(data), 4):
+            _, _, address, module = data[i:i+4]
+            if not module & 0x80:
+                responses.append(bytearray([address, 0, address, module]))
+        self.card.write_swt(self.gbt_channel, responses)
+
+    def _do_read_dp1(self, size):
+        self.card.set_gbt_channel(self.gbt_channel)
+        return self.card.read_swt(self.gbt_channel, size // 4)
+
+
+def make_ru(comm, layer=0, name=None, gbt_channel=None):
+    """Returns a RU (Xcku) communicating through comm, on the GBT channel gbt_channel of a card if given"""
+    ru = Xcku(comm, None,
+              ru_main_revision=2,
+              ru_minor_revision=1,
+              transition_board_version=TransitionBoardVersion.V2_5,
+              power_board_version=PowerUnitVersion.PRODUCTION,
+              powerunit_resistance_offset_pt100=0,
+              powerunit_1_offset_avdd=None,
+              powerunit_1_offset_dvdd=None,
+              powerunit_2_offset_avdd=None,
+              powerunit_2_offset_dvdd=None,
+              layer=layer)
+    if name is not None:
+        ru.name = name
+    if gbt_channel is not None:
+        ru.get_gbt_channel = lambda: gbt_channel
+    return ru
+
+
+def make_stave_ru(chips, latency=0, name=None, gbt_channel=None):
+    """Returns a RU whose ALPIDE control is connected to the SimulatedChips chips"""
+    comm = SimulatedCommunication(latency=latency)
+    comm.add_module(XckuModuleid.ALPIDE_CONTROL, SimulatedAlpideControl(chips))
+    return make_ru(comm, name=name, gbt_channel=gbt_channel)
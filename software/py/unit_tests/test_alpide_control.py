@@ -0,0 +1,105 @@
+#!/usr/bin/env python3.9
+"""Tests of the batched chip register access of the ALPIDE control on a simulated stave"""
+
+import unittest
+
+from simulated_board import SimulatedChips, make_stave_ru, report, timed
+
+from pALPIDE import Addr, Alpide
+from userdefinedexceptions import ChipidMismatchError
+
+
+class AddressChips(SimulatedChips):
+    """Chips whose registers read back (chipid << 12) ^ address"""
+
+    def read(self, chipid, address, now):
+        if chipid not in self.registers:
+            return None
+        return ((chipid << 12) ^ address) & 0xFFFF
+
+
+class TestReadChipRegs(unittest.TestCase):
+    NCHIPS = 9
+    NREGISTERS = 20
+
+    def setUp(self):
+        self.ru = make_stave_ru(AddressChips(range(self.NCHIPS)))
+        self.reg_list = [(chipid, 0x600 + address) for chipid in range(self.NCHIPS) for address in range(self.NREGISTERS)]
+
+    def test_batched_equals_single(self):
+        single, single_time = timed(lambda: [self.ru.read_chip_reg(address=address, extended_chipid=chipid)
+                                             for chipid, address in self.reg_list])
+        single_round_trips = self.ru.comm.flushes
+        batched, batched_time = timed(self.ru.read_chip_regs, self.reg_list)
+        batched_round_trips = self.ru.comm.flushes - single_round_trips
+        self.assertEqual(single, [((chipid << 12) ^ address) for chipid, address in self.reg_list])
+        self.assertEqual([reg['data'] for reg in batched], single)
+        self.assertLess(batched_round_trips, single_round_trips)
+        report(f"{len(self.reg_list)} chip registers: single {single_round_trips} round trips {single_time*1e3:.1f} ms, "
+               f"batched {batched_round_trips} round trips {batched_time*1e3:.1f} ms")
+
+    def test_dctrl_set_up_per_chip(self):
+        set_up = []
+        alpide_control = self.ru.alpide_control
+        original = alpide_control._set_up_dctrl
+
+        def spy(extended_chipid, commitTransaction=True):
+            set_up.append(extended_chipid)
+            original(extended_chipid, commitTransaction=commitTransaction)
+        alpide_control._set_up_dctrl = spy
+        self.ru.read_chip_regs(self.reg_list)
+        self.assertEqual(set_up, list(range(self.NCHIPS)))
+
+
+class TestWriteChipRegs(unittest.TestCase):
+    NCHIPS = 3
+
+    def test_single_equals_batched(self):
+        """write_chip_reg writes as write_chip_regs of one register, in one round trip"""
+        chips = SimulatedChips(range(self.NCHIPS))
+        ru = make_stave_ru(chips)
+        ru.read_chip_reg(address=0x600, extended_chipid=0)  # connector set up
+        flushes = ru.comm.flushes
+        for chipid in range(self.NCHIPS):
+            ru.write_chip_reg(address=0x600 + chipid, data=0x100 + chipid, extended_chipid=chipid)
+        self.assertEqual(ru.comm.flushes - flushes, self.NCHIPS)
+        ru.alpide_control.write_chip_regs([(chipid, 0x610 + chipid, 0x200 + chipid) for chipid in range(self.NCHIPS)])
+        ru.write_chip_reg(address=0x620, data=0x300, extended_chipid=0xF)
+        for chipid in range(self.NCHIPS):
+            self.assertEqual(chips.registers[chipid], {0x600 + chipid: 0x100 + chipid, 0x610 + chipid: 0x200 + chipid,
+                                                       0x620: 0x300})
+        ru.alpide_control.write_chip_reg(address=0x630, data=0x400, extended_chipid=1, readback=True)
+        self.assertEqual(chips.registers[1][0x630], 0x400)
+
+
+class TestStatusRegs(unittest.TestCase):
+    NCHIPS = 9
+    MISSING = 4
+
+    def test_status_regs(self):
+        """The status registers of a stave in one sequence, decoded as by the getreg_<register> functions"""
+        ru = make_stave_ru(AddressChips([chipid for chipid in range(self.NCHIPS) if chipid != self.MISSING]))
+        chips = [Alpide(ru, chipid) for chipid in range(self.NCHIPS)]
+        chips[0].getreg_seu_counter()  # selects the DCTRL connector
+        flushes = ru.comm.flushes
+        requests = [ch._request_status_regs() for ch in chips]
+        results = ru.flush_and_read_results(expected_length=2*sum(len(request) for request in requests))
+        self.assertEqual(ru.comm.flushes - flushes, 1)
+        offset = 0
+        for ch, request in zip(chips, requests):
+            chip_results = results[offset:offset + 2*len(request)]
+            offset += 2*len(request)
+            if ch.chipid == self.MISSING:
+                self.assertRaises(ChipidMismatchError, ch._format_status_regs, request, chip_results)
+                continue
+            status = ch._format_status_regs(request, chip_results)
+            self.assertEqual(list(status), list(Alpide.STATUS_REGS))
+            self.assertEqual(status[Addr.DTU_PLL_LOCK_1], ch.getreg_dtu_pll_lock_1())
+            self.assertEqual(status[Addr.FROMU_STATUS_1][0], ch.getreg_fromu_status_1()[0])
+            self.assertEqual(status[Addr.FROMU_STATUS_5], ch.getreg_fromu_status_5())
+            self.assertEqual(status[Addr.SEU_ERROR_COUNTER][0], ch.getreg_seu_counter()[0])
+            self.assertEqual(status[Addr.CMU_AND_DMU_STATUS], ch.getreg_cmu_and_dmu_status())
+
+
+if __name__ == '__main__':
+    unittest.main()
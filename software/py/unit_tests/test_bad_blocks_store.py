@@ -0,0 +1,187 @@
+#!/usr/bin/env python3.9
+"""Tests of the concurrent bad block scan and of the bad block store on simulated flash chips.
+
+Each simulated RU has a PA3 register model of the flash page read used by ProAsic3Flash.find_bad_blocks,
+with a latency per PA3 transaction (independent per RU, as for RUs on different GBT links).
+The RUs share two SimulatedCards, which record the transactions of a thread within the transaction of another:
+each PA3 access is a transaction of the card, the page reads hold the card from their first to their last access.
+"""
+
+import logging
+import random
+import sqlite3
+import threading
+import time
+import unittest
+
+from simulated_board import SimulatedCard, report, timed
+
+import ru_flashing
+from bad_blocks_store import BadBlockStore, scan_bad_blocks
+from proasic3_convenience import ConvenienceInitializer, PAGE_PER_BLOCK
+from proasic3_enums import Pa3Register, FlashCmdOpcode, FlashSelectICOpcode
+from proasic3_flash import ProAsic3Flash
+
+LATENCY = 20e-6
+
+
+class SimulatedFlashPa3(object):
+    """Register model of the PA3 flash page read, the marker byte of the first page of a bad block is not 0"""
+
+    def __init__(self, card, bad_blocks_d, latency=0):
+        self.card = card
+        self.bad_blocks_d = bad_blocks_d
+        self.latency = latency
+        self.transactions = 0
+        self._pending_latency = 0
+        self._registers = {}
+        self._page = None
+
+    def _transaction(self):
+        """A SCA transaction of the card, locked as Sca_O2 does"""
+        self.card._lock_comm()
+        try:
+            self.transactions += 1
+            self._pending_latency += self.latency
+            if self._pending_latency >= 1e-3:  # sleep in chunks, finer sleeps are not accurate
+                time.sleep(self._pending_latency)
+                self._pending_latency = 0
+        finally:
+            self.card._unlock_comm()
+
+    def write_reg(self, address, data):
+        self._transaction()
+        self._registers[address] = data
+        if address == Pa3Register.FLASH_CTRL and data & 0x7F == FlashCmdOpcode.PAGE_READ:
+            self._page = self._registers[Pa3Register.FLASH_ROW_ADDR3] << 16 | \
+                         self._registers[Pa3Register.FLASH_ROW_ADDR2] << 8 | \
+                         self._registers[Pa3Register.FLASH_ROW_ADDR1]
+
+    def read_reg(self, address):
+        self._transaction()
+        if address == Pa3Register.FIFO_DATA_RD:
+            flash_device = self._registers[Pa3Register.FLASH_SELECT_IC] - 1
+            block, page = divmod(self._page, PAGE_PER_BLOCK)
+            return 0xFF if page == 0 and block in self.bad_blocks_d[flash_device] else 0x00
+        return 0
+
+
+class SimulatedIdentity(object):
+    def __init__(self, dna, sn):
+        self.dna, self.sn = dna, sn
+
+    def get_dna(self):
+        return self.dna
+
+    def get_sn(self):
+        return self.sn
+
+    def decode_sn(self, dna):
+        return self.sn
+
+
+class SimulatedPa3(object):
+    def __init__(self, flash_model, blocks):
+        card = flash_model.card
+        conv_init = ConvenienceInitializer(flash_model.write_reg, flash_model.read_reg, logging.getLogger("pa3_sim"),
+                                           lambda: card._lock_comm(), lambda: card._unlock_comm())
+        self._FlashIf = ProAsic3Flash(conv_init, None)
+        self.flash_find_bad_blocks = lambda: self._FlashIf.find_bad_blocks(blocks)
+
+
+class SimulatedRu(object):
+    """RU exposing what the bad block scan and the flashing block checks use"""
+    scan_bad_blocks = ru_flashing.scan_bad_blocks
+    get_bad_blocks = ru_flashing.get_bad_blocks
+    _check_bad_block_list = ru_flashing._check_bad_block_list
+    ru_main_revision = 2
+    ru_minor_revision = 1
+
+    def __init__(self, cru, gbt_channel, bad_blocks_d, blocks, bad_block_store=None):
+        self.logger = logging.getLogger(f"ru_sim_{gbt_channel}")
+        self.bad_block_store = bad_block_store
+        self.cru = cru
+        self.gbt_channel = gbt_channel
+        self.identity = SimulatedIdentity(dna=0x400000000000000000000000 + gbt_channel, sn=gbt_channel + 1)
+        self.flash = SimulatedFlashPa3(cru, bad_blocks_d, LATENCY)
+        self.pa3 = SimulatedPa3(self.flash, blocks)
+
+    def get_gbt_channel(self):
+        return self.gbt_channel
+
+
+class TestScanBadBlocks(unittest.TestCase):
+    NRUS = 4
+    BLOCKS = range(1, 33)
+
+    def setUp(self):
+        random.seed(0)
+        self.expected = {}
+        self.rdo_list = []
+        self.cards = [SimulatedCard(), SimulatedCard()]
+        for gbt_channel in range(self.NRUS):
+            bad_blocks_d = {flash_device: sorted(random.sample(self.BLOCKS, 3)) for flash_device in [0, 1]}
+            self.expected[gbt_channel] = bad_blocks_d
+            self.rdo_list.append(SimulatedRu(self.cards[gbt_channel % 2], gbt_channel, bad_blocks_d, self.BLOCKS))
+
+    def test_find_bad_blocks(self):
+        rdo = self.rdo_list[0]
+        self.assertEqual(rdo.pa3.flash_find_bad_blocks(), self.expected[0])
+
+    def test_scan_and_lookup(self):
+        store = BadBlockStore()
+        scanned, duration = timed(scan_bad_blocks, self.rdo_list, store)
+        self.assertEqual(scanned, self.expected)
+        transactions = sum(rdo.flash.transactions for rdo in self.rdo_list)
+        cached, cached_duration = timed(scan_bad_blocks, self.rdo_list, store)
+        self.assertEqual(cached, self.expected)
+        self.assertEqual(sum(rdo.flash.transactions for rdo in self.rdo_list), transactions, "Cached lookup accessed the flash")
+        for gbt_channel, bad_blocks_d in self.expected.items():
+            self.assertEqual(store.lookup(serial=f"{gbt_channel + 1:06}"), bad_blocks_d)
+            self.assertEqual(store.lookup(dna=0x400000000000000000000000 + gbt_channel), bad_blocks_d)
+        self.assertIsNone(store.lookup(dna=0x1))
+        self.assertEqual([card.violations for card in self.cards], [[], []], "Transactions of the RUs of a card interleaved")
+        self.assertTrue(all('_lock_comm' not in card.__dict__ for card in self.cards), "Card lock not uninstalled")
+        report(f"{len(self.BLOCKS)} blocks x 2 flash chips on {self.NRUS} RUs scanned in {duration:.2f} s, "
+               f"cached lookup {cached_duration*1e3:.2f} ms")
+
+    def test_flashing_uses_store(self):
+        """The bitfile block checks of the flashing avoid the bad blocks found by a scan"""
+        store = BadBlockStore()
+        rdo = SimulatedRu(self.cards[0], 0, {0: [], 1: []}, self.BLOCKS, bad_block_store=store)
+        rdo.identity.sn = 100000  # not in the bad block LUTs
+        self.assertEqual(rdo._check_bad_block_list(FlashSelectICOpcode.FLASH_IC1, [0x300, 0x400], [], [], golden=False), [0x300, 0x400])
+        store.store({0: [0x305], 1: [0x1234]}, dna=rdo.identity.get_dna())
+        self.assertEqual(rdo.get_bad_blocks(FlashSelectICOpcode.FLASH_IC1, store=store), [0x300])
+        self.assertEqual(rdo._check_bad_block_list(FlashSelectICOpcode.FLASH_IC1, [0x300, 0x400], [], [], golden=False), [0x500, 0x400])
+        self.assertEqual(rdo._check_bad_block_list(FlashSelectICOpcode.FLASH_IC2, [0x300, 0x1200], [], [], golden=False), [0x300, 0x1300])
+
+    def test_import_legacy_db(self):
+        """A legacy bad_blocks_io database is merged by board, named by serial number or by DNA"""
+        conn = sqlite3.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE bad_blocks (board_id TEXT, block_addr INTEGER, flash_device INTEGER, date REAL);
+            CREATE TABLE board_id (board_id TEXT, board_serial_no TEXT);
+            INSERT INTO board_id VALUES ('1237940039285380274899124224', '000007');
+            INSERT INTO bad_blocks VALUES ('000007', 2, 0, 1.0), ('1237940039285380274899124224', 1334, 1, 2.0),
+                                          ('proto3', 9, 0, 3.0);
+        """)
+        store = BadBlockStore()
+        self.assertEqual(store.import_legacy_db(conn), 2)
+        self.assertEqual(store.lookup(dna=1237940039285380274899124224), {0: [2], 1: [1334]})
+        self.assertEqual(store.lookup(serial=7), {0: [2], 1: [1334]})
+        self.assertEqual(store.lookup(serial='proto3'), {0: [9], 1: []})
+
+    def test_interleaved_without_card_lock(self):
+        """Without the card lock, the page reads of the RUs of a card interleave"""
+        store = BadBlockStore()
+        threads = [threading.Thread(target=rdo.scan_bad_blocks, args=(store,)) for rdo in self.rdo_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(card.violations for card in self.cards), "Expected interleaved transactions without the card lock")
+
+
+if __name__ == '__main__':
+    unittest.main()
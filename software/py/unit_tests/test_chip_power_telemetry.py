@@ -0,0 +1,158 @@
+#!/usr/bin/env python3.9
+"""Tests of the chip power ADC readout and telemetry on simulated RUs.
+
+The simulated chip power slave acknowledges a conversion a conversion time after its start
+(firmware time), its channel sequencer converts the four channels one after the other.
+The DVDD current of a RU spikes (latch-up like) during given intervals.
+"""
+
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedCommunication, SimulatedModule, make_ru, report, timed
+
+from chip_power_telemetry import CHANNELS, ChipPowerTelemetry
+from ru_board import XckuModuleid
+from ru_chip_power import ChipPower
+
+CHIP_POWER_MODULEID = XckuModuleid.SYSMON
+NOMINAL = {'AVDD_CURRENT': 1200, 'DVDD': 2950, 'AVDD': 2950, 'DVDD_CURRENT': 1300}  # ADC steps
+SPIKE = 3900  # DVDD current steps during a spike, ~900 mA
+LATENCY = 100e-6
+
+
+class SimulatedChipPower(SimulatedModule):
+    """Chip power slave and its ADC, spikes: [(start, stop)] perf_counter intervals of DVDD current spikes"""
+
+    def __init__(self, seed, conversion_time=1e-6, spikes=()):
+        super(SimulatedChipPower, self).__init__()
+        self.conversion_time = conversion_time
+        self.spikes = list(spikes)
+        self.conversions = 0
+        self._rng = np.random.default_rng(seed)
+        self._channel = 0
+        self._data = 0
+        self._done_at = 0.
+
+    def value(self, channel, t):
+        """ADC steps of a channel at time t"""
+        name = CHANNELS[channel]
+        if name == 'DVDD_CURRENT' and any(start <= t < stop for start, stop in self.spikes):
+            return SPIKE
+        return NOMINAL[name] + int(self._rng.integers(-3, 4))
+
+    def write(self, address, data, now):
+        if address == 4:
+            self._channel = 0
+        elif address == 6 and data == 0x1:
+            self.conversions += 1
+            self._done_at = now + self.conversion_time
+            self._data = self._channel << 13 | self.value(self._channel, now)
+            self._channel = (self._channel + 1) % len(CHANNELS)
+
+    def read(self, address, now):
+        if address == 6:
+            return 0x4 if now >= self._done_at else 0
+        elif address == 5:
+            return self._data
+        return 0
+
+
+def make_chip_powers(nrus, spikes=None, conversion_time=None):
+    spikes = spikes or {}
+    conversion_time = conversion_time or {}
+    chip_powers = []
+    for i in range(nrus):
+        comm = SimulatedCommunication({CHIP_POWER_MODULEID: SimulatedChipPower(i, conversion_time.get(i, 1e-6), spikes.get(i, ()))},
+                                      latency=LATENCY)
+        chip_powers.append(ChipPower(make_ru(comm), CHIP_POWER_MODULEID))
+    return chip_powers
+
+
+def simulated(chip_power):
+    return chip_power.board.comm.modules[CHIP_POWER_MODULEID]
+
+
+class TestChipPower(unittest.TestCase):
+
+    def assertNominal(self, values_raw):
+        for j, channel in enumerate(CHANNELS):
+            self.assertLessEqual(abs(int(values_raw[j]) - NOMINAL[channel]), 3, channel)
+
+    def test_read_values_raw(self):
+        chip_power, = make_chip_powers(1)
+        values_raw, duration = timed(chip_power.read_values_raw)
+        self.assertNominal(values_raw)
+        self.assertEqual(chip_power.board.comm.result_reads, 1)
+        report(f"chip power ADC channels read in {duration*1e3:.2f} ms, {LATENCY*1e6:.0f} us per round trip")
+
+    def test_slow_conversion(self):
+        """Conversions slower than the firmware wait are repeated one at a time, each polled until acknowledged"""
+        fast, slow = make_chip_powers(2, conversion_time={1: 1e-3})
+        self.assertNominal(fast.read_values_raw(wait_value=0x1000))
+        self.assertEqual(simulated(fast).conversions, 4)
+        self.assertNominal(slow.read_values_raw())
+        self.assertEqual(simulated(slow).conversions, 8)
+
+    def test_no_acknowledge(self):
+        """No conversion is started while the previous one is not acknowledged"""
+        chip_power, = make_chip_powers(1, conversion_time={0: 10.})
+        values_raw = chip_power.read_values_raw()
+        self.assertEqual(list(values_raw.values()), [None]*4)
+        self.assertEqual(simulated(chip_power).conversions, 5)
+
+
+class TestChipPowerTelemetry(unittest.TestCase):
+    NRUS = 6
+    RATE = 200.
+
+    def test_sample(self):
+        chip_powers = make_chip_powers(self.NRUS)
+        telemetry = ChipPowerTelemetry(chip_powers)
+        _, duration = timed(telemetry.sample)
+        self.assertEqual(sum(chip_power.board.comm.result_reads for chip_power in chip_powers), self.NRUS)
+        for i in range(self.NRUS):
+            for j, channel in enumerate(CHANNELS):
+                self.assertLessEqual(abs(int(telemetry.raw[0, i, j]) - NOMINAL[channel]), 3, channel)
+        report(f"telemetry sample of {self.NRUS} RUs in {duration*1e3:.2f} ms")
+
+    def test_slow_conversion_invalid(self):
+        chip_powers = make_chip_powers(2, conversion_time={1: 1e-3})
+        telemetry = ChipPowerTelemetry(chip_powers, thresholds={'DVDD_CURRENT': (None, 600.)})
+        self.assertEqual(telemetry.sample(), [])
+        _, values = telemetry.get_samples(1)
+        self.assertTrue(np.isnan(values[0, 1:]).all())
+        self.assertFalse(np.isnan(telemetry.get_samples(0)[1]).any())
+
+    def test_spike_alarms(self):
+        """The spikes during the background sampling raise a high and a slope alarm each within a sampling period"""
+        duration = 0.8
+        now = time.perf_counter()
+        spikes = {3: [(now + 0.2, now + 0.3), (now + 0.45, now + 0.6)], self.NRUS - 1: [(now + 0.35, now + 0.4)]}
+        telemetry = ChipPowerTelemetry(make_chip_powers(self.NRUS, spikes=spikes), rate=self.RATE, buffer_size=int(self.RATE*duration/2),
+                                       thresholds={'DVDD_CURRENT': (None, 600.), 'AVDD': (1.6, 2.0), 'DVDD': (1.6, 2.0)},
+                                       slopes={'DVDD_CURRENT': 50e3})
+        received = []
+        telemetry.add_alarm_callback(lambda alarm: received.append((time.perf_counter(), alarm)))
+        telemetry.start()
+        time.sleep(duration)
+        telemetry.stop()
+        alarms = telemetry.get_alarms()
+        self.assertEqual([alarm for _, alarm in received], alarms)
+        expected = sorted((start, ru, kind) for ru, intervals in spikes.items() for start, _ in intervals for kind in ['high', 'slope'])
+        self.assertEqual(sorted((alarm.ru, alarm.kind) for alarm in alarms), sorted((ru, kind) for _, ru, kind in expected))
+        latencies = [min(t for t, alarm in received if alarm.ru == ru and alarm.kind == kind and t >= start) - start
+                     for start, ru, kind in expected]
+        self.assertLess(max(latencies), 2./self.RATE)
+        timestamps, values = telemetry.get_samples(3)
+        self.assertEqual(len(timestamps), telemetry.buffer_size)
+        self.assertGreater(telemetry.count, 0.9*self.RATE*duration)
+        self.assertGreater(np.nanmax(values[:, CHANNELS.index('DVDD_CURRENT')]), 600)
+        report(f"background sampling at {self.RATE} Hz: {telemetry.count} samples in {duration} s, "
+               f"alarm latency max {max(latencies)*1e3:.1f} ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
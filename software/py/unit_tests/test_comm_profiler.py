@@ -0,0 +1,99 @@
+#!/usr/bin/env python3.9
+"""Tests of the communication transaction profiler on a simulated RU"""
+
+import unittest
+
+from simulated_board import SimulatedCommunication, SimulatedModule, make_ru, report, timed
+
+from comm_profiler import CommProfiler
+from wishbone_module import WishboneModule
+
+COUNTERS_MODULEID = 0x3A
+CONFIG_MODULEID = 0x3B
+ITERATIONS = 200
+
+
+class CafeModule(SimulatedModule):
+    """Slave answering 0xCAFE to every read"""
+
+    def read(self, address, now):
+        return 0xCAFE
+
+
+class CounterModule(WishboneModule):
+    def read_counters(self):
+        for addr in range(16):
+            self.read(addr, commitTransaction=False)
+        return self.read_all()
+
+
+class ConfigModule(WishboneModule):
+    def configure(self):
+        for addr in range(4):
+            self.write(addr, addr)
+        return self.read(0)
+
+
+class StreamModule(WishboneModule):
+    def write_stream(self, nwords):
+        self.comm.register_write_stream(self.moduleid, 0, bytes(2*nwords))
+        self.comm.flush()
+
+
+def make_board():
+    comm = SimulatedCommunication({COUNTERS_MODULEID: CafeModule(), CONFIG_MODULEID: CafeModule()})
+    ru = make_ru(comm)
+    ru.counters = CounterModule(moduleid=COUNTERS_MODULEID, name="Counters", board_obj=ru)
+    ru.config = ConfigModule(moduleid=CONFIG_MODULEID, name="Config", board_obj=ru)
+    ru.stream = StreamModule(moduleid=CONFIG_MODULEID, name="Stream", board_obj=ru)
+    return ru
+
+
+def workload(board, iterations):
+    for _ in range(iterations):
+        assert board.counters.read_counters() == [0xCAFE]*16
+        assert board.config.configure() == 0xCAFE
+
+
+class TestCommProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.board = make_board()
+        self.profiler = CommProfiler()
+
+    def test_detach_restores_methods(self):
+        with self.profiler.attached(self.board.comm):
+            workload(self.board, 1)
+        self.assertFalse({'register_write', 'register_write_stream', 'register_read', 'flush', '_read_all_bytes'} &
+                         set(self.board.comm.__dict__))
+
+    def test_write_stream(self):
+        """The words of a write stream are counted as writes"""
+        with self.profiler.attached(self.board.comm):
+            self.board.stream.write_stream(100)
+        stats = self.profiler.get_stats(by='caller')
+        stream = stats[next(key for key in stats if key.startswith('StreamModule.write_stream'))]
+        self.assertEqual(stream['writes'], 100)
+        self.assertEqual(stream['bytes_out'], 4*100)
+
+    def test_stats(self):
+        with self.profiler.attached(self.board.comm):
+            _, profiled = timed(workload, self.board, ITERATIONS)
+        stats = self.profiler.get_stats(by='caller')
+        counters = stats[next(key for key in stats if key.startswith('CounterModule.read_counters'))]
+        self.assertEqual(counters['reads'], 16*ITERATIONS)
+        self.assertEqual(counters['flushes'], ITERATIONS)
+        self.assertEqual(counters['bytes_in'], 16*4*ITERATIONS)
+        self.assertEqual(counters['bytes_out'], 16*4*ITERATIONS)
+        configure = [s for key, s in stats.items() if key.startswith('ConfigModule.configure')]
+        self.assertEqual(sum(s['writes'] for s in configure), 4*ITERATIONS)
+        self.assertEqual(sum(s['flushes'] for s in configure), 5*ITERATIONS)
+        self.assertIn('workload;CounterModule.read_counters', self.profiler.folded_stacks())
+        self.assertIn('0x3A', self.profiler.report(by='module'))
+        self.assertTrue(self.profiler.report(by='both'))
+        _, baseline = timed(workload, make_board(), ITERATIONS)
+        report(f"profiler overhead: {(profiled/baseline - 1)*100:+.1f}%\n{self.profiler.report(by='both')}")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3.9
+"""Tests of the DAC scan engine on simulated staves whose chips measure their DACs with the ADC.
+
+The chips measure the DAC selected by the analog monitor, or AVDD, on ADCMEASURE; an ADC value read
+less than ADC_CONVERSION_TIME after ADCMEASURE (firmware time) is the previous one.
+"""
+
+import os
+import sys
+import unittest
+
+from simulated_board import SimulatedChips, make_stave_ru, report, timed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../ib_tools/ibtests'))
+from dac_scan_engine import (CDACSel, DACS, INPUTS, VDACSel, DacScanEngine, adc_ctrl_value, adc_input,
+                             analog_monitor_value, dac_address)
+from pALPIDE import AdcIndex, Addr, Alpide
+
+ADC_CONVERSION_TIME = 5e-3
+NCHIPS = 9
+
+
+def expected_adc(chipid, sel_input, dac, step):
+    """ADC value of the simulated chip"""
+    if sel_input == AdcIndex.AVDD:
+        return 1000 + 3*chipid
+    return (3*step + 17*chipid + 5*DACS.index(dac)) & 0xFFF
+
+
+class AdcChips(SimulatedChips):
+    """Chips measuring their DACs, flaky: {chipid: number of reads of the ADC value without answer}"""
+
+    def __init__(self, chipids, flaky=None):
+        super(AdcChips, self).__init__(chipids)
+        self.flaky = dict(flaky or {})
+        self.measurements = {chipid: (-1, 0.) for chipid in chipids}  # (value, time of ADCMEASURE)
+        self.adc = {chipid: -1 for chipid in chipids}                 # converted ADC value
+
+    def _measure(self, chipid, now):
+        regs = self.registers[chipid]
+        sel_input = (regs.get(Addr.ADC_CTRL, 0) >> 2) & 0xF
+        monitor = regs.get(Addr.ANALOG_MONITOR_AND_OVERRIDE, 0)
+        if sel_input == AdcIndex.DACMONV:
+            dac = [d for d, sel in VDACSel.items() if sel == monitor & 0xF][0]
+        elif sel_input == AdcIndex.DACMONI:
+            dac = [d for d, sel in CDACSel.items() if sel == (monitor >> 4) & 0x7][0]
+        else:
+            dac = None
+        step = regs.get(dac_address(dac), 0) if dac in DACS else 0
+        self.measurements[chipid] = (expected_adc(chipid, sel_input, dac, step), now)
+
+    def write_chip(self, chipid, address, data, now):
+        super(AdcChips, self).write_chip(chipid, address, data, now)
+        if address == Addr.CMD and data == 0xFF20:  # ADCMEASURE
+            self._measure(chipid, now)
+
+    def read(self, chipid, address, now):
+        if address != Addr.ADC_AVSS_VALUE:
+            return super(AdcChips, self).read(chipid, address, now)
+        if self.flaky.get(chipid, 0) > 0:
+            self.flaky[chipid] -= 1
+            return None
+        value, measured_at = self.measurements[chipid]
+        if now - measured_at >= ADC_CONVERSION_TIME:
+            self.adc[chipid] = value
+        return self.adc[chipid]
+
+
+class TestDacScanEngine(unittest.TestCase):
+    NSTAVES = 2
+    STEPS = [0, 64, 128, 192]
+
+    def setUp(self):
+        self.rus = [make_stave_ru(AdcChips(range(NCHIPS), flaky={4: 2} if i == 0 else None), name=f"L0_{i:02d}")
+                    for i in range(self.NSTAVES)]
+        for ru in self.rus:
+            ru.alpide_control._set_up_dctrl(0)
+        self.dacs = [DACS[0], DACS[-1]]  # a voltage and a current DAC
+
+    def scan(self, engine):
+        result = engine.new_result(self.rus, dacs=self.dacs, steps=self.STEPS)
+        for dac in self.dacs:
+            engine.configure_dacs(self.rus)
+            engine.measure(self.rus, result, dac, range(len(self.STEPS)))
+        return result
+
+    def test_scan(self):
+        result, duration = timed(self.scan, DacScanEngine(chipids=range(NCHIPS), steps_per_sequence=2))
+        self.assertTrue(result.valid.all())
+        self.assertEqual(result.retries, 2)
+        for istave in range(self.NSTAVES):
+            for ichip in range(NCHIPS):
+                for idac, dac in enumerate(self.dacs):
+                    self.assertEqual(result.values[istave, ichip, idac, INPUTS.index('Value')].tolist(),
+                                     [expected_adc(ichip, adc_input(dac), dac, step) for step in self.STEPS])
+                    self.assertEqual(result.values[istave, ichip, idac, INPUTS.index('AVDD')].tolist(),
+                                     [expected_adc(ichip, AdcIndex.AVDD, dac, step) for step in self.STEPS])
+        data = result.to_dict()
+        self.assertEqual(data['STEPS'], self.STEPS)
+        self.assertEqual(data['L0_00'][4][self.dacs[0]]['AVDD'], [1012]*len(self.STEPS))
+        report(f"DAC scan of {len(self.dacs)} DACs x {len(self.STEPS)} steps on {self.NSTAVES} staves: {duration:.2f} s, "
+               f"{sum(ru.comm.flushes for ru in self.rus)} flushes, {result.sequences} sequences")
+
+    def test_stale_adc_value(self):
+        """An ADC value read before the end of the conversion is the previous measurement"""
+        ch = Alpide(self.rus[1], chipid=3)
+        ch.setreg_adc_ctrl(Mode=0, SelInput=AdcIndex.AVDD, SetIComp=2, RampSpd=1, DiscriSign=0, HalfLSBTrim=0, CompOut=0)
+        ch.setreg_cmd(0xFF20)  # ADCMEASURE
+        self.assertEqual(ch.read_reg(Addr.ADC_AVSS_VALUE), 0xFFFF)
+        self.rus[1].wait(int(160e6*ADC_CONVERSION_TIME))
+        self.assertEqual(ch.read_reg(Addr.ADC_AVSS_VALUE), expected_adc(3, AdcIndex.AVDD, None, 0))
+
+    def test_register_values(self):
+        """The precompiled register values are those written by the setreg functions"""
+        ch = Alpide(self.rus[0], chipid=5)
+        for dac in self.dacs:
+            ch.setreg_analog_monitor_and_override(VoltageDACSel=VDACSel.get(dac, 0), CurrentDACSel=CDACSel.get(dac, 0),
+                                                  SWCNTL_DACMONI=0, SWCNTL_DACMONV=0, IRefBufferCurrent=1)
+            self.assertEqual(ch.read_reg(Addr.ANALOG_MONITOR_AND_OVERRIDE), analog_monitor_value(dac))
+        for sel_input in [AdcIndex.AVDD, adc_input(self.dacs[0])]:
+            ch.setreg_adc_ctrl(Mode=0, SelInput=sel_input, SetIComp=2, DiscriSign=0, RampSpd=1, HalfLSBTrim=0, CompOut=0)
+            self.assertEqual(ch.read_reg(Addr.ADC_CTRL), adc_ctrl_value(sel_input))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3.9
+"""Tests of the compiled configurations of the DaqTest runs.
+
+The configuration files and their testbench yml are copied to a temporary directory, with the
+HOSTNAME of the yml set to this machine, and the compiled configurations are cached in it.
+The configurations applied and the test_config.json stored have to be the ones of the parsing,
+and the cache has to be invalidated by a change of the configuration or yml files.
+"""
+
+import json
+import os
+import re
+import tempfile
+import time
+import unittest
+import warnings
+
+from simulated_board import report, script_path
+
+from daq_test_configurator import CompiledConfig, DaqTestConfig
+from fakehitrate import FHRConfig
+from threshold_scan import ThresholdConfig
+
+CONFIG_DIR = os.path.join(script_path, '../../config')
+FAKEHIT = """
+[FAKEHIT]
+ITHR = 50
+VCASN = 60
+VCASN2 = 72
+VPULSEH = 170
+VRESETD = 147
+IDB = 29
+MODE = CONTINUOUS
+SOURCE = GBTx2
+USE_LTU = False
+LTU_MASTER = False
+MULTIPLE_OF_ORBIT = False
+"""
+CONFIGS = [(DaqTestConfig, 'daq_test_LANL_flx.cfg'),
+           (ThresholdConfig, 'threshold_LANL.cfg'),
+           (FHRConfig, 'threshold_LANL.cfg')]
+
+
+def copy_config(tmpdir, cfg_name, yml_name=None):
+    """Copies a configuration file and its yml to tmpdir, returns the path of the configuration file"""
+    with open(os.path.join(CONFIG_DIR, cfg_name)) as f:
+        cfg = f.read()
+    yml_path = os.path.join(script_path, '..', re.search(r'^YML\s*=\s*(\S+)', cfg, re.M).group(1))
+    with open(yml_path) as f:
+        yml = f.read()
+    yml = re.sub(r'^HOSTNAME\s*:.*$', f'HOSTNAME : "{os.uname().nodename}"', yml, flags=re.M)
+    yml_name = yml_name or os.path.basename(yml_path)
+    with open(os.path.join(tmpdir, yml_name), 'w') as f:
+        f.write(yml)
+    cfg = re.sub(r'^YML\s*=.*$', f'YML = {os.path.join(tmpdir, yml_name)}', cfg, flags=re.M) + FAKEHIT
+    cfg_path = os.path.join(tmpdir, cfg_name)
+    with open(cfg_path, 'w') as f:
+        f.write(cfg)
+    return cfg_path
+
+
+def parse_configure_run(config, config_file, logdir):
+    """Setup of a run parsing the configuration file, without the compiled configurations"""
+    config._parse_configuration_file(config_file)
+    config._load_config()
+    config._store_configuration(logdir)
+
+
+def public(config):
+    return {name: value for name, value in vars(config).items() if not name.startswith('_')}
+
+
+def read_json(logdir):
+    with open(os.path.join(logdir, 'test_config.json')) as f:
+        return f.read()
+
+
+def mean_duration(function, repeat=10):
+    """Returns the mean duration of function() in s"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start)/repeat
+
+
+class TestCompiledConfig(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.tmpdir = self._tmpdir.name
+        self._cache_dir = DaqTestConfig.CACHE_DIR
+        DaqTestConfig.CACHE_DIR = os.path.join(self.tmpdir, 'cache')
+        DaqTestConfig._compiled.clear()
+        self.logdir = os.path.join(self.tmpdir, 'logs')
+        os.makedirs(self.logdir)
+
+    def tearDown(self):
+        DaqTestConfig.CACHE_DIR = self._cache_dir
+        DaqTestConfig._compiled.clear()
+        self._tmpdir.cleanup()
+
+    def test_same_as_parsed(self):
+        """The configuration applied and stored from the compiled one, from the cache directory and from memory,
+        is the parsed one"""
+        for config_class, cfg_name in CONFIGS:
+            cfg_path = copy_config(self.tmpdir, cfg_name)
+            parsed = config_class()
+            parse_time = mean_duration(lambda: parse_configure_run(config_class(), cfg_path, self.logdir))
+            parse_configure_run(parsed, cfg_path, self.logdir)
+            parsed_json = read_json(self.logdir)
+            DaqTestConfig._compiled.clear()
+            compiled = config_class().compile(cfg_path)
+
+            def from_disk():
+                DaqTestConfig._compiled.clear()
+                config_class().configure_run(cfg_path, self.logdir)
+            for configure in [from_disk, lambda: config_class().configure_run(cfg_path, self.logdir)]:
+                configure()
+                self.assertEqual(read_json(self.logdir), parsed_json, cfg_name)
+            config = config_class()
+            config.configure_run(cfg_path, self.logdir, compiled=compiled)
+            self.assertEqual(public(config), public(parsed), cfg_name)
+            self.assertEqual(read_json(self.logdir), parsed_json, cfg_name)
+            self.assertEqual(config_class().compile(cfg_path), compiled)
+            self.assertIs(config_class().compile(cfg_path), config_class().compile(cfg_path))
+            report(f"{config_class.__name__} {cfg_name}: per scan setup parsing {parse_time*1e3:.2f} ms, "
+                   f"from the cache directory {mean_duration(from_disk)*1e3:.2f} ms, from memory "
+                   f"{mean_duration(lambda: config_class().configure_run(cfg_path, self.logdir))*1e3:.2f} ms")
+
+    def test_immutable(self):
+        """Immutable, hashable and applied lists independent of the compiled ones"""
+        cfg_path = copy_config(self.tmpdir, 'threshold_LANL.cfg')
+        compiled = ThresholdConfig().compile(cfg_path)
+        self.assertIsInstance(compiled, CompiledConfig)
+        self.assertEqual(compiled.STEP_ROWS, compiled['STEP_ROWS'])
+        self.assertEqual(hash(compiled), hash(ThresholdConfig().compile(cfg_path, use_cache=False)))
+        self.assertEqual(compiled, ThresholdConfig().compile(cfg_path, use_cache=False))
+        with self.assertRaises(AttributeError):
+            compiled.STEP_ROWS = 1
+        with self.assertRaises(AttributeError):
+            del compiled.rows
+        config = ThresholdConfig()
+        config.apply(compiled)
+        config.rows.append(1000)
+        self.assertIsInstance(config.rows, list)
+        self.assertNotIn(1000, compiled.rows)
+        self.assertNotIn(1000, ThresholdConfig().compile(cfg_path).rows)
+
+    def test_dict_values(self):
+        """dict and set values are compiled into read-only values and applied as copies"""
+        cfg_path = copy_config(self.tmpdir, 'threshold_LANL.cfg')
+        config = ThresholdConfig()
+        config.CHIP_SETTINGS = {'VCASN': [50, 51], 'excluded': {3, 4}, 'lanes': {0: {'VCASN2': 62}}}
+        compiled = config.compile(cfg_path)
+        hash(compiled)
+        self.assertEqual(compiled.CHIP_SETTINGS['lanes'][0]['VCASN2'], 62)
+        with self.assertRaises(TypeError):
+            compiled.CHIP_SETTINGS['VCASN'] = [0]
+        DaqTestConfig._compiled.clear()
+        self.assertEqual(config.compile(cfg_path), compiled)
+        applied = ThresholdConfig()
+        applied.apply(compiled)
+        self.assertEqual(applied.CHIP_SETTINGS, config.CHIP_SETTINGS)
+        self.assertIsInstance(applied.CHIP_SETTINGS['lanes'], dict)
+        self.assertIsInstance(applied.CHIP_SETTINGS['excluded'], set)
+        applied.CHIP_SETTINGS['lanes'][0]['VCASN2'] = 0
+        self.assertEqual(compiled.CHIP_SETTINGS['lanes'][0]['VCASN2'], 62)
+        config.configure_run(cfg_path, self.logdir)
+        self.assertEqual(config.CHIP_SETTINGS, {'VCASN': [50, 51], 'excluded': {3, 4}, 'lanes': {0: {'VCASN2': 62}}})
+
+    def test_initial_state_in_key(self):
+        cfg_path = copy_config(self.tmpdir, 'threshold_LANL.cfg')
+        fhr = FHRConfig()
+        fhr.force_sequencer()
+        self.assertEqual(fhr.compile(cfg_path).TRIGGER_PERIOD_BC, 3564)
+        self.assertNotEqual(FHRConfig().compile(cfg_path).TRIGGER_PERIOD_BC, 3564)
+
+    def test_invalidation(self):
+        """The cache is invalidated by the configuration, yml and local yml files"""
+        cfg_path = copy_config(self.tmpdir, 'daq_test_LANL_flx.cfg', yml_name='invalidation.yml')
+        yml_path = os.path.join(self.tmpdir, 'invalidation.yml')
+        DaqTestConfig().compile(cfg_path)
+        with open(yml_path) as f:
+            yml = f.read()
+        with open(yml_path, 'w') as f:
+            f.write(re.sub(r'^SUBRACK\s*:.*$', 'SUBRACK : "L0T-PP1-I-3"', yml, flags=re.M))
+        self.assertEqual(DaqTestConfig().compile(cfg_path).SUBRACK, 'L0T-PP1-I-3')
+        with open(os.path.join(self.tmpdir, 'invalidation_local.yml'), 'w') as f:
+            f.write(re.sub(r'^SUBRACK\s*:.*$', 'SUBRACK : "L0B-PP1-O-4"', yml, flags=re.M))
+        self.assertEqual(DaqTestConfig().compile(cfg_path).SUBRACK, "L0B-PP1-O-4")
+        os.remove(os.path.join(self.tmpdir, 'invalidation_local.yml'))
+        self.assertEqual(DaqTestConfig().compile(cfg_path).SUBRACK, 'L0T-PP1-I-3')
+        with open(cfg_path) as f:
+            cfg = f.read()
+        with open(cfg_path, 'w') as f:
+            f.write(cfg.replace('NUM_TRIGGERS = 1', 'NUM_TRIGGERS = 7'))
+        self.assertEqual(DaqTestConfig().compile(cfg_path).NUM_TRIGGERS, 7)
+        with open(os.path.join(DaqTestConfig.CACHE_DIR, DaqTestConfig().compile(cfg_path).key + '.pickle'), 'wb') as f:
+            f.write(b'corrupted')
+        DaqTestConfig._compiled.clear()
+        self.assertEqual(DaqTestConfig().compile(cfg_path).NUM_TRIGGERS, 7)
+
+    def test_only_warn(self):
+        """The warnings of only_warn are raised at each run, an invalid configuration is not compiled"""
+        cfg_path = copy_config(self.tmpdir, 'daq_test_LANL_flx.cfg')
+        with open(cfg_path) as f:
+            cfg = f.read()
+        with open(cfg_path, 'w') as f:
+            f.write(cfg.replace('NUM_TRIGGERS = 1', 'NUM_TRIGGERS = one'))
+        messages = []
+        for _ in range(2):
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                DaqTestConfig(only_warn=True).configure_run(cfg_path, self.logdir)
+            messages.append([str(w.message) for w in caught])
+        self.assertEqual(messages[0], messages[1])
+        self.assertEqual(len(messages[0]), 1)
+        self.assertIn('NUM_TRIGGERS', messages[0][0])
+        with self.assertRaises(ValueError):
+            DaqTestConfig().compile(cfg_path)
+        self.assertEqual(json.loads(read_json(self.logdir))['NUM_TRIGGERS'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.9
+"""Tests of the data lane counter snapshots of several simulated RUs.
+
+The counters of the IB and OB data lane monitors of each RU increase at a given rate per lane and
+counter, starting close to their wraparound, and are latched at the firmware time of the latch
+command (latching OB 1 also latches OB 2).
+"""
+
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedCommunication, SimulatedCounterMonitor, make_ru, report, timed
+
+from data_lane_snapshot import DataLaneSnapshotSampler
+from ru_board import XckuModuleid
+from ru_data_lane_monitor import DataLaneMonitor, DatalaneMonitorAddress
+
+LANES_IB = 9
+LANES_OB = 28
+MONITOR = make_ru(SimulatedCommunication())._datalane_monitor_ib
+COUNTERS = DataLaneMonitor.nr_counter_regs
+NR_REGS = len(DatalaneMonitorAddress) - 2
+COUNTER_MAPPING = MONITOR.counter_mapping
+LATENCY = 200e-6
+SHAPES = {XckuModuleid.DATALANE_MONITOR_IB: (LANES_IB, COUNTERS),
+          XckuModuleid.DATALANE_MONITOR_OB_1: (14, COUNTERS),
+          XckuModuleid.DATALANE_MONITOR_OB_2: (LANES_OB - 14, COUNTERS)}
+
+
+def decode(address, latched):
+    """Data lane monitor register of the latched [lane, counter] values"""
+    lane, reg = divmod(address - 2, NR_REGS)
+    name = DataLaneMonitor.wb_register_mapping[reg]
+    values = dict(zip(COUNTER_MAPPING, latched[lane].tolist()))
+    if name.endswith('_LOW'):
+        return values[name[:-len('_LOW')]] & 0xFFFF
+    elif name.endswith('_HIGH'):
+        return values[name[:-len('_HIGH')]] >> 16
+    elif '_X_' in name:
+        high, low = name.split('_X_')
+        return values[high] << 8 | values[low]
+    return values[name]
+
+
+def make_rus(nrus, rng):
+    t0 = time.perf_counter()
+    modulo = np.array([1 << MONITOR.get_counter_width(c) for c in COUNTER_MAPPING], dtype=np.int64)
+    rus = []
+    for _ in range(nrus):
+        comm = SimulatedCommunication(latency=LATENCY)
+        for moduleid, shape in SHAPES.items():
+            # close to the wraparound
+            comm.add_module(moduleid, SimulatedCounterMonitor(rng.uniform(0, 1000, shape), modulo - rng.integers(1, 300, shape),
+                                                              np.broadcast_to(modulo, shape), decode, t0))
+        comm.modules[XckuModuleid.DATALANE_MONITOR_OB_1].slaves.append(comm.modules[XckuModuleid.DATALANE_MONITOR_OB_2])
+        rus.append(make_ru(comm))
+    return rus
+
+
+def monitors(ru, datapath):
+    if datapath == 'ib':
+        return [ru.comm.modules[XckuModuleid.DATALANE_MONITOR_IB]]
+    return [ru.comm.modules[XckuModuleid.DATALANE_MONITOR_OB_1], ru.comm.modules[XckuModuleid.DATALANE_MONITOR_OB_2]]
+
+
+def latch_spread(rus, since):
+    times = [t for ru in rus for monitor in monitors(ru, 'ib') + monitors(ru, 'ob') for t in monitor.latches if t >= since]
+    return max(times) - min(times)
+
+
+class TestDataLaneSnapshotSampler(unittest.TestCase):
+    NRUS = 4
+
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+
+    def check_snapshot(self, datapath, nlanes):
+        rus = make_rus(self.NRUS, self.rng)
+        start = time.perf_counter()
+        _, per_lane_time = timed(lambda: [rus[0]._datalane_monitor_ib.read_counters(lane) for lane in range(LANES_IB)]
+                                 if datapath == 'ib' else
+                                 [rus[0]._datalane_monitor_ob.read_counters(lane) for lane in range(LANES_OB)])
+        per_lane_spread = latch_spread(rus, start)
+        sampler = DataLaneSnapshotSampler(rus, datapath=datapath)
+        flushes, reads = sum(ru.comm.flushes for ru in rus), sum(ru.comm.result_reads for ru in rus)
+        start = time.perf_counter()
+        (_, values), snapshot_time = timed(sampler.snapshot)
+        spread = latch_spread(rus, start)
+        self.assertEqual(values.shape, (self.NRUS, nlanes, COUNTERS))
+        self.assertEqual(sum(ru.comm.result_reads for ru in rus) - reads, self.NRUS)
+        self.assertEqual(sum(ru.comm.flushes for ru in rus) - flushes, 2*self.NRUS)
+        self.assertLess(spread, 0.1*per_lane_spread)
+        for i, ru in enumerate(rus):
+            latch_time = monitors(ru, datapath)[0].latches[-1]
+            expected = np.concatenate([monitor.counters_at(latch_time) for monitor in monitors(ru, datapath)])
+            np.testing.assert_array_equal(values[i], expected)
+        report(f"{datapath}: {nlanes} lanes of one RU read per lane in {per_lane_time*1e3:.1f} ms, latches spread over "
+               f"{per_lane_spread*1e3:.2f} ms; {self.NRUS} RUs in a snapshot in {snapshot_time*1e3:.1f} ms, "
+               f"latches spread over {spread*1e6:.1f} us")
+
+    def test_snapshot_ib(self):
+        self.check_snapshot('ib', LANES_IB)
+
+    def test_snapshot_ob(self):
+        self.check_snapshot('ob', LANES_OB)
+
+    def test_rates(self):
+        """Deltas and rates through wraparounds, a RU failing once has NaN deltas until it sets a new reference"""
+        rus = make_rus(self.NRUS, self.rng)
+        sampler = DataLaneSnapshotSampler(rus, datapath='ob', lanes=[0, 5, 13, 14, 27],
+                                          counters=['LANE_FIFO_START', 'u8B10B_OOT', 'DATA_OVERRUN', 'LANE_TIMEOUT'], rate=5)
+        sampler.run(nsamples=2)
+        rus[1].comm.fail_reads = 1
+        sampler.sample()
+        sampler.run(nsamples=2)
+        timestamps, intervals, deltas = sampler.get_samples()
+        self.assertEqual(len(timestamps), 5)
+        self.assertTrue(np.all(np.isnan(deltas[0])))
+        self.assertTrue(np.all(np.isnan(deltas[2, 1])) and np.all(np.isnan(deltas[3, 1])))
+        self.assertFalse(np.any(np.isnan(deltas[4])))
+        self.assertFalse(np.any(np.isnan(deltas[1:, [0] + list(range(2, self.NRUS))])))
+        _, rates = sampler.get_rates()
+        counter_index = [COUNTER_MAPPING.index(c) for c in sampler.counters]
+        for i, ru in enumerate(rus):
+            expected = np.concatenate([monitor.rates for monitor in monitors(ru, 'ob')])[sampler.lanes][:, counter_index]
+            for s in range(1, 5):
+                if not np.isnan(intervals[s, i]):
+                    # 1 count, and 2 ms between the time of the latch and the end of its flush
+                    self.assertTrue(np.all(np.abs(rates[s, i] - expected)*intervals[s, i] <= 1. + expected*2e-3), (i, s))
+        latest = sampler.get_latest()
+        self.assertEqual(list(latest), list(range(self.NRUS)))
+        self.assertEqual(list(latest[0]), sampler.lanes)
+
+    def test_failed_flush(self):
+        """A request flush failing after the requests reached the RU leaves no results for the next snapshot"""
+        rus = make_rus(self.NRUS, self.rng)
+        sampler = DataLaneSnapshotSampler(rus, datapath='ib')
+        comm = rus[1].comm
+        do_write_dp0 = comm._do_write_dp0
+        failures = [1]  # flushes with reads failing once the RU has received them
+
+        def failing_write_dp0(data):
+            read_flushes = comm.read_flushes
+            do_write_dp0(data)
+            if comm.read_flushes > read_flushes and failures[0]:
+                failures[0] -= 1
+                raise RuntimeError("Simulated timeout")
+        comm._do_write_dp0 = failing_write_dp0
+        _, values = sampler.snapshot()
+        self.assertTrue(np.all(values[1] == -1))
+        self.assertEqual(len(comm._response), 0)
+        self.assertEqual((len(comm._buffer), comm._read_bytes), (0, 0))
+        _, values = sampler.snapshot()
+        for i, ru in enumerate(rus):
+            latch_time = monitors(ru, 'ib')[0].latches[-1]
+            np.testing.assert_array_equal(values[i], monitors(ru, 'ib')[0].counters_at(latch_time))
+
+
+if __name__ == '__main__':
+    unittest.main()
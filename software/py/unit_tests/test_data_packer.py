@@ -0,0 +1,42 @@
+#!/usr/bin/env python3.9
+"""Tests of the ITS-UL gearboxes of its-ul/data_packer.py on synthetic pages of random GBT words"""
+
+import logging
+import os
+import sys
+import unittest
+
+from simulated_board import report, script_path, timed
+
+sys.path.append(os.path.join(script_path, '../its-ul'))
+from data_packer import B_PER_GBT_WORD, WORD_SIZE, Packer, synthetic_pages
+
+
+class TestGearbox(unittest.TestCase):
+
+    def setUp(self):
+        self.packer = Packer(logging.getLogger("packer"), filename=os.devnull)
+        self.addCleanup(self.packer.f.close)
+
+    def round_trip(self, data):
+        packed = self.packer.gearbox80128(data)
+        nwords = len(data)//B_PER_GBT_WORD
+        self.assertEqual(len(packed), -(-nwords*WORD_SIZE//16)*16)
+        self.assertEqual(self.packer.gearbox12880(packed), data)
+        return packed
+
+    def test_word_counts(self):
+        """Pages of one to three cycles of 8 words, ending at every position of the cycle"""
+        for page in synthetic_pages(1, seed=1):
+            for nwords in range(1, 25):
+                with self.subTest(nwords=nwords):
+                    self.round_trip(page[:nwords*B_PER_GBT_WORD])
+
+    def test_round_trip(self):
+        data = synthetic_pages(200)
+        _, duration = timed(lambda: [self.round_trip(page) for page in data])
+        report(f"Round trip of {len(data)} pages ({sum(len(page) for page in data)/1e6:.1f} MB) in {duration:.2f} s")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3.9
+"""Tests of the dcol test scan (dcol_tester.py) on simulated RUs and staves.
+
+The ALPIDE control of each simulated RU writes by broadcast to a simulated stave: the pixel matrices of
+its chips, which give hits for the pulsed pixels when the sequencer starts in triggered mode,
+with some dead, inefficient and noisy double columns.
+The GBT packers count the packets of the timeframes of the sequencer as they are sent.
+"""
+
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedChips, SimulatedModule, counter_decoder, make_stave_ru, report, timed
+
+import trigger_handler
+from ru_calibration_lane import CalibrationLaneAddress
+from pALPIDE import ALPIDE_COLS, ALPIDE_ROWS, Addr, Alpide, ModeControlChipModeSelector
+from ru_board import XckuModuleid
+from testbench import LayerList
+from trigger_handler import WsTriggerHandlerAddress
+
+from dcol_efficiency import ALPIDE_DCOLS, CHIP_PER_LANE, DcolEfficiency
+from dcol_tester import DColTester
+
+LANES_PER_RU = 2
+LATENCY = 0.5e-3
+NINJ = 21
+HBF_PER_TF = 1
+TF_PERIOD = HBF_PER_TF*3564*25e-9
+
+# (chip in RU, dcol): efficiency of the faulty double columns, a noisy one fires twice per injection
+DEAD, INEFFICIENT, NOISY = (3, 100), (10, 7), (12, 300)
+FAULTS = {DEAD: (0., 1), INEFFICIENT: (0.5, 1), NOISY: (1., 2)}
+
+
+class SimulatedStave(SimulatedChips):
+    """Pixel matrices of the chips of a RU configured by broadcast, giving hits when pulsed"""
+
+    def __init__(self, first_chip, nchips, rng):
+        super(SimulatedStave, self).__init__([])
+        self.chips = np.arange(first_chip, first_chip + nchips)
+        self.rng = rng
+        self.mask = np.ones((ALPIDE_ROWS, ALPIDE_COLS), dtype=bool)
+        self.pulse = np.ones((ALPIDE_ROWS, ALPIDE_COLS), dtype=bool)
+        self.row_select = np.zeros(ALPIDE_ROWS, dtype=bool)
+        self.col_select = np.zeros(ALPIDE_COLS, dtype=bool)
+        self.pixel_cfg = 0
+        self.mode = ModeControlChipModeSelector.CONFIGURATION
+        self.efficiency = np.full((nchips, ALPIDE_DCOLS), 0.999)
+        self.multiplicity = np.ones((nchips, ALPIDE_DCOLS), dtype=np.int64)
+        for (chip, dcol), (efficiency, multiplicity) in FAULTS.items():
+            self.efficiency[chip, dcol] = efficiency
+            self.multiplicity[chip, dcol] = multiplicity
+        self.writes = []
+        self.errors = []
+        self.hits = []
+
+    def write(self, chipid, address, data, now):
+        if chipid != 0xF:
+            self.errors.append(f"Write to chip {chipid}, only broadcast writes are simulated")
+            return
+        self.writes.append((address, data))
+        if address == Addr.MODE_CTRL:
+            self.mode = data & 0x3
+        elif address == Addr.PIXEL_CFG:
+            self.pixel_cfg = data
+        elif (address >> 8) & 0x7 == 0b100:  # row and column select of the pixel matrix
+            sub_addr = address & 0xFF
+            regions = range(32) if sub_addr & (1<<7) else [address >> 11]
+            bits = np.array([(data >> i) & 1 for i in range(16)], dtype=bool)
+            for region in regions:
+                if sub_addr & (1<<2):
+                    self.row_select[region*16:(region + 1)*16] = bits
+                if sub_addr & (1<<0):
+                    self.col_select[region*32:region*32 + 16] = bits
+                if sub_addr & (1<<1):
+                    self.col_select[region*32 + 16:(region + 1)*32] = bits
+            flip_flop = self.pulse if self.pixel_cfg & 1 else self.mask
+            flip_flop[np.ix_(self.row_select, self.col_select)] = bool(self.pixel_cfg >> 1 & 1)
+
+    def inject(self, ninj, user_field):
+        if self.mode != ModeControlChipModeSelector.TRIGGERED:
+            self.errors.append(f"Injection of row {user_field} in mode {self.mode}")
+            return
+        pulsed = self.pulse & ~self.mask
+        rows = np.nonzero(pulsed.any(axis=1))[0].tolist()
+        if rows != [user_field & 0xFFFF]:
+            self.errors.append(f"Rows {rows} pulsed with the calibration data word of row {user_field & 0xFFFF}")
+        pixels = pulsed.sum(axis=0)  # per column
+        efficiency = np.repeat(self.efficiency, 2, axis=1)
+        count = self.rng.binomial(ninj*pixels[np.newaxis, :], efficiency)*np.repeat(self.multiplicity, 2, axis=1)
+        chip, col = np.nonzero(count)
+        self.hits.append((self.chips[chip], col, count[chip, col]))
+
+    def get_hits(self):
+        """Returns the (chip index, column, count) of the hits since the previous call"""
+        hits, self.hits = self.hits, []
+        if not hits:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return tuple(np.concatenate(h) for h in zip(*hits))
+
+
+class SimulatedSequencer(SimulatedModule):
+    """Trigger handler sequencer sending a timeframe every TF_PERIOD and injecting the stave with the
+    user field of the calibration lane when started"""
+
+    def __init__(self, stave, calibration_lane):
+        super(SimulatedSequencer, self).__init__()
+        self.stave = stave
+        self.calibration_lane = calibration_lane
+        self.sequences = []  # (start, number of timeframes)
+
+    def packets(self, now):
+        return sum(min(ntf, int((now - start)/TF_PERIOD)) for start, ntf in self.sequences)
+
+    def write(self, address, data, now):
+        if address == WsTriggerHandlerAddress.SEQ_NUM_TF:
+            self.sequences.append((now, data))
+            user_field = sum(self.calibration_lane.registers.get(CalibrationLaneAddress.USER_FIELD_0 + i, 0) << 16*i
+                             for i in range(3))
+            self.stave.inject(data, user_field)
+        else:
+            super(SimulatedSequencer, self).write(address, data, now)
+
+    def read(self, address, now):
+        if address == WsTriggerHandlerAddress.SEQ_NUM_TF:
+            return sum(max(0, ntf - int((now - start)/TF_PERIOD)) for start, ntf in self.sequences)
+        return super(SimulatedSequencer, self).read(address, now)
+
+
+class SimulatedPackerMonitor(SimulatedModule):
+    """GBT packer monitor counting a packet per timeframe of the sequencer, the first monitor latches the three.
+    The third packer is unused for the MIDDLE/OUTER layers"""
+
+    def __init__(self, monitor, sequencer, start, unused=False):
+        super(SimulatedPackerMonitor, self).__init__()
+        self.sequencer = sequencer
+        self.start = start
+        self.unused = unused
+        self.decode = counter_decoder(monitor, ['PACKET_DONE'])
+        self.slaves = []
+        self.latched = np.array([start])
+
+    def latch(self, now):
+        packets = 0 if self.unused else self.sequencer.packets(now)
+        self.latched = np.array([(self.start + packets) % (1 << 32)])
+
+    def write(self, address, data, now):
+        if address == 0:
+            for monitor in [self] + self.slaves:
+                monitor.latch(now)
+
+    def read(self, address, now):
+        return self.decode(address, self.latched)
+
+
+def make_ru_with_stave(gbt_channel, layer, packet_done_start):
+    stave = SimulatedStave(gbt_channel*LANES_PER_RU*CHIP_PER_LANE, LANES_PER_RU*CHIP_PER_LANE,
+                           np.random.default_rng(gbt_channel))
+    ru = make_stave_ru(stave, latency=LATENCY, gbt_channel=gbt_channel)
+    comm = ru.comm
+    calibration_lane = comm.add_module(XckuModuleid.CALIBRATION_LANE, SimulatedModule())
+    sequencer = comm.add_module(XckuModuleid.TRIGGER_HANDLER, SimulatedSequencer(stave, calibration_lane))
+    monitors = [comm.add_module(monitor.moduleid, SimulatedPackerMonitor(monitor, sequencer, packet_done_start,
+                                                                          unused=i == 2 and layer != LayerList.INNER))
+                for i, monitor in enumerate([ru._gbt_packer_0_monitor, ru._gbt_packer_1_monitor, ru._gbt_packer_2_monitor])]
+    monitors[0].slaves += monitors[1:]
+    return ru, stave
+
+
+class SimulatedTestbench(object):
+    """Testbench setting the mode of the chips by broadcast"""
+
+    def __init__(self, rdo_list):
+        self.rdo_list = rdo_list
+
+    def set_chips_in_mode(self, mode, LinkSpeed, enable_clock_gating=False, enable_skew_start_of_readout=False,
+                          enable_clustering=True, rdo=None, silent=False, excluded_chipid_ext=[], only_masters=False):
+        Alpide(rdo, chipid=0xF).setreg_mode_ctrl(ChipModeSelector=mode, EnClustering=int(enable_clustering),
+                                                 MatrixROSpeed=1, IBSerialLinkSpeed=LinkSpeed, EnSkewGlobalSignals=0,
+                                                 EnSkewStartReadout=int(enable_skew_start_of_readout),
+                                                 EnReadoutClockGating=int(enable_clock_gating), EnReadoutFromCMU=0)
+
+
+def make_tester(nrus, layer=LayerList.INNER, packet_done_start=0):
+    rdo_list, staves = zip(*[make_ru_with_stave(i, layer, packet_done_start) for i in range(nrus)])
+    tester = DColTester(testbench=SimulatedTestbench(list(rdo_list)))
+    config = tester.config
+    config.NINJ = NINJ
+    config.TRIGGER_HBF_PER_TF = HBF_PER_TF
+    config.TRIGGER_PERIOD_BC = 3564
+    config.TRIGGER_SOURCE = trigger_handler.TriggerSource.SEQUENCER
+    config.DRY = False
+    config.LAYER = layer
+    config.STEP_ROWS = 1
+    config.GTH_ACTIVE = True
+    config.GPIO_ACTIVE = False
+    config.LINK_SPEED = 3
+    config.SENSOR_CLOCK_GATING = False
+    config.SENSOR_SKEW_START_OF_READOUT = False
+    config.SENSOR_CLUSTERING = True
+    tester.hit_source = lambda: tuple(np.concatenate(h) for h in zip(*[stave.get_hits() for stave in staves]))
+    return tester, list(staves), list(rdo_list)
+
+
+def row_by_row_writes(rows):
+    """Chip writes of the row by row configuration moving the pulsing from row to row"""
+    stave = SimulatedStave(0, LANES_PER_RU*CHIP_PER_LANE, np.random.default_rng(0))
+    ch = Alpide(make_stave_ru(stave), chipid=0xF)
+    for irow in range(1, rows):
+        ch.pulse_row_disable(irow - 1, commitTransaction=False)
+        ch.pulse_row_enable(irow)
+    return stave.writes
+
+
+class TestDColTester(unittest.TestCase):
+    NRUS = 3
+    ROWS = 16
+
+    def scan(self, layer, packet_done_start=0):
+        tester, staves, rdo_list = make_tester(self.NRUS, layer, packet_done_start)
+        _, start_time = timed(tester.scan_start)
+        flushes = sum(rdo.comm.flushes for rdo in rdo_list)
+        _, rows_time = timed(lambda: [tester.scan_row(irow) for irow in range(self.ROWS)])
+        self.assertTrue(tester.test_pass, "Row not completed")
+        for stave in staves:
+            self.assertEqual(stave.errors, [])
+            self.assertFalse(stave.mask.any())
+            self.assertTrue(stave.pulse[self.ROWS - 1].all())
+            self.assertEqual(stave.pulse.sum(), ALPIDE_COLS)
+        report(f"{self.NRUS} RUs, {LATENCY*1e3} ms round trip, {NINJ} injections per row: scan start {start_time*1e3:.1f} ms, "
+               f"per row {rows_time/self.ROWS*1e3:.2f} ms, "
+               f"{(sum(rdo.comm.flushes for rdo in rdo_list) - flushes)/self.ROWS/self.NRUS:.1f} round trips per RU")
+        return tester, staves, rdo_list
+
+    def test_scan(self):
+        # 3 injections before the 32 bit wraparound of PACKET_DONE
+        tester, staves, rdo_list = self.scan(LayerList.INNER, packet_done_start=(1 << 32) - 3)
+        # The same chip writes for the row transitions as the row by row configuration
+        row_writes = [w for w in staves[0].writes if w[0] != Addr.MODE_CTRL][-8*(self.ROWS - 1):]
+        self.assertEqual(row_writes, row_by_row_writes(self.ROWS))
+        self.assertEqual(row_writes, [w for regs in tester.row_regs[1:self.ROWS] for w in regs])
+        packets = rdo_list[0].comm.modules[XckuModuleid.GBT_PACKER_0_MONITOR].latched[0]
+        self.assertEqual(packets, self.ROWS*NINJ - 3)
+        self.assertEqual(tester.gbt_packer_packet_done_counter[0][0], packets)
+
+        # Faulty double columns found, only the ones of the chips read out considered
+        efficiency = tester.efficiency
+        self.assertEqual(efficiency.expected, 2*NINJ*self.ROWS)
+        expected = {}
+        for i in range(self.NRUS):
+            for chip, dcol in sorted(FAULTS):
+                expected.setdefault(i*LANES_PER_RU*CHIP_PER_LANE + chip, []).append(dcol)
+        chips = range(self.NRUS*LANES_PER_RU*CHIP_PER_LANE)
+        self.assertEqual(dict(efficiency.get_bad_dcols(chips=chips)), expected)
+        self.assertEqual(efficiency.get_bad_dcols(chips=[0]), {})
+
+    def test_scan_outer_layer(self):
+        """The unused third packer does not block the rows"""
+        self.scan(LayerList.OUTER)
+
+
+class TestDcolEfficiency(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertTrue(np.isnan(DcolEfficiency().get_efficiency()).all())
+
+    def test_hitmap_blocks(self):
+        """A stave hitmap gives the same efficiency in any chunks as its hits"""
+        rng = np.random.default_rng(0)
+        hitmap = rng.poisson(0.2, size=(LANES_PER_RU*ALPIDE_ROWS, CHIP_PER_LANE*ALPIDE_COLS))
+        by_hits, by_blocks = DcolEfficiency(), DcolEfficiency()
+        lane_row, col = np.nonzero(hitmap)
+        by_hits.add_hits((lane_row//ALPIDE_ROWS)*CHIP_PER_LANE + col//ALPIDE_COLS, col % ALPIDE_COLS, hitmap[lane_row, col])
+        for first_row in range(0, hitmap.shape[0], 300):
+            by_blocks.add_hitmap_block(first_row, hitmap[first_row:first_row + 300])
+        np.testing.assert_array_equal(by_hits.hits, by_blocks.hits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3.9
+"""Tests of the bulk GBT-SCA ADC acquisition on a simulated SCA behind the Sca_RU wishbone slave"""
+
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedCommunication, SimulatedModule, make_ru, report, timed
+
+from gbt_sca import Sca, ScaAdcCmd, ScaAdcSampler, ScaChannel
+from sca_ru import RuScaReg, Sca_RU
+
+SCA_MODULEID = 0x3C
+
+
+def adc_code(mux, conversion):
+    """Deterministic 12 bit code of a conversion of the channel mux"""
+    return (mux*131 + conversion*7) & 0xFFF
+
+
+class SimulatedScaRu(SimulatedModule):
+    """Sca_RU slave executing the SCA commands written to the HDLC payload registers on a SCA ADC"""
+
+    def __init__(self):
+        super(SimulatedScaRu, self).__init__()
+        self.conversions = 0
+        self._reply = {RuScaReg.CTRL_STATUS: 0, RuScaReg.TRID_CHANNEL: 0, RuScaReg.LENGTH_ERROR: 0,
+                       RuScaReg.DATA_LSB: 0, RuScaReg.DATA_MSB: 0}
+        self._mux = 0
+
+    def write(self, address, data, now):
+        if address == RuScaReg.CTRL_STATUS:
+            if data == 0x4:
+                self._execute()
+        else:
+            super(SimulatedScaRu, self).write(address, data, now)
+
+    def read(self, address, now):
+        return self._reply[address]
+
+    def _execute(self):
+        trid_channel = self.registers.get(RuScaReg.TRID_CHANNEL, 0)
+        command = self.registers.get(RuScaReg.LENGTH_COMMAND, 0) & 0xFF
+        data = self.registers.get(RuScaReg.DATA_MSB, 0) << 16 | self.registers.get(RuScaReg.DATA_LSB, 0)
+        rx_data = 0
+        if trid_channel & 0xFF == ScaChannel.ADC:
+            if command == ScaAdcCmd.ADC_W_MUX:
+                self._mux = data
+            elif command == ScaAdcCmd.ADC_GO:
+                rx_data = adc_code(self._mux, self.conversions)
+                self.conversions += 1
+        self._reply[RuScaReg.CTRL_STATUS] = 0x1
+        self._reply[RuScaReg.TRID_CHANNEL] = trid_channel
+        self._reply[RuScaReg.LENGTH_ERROR] = 4 << 8
+        self._reply[RuScaReg.DATA_LSB] = rx_data & 0xFFFF
+        self._reply[RuScaReg.DATA_MSB] = rx_data >> 16
+
+
+def make_sca(is_on_ruv2_0=True):
+    comm = SimulatedCommunication({SCA_MODULEID: SimulatedScaRu()})
+    return Sca_RU(SCA_MODULEID, make_ru(comm), is_on_ruv2_0=is_on_ruv2_0)
+
+
+class TestScaAdc(unittest.TestCase):
+
+    def test_bulk_read(self):
+        sca = make_sca()
+        channel_by_channel, single_time = timed(lambda: [sca.adc_code_to_float(adc, sca.read_adc_channel(adc.value))
+                                                         for adc in sca.adc_channels])
+        single_round_trips = sca.board.comm.flushes
+        sca = make_sca()
+        values, bulk_time = timed(sca.read_adcs_array)
+        np.testing.assert_allclose(values, channel_by_channel)
+        sca = make_sca()
+        self.assertEqual(list(sca.read_adcs_conv().values()), channel_by_channel)
+        report(f"all SCA ADCs: channel by channel {single_round_trips} round trips {single_time*1e3:.1f} ms, "
+               f"bulk {bulk_time*1e3:.1f} ms")
+
+    def test_conversion(self):
+        """The vectorized conversion equals adc_code_to_float over the full code range"""
+        for is_on_ruv2_0 in [True, False]:
+            sca = make_sca(is_on_ruv2_0)
+            codes = np.arange(4096)
+            for adc in sca.adc_channels:
+                expected = [sca.adc_code_to_float(adc, code) for code in codes]
+                np.testing.assert_allclose(sca.adc_codes_to_float(codes, [adc]), expected, rtol=1e-12, atol=1e-9,
+                                           err_msg=adc.name)
+            self.assertEqual(sca.get_adc_units(), [sca.get_adc_unit_of_measurement(adc) for adc in sca.adc_channels])
+
+    def test_generic_bulk_read(self):
+        """The bulk read of the base class (used by the CRU/FELIX SCAs) equals the pipelined one"""
+        sca = make_sca()
+        channels = [adc.value for adc in sca.adc_channels]
+        self.assertEqual(Sca.read_adc_channels(sca, channels), [adc_code(ch, i) for i, ch in enumerate(channels)])
+        self.assertEqual(sca.read_adc_channels(channels), [adc_code(ch, i + len(channels)) for i, ch in enumerate(channels)])
+
+
+class TestScaAdcSampler(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        nsamples, buffer_size = 50, 16
+        sca = make_sca()
+        adcs = ["T_INT", "V_IN", "I_IN"]
+        sampler = ScaAdcSampler(sca, adcs=adcs, rate=1e4, buffer_size=buffer_size)
+        self.assertEqual(sampler.run(nsamples=nsamples), nsamples)
+        timestamps, values = sampler.get_samples()
+        self.assertEqual(len(timestamps), buffer_size)
+        self.assertEqual(len(values), buffer_size)
+        self.assertTrue(np.all(np.diff(timestamps) >= 0), "Samples not in chronological order")
+        first = nsamples - buffer_size
+        channels = [sca.adc_channels[adc].value for adc in adcs]
+        expected = [sca.adc_codes_to_float([adc_code(ch, (first + s)*len(adcs) + i) for i, ch in enumerate(channels)], adcs)
+                    for s in range(buffer_size)]
+        np.testing.assert_allclose(values, expected)
+        aggregated = sampler.aggregate()
+        self.assertEqual(list(aggregated.keys()), adcs)
+        self.assertEqual(aggregated["V_IN"]["unit"], "V")
+        self.assertEqual(len(sampler.get_samples(since=timestamps[-1])[0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3.9
+"""Tests of the Hameg driver against a simulated HMP4040 on a pty.
+
+The simulated supply answers the SCPI commands used by hameg.py one after the other, each command taking
+a processing time and each query a response latency. Responses can be lost or delayed.
+"""
+
+import os
+import select
+import threading
+import time
+import tty
+import unittest
+
+import numpy as np
+
+from simulated_board import report, timed
+
+from hameg import Hameg, HamegResponseLostError
+
+RESPONSE_LATENCY = 5e-3
+
+
+class SimulatedHameg(object):
+    """SCPI emulation of a HMP4040 on the master side of a pty, port is the slave device"""
+
+    def __init__(self, command_time=1e-3, response_latency=RESPONSE_LATENCY, channels=4):
+        self.command_time = command_time
+        self.response_latency = response_latency
+        self.master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self._slave = slave
+        self.commands = 0
+        self.channel = 1
+        self.voltage = {ch: 0. for ch in range(1, channels+1)}
+        self.current = {ch: 0. for ch in range(1, channels+1)}
+        self.selected = {ch: 0 for ch in range(1, channels+1)}
+        self.load = {ch: 10.*ch for ch in range(1, channels+1)}  # ohm
+        self.output = False
+        self.drop = {}   # {query: number of responses not sent}
+        self.delay = {}  # {query: delay of the next response}
+        self.stall = {}  # {query: time the supply is busy before answering it}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self.master)
+        os.close(self._slave)
+
+    def measured(self, channel):
+        """(voltage, current in A) at the output of the channel"""
+        if not (self.output and self.selected[channel]):
+            return 0., 0.
+        current = min(self.voltage[channel]/self.load[channel], self.current[channel])
+        return current*self.load[channel], current
+
+    def _answer(self, command):
+        channel = self.channel
+        if command == '*IDN?':
+            return 'HAMEG,HMP4040,012345678,HW50020001/SW2.51'
+        elif command.startswith('INST'):
+            self.channel = int(command.split('OUT')[1])
+        elif command.startswith('VOLT '):
+            self.voltage[channel] = float(command.split()[1])
+        elif command.startswith('CURR '):
+            self.current[channel] = float(command.split()[1])
+        elif command == 'VOLT?':
+            return f'{self.voltage[channel]:.3f}'
+        elif command == 'CURR?':
+            return f'{self.current[channel]:.4f}'
+        elif command.startswith('OUTP:SEL '):
+            self.selected[channel] = int(command.endswith('ON'))
+        elif command == 'OUTP:SEL?':
+            return str(self.selected[channel])
+        elif command.startswith('OUTP:GEN '):
+            self.output = command.endswith('ON')
+        elif command == 'MEAS:SCAL:VOLT?':
+            return f'{self.measured(channel)[0]:.3f}'
+        elif command == 'MEAS:CURR?':
+            return f'{self.measured(channel)[1]:.4f}'
+        elif command.startswith('STAT:QUES:INST:ISUM'):
+            return '1024' if self.measured(int(command[19]))[1] >= self.current[int(command[19])] > 0 else '0'
+        return None
+
+    def _run(self):
+        buffer = b''
+        while not self._stop.is_set():
+            if not select.select([self.master], [], [], 0.1)[0]:
+                continue
+            try:
+                buffer += os.read(self.master, 1024)
+            except OSError:
+                break
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                command = line.decode().strip()
+                self.commands += 1
+                time.sleep(self.command_time)
+                response = self._answer(command)
+                if response is None:
+                    continue
+                time.sleep(self.response_latency + self.stall.pop(command, 0.))
+                if self.drop.get(command, 0) > 0:
+                    self.drop[command] -= 1
+                elif command in self.delay:
+                    delay = self.delay.pop(command)
+                    threading.Timer(delay, os.write, (self.master, (response + '\n').encode())).start()
+                else:
+                    os.write(self.master, (response + '\n').encode())
+
+
+class TestHameg(unittest.TestCase):
+
+    def setUp(self):
+        self.supply = SimulatedHameg()
+        self.hameg = Hameg(port=self.supply.port, timeout=0.5)
+        for channel, (voltage, current) in {1: (7., 2.), 2: (1.8, 0.4), 3: (1.8, 0.6), 4: (3.6, 0.05)}.items():
+            self.hameg.configure_channel(channel, voltage, current)
+        self.hameg.activate_channels([1, 2, 3, 4])
+        self.hameg.activate_output(True)
+        self.hameg.get_model()  # the commands are not acknowledged, a query waits for their execution
+        self.expected = {channel: (round(self.supply.measured(channel)[0], 3), round(self.supply.measured(channel)[1]*1000, 3))
+                         for channel in range(1, 5)}
+
+    def tearDown(self):
+        self.hameg.close()
+        self.supply.close()
+
+    def test_configuration(self):
+        self.assertEqual(self.hameg.number_channels, 4)
+        self.assertEqual(self.hameg.get_channel_config(2), (1.8, 0.4, 1))
+        self.assertTrue(self.hameg.get_fuse_triggered(4))
+        self.assertFalse(self.hameg.get_fuse_triggered(1))
+
+    def test_power_values(self):
+        values, duration = timed(self.hameg.get_power_values)
+        self.assertEqual({ch: (round(v, 3), round(c, 3)) for ch, (v, c) in values.items()}, self.expected)
+        report(f"power of 4 channels, {RESPONSE_LATENCY*1e3} ms response latency: {duration*1e3:.0f} ms")
+
+    def test_monitor(self):
+        """The monitor samples at its rate while other threads query the supply"""
+        rate, duration = 10., 1.5
+        monitor = self.hameg.get_monitor(rate=rate, buffer_size=100)
+        errors = []
+
+        def query_configs():
+            try:
+                for _ in range(10):
+                    for channel in range(1, 5):
+                        voltage, current, active = self.hameg.get_channel_config(channel)
+                        self.assertEqual((voltage, active), (self.supply.voltage[channel], 1))
+            except Exception as e:
+                errors.append(e)
+        monitor.start()
+        threads = [threading.Thread(target=query_configs) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        for thread in threads:
+            thread.join()
+        monitor.stop()
+        self.assertEqual(errors, [])
+        timestamps, samples = monitor.get_samples()
+        self.assertTrue(np.all(np.diff(timestamps) > 0))
+        achieved = (len(timestamps) - 1)/(timestamps[-1] - timestamps[0])
+        self.assertGreater(achieved, 0.8*rate, "Monitor slower than its rate")
+        np.testing.assert_allclose(samples, [[self.expected[channel] for channel in range(1, 5)]]*len(timestamps),
+                                   err_msg="Mismatched responses")
+        report(f"monitoring: {len(timestamps)} samples in {timestamps[-1] - timestamps[0]:.1f} s, achieved rate "
+               f"{achieved:.1f} Hz (configured {rate} Hz) while 2 threads queried the configuration")
+
+    def test_lost_and_late_responses(self):
+        """A lost response times out, a late one is discarded and the next queries are correct"""
+        self.supply.drop['MEAS:CURR?'] = 1
+        with self.assertRaises(TimeoutError):
+            self.hameg.get_current(1)
+        self.assertEqual(self.hameg.get_voltage(2), self.expected[2][0])
+        self.supply.delay['MEAS:SCAL:VOLT?'] = 0.8
+        with self.assertRaises(TimeoutError):
+            self.hameg.get_voltage(3)
+        self.assertEqual(self.hameg.get_power_values(), self.hameg.get_power_values())
+        self.assertEqual(self.hameg.get_power_values()[3], self.expected[3])
+
+    def test_response_lost_after_timeout(self):
+        """The queries sent after a timed out one fail as lost, not as timed out"""
+        self.supply.stall['MEAS:CURR?'] = 0.8
+        errors = []
+
+        def query():
+            time.sleep(0.1)
+            try:
+                self.hameg.get_voltage(2)
+            except Exception as e:
+                errors.append(e)
+        thread = threading.Thread(target=query)
+        thread.start()
+        with self.assertRaises(TimeoutError):
+            self.hameg.get_current(1)
+        thread.join()
+        self.assertEqual([type(e) for e in errors], [HamegResponseLostError])
+        self.assertEqual(self.hameg.get_voltage(2), self.expected[2][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3.9
+"""Tests of the vectorized hitmap loader of the FHR/threshold analysis scripts (ib_tools/analysis/hitmap.py).
+
+Synthetic decoder files ([512, nchips*1024] row major) are loaded as [nchips, 512, 1024] chip maps,
+which must be identical byte for byte to the maps the analysis scripts filled pixel by pixel.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from simulated_board import report, script_path, timed
+
+sys.path.append(os.path.join(script_path, '../ib_tools/analysis'))
+from hitmap import NCOLS, NROWS, load_chip_maps, load_raw, to_chip_maps
+
+
+def chip_maps(data, nchips):
+    """Maps of the chips of the [NROWS, nchips*NCOLS] data: chip i is the columns [i*NCOLS, (i+1)*NCOLS)"""
+    return np.stack([data[:, i*NCOLS:(i + 1)*NCOLS] for i in range(nchips)])
+
+
+def write(directory, name, array, trailing=b''):
+    filename = os.path.join(directory, name)
+    with open(filename, 'wb') as f:
+        f.write(array.tobytes())
+        f.write(trailing)
+    return filename
+
+
+class TestHitmapLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def assertSameBytes(self, a, b):
+        self.assertEqual((a.dtype, a.shape), (b.dtype, b.shape))
+        self.assertEqual(np.ascontiguousarray(a).tobytes(), np.ascontiguousarray(b).tobytes())
+
+    def test_hit_counts(self):
+        """3 chips of hit counts (fhrana_c.py), with a partial trailing item ignored as by np.fromfile"""
+        hits = self.rng.poisson(0.05, size=(NROWS, 3*NCOLS)).astype(np.uint32)
+        hits[self.rng.integers(NROWS, size=50), self.rng.integers(3*NCOLS, size=50)] = \
+            self.rng.integers(10, 1 << 32, size=50, dtype=np.uint64)
+        filename = write(self.directory, 'hitmap.dat', hits, trailing=b'\x01\x02')
+        expected = chip_maps(hits, 3)
+        maps = load_chip_maps(filename)
+        self.assertSameBytes(maps, expected)
+        self.assertSameBytes(to_chip_maps(load_raw(filename, mmap=False)), expected)
+        with subprocess.Popen(['cat', filename], stdout=subprocess.PIPE) as cat:
+            self.assertSameBytes(load_chip_maps(f"/dev/fd/{cat.stdout.fileno()}"), expected)
+        self.assertTrue(isinstance(maps.base, np.memmap) or isinstance(maps.base.base, np.memmap), "Maps are not memory mapped")
+        # Copy-on-write: the analysis can modify the maps, the file is untouched
+        maps[0, 0, 0] += 1
+        self.assertSameBytes(load_chip_maps(filename), expected)
+
+    def test_thresholds(self):
+        """9 chips of thresholds (thrana_c.py) and .npy files (fhr.py), already [nchips, NROWS, NCOLS]"""
+        thresholds = self.rng.normal(100, 10, size=(NROWS, 9*NCOLS)).astype(np.float32)
+        filename = write(self.directory, 'thrmap.dat', thresholds)
+        expected = chip_maps(thresholds, 9)
+        self.assertSameBytes(load_chip_maps(filename, dtype=np.float32, nchips=9), expected)
+        filename = os.path.join(self.directory, 'thrmap.npy')
+        np.save(filename, expected)
+        self.assertSameBytes(load_chip_maps(filename), expected)
+
+    def test_large_file(self):
+        """Only the accessed chip is read"""
+        nchips = 27
+        stave = np.zeros((NROWS, nchips*NCOLS), dtype=np.uint32)
+        stave[:, -NCOLS:] = np.arange(NROWS*NCOLS, dtype=np.uint32).reshape(NROWS, NCOLS)
+        filename = write(self.directory, 'stave.dat', stave)
+        del stave
+        maps, load_time = timed(load_chip_maps, filename)
+        (last, hits), access_time = timed(lambda: (maps[-1], int(maps[-1].sum())))
+        self.assertEqual(maps.shape, (nchips, NROWS, NCOLS))
+        self.assertEqual(hits, (NROWS*NCOLS - 1)*NROWS*NCOLS // 2)
+        self.assertEqual(last[3, 5], 3*NCOLS + 5)
+        report(f"{nchips} chips ({os.path.getsize(filename)/2**20:.0f} MiB): loader {load_time*1e3:.3f} ms, "
+               f"sum of the last chip {access_time*1e3:.1f} ms")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3.9
+"""Tests of the Prometheus metrics exporter on simulated RUs"""
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+from simulated_board import SimulatedCommunication, make_ru, report, script_path, simulate_counter_monitor
+
+from metrics_exporter import MetricsExporter, MetricsRegistry
+
+TH_RATES = {'TRIGGER_SENT': 2e5, 'PROCESSED_TRIGGERS': 2e5, 'HB': 11245., 'HBR': 1245., 'PHYSICS': 2e5, 'TF': 44.}
+LATENCY = 1e-3
+
+
+def make_testbench(nrus):
+    rdo_list = []
+    for i in range(nrus):
+        comm = SimulatedCommunication(latency=LATENCY)
+        rdo = make_ru(comm, gbt_channel=i)
+        simulate_counter_monitor(comm, rdo._trigger_handler_monitor, TH_RATES)
+        rdo_list.append(rdo)
+    return SimpleNamespace(rdo_list=rdo_list, cru=None)
+
+
+def parse(text):
+    """Returns {(name, labels): value} of the Prometheus text format"""
+    ret = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        metric, value = line.rsplit(' ', 1)
+        name, _, labels = metric.partition('{')
+        ret[(name, labels.rstrip('}'))] = float(value)
+    return ret
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_counter(self):
+        registry = MetricsRegistry()
+        registry.counter("its_counter", 100, timestamp=10., ru=1)
+        registry.counter("its_counter", 150, timestamp=12., ru=1)
+        registry.counter("its_counter", 20, timestamp=13., ru=2)
+        metrics = parse(registry.render())
+        self.assertEqual(metrics[('its_counter_total', 'ru="1"')], 150)
+        self.assertEqual(metrics[('its_counter_delta', 'ru="1"')], 50)
+        self.assertEqual(metrics[('its_counter_rate', 'ru="1"')], 25)
+        self.assertNotIn(('its_counter_delta', 'ru="2"'), metrics, "First value of a counter has no delta")
+        # reset or wraparound: the delta restarts from the new value
+        registry.counter("its_counter", 30, timestamp=14., ru=1)
+        self.assertEqual(parse(registry.render())[('its_counter_delta', 'ru="1"')], 30)
+
+    def test_render(self):
+        registry = MetricsRegistry()
+        registry.gauge("its.temperature", 42.5, ru='a"b')
+        registry.add("its_polls_total", 1, group="pu")
+        registry.add("its_polls_total", 2, group="pu")
+        text = registry.render()
+        self.assertIn("# TYPE its_temperature gauge\n", text)
+        self.assertIn('its_temperature{ru="a\\"b"} 42.5\n', text)
+        self.assertIn('its_polls_total{group="pu"} 3\n', text)
+
+
+class TestMetricsExporter(unittest.TestCase):
+
+    def test_import(self):
+        """The exporter can be started from any directory"""
+        ret = subprocess.run([sys.executable, '-c', 'import metrics_exporter'], cwd='/',
+                             env=dict(os.environ, PYTHONPATH=os.path.join(script_path, '..')),
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.assertEqual(ret.returncode, 0, ret.stdout.decode())
+
+    def test_poll(self):
+        tb = make_testbench(2)
+        exporter = MetricsExporter(tb, periods={"trigger_handler": 1.})
+        exporter._start_time = time.time()
+        exporter.poll("trigger_handler")
+        time.sleep(0.1)
+        exporter.poll("trigger_handler")
+        metrics = parse(exporter.registry.render())
+        for ru in range(2):
+            for counter, rate in TH_RATES.items():
+                labels = f'ru="{ru}",counter="{counter}"'
+                self.assertGreater(metrics[('its_ru_trigger_handler_total', labels)], 0)
+                # host timestamps of the polls, not of the latches
+                self.assertLess(abs(metrics[('its_ru_trigger_handler_rate', labels)] - rate), 0.2*rate + 20, labels)
+        self.assertEqual(metrics[('its_exporter_polls_total', 'group="trigger_handler"')], 2)
+        tb.rdo_list[1].comm.fail_reads = 1
+        with self.assertLogs('MetricsExporter', level='WARNING'):
+            exporter.poll("trigger_handler")
+        self.assertEqual(parse(exporter.registry.render())[('its_exporter_poll_errors_total', 'group="trigger_handler"')], 1)
+
+    def test_duty_cycle(self):
+        """Polling as fast as possible is limited to max_duty_cycle"""
+        max_duty_cycle = 0.2
+        exporter = MetricsExporter(make_testbench(4), periods={"trigger_handler": 1e-3, "sysmon": 1e-3},
+                                   max_duty_cycle=max_duty_cycle)
+        duration = 0.5
+        exporter.run(duration=duration)
+        duty_cycle = parse(exporter.registry.render())[('its_exporter_duty_cycle', '')]
+        self.assertLess(duty_cycle, max_duty_cycle*1.1)
+        self.assertGreater(duty_cycle, max_duty_cycle*0.5)
+        report(f"duty cycle {duty_cycle:.3f} with max_duty_cycle {max_duty_cycle}")
+
+    def test_server(self):
+        exporter = MetricsExporter(make_testbench(1), port=0)
+        exporter._start_time = time.time()
+        exporter.poll("trigger_handler")
+        exporter.start_server()
+        try:
+            url = f"http://127.0.0.1:{exporter._server.server_address[1]}"
+            with urllib.request.urlopen(url + "/metrics") as response:
+                self.assertEqual(response.status, 200)
+                self.assertEqual(parse(response.read().decode()), parse(exporter.registry.render()))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(url + "/other")
+            self.assertEqual(context.exception.code, 404)
+        finally:
+            exporter.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
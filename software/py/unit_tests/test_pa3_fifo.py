@@ -0,0 +1,291 @@
+#!/usr/bin/env python3.9
+"""Tests of the bulk PA3 FIFO writer through the CRU and FELIX SWT communications.
+
+The SWT interface of the CRU and FELIX cards is emulated by a register file: the SWT messages written
+to the TX registers are executed by a model of the PA3 FIFO and PA3 FIFO monitor wishbone slaves, and
+the read results are returned through the RX registers, so that the actual CruSwtCommunication,
+FlxSwtCommunication, Pa3Fifo and Pa3FifoMonitor are used.
+The PA3 reads the FIFO at a given rate and the FIFO counts an overflow when written while full.
+"""
+
+import os
+import sys
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import make_ru, modules_path, report, timed
+
+sys.path.append(os.path.join(modules_path, '../../../cru_support_software/software/py/'))
+sys.path.append(os.path.join(modules_path, '../../../felix-sw/software/py/'))
+from cru_swt_communication import CruSwtAddress, CruSwtCommunication
+from flx_swt_communication import FlxSwtAddress, FlxSwtCommunication
+from pa3_fifo import Pa3FifoAddress, Pa3FifoError
+from pa3_fifo_monitor import Pa3FifoMonitorAddress
+from ru_board import XckuModuleid
+
+GBT_CHANNEL = 3
+
+
+class SimulatedPa3FifoRu(object):
+    """PA3 FIFO and PA3 FIFO monitor wishbone slaves, the PA3 reading the FIFO at read_rate words/s (None: instantly)"""
+
+    def __init__(self, depth=1024, read_rate=None):
+        self.depth = depth
+        self.read_rate = read_rate
+        self.fifo = []   # words not read by the PA3 yet
+        self.flash = []  # words read by the PA3
+        self.counters = dict.fromkeys(['FIFO_WRITE', 'FIFO_READ', 'FIFO_UNDERFLOW', 'FIFO_OVERFLOW'], 0)
+        self.latched = dict(self.counters)
+        self.max_level = 0
+        self.registers = {}
+        self._last_read = time.perf_counter()
+
+    def _pa3_read(self):
+        now = time.perf_counter()
+        if self.read_rate is None:
+            n = len(self.fifo)
+        else:
+            n = min(len(self.fifo), int((now - self._last_read)*self.read_rate))
+        if n or not self.fifo:
+            self._last_read = now
+        self.flash += self.fifo[:n]
+        del self.fifo[:n]
+        self.counters['FIFO_READ'] += 2*n
+
+    def written(self):
+        """Words written to the FIFO, read by the PA3 or not"""
+        return self.flash + self.fifo
+
+    def swt(self, msg):
+        """Executes a SWT, returns the response or None"""
+        module = (msg >> 24) & 0x7F
+        address = (msg >> 16) & 0xFF
+        data = msg & 0xFFFF
+        self._pa3_read()
+        if msg >> 31:
+            if module == XckuModuleid.PA3_FIFO and address == Pa3FifoAddress.WR_FIFO_DATA:
+                self.counters['FIFO_WRITE'] += 1
+                if len(self.fifo) >= self.depth:
+                    self.counters['FIFO_OVERFLOW'] += 1
+                else:
+                    self.fifo.append(data)
+                    self.max_level = max(self.max_level, len(self.fifo))
+            elif module == XckuModuleid.PA3_FIFO_MONITOR and address == Pa3FifoMonitorAddress.LATCH_COUNTERS:
+                self.latched = dict(self.counters)
+            elif module == XckuModuleid.PA3_FIFO_MONITOR and address == Pa3FifoMonitorAddress.RESET_COUNTERS:
+                self.counters = dict.fromkeys(self.counters, 0)
+            else:
+                self.registers[(module, address)] = data
+            return None
+        if module == XckuModuleid.PA3_FIFO_MONITOR:
+            data = self.latched[Pa3FifoMonitorAddress(address).name] & 0xFFFF
+        else:
+            data = self.registers.get((module, address), 0)
+        return module << 24 | address << 16 | data
+
+
+class SimulatedSwtRegisters(object):
+    """Register file of the SWT interface of a CRU or FELIX card"""
+
+    def __init__(self, ru, addresses, words_available_shift, write_on_control):
+        self.ru = ru
+        self.addresses = addresses
+        self.shift = words_available_shift
+        self.write_on_control = write_on_control
+        self.writes = 0
+        self.reads = 0
+        self.rx = []
+        self.tx_low = 0
+        self.rx_low = 0
+        self.rx_counter = 0
+
+    def _send(self, msg):
+        response = self.ru.swt(msg)
+        if response is not None:
+            self.rx.append(response)
+
+    def register_write(self, reg, data):
+        self.writes += 1
+        if reg == self.addresses.TX_LOW:
+            self.tx_low = data
+            if not self.write_on_control:
+                self._send(data)
+        elif reg == self.addresses.SWT_CONTROL:
+            if data == 1 and self.write_on_control:
+                self._send(self.tx_low)
+            elif data == 2:  # FELIX read enable
+                self.rx_low = self.rx.pop(0)
+                self.rx_counter = (self.rx_counter + 1) & 0xF
+
+    def register_read(self, reg):
+        self.reads += 1
+        if reg == self.addresses.SWT_MONITOR:
+            return len(self.rx) << self.shift
+        elif reg == self.addresses.RX_LOW:
+            if self.write_on_control:
+                return self.rx_low
+            return self.rx.pop(0)
+        elif reg == self.addresses.RX_HI:
+            return self.rx_counter << 12
+        return 0
+
+
+class SimulatedCru(object):
+    def __init__(self, ru):
+        self._roc = SimulatedSwtRegisters(ru, CruSwtAddress, 16, False)
+
+    def roc_write(self, reg, data, channel=None):
+        self._roc.register_write(reg, data)
+
+    def roc_read(self, reg, channel=None):
+        return self._roc.register_read(reg)
+
+    def _lock_comm(self):
+        return True
+
+    def _unlock_comm(self, force=False):
+        return True
+
+    def _is_lla_locked(self):
+        return True
+
+
+class SimulatedFlx(object):
+    def __init__(self, ru):
+        self._roc = SimulatedSwtRegisters(ru, FlxSwtAddress, 52, True)
+        self._selected_gbt_channel = GBT_CHANNEL
+        self._prev_swt_cntr = None
+
+    def roc_write(self, reg, data):
+        self._roc.register_write(reg, data)
+
+    def roc_read(self, reg):
+        return self._roc.register_read(reg)
+
+    def _lock_comm(self):
+        pass
+
+    def _unlock_comm(self, force=False):
+        pass
+
+    def set_gbt_channel(self, gbt_channel=0):
+        self._selected_gbt_channel = gbt_channel
+
+    def set_prev_swt_cntr(self, cntr_val):
+        self._prev_swt_cntr = cntr_val
+
+    def get_prev_swt_cntr(self):
+        return self._prev_swt_cntr
+
+
+def make_board(card, depth=1024, read_rate=None):
+    """Returns the RU, the simulated PA3 FIFO and the SWT registers of the card"""
+    simulated = SimulatedPa3FifoRu(depth=depth, read_rate=read_rate)
+    if card == "cru":
+        card_obj = SimulatedCru(simulated)
+        comm = CruSwtCommunication(card_obj, gbt_channel=GBT_CHANNEL)
+    else:
+        card_obj = SimulatedFlx(simulated)
+        comm = FlxSwtCommunication(card_obj, gbt_channel=GBT_CHANNEL)
+    return make_ru(comm), simulated, card_obj._roc
+
+
+def word_by_word_write(ru, card, data):
+    """Word by word transfer with the optimized single word writes"""
+    write_f = ru.pa3fifo.write_data_to_fifo_opt if card == "cru" else ru.pa3fifo.write_data_to_fifo_opt_flx
+    for i in range(0, len(data), 2):
+        write_f(int().from_bytes(data[i:i+2], 'little'))
+
+
+class TestPa3FifoBulk(unittest.TestCase):
+    KBYTES = 64
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.data = bytearray(rng.integers(0, 256, self.KBYTES*1024, dtype=np.uint8).tobytes())
+        self.expected = np.frombuffer(bytes(self.data), dtype='<u2').tolist()
+
+    def check_bulk(self, card, max_ratio):
+        nwords = len(self.expected)
+        ru, simulated, roc = make_board(card)
+        _, word_by_word_time = timed(word_by_word_write, ru, card, self.data)
+        self.assertEqual(simulated.written(), self.expected)
+        word_by_word_accesses = roc.writes + roc.reads
+
+        ru, simulated, roc = make_board(card)
+        # transactions queued before the transfer are kept for the next flush
+        ru.comm.register_write(XckuModuleid.IDENTITY, 0, 0xCAFE)
+        ru.comm.register_read(XckuModuleid.IDENTITY, 0)
+        sent, bulk_time = timed(ru.pa3fifo.write_data_to_fifo_bulk, self.data)
+        self.assertEqual(sent, nwords)
+        self.assertEqual(simulated.written(), self.expected)
+        self.assertNotIn((XckuModuleid.IDENTITY, 0), simulated.registers, "Queued write sent by the bulk transfer")
+        self.assertEqual(ru.comm.flush_and_read_results(), [(XckuModuleid.IDENTITY << 8, 0xCAFE)])
+        counters = ru.pa3fifo.read_counters()
+        self.assertEqual(counters['FIFO_WRITE'], nwords % 2**16)
+        self.assertEqual(counters['FIFO_READ'], 2*nwords % 2**16)
+        self.assertEqual(counters['FIFO_OVERFLOW'], 0)
+        bulk_accesses = roc.writes + roc.reads
+        self.assertLess(bulk_accesses, max_ratio*word_by_word_accesses)
+        report(f"{card}: {nwords} words word by word {word_by_word_time:.2f} s "
+               f"({word_by_word_accesses/nwords:.2f} accesses/word), bulk {bulk_time:.2f} s ({bulk_accesses/nwords:.2f} accesses/word)")
+
+    def test_bulk_cru(self):
+        self.check_bulk("cru", 0.6)
+
+    def test_bulk_flx(self):
+        # the FELIX needs the SWT_CONTROL pulse for each word in both cases
+        self.check_bulk("flx", 1.02)
+
+    def test_flow_control(self):
+        """The transfer is paced by the PA3 reading the FIFO slower than it is written"""
+        depth, read_rate = 512, 100e3
+        nwords = 8*1024
+        ru, simulated, _ = make_board("cru", depth=depth, read_rate=read_rate)
+        sent, paced_time = timed(ru.pa3fifo.write_data_to_fifo_bulk, self.data[:2*nwords], max_in_flight=depth)
+        self.assertEqual(sent, nwords)
+        self.assertEqual(simulated.written(), self.expected[:nwords])
+        self.assertEqual(simulated.counters['FIFO_OVERFLOW'], 0)
+        self.assertLessEqual(simulated.max_level, depth)
+        self.assertGreater(paced_time, 0.8*(nwords - depth)/read_rate)
+        ru, simulated, _ = make_board("cru", depth=depth, read_rate=read_rate)
+        with self.assertRaises(Pa3FifoError):
+            ru.pa3fifo.write_data_to_fifo_bulk(self.data[:2*nwords], max_in_flight=None)
+        self.assertGreater(simulated.counters['FIFO_OVERFLOW'], 0, "No overflow without flow control")
+        report(f"PA3 reading {read_rate/1e3:.0f} kwords/s, {depth} words FIFO: {nwords} words in {paced_time:.2f} s")
+
+    def test_fifo_smaller_than_assumed(self):
+        """Words dropped by a FIFO shallower than max_in_flight are reported"""
+        ru, simulated, _ = make_board("cru", depth=256, read_rate=10e3)
+        with self.assertRaises(Pa3FifoError):
+            ru.pa3fifo.write_data_to_fifo_bulk(self.data[:2*4096])
+        self.assertGreater(simulated.counters['FIFO_OVERFLOW'], 0)
+
+    def test_queue_swapped_under_lock(self):
+        """The pending transactions are put aside only once the communication is locked"""
+        ru, simulated, _ = make_board("cru", depth=1024, read_rate=1e6)
+        ru.comm.register_write(ru.pa3fifo.moduleid, Pa3FifoAddress.WR_FIFO_DATA, 0x1234)
+        pending = bytes(ru.comm._buffer)
+        lock_comm = ru.comm._lock_comm
+        buffers = []
+        def recording_lock_comm():
+            buffers.append(bytes(ru.comm._buffer))
+            return lock_comm()
+        ru.comm._lock_comm = recording_lock_comm
+        ru.pa3fifo.write_data_to_fifo_bulk(self.data[:2*64])
+        self.assertEqual(buffers[0], pending)
+        self.assertEqual(bytes(ru.comm._buffer), pending)
+
+    def test_fifo_not_read(self):
+        depth = 512
+        ru, simulated, _ = make_board("cru", depth=depth, read_rate=0)
+        with self.assertRaises(TimeoutError):
+            ru.pa3fifo.write_data_to_fifo_bulk(self.data[:4*depth], max_in_flight=depth, timeout=0.2)
+        self.assertEqual(simulated.counters['FIFO_OVERFLOW'], 0)
+        self.assertEqual(len(simulated.fifo), depth)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3.9
+"""Tests of the ring buffers and of the sampling loop shared by the samplers"""
+
+import time
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+
+from simulated_board import report
+
+from periodic_sampler import PeriodicSampler
+
+
+class CountingSampler(PeriodicSampler):
+    """Sample i: timestamp i, values [i, 10*i] of two RUs, failing for the samples in fail"""
+
+    def __init__(self, buffer_size, rate=1e3, fail=()):
+        super(CountingSampler, self).__init__(OrderedDict([('timestamps', ((), np.float64, 0.)),
+                                                           ('values', ((2,), np.int64, -1))]),
+                                              rate=rate, buffer_size=buffer_size)
+        self.fail = set(fail)
+        self.reads = 0
+
+    def _read(self):
+        i = self.reads
+        self.reads += 1
+        if i in self.fail:
+            raise RuntimeError(f"sample {i} failed")
+        return float(i), [i, 10*i]
+
+
+class TestPeriodicSampler(unittest.TestCase):
+
+    def test_ring_buffer(self):
+        sampler = CountingSampler(buffer_size=4)
+        self.assertEqual(sampler.values.shape, (4, 2))
+        for _ in range(3):
+            sampler.sample()
+        timestamps, values = sampler.get_samples()
+        np.testing.assert_array_equal(timestamps, [0, 1, 2])
+        for _ in range(3):
+            sampler.sample()
+        timestamps, values = sampler.get_samples()
+        np.testing.assert_array_equal(timestamps, [2, 3, 4, 5])
+        np.testing.assert_array_equal(values[:, 1], [20, 30, 40, 50])
+        np.testing.assert_array_equal(sampler.get_samples(since=3)[0], [4, 5])
+        np.testing.assert_array_equal(sampler.get_samples(last=3)[0], [3, 4, 5])
+        np.testing.assert_array_equal(sampler.get_samples(since=2, last=1)[1], [[5, 50]])
+        values[:] = 0
+        self.assertEqual(sampler.get_samples(last=1)[1].tolist(), [[5, 50]], "get_samples does not return copies")
+        sampler.clear()
+        self.assertEqual(len(sampler.get_samples()[0]), 0)
+
+    def test_run(self):
+        """Failed samples are logged and skipped, the rate is kept"""
+        sampler = CountingSampler(buffer_size=100, rate=200., fail=[1, 2])
+        start = time.time()
+        with self.assertLogs('CountingSampler', level='ERROR'):
+            self.assertEqual(sampler.run(nsamples=10), 10)
+        self.assertGreaterEqual(time.time() - start, 9/200.)
+        self.assertEqual(sampler.count, 8)
+        self.assertRaises(AssertionError, sampler.run)
+
+    def test_background(self):
+        sampler = CountingSampler(buffer_size=10, rate=500.)
+        sampler.start()
+        self.assertRaises(AssertionError, sampler.start)
+        time.sleep(0.1)
+        sampler.stop()
+        count = sampler.count
+        time.sleep(0.02)
+        self.assertEqual(sampler.count, count, "Sampling not stopped")
+        self.assertGreater(count, 10)
+        self.assertTrue(np.all(np.diff(sampler.get_samples()[0]) == 1))
+        report(f"background sampling at 500 Hz: {count} samples in 0.1 s")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3.9
+"""Tests of the batched power unit reads on the simulated RU.
+
+The power unit controllers are simulated by slaves holding random register values: the values read in a single
+wishbone sequence must be the ones of the per register reads that PowerUnit.get_values_modules did before.
+"""
+
+import unittest
+from collections import OrderedDict
+
+import numpy as np
+
+from simulated_board import SimulatedCommunication, SimulatedModule, make_ru
+
+from pu_controller import Adc
+from power_unit import read_power_units_values
+
+MODULES = [0, 3, 7]
+
+
+def per_register_values(controller, module_list):
+    """Values of the controller read one register at a time"""
+    values = OrderedDict([
+        ("power_enable_status", controller.get_power_enable_status()),
+        ("bias_enable_status", controller.get_bias_enable_status()),
+        ("bb_voltage", controller.read_bias_adc_channel(channel=Adc.V_BB)),
+        ("bb_current", controller.read_bias_adc_channel(channel=Adc.I_BB))
+    ])
+    for module in module_list:
+        for key, value in controller.get_power_adc_values(module).items():
+            values["module_{0}_{1}".format(module, key)] = value
+    return values
+
+
+class ShortReadCommunication(SimulatedCommunication):
+    """SimulatedCommunication losing the last short_read bytes of the results"""
+
+    def __init__(self, *args, **kwargs):
+        super(ShortReadCommunication, self).__init__(*args, **kwargs)
+        self.short_read = 0
+
+    def _do_read_dp1(self, size):
+        ret = super(ShortReadCommunication, self)._do_read_dp1(size)
+        return ret[:len(ret) - self.short_read]
+
+
+class TestPowerUnitValues(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.comm = ShortReadCommunication()
+        self.ru = make_ru(self.comm)
+        for power_unit in [self.ru.powerunit_1, self.ru.powerunit_2]:
+            registers = {address: int(value) for address, value in enumerate(rng.integers(0, 1 << 16, size=256))}
+            self.comm.add_module(power_unit.controller.moduleid, SimulatedModule(registers))
+        self.expected = {index: per_register_values(power_unit.controller, MODULES)
+                         for index, power_unit in [(1, self.ru.powerunit_1), (2, self.ru.powerunit_2)]}
+
+    def test_read_values_modules(self):
+        flushes = self.comm.flushes
+        self.assertEqual(self.ru.powerunit_2.controller.read_values_modules(module_list=MODULES), self.expected[2])
+        self.assertEqual(self.comm.flushes - flushes, 1)
+
+    def test_read_power_units_values(self):
+        flushes = self.comm.flushes
+        values = read_power_units_values([self.ru.powerunit_1, self.ru.powerunit_2], module_list=MODULES)
+        self.assertEqual(self.comm.flushes - flushes, 1)
+        self.assertEqual(values, self.expected)
+        self.assertEqual(list(values[1]), list(self.expected[1]))
+
+    def test_ru_values_and_sampler(self):
+        self.assertEqual(self.ru.get_powerunits_values(module_list=MODULES), self.expected)
+        self.assertEqual(self.ru.get_powerunits_values(powerunits=(2,), module_list=MODULES), {2: self.expected[2]})
+        sampler = self.ru.get_powerunits_sampler(module_list=MODULES, rate=1000.)
+        sampler.run(nsamples=3)
+        samples = sampler.get_samples()
+        self.assertEqual(len(samples), 3)
+        for _, values in samples:
+            self.assertEqual(values, self.expected)
+        aggregated = sampler.aggregate()
+        self.assertEqual(aggregated[1]["module_3_dvdd_current"],
+                         {"min": self.expected[1]["module_3_dvdd_current"],
+                          "max": self.expected[1]["module_3_dvdd_current"],
+                          "mean": self.expected[1]["module_3_dvdd_current"]})
+
+    def test_short_result(self):
+        """A missing result is not silently shifted into the values"""
+        with self.assertLogs(level='WARNING'):
+            self.comm.short_read = 4
+            with self.assertRaises(AssertionError):
+                self.ru.powerunit_1.controller.read_values_modules(module_list=MODULES)
+            with self.assertRaises(AssertionError):
+                read_power_units_values([self.ru.powerunit_1, self.ru.powerunit_2], module_list=MODULES)
+            with self.assertRaises(AssertionError):
+                self.ru.get_powerunits_values(module_list=MODULES)
+            self.comm.short_read = 0
+            self.comm.fail_reads = 1
+            with self.assertRaises(AssertionError):
+                self.ru.get_powerunits_values(module_list=MODULES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3.9
+"""Tests of the parallel PRBS BER scan on simulated lanes.
+
+Each simulated RU has a GTH frontend whose PRBS error counters count Poisson distributed errors
+at a BER per lane and setting, accumulated in real time at the line rate.
+Every counter snapshot costs a round trip latency.
+"""
+
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import report, timed
+
+from prbs_scan import MAX_TIME_TO_PASS, PrbsBerScan, poisson_upper_limit
+
+NR_TRANSCEIVERS = 9
+LINE_RATE = 600e6
+TARGET_BER = 1e-7
+BAD_BER = 1e-5
+LATENCY = 1e-3
+
+
+class SimulatedGth(object):
+    """PRBS checkers of the lanes of a RU, the BER of a lane depends on the current setting"""
+
+    def __init__(self, ber_f, line_rate, latency, seed):
+        self.ber_f = ber_f
+        self.line_rate = line_rate
+        self.latency = latency
+        self.transceivers = list(range(NR_TRANSCEIVERS))
+        self.setting = None
+        self.snapshots = 0
+        self._rng = np.random.default_rng(seed)
+        self._errors = np.zeros(NR_TRANSCEIVERS, dtype=np.int64)
+        self._last = time.monotonic()
+
+    def set_transceivers(self, transceivers):
+        self.transceivers = list(transceivers)
+
+    def get_transceivers(self):
+        return self.transceivers
+
+    def _accumulate(self):
+        now = time.monotonic()
+        bits = (now - self._last) * self.line_rate
+        ber = np.array([self.ber_f(lane, self.setting) for lane in range(NR_TRANSCEIVERS)])
+        self._errors += self._rng.poisson(bits * ber)
+        self._last = now
+
+    def set_setting(self, setting):
+        self._accumulate()
+        self.setting = setting
+
+    def reset_prbs_counter(self, commitTransaction=True):
+        time.sleep(self.latency)
+        self._accumulate()
+        for lane in self.transceivers:
+            self._errors[lane] = 0
+
+    def read_prbs_counter(self, reset=False):
+        time.sleep(self.latency)
+        self.snapshots += 1
+        self._accumulate()
+        counters = [int(self._errors[lane]) for lane in self.transceivers]
+        if reset:
+            self.reset_prbs_counter()
+        return counters
+
+
+class SimulatedRu(object):
+    def __init__(self, gbt_channel, ber_f):
+        self.gbt_channel = gbt_channel
+        self.gth = SimulatedGth(ber_f, LINE_RATE, LATENCY, seed=gbt_channel)
+
+    def get_gbt_channel(self):
+        return self.gbt_channel
+
+
+def make_rus(nrus, nsettings, bad_ber=BAD_BER):
+    def ber_f(gbt_channel):
+        # Lane 3 of RU 0 fails at the highest setting, lane 5 of the others at the lowest one
+        def f(lane, setting):
+            if gbt_channel == 0 and lane == 3 and setting is not None and setting >= nsettings - 1:
+                return bad_ber
+            if gbt_channel != 0 and lane == 5 and setting == 0:
+                return bad_ber
+            return 0.
+        return f
+    return [SimulatedRu(i, ber_f(i)) for i in range(nrus)]
+
+
+def apply_setting_f(rdo_list):
+    def apply_setting(setting):
+        for rdo in rdo_list:
+            rdo.gth.set_setting(setting)
+    return apply_setting
+
+
+class TestPrbsBerScan(unittest.TestCase):
+    NRUS = 2
+    NSETTINGS = 4
+
+    def test_poisson_upper_limit(self):
+        self.assertAlmostEqual(poisson_upper_limit(0, 0.95), 2.9957, places=3)
+        self.assertAlmostEqual(poisson_upper_limit(5, 0.95), 10.513, places=2)
+
+    def test_scan(self):
+        settings = list(range(self.NSETTINGS))
+        scan = PrbsBerScan(make_rus(self.NRUS, self.NSETTINGS), line_rate=LINE_RATE, target_ber=TARGET_BER,
+                           confidence=0.95, dwell=0.01, max_time=10)
+        time_to_pass = scan.time_to_pass()
+        results, duration = timed(scan.run, settings=settings, apply_setting=apply_setting_f(scan.rdo_list))
+        self.assertEqual(len(results), self.NRUS * NR_TRANSCEIVERS * self.NSETTINGS)
+        failing = sorted((row['setting'], row['gbt_channel'], row['lane']) for row in results.rows(status='FAIL'))
+        self.assertEqual(failing, sorted([(self.NSETTINGS - 1, 0, 3)] + [(0, ch, 5) for ch in range(1, self.NRUS)]))
+        self.assertLessEqual(set(results.column('status')), {'PASS', 'FAIL'}, "Undecided lanes")
+        passing = results.column('status') == 'PASS'
+        self.assertTrue(np.all(results.column('ber_upper')[passing] <= TARGET_BER * 1.01))
+        self.assertTrue(np.all(results.column('duration')[~passing] < time_to_pass), "Failing lanes were not stopped early")
+        # all the lanes of a setting are scanned at once
+        self.assertLess(duration, 1.5*self.NSETTINGS*time_to_pass + 1)
+        snapshots = sum(rdo.gth.snapshots for rdo in scan.rdo_list)
+        report(f"{self.NRUS} RUs x {NR_TRANSCEIVERS} lanes, {self.NSETTINGS} settings in {duration:.2f} s "
+               f"({time_to_pass:.3f} s per setting to pass), {snapshots} counter snapshots")
+
+    def test_default_max_time(self):
+        """A lane at the target BER is never decided for sure: the setting ends after the default max_time"""
+        scan = PrbsBerScan(make_rus(1, 1, bad_ber=TARGET_BER), line_rate=LINE_RATE, target_ber=TARGET_BER,
+                           confidence=0.95, dwell=0.01)
+        self.assertEqual(scan.max_time, MAX_TIME_TO_PASS * scan.time_to_pass())
+        results, duration = timed(scan.run, settings=[0], apply_setting=apply_setting_f(scan.rdo_list))
+        self.assertEqual(len(results), NR_TRANSCEIVERS)
+        self.assertLess(duration, scan.max_time + 0.5)
+        statuses = dict(zip(results.column('lane'), results.column('status')))
+        self.assertTrue(all(status == 'PASS' for lane, status in statuses.items() if lane != 3), statuses)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3.9
+"""Tests of the SelectMAP frame readback through the PA3 on a simulated PA3.
+
+The simulated PA3 emulates the SMAP_DATA_RX/SMAP_CMD/SMAP_DATA_TX byte interface and a Xilinx
+configuration logic answering FAR writes and FDRO reads. The FAR auto-increments through the minor
+addresses of the columns of a device row whose columns have different numbers of minor addresses.
+It counts the PA3 register transactions (one SCA I2C transaction each on the real hardware).
+"""
+
+import logging
+import unittest
+
+import numpy as np
+
+from simulated_board import report
+
+from proasic3_convenience import ConvenienceInitializer
+from proasic3_enums import Pa3Register, SmapCmdOpcode, XIL_ADDR
+from proasic3_selectmap import ProAsic3Selmap, WORDS_PER_FRAME, make_far
+
+FDRO_PAD_WORDS = WORDS_PER_FRAME + 11
+ROW = 2
+MINORS = [12, 58, 4, 6, 36, 28, 12, 4]  # minor addresses per column of the row
+
+
+def frame_addresses(columns=range(len(MINORS))):
+    """Frame addresses of the columns in auto-increment order"""
+    return [make_far(0, ROW, column, minor) for column in columns for minor in range(MINORS[column])]
+
+
+def next_far(far):
+    """Frame address following far in the auto-increment order of the simulated device"""
+    column, minor = (far >> 7) & 0x3FF, far & 0x7F
+    if minor + 1 < MINORS[column]:
+        return far + 1
+    if column + 1 < len(MINORS):
+        return make_far(0, ROW, column + 1, 0)
+    return make_far(0, ROW + 1, 0, 0)
+
+
+def frame_content(address):
+    """Deterministic content of the configuration frame at address"""
+    words = np.arange(WORDS_PER_FRAME, dtype=np.uint64)
+    return ((address * 2654435761 + words * 40503) & 0xFFFFFFFF).astype(np.uint32)
+
+
+class SimulatedPa3(object):
+    """Register model of the PA3 selectmap interface in front of a Xilinx configuration logic"""
+
+    def __init__(self):
+        self.transactions = 0
+        self.locks = 0
+        self._rx_byte = 0
+        self._tx_byte = 0
+        self._word = []
+        self._readback = []
+        self._pending_reg = None
+        self._pending_words = 0
+        self._read_reg = None
+        self.far = 0
+
+    def lock(self):
+        self.locks += 1
+
+    def unlock(self):
+        pass
+
+    def write_reg(self, address, data):
+        self.transactions += 1
+        if address == Pa3Register.SMAP_DATA_RX:
+            self._rx_byte = data & 0xFF
+        elif address == Pa3Register.SMAP_CMD:
+            if data == SmapCmdOpcode.WRITE | 0x80:
+                self._word.append(self._rx_byte)
+                if len(self._word) == 4:
+                    self._process_word(int.from_bytes(bytes(self._word), 'big'))
+                    self._word = []
+            elif data == SmapCmdOpcode.READ | 0x80:
+                self._tx_byte = self._readback.pop(0) if self._readback else 0
+
+    def read_reg(self, address):
+        self.transactions += 1
+        if address == Pa3Register.SMAP_DATA_TX:
+            return self._tx_byte
+        return 0
+
+    def _process_word(self, word):
+        if self._pending_words:
+            self._pending_words -= 1
+            if self._pending_reg == XIL_ADDR.FAR:
+                self.far = word
+            return
+        header_type = word >> 29
+        opcode = (word >> 27) & 0x3
+        if header_type == 0b001:
+            reg = (word >> 13) & 0x1F
+            count = word & 0x7FF
+            if opcode == 0b10:
+                self._pending_reg, self._pending_words = reg, count
+            elif opcode == 0b01:
+                self._read_reg = reg
+        elif header_type == 0b010 and opcode == 0b01 and self._read_reg == XIL_ADDR.FDRO:
+            nframes = (word & 0x7FFFFFF) // WORDS_PER_FRAME - 1
+            words = [0] * FDRO_PAD_WORDS
+            for _ in range(nframes):
+                words += frame_content(self.far).tolist()
+                self.far = next_far(self.far)
+            self._readback = [b for w in words for b in w.to_bytes(4, 'big')]
+
+
+def make_selmap():
+    pa3 = SimulatedPa3()
+    return ProAsic3Selmap(ConvenienceInitializer(pa3.write_reg, pa3.read_reg, logging.getLogger("pa3_sim"),
+                                                 pa3.lock, pa3.unlock)), pa3
+
+
+class TestSelectMapReadback(unittest.TestCase):
+    MAX_BURST = 16
+
+    def test_burst_readback(self):
+        """The burst readback returns the frames of the frame by frame readback with fewer transactions,
+        the bursts do not cross the column boundaries"""
+        addresses = frame_addresses()
+        transactions = {}
+        for method, max_burst in [("single", 1), ("burst", self.MAX_BURST)]:
+            selmap, pa3 = make_selmap()
+            frames = selmap.read_frames(addresses, max_burst=max_burst)
+            np.testing.assert_array_equal(np.array(frames, dtype=np.uint32), [frame_content(address) for address in addresses])
+            self.assertEqual(pa3.locks, sum(-(-minors // max_burst) for minors in MINORS))
+            transactions[method] = pa3.transactions
+        self.assertLess(transactions["burst"], 0.6*transactions["single"])
+        report(f"{len(addresses)} frames: {transactions['single']/len(addresses):.1f} PA3 transactions/frame frame by frame, "
+               f"{transactions['burst']/len(addresses):.1f} in bursts")
+
+    def test_column_boundary(self):
+        """The frames of two consecutive columns are read in separate bursts"""
+        addresses = frame_addresses([2, 3])
+        selmap, pa3 = make_selmap()
+        frames = selmap.read_frames(addresses, max_burst=self.MAX_BURST)
+        np.testing.assert_array_equal(np.array(frames, dtype=np.uint32), [frame_content(address) for address in addresses])
+        self.assertEqual(pa3.locks, 2)
+
+    def test_readback_and_compare(self):
+        """The compare detects the unmasked bit flips injected in the golden frames"""
+        addresses = frame_addresses([1, 2, 3])
+        selmap, _ = make_selmap()
+        golden = np.array([frame_content(address) for address in addresses], dtype=np.uint32)
+        mask = np.zeros_like(golden)
+        boundary = MINORS[1]  # first frame of column 2
+        golden[boundary, 5] ^= 0x00010001
+        golden[-1, 0] ^= 0x80000000
+        mask[-1, 0] = 0x80000000
+        result = selmap.readback_and_compare(addresses, golden, mask, max_burst=self.MAX_BURST)
+        self.assertEqual(result['mismatched_frames'], [boundary])
+        self.assertEqual(result['mismatched_words'], 1)
+        self.assertEqual(result['mismatched_bits'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
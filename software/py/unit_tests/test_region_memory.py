@@ -0,0 +1,71 @@
+#!/usr/bin/env python3.9
+"""Tests of the region memory test engine of the FIFO test on a simulated stave with faulty region memories"""
+
+import os
+import sys
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedChips, make_stave_ru, report, timed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../ib_tools/ibtests'))
+from pALPIDE import Alpide
+from region_memory import NADDRESSES, NREGIONS, RegionMemoryTester, region_reg_address
+
+PATTERN = [(i*17) & 0xFFFFFF for i in range(NREGIONS*NADDRESSES)]
+
+
+class FaultyChips(SimulatedChips):
+    """Chips storing the region memory writes with injected faults:
+    faults: {chipid: {'stuck_high': {region: mask}, 'flaky': set of addresses failing on their first read,
+                      'dead_region': region never answering}}
+    """
+
+    def __init__(self, chipids, faults):
+        super(FaultyChips, self).__init__(chipids)
+        self.faults = faults
+
+    def write_chip(self, chipid, address, data, now):
+        stuck = self.faults.get(chipid, {}).get('stuck_high', {}).get(address >> 11, 0)
+        if (address >> 8) & 0x7 == 2:
+            stuck >>= 16
+        super(FaultyChips, self).write_chip(chipid, address, (data | stuck) & 0xFFFF, now)
+
+    def read(self, chipid, address, now):
+        faults = self.faults.get(chipid, {})
+        flaky = faults.get('flaky', set())
+        if address in flaky or faults.get('dead_region') == address >> 11:
+            flaky.discard(address)
+            return None
+        return super(FaultyChips, self).read(chipid, address, now)
+
+
+class TestRegionMemoryTester(unittest.TestCase):
+    NCHIPS = 3
+
+    def setUp(self):
+        self.flaky = {region_reg_address(3, 1, a) for a in range(0, 128, 9)} | {region_reg_address(30, 2, 100)}
+        faults = {0: {'flaky': set(self.flaky)},
+                  1: {'stuck_high': {7: 0x000100, 20: 0x800000}},
+                  self.NCHIPS - 1: {'dead_region': 31}}
+        self.ru = make_stave_ru(FaultyChips(range(self.NCHIPS), faults), name="L0_00")
+        self.ru.alpide_control._set_up_dctrl(0)
+
+    def test_write_and_verify(self):
+        tester = RegionMemoryTester(max_read_tries=2)
+        _, write_time = timed(tester.write_pattern, Alpide(self.ru, chipid=0xF), PATTERN)
+        results, read_time = timed(lambda: {chipid: tester.verify_pattern(Alpide(self.ru, chipid=chipid), PATTERN)
+                                            for chipid in range(self.NCHIPS)})
+        errors = {chipid: set(np.flatnonzero(result.error_map.any(axis=1)).tolist()) for chipid, result in results.items()}
+        self.assertEqual(errors, {0: set(), 1: {7, 20}, self.NCHIPS - 1: {31}})
+        self.assertEqual(results[0].retries, len(self.flaky))
+        self.assertEqual(results[1].retries, 0)
+        self.assertEqual(results[self.NCHIPS - 1].retries, 2*2*NADDRESSES)
+        self.assertEqual(np.count_nonzero(results[self.NCHIPS - 1].error_map), NADDRESSES)
+        report(f"region memory pattern on {self.NCHIPS} chips: write {write_time:.2f} s, read back {read_time:.2f} s, "
+               f"{self.ru.comm.flushes} round trips")
+
+
+if __name__ == '__main__':
+    unittest.main()
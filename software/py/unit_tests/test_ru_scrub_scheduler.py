@@ -0,0 +1,156 @@
+#!/usr/bin/env python3.9
+"""Tests of the crate scrub scheduler on simulated RUs.
+
+The simulated RUs run the scrub cycle code of ru_scrubbing on an in-memory scrubbing status with a simulated PA3:
+each PA3 access costs a transaction latency, a scrub takes SCRUB_SEC and SB errors are injected on every 4th RU.
+"""
+
+import logging
+import random
+import signal
+import time
+import unittest
+
+from simulated_board import report, timed
+
+import git_hash_lut
+import ru_scrubbing
+from ru_scrub_scheduler import CrateScrubScheduler, ScrubbingStatusWriter
+from scrubbing_status import ImageLocationStatus, ImageStatus, Location, ScrubbingRUStatus
+
+FW_CRC, FW_VERSION = next(iter(git_hash_lut.ru_scrubcrc2ver_lut.items()))
+LATENCY = 0.2e-3
+SCRUB_SEC = 0.05
+SLEEP_SEC = 0.05
+
+
+class SimulatedPa3(object):
+    """PA3 answering the accesses of a scrub cycle, each access costs latency seconds"""
+
+    def __init__(self, latency, scrub_sec, sb_error_rate):
+        self.latency = latency
+        self.scrub_sec = scrub_sec
+        self.sb_error_rate = sb_error_rate
+        self.transactions = 0
+        self.sb_errors = 0
+
+    def _access(self, n=1):
+        self.transactions += n
+        time.sleep(self.latency * n)
+
+    def stop_scrubbing_and_reset_on_db_error(self):
+        self._access(3)
+
+    def is_pa3_fw_mature(self):
+        self._access(2)
+        return True
+
+    def clear_scrub_block_address(self):
+        self._access(4)
+
+    def set_flash_select_ic(self, ic):
+        self._access()
+
+    def set_scrub_block_address(self, start_block):
+        self._access(4)
+
+    def smap_abort_and_verify(self):
+        self._access(40)
+
+    def single_scrub_steps(self):
+        self._access(4)
+        yield self.scrub_sec
+        self._access()
+        self.sb_errors = 1 if random.random() < self.sb_error_rate else 0
+        return True
+
+    def single_scrub_test_steps(self):
+        self._access()
+        success = yield from self.single_scrub_steps()
+        self._access()
+        return success
+
+
+class SimulatedRu(object):
+    """RU running the scrub cycles of ru_scrubbing with a simulated PA3"""
+    configure_scrub_location = ru_scrubbing.configure_scrub_location
+    _configure_scrub_imagelocation = ru_scrubbing._configure_scrub_imagelocation
+    _run_scrub_cycle_steps = ru_scrubbing._run_scrub_cycle_steps
+    scrub_loop_cycle_steps = ru_scrubbing.scrub_loop_cycle_steps
+    determine_post_scrub_status = ru_scrubbing.determine_post_scrub_status
+
+    def __init__(self, gbt_channel, sb_error_rate):
+        self.gbt_channel = gbt_channel
+        self.logger = logging.getLogger(f"ru_sim_{gbt_channel}")
+        self.pa3 = SimulatedPa3(LATENCY, SCRUB_SEC, sb_error_rate)
+        self.scrubbing_status = ScrubbingRUStatus()
+        self.scrubbing_status.ru_sn = gbt_channel + 1
+        for ic in range(1, 3):
+            image_location = ImageLocationStatus()
+            image_location.location = Location(ic, 0x100)
+            image_location.programmed_fw_version = FW_VERSION
+            image_location._image_status = ImageStatus.OK
+            self.scrubbing_status.add_image_location(image_location)
+        self.scrubbing_status.update_current_image_location()
+        self.scrubbing_status.update_status()
+
+    def get_gbt_channel(self):
+        return self.gbt_channel
+
+    def load_scrubbing_status(self, force=False):
+        return True
+
+    def git_tag(self):
+        return FW_VERSION
+
+    def get_pa3_post_scrub_metrics(self):
+        self.pa3._access(6)
+        sb = self.pa3.sb_errors
+        return FW_CRC, sb > 0, sb, 0, sb, False
+
+
+def make_rus(nrus, sb_error_rate=1.):
+    random.seed(0)
+    return [SimulatedRu(i, sb_error_rate if i % 4 == 0 else 0) for i in range(nrus)]
+
+
+class TestCrateScrubScheduler(unittest.TestCase):
+    NRUS = 8
+    CYCLES = 2
+
+    def test_run(self):
+        rdo_list = make_rus(self.NRUS)
+        writes = []
+        scheduler = CrateScrubScheduler(rdo_list, sleep_sec=SLEEP_SEC,
+                                        status_writer=ScrubbingStatusWriter(write_f=lambda ru_sn, status: writes.append(ru_sn)))
+        _, duration = timed(scheduler.run, num_cycles=self.CYCLES, handle_sigint=False)
+        stats = scheduler.get_stats()
+        rus = stats['rus']
+        self.assertEqual(sorted(rus), list(range(self.NRUS)))
+        for ru in rus.values():
+            self.assertEqual(ru['cycles'], self.CYCLES)
+            self.assertFalse(ru['stopped'])
+        self.assertEqual([ch for ch, ru in rus.items() if ru['recent_errors'] >= 1], list(range(0, self.NRUS, 4)))
+        self.assertEqual(sorted(set(writes)), [rdo.scrubbing_status.ru_sn for rdo in rdo_list])
+        # the scrubs of the RUs overlap: a crate cycle is much shorter than scrubbing the RUs one after the other
+        self.assertLess(stats['max_crate_cycle_time'], self.NRUS*SCRUB_SEC)
+        report(f"{self.NRUS} RUs, {self.CYCLES} cycles of {SCRUB_SEC} s scrubs in {duration:.2f} s, "
+               f"crate cycle {stats['max_crate_cycle_time']:.3f} s")
+
+    def test_run_twice(self):
+        """A second run scrubs again and writes its status files, each run restores the SIGINT handler"""
+        rdo_list = make_rus(2)
+        writes = []
+        scheduler = CrateScrubScheduler(rdo_list, sleep_sec=SLEEP_SEC,
+                                        status_writer=ScrubbingStatusWriter(write_f=lambda ru_sn, status: writes.append(ru_sn)))
+        handler = signal.getsignal(signal.SIGINT)
+        for run in range(1, 3):
+            self.assertTrue(scheduler.run(num_cycles=1))
+            self.assertIs(signal.getsignal(signal.SIGINT), handler)
+            self.assertEqual([ru['cycles'] for ru in scheduler.get_stats()['rus'].values()], [run]*2)
+            self.assertEqual(sorted(set(writes)), [rdo.scrubbing_status.ru_sn for rdo in rdo_list])
+            writes.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.9
+"""Tests of the run control server with simulated clients against a local instance.
+
+The hardware commands of the local instance sleep for HW_SEC, the data move is a subprocess
+printing its progress during MOVE_SEC. Many clients send commands concurrently, without
+and with a data move in flight.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import report, script_path
+
+sys.path.append(os.path.join(script_path, '../rcs'))
+from run_control_server import RunControl, RunControlServer, run_process
+
+HW_SEC = 5e-3
+MOVE_SEC = 2.
+MOVE_SCRIPT = """
+import sys, time
+steps = 20
+for i in range(steps + 1):
+    sys.stdout.write('\\r  %d bytes %d%% ' % (i*1000, i*100//steps))
+    sys.stdout.flush()
+    time.sleep(DURATION/steps)
+sys.exit(RETURNCODE)
+"""
+
+
+class SimulatedRunControl(RunControl):
+    def __init__(self, log):
+        super().__init__('SIM', None, log)
+        self.move_sec = MOVE_SEC
+        self.move_returncode = 0
+
+    def execute(self, cmd):
+        time.sleep(HW_SEC)
+        return 'Done'
+
+    async def move_raw_data(self, job):
+        job.stage = 'raw data'
+        script = MOVE_SCRIPT.replace('DURATION', str(self.move_sec)).replace('RETURNCODE', str(self.move_returncode))
+        await run_process([sys.executable, '-c', script], job=job, check=True)
+        return 'Done'
+
+
+def snd_rcv_one(cmd, port):
+    start_time = time.perf_counter()
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.connect(('127.0.0.1', port))
+        sock.sendall(bytes(cmd + "\n", "utf-8"))
+        ret = str(sock.recv(1024), "utf-8").strip()
+    return ret, time.perf_counter()-start_time
+
+
+def run_clients(port, nclients, ncommands):
+    """Each client sends ncommands, mostly status queries and some hardware commands.
+    Returns the latencies of the status queries in ms and the unexpected responses"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(i):
+        local = []
+        for j in range(ncommands):
+            cmd = 'STOP' if (i + j) % 10 == 0 else ['PING', 'JOBS'][j % 2]
+            ret, latency = snd_rcv_one(cmd, port)
+            if not ret.startswith(cmd) or 'ERROR' in ret:
+                with lock:
+                    errors.append(ret)
+            if cmd != 'STOP':
+                local.append(latency)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(nclients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies)*1e3, errors
+
+
+def job_id(ret):
+    return ret.split()[-1]
+
+
+class TestRunControlServer(unittest.TestCase):
+    CLIENTS = 10
+    COMMANDS = 20
+
+    def setUp(self):
+        log = logging.getLogger('run_control')
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = RunControlServer(SimulatedRunControl(log), log)
+        self.port = asyncio.run_coroutine_threadsafe(self.server.start('127.0.0.1', 0), self.loop).result()
+
+    def tearDown(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def command(self, cmd):
+        return snd_rcv_one(cmd, self.port)[0]
+
+    def test_load_during_transfer(self):
+        """The status commands are not slowed down by a data move in flight"""
+        baseline, errors = run_clients(self.port, self.CLIENTS, self.COMMANDS)
+        self.assertEqual(errors, [])
+        move = job_id(self.command('MOVE_DATA'))
+        loaded, errors = run_clients(self.port, self.CLIENTS, self.COMMANDS)
+        self.assertEqual(errors, [])
+        status = self.command('JOB ' + move)
+        self.assertIn('RUNNING', status, "Transfer not in flight during the load")
+        self.assertLess(np.percentile(loaded, 99), max(2*np.percentile(baseline, 99), np.percentile(baseline, 99) + 20),
+                        "Command latency increased while a transfer was in flight")
+        self.assertIn('DONE 100%', self.command('WAIT ' + move))
+        report(f"{self.CLIENTS} clients x {self.COMMANDS} commands, status latency p99: "
+               f"no transfer {np.percentile(baseline, 99):.2f} ms, with transfer {np.percentile(loaded, 99):.2f} ms")
+
+    def test_cancel_transfer(self):
+        move = job_id(self.command('MOVE_DATA'))
+        time.sleep(MOVE_SEC / 4)
+        ret = self.command('CANCEL ' + move)
+        self.assertIn('CANCELLED', ret)
+        self.assertTrue(0 < float(ret.split()[4].rstrip('%')) < 100, ret)
+        self.assertIn('ERROR', self.command('WAIT_JOBS'))
+        self.assertEqual(self.command('WAIT_JOBS'), 'WAIT_JOBS Done')
+
+    def test_failed_transfer(self):
+        """A transfer whose process fails marks its job FAILED with the output of the process"""
+        self.server.run_control.move_sec = 0.1
+        self.server.run_control.move_returncode = 23
+        ret = self.command('WAIT ' + job_id(self.command('MOVE_DATA')))
+        self.assertIn('FAILED', ret)
+        self.assertIn('returned 23', ret)
+        self.assertIn('100%', ret.split(': ', 1)[1])
+
+    def test_background_commands(self):
+        """Background hardware commands are queued, cancelled and waited for"""
+        runs = [job_id(self.command('SUBMIT START_RUN')) for _ in range(3)]
+        self.assertIn('CANCELLED', self.command('CANCEL ' + runs[-1]))
+        ret = self.command('WAIT ' + runs[0])
+        self.assertIn('DONE', ret)
+        self.assertTrue(ret.endswith(': Done'), ret)
+        self.assertIn('ERROR', self.command('CANCEL ' + runs[0]))
+        self.assertIn('ERROR unknown job', self.command('JOB 1000'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3.9
+"""Tests of the simulation socket interface against a testbench executing the transactions on the simulated board.
+
+The testbench connects to the DP0/DP1 socket of UsbCommSim like the SystemVerilog testbench does, executes the
+wishbone transactions of each line on a SimulatedCommunication and sends back the read results.
+"""
+
+import asyncio
+import binascii
+import socket
+import threading
+import time
+import unittest
+
+from simulated_board import SimulatedCommunication, SimulatedModule
+
+from simulation_if import UsbCommSim
+
+MODULEID = 0x10
+
+
+class RecordingModule(SimulatedModule):
+    """Wishbone slave recording the order of the written values"""
+
+    def __init__(self):
+        super(RecordingModule, self).__init__()
+        self.written = []
+
+    def write(self, address, data, now):
+        super(RecordingModule, self).write(address, data, now)
+        self.written.append(data)
+
+
+class SimulatedTestbench(threading.Thread):
+    """Testbench client of the DP0/DP1 socket executing the transactions on board"""
+
+    def __init__(self, board, port=32226):
+        super(SimulatedTestbench, self).__init__(daemon=True)
+        self.board = board
+        self.port = port
+        self.lines = 0
+
+    def run(self):
+        sock = socket.create_connection(("localhost", self.port))
+        with sock, sock.makefile('rb') as rx:
+            for line in rx:
+                if line == b'EXIT\n':
+                    break
+                if line == b'NOP\n':
+                    continue
+                self.lines += 1
+                self.board._do_write_dp0(binascii.unhexlify(line.strip()))
+                response, self.board._response = self.board._response, bytearray()
+                if response:
+                    sock.sendall(binascii.hexlify(response) + b'\n')
+
+
+class StalledWriter(object):
+    """StreamWriter whose drain waits until drained is set, or raises error"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.data = bytearray()
+        self.drained = asyncio.Event()
+
+    def write(self, data):
+        self.data += data
+
+    def is_closing(self):
+        return False
+
+    async def drain(self):
+        if self.error is not None:
+            raise self.error
+        await self.drained.wait()
+
+
+class TestSimulationIf(unittest.TestCase):
+
+    def setUp(self):
+        self.module = RecordingModule()
+        self.comm = UsbCommSim()
+        self.testbench = SimulatedTestbench(SimulatedCommunication({MODULEID: self.module}))
+        self.testbench.start()
+
+    def tearDown(self):
+        self.comm.close()
+        self.testbench.join(timeout=5)
+
+    def test_ordering(self):
+        """The results of many flushes sent before reading are returned in order"""
+        nflushes = 200
+        for i in range(nflushes):
+            self.comm.register_write(MODULEID, i % 64, i)
+            self.comm.register_read(MODULEID, i % 64)
+            self.comm.flush()
+        results = self.comm.read_results()
+        self.assertEqual([data for _, data in results], list(range(nflushes)))
+        self.assertEqual([address & 0xFF for address, _ in results], [i % 64 for i in range(nflushes)])
+        self.assertEqual(self.module.written, list(range(nflushes)))
+        self.assertEqual(self.testbench.lines, nflushes)
+
+    def _with_writer(self, writer, f):
+        """Calls f with the connection replaced by writer"""
+        self.comm.check_conn()
+        conn = self.comm.conn[0]
+        self.comm.conn[0] = writer
+        try:
+            return f()
+        finally:
+            self.comm.conn[0] = conn
+
+    def test_flush_waits_for_drain(self):
+        """flush returns only once the write is drained"""
+        writer = StalledWriter()
+        self.comm.register_write(MODULEID, 0, 0x1234)
+
+        def flush():
+            flusher = threading.Thread(target=self.comm.flush, daemon=True)
+            flusher.start()
+            time.sleep(0.1)
+            self.assertTrue(flusher.is_alive(), "flush returned before the write was drained")
+            self.comm.loop.call_soon_threadsafe(writer.drained.set)
+            flusher.join(timeout=5)
+            self.assertFalse(flusher.is_alive())
+        self._with_writer(writer, flush)
+        self.assertEqual(writer.data, b'34120090\n')
+
+    def test_write_error(self):
+        """A write error is raised by flush"""
+        self.comm.register_write(MODULEID, 0, 0x1234)
+        with self.assertRaises(KeyboardInterrupt):
+            self._with_writer(StalledWriter(ConnectionResetError()), self.comm.flush)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3.9
+"""Tests of the stave plotter analysis (stave_plotter.py).
+
+The hitmaps are small synthetic ones: HITMAP_SHAPE or MAX_LANES are reduced for the duration of the tests,
+the worker processes of the parallel accumulation inherit them when forked.
+"""
+
+import gzip
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from simulated_board import report, timed
+
+import stave_plotter
+
+SHAPE = (48, 40)
+LANES = 4
+
+
+def loop_analysis(plotter):
+    """Noisy pixels, double columns and empty chips found chip by chip and double column by double column,
+    as analyse_hits did before its vectorization"""
+    cols, rows, chips_per_lane = stave_plotter.ALPIDE_COLS, stave_plotter.ALPIDE_ROWS, stave_plotter.CHIP_PER_LANE
+    dcol_hits = np.zeros(shape=(stave_plotter.MAX_LANES*chips_per_lane, 512))
+    dcol_hit_pixels = np.zeros(shape=(stave_plotter.MAX_LANES*chips_per_lane, 512))
+    hits = np.zeros(shape=(stave_plotter.MAX_LANES, chips_per_lane))
+    bad_dcols = {}
+    bad_pixels = {}
+    empty_chips = []
+    noise_list = np.array([[0, 0, 0, 0]])
+
+    data = plotter.data.astype(float) / plotter.n_events
+    data[data>1] = 1
+    for link in plotter.lane_list:
+        chipids = [i for i in range(stave_plotter.link2master_chip_id_lut[link], stave_plotter.link2master_chip_id_lut[link]+7)]
+        for chipid in range(chips_per_lane):
+            chip_bad_dcols = []
+            chip_bad_pixels = []
+            chip = data[link*rows:(link+1)*rows, chipid*cols:(chipid+1)*cols]
+            x, y = np.where(chip>plotter.noise_threshold)
+            for i in range(len(y)):
+                chip_bad_pixels.append([int(y[i]), int(x[i]), float(chip[x[i], y[i]])])
+            x, y = np.where(chip>0)
+            for i in range(len(y)):
+                noise_list = np.vstack([noise_list, [int(y[i]), int(x[i]), float(chip[x[i], y[i]]), 0.]])
+            if len(chip_bad_pixels) > 0:
+                bad_pixels.update({chipids[chipid]: chip_bad_pixels})
+            hits[link, chipid] = np.sum(chip)/1024./512.
+            for dcol in range(512):
+                dcol_hits[link*chips_per_lane+chipid, dcol] = np.sum(chip[:, 2*dcol:2*(dcol+1)]) / 1024.
+                dcol_hit_pixels[link*chips_per_lane+chipid, dcol] = np.count_nonzero(chip[:, 2*dcol:2*(dcol+1)])
+                if dcol_hit_pixels[link*chips_per_lane+chipid, dcol] > stave_plotter.CUT_HIT_PIXELS_PER_DCOL:
+                    chip_bad_dcols.append(dcol)
+            if len(chip_bad_dcols) > 0:
+                bad_dcols.update({chipids[chipid]: chip_bad_dcols})
+    for link in plotter.lane_list:
+        chipids = [i for i in range(stave_plotter.link2master_chip_id_lut[link], stave_plotter.link2master_chip_id_lut[link]+7)]
+        for chipid in range(chips_per_lane):
+            if hits[link, chipid] == 0:
+                empty_chips.append(chipids[chipid])
+
+    noise_list = np.delete(noise_list, (0), axis=0)
+    noise_list = noise_list[(-noise_list[:, 2]).argsort()]
+    noise_list[-1][3] = noise_list[-1][2]/1024./512./float(plotter.lanes)/7.
+    for i in range(len(noise_list)-2, -1, -1):
+        noise_list[i][3] = noise_list[i+1][3]+noise_list[i][2]/1024./512./float(plotter.lanes)/7.
+    return {'hits': hits, 'dcol_hits': dcol_hits, 'dcol_hit_pixels': dcol_hit_pixels, 'bad_pixels': bad_pixels,
+            'bad_dcols': bad_dcols, 'empty_chips': empty_chips, 'noise_list': noise_list}
+
+
+class TestHitmapAccumulation(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(1)
+        self._directory = tempfile.TemporaryDirectory()
+        self.directory = self._directory.name
+        patcher = mock.patch.object(stave_plotter, 'HITMAP_SHAPE', SHAPE)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def write(self, name, array):
+        filename = os.path.join(self.directory, name)
+        with (gzip.open if name.endswith('.gz') else open)(filename, 'wb') as f:
+            f.write(array.astype(np.int32).tobytes())
+        return filename
+
+    def hitmaps(self, n):
+        """Writes n raw and gzipped hitmaps, returns the file names and the hitmaps"""
+        data = [self.rng.integers(0, 1000, size=SHAPE, dtype=np.int32) for _ in range(n)]
+        filenames = [self.write(f"hitmap_{i}.dat" + (".gz" if i % 2 else ""), hitmap) for i, hitmap in enumerate(data)]
+        return filenames, data
+
+    def test_chunks(self):
+        """The chunks of raw and gzipped files cover the hitmap"""
+        filenames, data = self.hitmaps(2)
+        for filename, hitmap in zip(filenames, data):
+            blocks = list(stave_plotter.hitmap_chunks(filename, chunk_rows=10))
+            self.assertEqual([row for row, _ in blocks], list(range(0, SHAPE[0], 10)))
+            np.testing.assert_array_equal(np.concatenate([block for _, block in blocks]), hitmap)
+
+    def test_serial_and_parallel_totals(self):
+        """The serial and parallel totals are the sum of the hitmaps"""
+        filenames, data = self.hitmaps(5)
+        expected = np.sum(data, axis=0)
+        for processes in [1, 3]:
+            (total, file_stats), duration = timed(stave_plotter.accumulate_hitmaps, filenames, processes=processes,
+                                                  file_stats=True)
+            report(f"{len(filenames)} hitmaps accumulated by {processes} processes in {duration*1e3:.1f} ms")
+            self.assertEqual(total.dtype, np.int32)
+            np.testing.assert_array_equal(total, expected)
+            self.assertEqual(sorted(file_stats),
+                             sorted([os.path.realpath(filename), int(np.sum(hitmap)), int(np.count_nonzero(hitmap))]
+                                    for filename, hitmap in zip(filenames, data)))
+
+    def test_truncated_gzip(self):
+        """A gzipped hitmap with missing rows or a partial row is rejected"""
+        hitmap = self.rng.integers(0, 1000, size=SHAPE, dtype=np.int32)
+        missing_rows = self.write("missing_rows.dat.gz", hitmap[:-3])
+        with self.assertRaisesRegex(AssertionError, f"{SHAPE[0] - 3} rows instead of {SHAPE[0]}"):
+            stave_plotter.accumulate_hitmaps([missing_rows])
+        partial_row = self.write("partial_row.dat.gz", hitmap.ravel()[:-5])
+        with self.assertRaisesRegex(AssertionError, "truncated hitmap"):
+            stave_plotter.accumulate_hitmaps([partial_row])
+
+
+class TestFHRateAnalysis(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(stave_plotter, 'MAX_LANES', LANES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rows, cols = stave_plotter.ALPIDE_ROWS, stave_plotter.ALPIDE_COLS
+        self.plotter = object.__new__(stave_plotter.FHRateStavePlotter)
+        self.plotter.lane_list = (0, 1, 3)  # the hits of lane 2 are ignored
+        self.plotter.lanes = len(self.plotter.lane_list)
+        self.plotter.n_events = 1000000
+        self.plotter.noise_threshold = 1e-4
+
+        # all the hit pixels have different counts, so that the noise lists are sorted the same way
+        data = np.zeros((LANES*rows, stave_plotter.CHIP_PER_LANE*cols), dtype=np.int32)
+        rng = np.random.default_rng(1)
+        pixels = rng.choice(data.size, size=2000, replace=False)
+        data.flat[pixels] = 1 + rng.permutation(len(pixels))
+        chip = lambda lane, chip: data[lane*rows:(lane+1)*rows, chip*cols:(chip+1)*cols]
+        chip(0, 6)[:] = 0            # empty chips
+        chip(3, 5)[:] = 0
+        chip(0, 3)[:60, 200] = 10000 + np.arange(60)  # hot double column
+        chip(1, 0)[:50, 15] = 20000 + np.arange(50)   # at the cut
+        hot_row = chip(1, 2)[10]     # all double columns hit but a dead one
+        hot_row[:] = 30000 + np.arange(cols)
+        hot_row[40:42] = 0
+        chip(3, 1)[5, 5] = 2*self.plotter.n_events    # capped rate
+        self.plotter.data = data
+
+    def test_loop_equivalence(self):
+        """The vectorized analysis finds the same noisy pixels, double columns and empty chips as the loops"""
+        stats, vectorized_time = timed(self.plotter.compute_hit_statistics)
+        expected, loop_time = timed(loop_analysis, self.plotter)
+        report(f"Noisy pixels and double columns of {self.plotter.lanes} lanes: {vectorized_time*1e3:.0f} ms vectorized, "
+               f"{loop_time*1e3:.0f} ms with loops")
+        for key in ['hits', 'dcol_hits', 'dcol_hit_pixels']:
+            np.testing.assert_allclose(stats[key], expected[key], err_msg=key)
+        self.assertEqual(self.plotter.get_bad_pixels(stats), expected['bad_pixels'])
+        self.assertEqual(self.plotter.get_bad_dcols(stats), expected['bad_dcols'])
+        self.assertEqual(sorted(self.plotter.get_empty_chips(stats)), sorted(expected['empty_chips']))
+        np.testing.assert_allclose(self.plotter.get_noise_list(stats), expected['noise_list'])
+
+        chipid = lambda lane, chip: stave_plotter.link2master_chip_id_lut[lane] + chip
+        self.assertEqual(sorted(expected['empty_chips']), sorted([chipid(0, 6), chipid(3, 5)]))
+        self.assertIn(100, expected['bad_dcols'][chipid(0, 3)])
+        self.assertNotIn(7, expected['bad_dcols'].get(chipid(1, 0), []))
+        self.assertEqual(expected['dcol_hit_pixels'][1*stave_plotter.CHIP_PER_LANE + 2, 20], 0)
+        self.assertEqual(expected['noise_list'][0][2], 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3.9
+"""Tests of the parallel subrack verification on a simulated FELIX card and simulated RUs.
+
+The tests of subrack_verify.py and mvtx_flx_verify.py run unchanged on a simulated testbench (SimulatedCard,
+which records the accesses breaking its rules). The RUs, PA3s and SCAs do a few SWT transactions per method
+and wait to emulate the duration of the real operations. One RU has a wrong githash and one fails to initialize.
+The tests are run one RU after another as unittest does and with the verification runner, which has
+to give the same results (except for the checks skipped after a failed initialization),
+to break no rule of the card, to write the json report and to be faster.
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from simulated_board import SimulatedCard, SimulatedSwtCommunication, report, script_path, timed
+
+sys.path.append(os.path.join(script_path, '../subrack_verify'))
+from gbt_sca import ScaAdcChannelsRUv2
+import mvtx_flx_verify
+import subrack_verify
+import verify_runner
+
+RDO_GITHASH = 0x0A0B0C0D
+PA3_GITHASH = 0x01020304
+CHARGEPUMP = 4
+LATENCY = 500e-6
+
+
+class SimulatedPart(object):
+    """Part of a RU: each access is a SWT transaction followed by a wait"""
+
+    def __init__(self, comm):
+        self.comm = comm
+
+    def _access(self, duration=0., nreads=2):
+        for address in range(nreads):
+            self.comm.register_read(1, address)
+        results = self.comm.flush_and_read_results()
+        assert [data for _, data in results] == list(range(nreads)), results
+        time.sleep(duration)
+
+
+class SimulatedGbtx0(SimulatedPart):
+    def __init__(self, comm):
+        super(SimulatedGbtx0, self).__init__(comm)
+        self.chargepump = 0
+
+    def get_phase_detector_charge_pump(self):
+        self._access()
+        return self.chargepump
+
+
+class SimulatedIdentity(SimulatedPart):
+    def __init__(self, comm, layer, stave, sn):
+        super(SimulatedIdentity, self).__init__(comm)
+        self.layer, self.stave, self.sn = layer, stave, sn
+
+    def is_fee_id_correct(self, layer, stave):
+        self._access()
+        return (layer, stave) == (self.layer, self.stave)
+
+    def get_dna(self):
+        self._access(nreads=6)
+        return self.sn
+
+    def decode_sn(self, dna):
+        return dna
+
+
+class SimulatedSysmon(SimulatedPart):
+    def get_temperature(self):
+        self._access()
+        return 30.
+
+
+class SimulatedTriggerHandler(SimulatedPart):
+    def set_opcode_gating(self, value):
+        self.comm.register_write(2, 0, value)
+        self.comm.flush()
+
+
+class SimulatedPa3(SimulatedPart):
+    def initialize(self, verbose=False):
+        self._access(0.075, nreads=8)
+
+    def githash(self):
+        self._access()
+        return PA3_GITHASH
+
+
+class SimulatedSca(SimulatedPart):
+    adc_channels = ScaAdcChannelsRUv2
+
+    def initialize(self):
+        self._access(0.01)
+
+    def read_adc_converted(self, channel):
+        self._access(0.015)
+        return 300.
+
+
+class SimulatedRu(SimulatedPart):
+    """RU with the parts used by the verification tests"""
+    GBTx0_CHARGEPUMP_DEFAULT = CHARGEPUMP
+
+    def __init__(self, card, gbt_channel, layer, stave, sn, githash=RDO_GITHASH, fail_initialize=False):
+        super(SimulatedRu, self).__init__(SimulatedSwtCommunication(card, gbt_channel))
+        self.githash = githash
+        self.fail_initialize = fail_initialize
+        self.gbtx0_swt = SimulatedGbtx0(self.comm)
+        self.identity = SimulatedIdentity(self.comm, layer, stave, sn)
+        self.sysmon = SimulatedSysmon(self.comm)
+        self.trigger_handler = SimulatedTriggerHandler(self.comm)
+        self.pa3 = SimulatedPa3(self.comm)
+        self.sca = SimulatedSca(self.comm)
+        # the power unit tests are not enabled
+        self.powerunit_1 = None
+        self.powerunit_2 = None
+
+    def initialize(self):
+        self._access(0.025, nreads=16)
+        if self.fail_initialize:
+            raise RuntimeError("No SWT available")
+        self.gbtx0_swt.chargepump = self.GBTx0_CHARGEPUMP_DEFAULT
+
+    def git_hash(self):
+        self._access()
+        return self.githash
+
+    def initialize_gbtx12(self, verbose=False, check=True, readback=True):
+        self._access(0.15, nreads=32)
+        return True
+
+
+class SimulatedTestbench(object):
+    def __init__(self, card, rdos, data_link_list):
+        self.cru = card
+        self._rdos = rdos
+        self.ctrl_link_list = list(rdos)
+        self.data_link_list = data_link_list
+
+    def rdos(self, gbt_channel):
+        return self._rdos[gbt_channel]
+
+    def pa3s(self, gbt_channel):
+        return self._rdos[gbt_channel].pa3
+
+    def scas(self, gbt_channel):
+        return self._rdos[gbt_channel].sca
+
+
+def setup(module, gbt_channels, wrong_githash=None, failing=None):
+    """Sets up the globals of a verification module on a simulated testbench"""
+    card = SimulatedCard(LATENCY)
+    parameters = {gbt_channel: (2, 1000 + i, i, RDO_GITHASH, PA3_GITHASH) for i, gbt_channel in enumerate(gbt_channels)}
+    rdos = {gbt_channel: SimulatedRu(card, gbt_channel, layer, stave, sn,
+                                     githash=RDO_GITHASH + 1 if gbt_channel == wrong_githash else RDO_GITHASH,
+                                     fail_initialize=gbt_channel == failing)
+            for gbt_channel, (layer, sn, stave, _, _) in parameters.items()}
+    module.tb_global = SimulatedTestbench(card, rdos, data_link_list=list(gbt_channels))
+    module.ru_parameter_dict_global = parameters
+    module.test_pu1 = False
+    module.test_pu2 = False
+    module.test_trg = False
+    module.test_stv = False
+    card.initialize()
+    return card
+
+
+def ru_target(module, gbt_channel):
+    """Returns the name of the test case class of the RU on a gbt channel"""
+    prefix = 'TestRuOnChannel'
+    return [test_case_class.__name__ for test_case_class in module.get_test_case_classes()
+            if test_case_class.__name__.startswith(prefix) and int(test_case_class.__name__[len(prefix):]) == gbt_channel][0]
+
+
+def run_serial(module):
+    """Runs the tests as unittest, returns {(class name, test name): status}"""
+    suite = unittest.TestSuite(unittest.TestLoader().loadTestsFromTestCase(test_case_class)
+                               for test_case_class in module.get_test_case_classes())
+    statuses = {}
+    for test in suite:
+        for t in test:
+            statuses[(type(t).__name__, t._testMethodName)] = verify_runner.PASSED
+    result = unittest.TextTestRunner(stream=io.StringIO(), verbosity=0).run(suite)
+    for status, tests in [(verify_runner.FAILED, result.failures), (verify_runner.ERROR, result.errors),
+                          (verify_runner.SKIPPED, result.skipped)]:
+        for t, _ in tests:
+            statuses[(type(t).__name__, t._testMethodName)] = status
+    return statuses
+
+
+class TestParallelVerification(unittest.TestCase):
+
+    def check_module(self, module, gbt_channels):
+        wrong_githash, failing = gbt_channels[3], gbt_channels[5]
+        card = setup(module, gbt_channels, wrong_githash, failing)
+        with contextlib.redirect_stdout(io.StringIO()):
+            serial, serial_time = timed(run_serial, module)
+        self.assertEqual(card.violations, [])
+
+        card = setup(module, gbt_channels, wrong_githash, failing)
+        with tempfile.TemporaryDirectory() as tmp:
+            report_file = os.path.join(tmp, 'report.json')
+            with contextlib.redirect_stdout(io.StringIO()):
+                _, parallel_time = timed(module.run_parallel, report_file=report_file)
+            with open(report_file) as f:
+                json_report = json.load(f)
+        self.assertEqual(card.violations, [])
+        # the card is initialized by setup and by the initialization test of each RU but the failing one
+        self.assertEqual((card.eots, card.initializations), (1, len(gbt_channels)))
+
+        # same results, the checks of the RU failing to initialize are skipped instead
+        parallel = {(check['target'], check['name']): check['status'] for check in json_report['checks']}
+        self.assertEqual(set(parallel), set(serial))
+        differ = sorted(key for key in serial if parallel[key] != serial[key])
+        failing_target, wrong_githash_target = ru_target(module, failing), ru_target(module, wrong_githash)
+        self.assertEqual(serial[(failing_target, 'test_AA_initialize_rdo')], verify_runner.ERROR)
+        self.assertEqual(parallel[(failing_target, 'test_AA_initialize_rdo')], verify_runner.ERROR)
+        for target, test in differ:
+            self.assertEqual((target, parallel[(target, test)]), (failing_target, verify_runner.SKIPPED), test)
+        failed = sorted(key for key, status in parallel.items() if status == verify_runner.FAILED)
+        self.assertEqual(failed, [(wrong_githash_target, 'test_rdo_githash')])
+        errors = sorted(key for key, status in parallel.items() if status == verify_runner.ERROR)
+        self.assertEqual(errors, [(failing_target, 'test_AA_initialize_rdo')])
+        self.assertFalse(json_report['passed'])
+        self.assertEqual(json_report['summary'][verify_runner.FAILED], 1)
+        self.assertEqual(sum(json_report['summary'].values()), len(json_report['checks']))
+
+        # per check timings, the checks using the card run alone
+        checks = [check for check in json_report['checks'] if check['start'] is not None]
+        for check in checks:
+            self.assertTrue(0 <= check['start'] and check['start'] + check['duration'] <= json_report['duration'] + 1e-3)
+            if check['uses_card']:
+                overlapping = [(other['target'], other['name']) for other in checks if other is not check and
+                               other['start'] < check['start'] + check['duration'] and check['start'] < other['start'] + other['duration']]
+                self.assertEqual(overlapping, [], (check['target'], check['name']))
+        self.assertLess(parallel_time, serial_time / 1.8)
+        report(f"{module.__name__}: {len(gbt_channels)} RUs, {len(json_report['checks'])} checks: "
+               f"one RU after another {serial_time:.1f} s, parallel {parallel_time:.1f} s")
+
+    def test_subrack_verify(self):
+        self.check_module(subrack_verify, list(range(12)))
+
+    def test_mvtx_flx_verify(self):
+        self.check_module(mvtx_flx_verify, list(range(0, 24, 3)))
+
+    def test_card_lock(self):
+        """Without the card lock, the transactions of the RUs mix on the card"""
+        card = setup(subrack_verify, list(range(12)))
+        runner = verify_runner.VerificationRunner()
+        for test_case_class in subrack_verify.get_test_case_classes():
+            runner.add_test_case(test_case_class)
+        subrack_verify.TestcaseBase.share_card = True
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                runner.run()
+        finally:
+            subrack_verify.TestcaseBase.share_card = False
+        self.assertNotEqual(card.violations, [], "Expected mixed transactions without the card lock")
+
+
+class TestVerificationRunner(unittest.TestCase):
+
+    def test_dependency_cycle(self):
+        runner = verify_runner.VerificationRunner()
+        runner.add_check('a', lambda: None, requires=['b'])
+        runner.add_check('b', lambda: None, requires=['a'])
+        with self.assertRaises(ValueError):
+            runner.run()
+
+    def test_unknown_check(self):
+        runner = verify_runner.VerificationRunner()
+        runner.add_check('a', lambda: None, target='RU0', requires=[('RU1', 'b')])
+        with self.assertRaises(ValueError):
+            runner.run()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3.9
+"""Tests of the trigger/packer rate sampler on simulated RUs whose counters wrap around during the sampling.
+
+The counters of the trigger handler and of the three GBT packer monitors run at known rates from values
+close to their wraparound (32 and 8 bits), and one RU fails some of its reads.
+"""
+
+import time
+import unittest
+
+import numpy as np
+
+from simulated_board import SimulatedCommunication, make_ru, report, simulate_counter_monitor
+
+from trigger_rate_sampler import GBT_PACKER_COUNTERS, TriggerRateSampler
+
+TH_RATES = {'TRIGGER_SENT': 2e5, 'PROCESSED_TRIGGERS': 2e5, 'HB': 11245., 'HBR': 1245., 'PHYSICS': 2e5, 'TF': 44.}
+PACKER_RATES = {'TRIGGER_READ': 44., 'SOP_SENT': 1e4, 'EOP_SENT': 1e4, 'PACKET_DONE': 1e4, 'PACKET_EMPTY': 100.,
+                'PACKET_TIMEOUT': 300.}  # 8 bit counter
+DURATION = 1.5
+RATE = 20.
+
+
+def make_ru_with_counters(start_before_wrap, fail_every=0):
+    """RU whose counters wrap start_before_wrap s after its creation"""
+    comm = SimulatedCommunication()
+    comm.fail_every = fail_every
+    ru = make_ru(comm)
+    t0 = time.perf_counter()
+    monitors = [(ru._trigger_handler_monitor, TH_RATES)] + \
+               [(monitor, PACKER_RATES) for monitor in [ru._gbt_packer_0_monitor, ru._gbt_packer_1_monitor, ru._gbt_packer_2_monitor]]
+    simulated = []
+    for monitor, rates in monitors:
+        offsets = {name: (1 << monitor.get_counter_width(name)) - int(start_before_wrap*rate) for name, rate in rates.items()}
+        simulated.append(simulate_counter_monitor(comm, monitor, rates, offsets, t0))
+    simulated[1].slaves += simulated[2:]  # the master packer monitor latches the others
+    return ru
+
+
+def expected_rates(sampler):
+    ret = {name: TH_RATES[name] for name in sampler.th_counters}
+    for i in range(3):
+        ret.update({f"PACKER{i}_{name}": PACKER_RATES[name] for name in sampler.packer_counters})
+    ret['HBA'] = TH_RATES['HB'] - TH_RATES['HBR']
+    return ret
+
+
+class TestTriggerRateSampler(unittest.TestCase):
+    NRUS = 3
+
+    def test_background_sampling(self):
+        # The counters wrap after 1/3 of the duration, the last RU fails every 7th snapshot
+        rus = [make_ru_with_counters(DURATION/3, fail_every=7 if i == self.NRUS - 1 else 0) for i in range(self.NRUS)]
+        self.assertEqual(set(rus[0].trigger_handler.read_counters(counters=list(TH_RATES))), set(TH_RATES))
+        sampler = TriggerRateSampler(rus, packer_counters=list(GBT_PACKER_COUNTERS) + ['PACKET_TIMEOUT'],
+                                     rate=RATE, buffer_size=int(DURATION*RATE/2))
+        self.assertEqual(sampler._get_modulo()[sampler.names.index('PACKER0_PACKET_TIMEOUT')], 256)
+        flushes = [ru.comm.flushes for ru in rus]
+        sampler.start()
+        query_latencies = []
+        stop = time.time() + DURATION
+        while time.time() < stop:
+            start = time.perf_counter()
+            sampler.percentiles()
+            sampler.moving_average(window=10)
+            query_latencies.append(time.perf_counter() - start)
+            time.sleep(0.05)
+        sampler.stop()
+        self.assertEqual([ru.comm.flushes - f for ru, f in zip(rus, flushes)], [sampler.count]*self.NRUS,
+                         "Not one sequence per RU and sample")
+
+        timestamps, rates = sampler.get_samples()
+        self.assertEqual(len(timestamps), sampler.buffer_size)
+        self.assertTrue(np.all(np.diff(timestamps) > 0), "Buffer not in chronological order")
+        self.assertTrue(np.all(rates[~np.isnan(rates)] >= 0), "Negative rate, wraparound not handled")
+        failed = np.isnan(rates[:, -1, 0])
+        self.assertTrue(failed.any())
+        self.assertFalse(np.isnan(rates[:, :-1]).any(), "Failures not isolated to the failing RU")
+        percentiles = sampler.percentiles(q=(1, 50, 99))
+        for name, rate in expected_rates(sampler).items():
+            for i in range(self.NRUS):
+                p = percentiles[i][name]
+                # Counts are integers (one count per period) and the latch and host timestamps differ by the jitter
+                tolerance = max(0.05*rate, 1.5*RATE)
+                self.assertLess(abs(p[50] - rate), tolerance, (i, name, p, rate))
+                self.assertTrue(p[1] > rate - 3*tolerance and p[99] < rate + 3*tolerance, (i, name, p, rate))
+        report(f"{self.NRUS} RUs sampled {sampler.count} times at {RATE} Hz, query latency while sampling: "
+               f"p50 {np.percentile(query_latencies, 50)*1e3:.2f} ms, max {np.max(query_latencies)*1e3:.2f} ms")
+
+    def test_clear(self):
+        rus = [make_ru_with_counters(DURATION/3)]
+        sampler = TriggerRateSampler(rus, rate=RATE)
+        sampler.run(nsamples=2)
+        sampler.clear()
+        self.assertIsNone(sampler.get_latest())
+        self.assertEqual(sampler.aggregate(), {})
+        sampler.sample()
+        self.assertTrue(np.isnan(sampler.get_samples()[1]).all(), "First snapshot after clear must only set the reference")
+
+
+if __name__ == '__main__':
+    unittest.main()